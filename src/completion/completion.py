@@ -22,12 +22,13 @@ from completion.completion_db import CompletionDbMng
 from completion.completion_env import CompletionEnvMng
 from completion.completion_mng import AbstractCompletionMng
 from completion.completion_svc import CompletionSvcMng
+from completion.completion_system import CompletionSystemMng
 from config import ConfigMng
 
 
 class CompletionMng(AbstractCompletionMng):
 
-    CATEGORIES = ["db", "env", "svc"]
+    CATEGORIES = ["db", "env", "svc", "system"]
 
     def __init__(self, cli_flags: dict[str, bool], configMng: ConfigMng):
         self.cli_flags = cli_flags
@@ -35,6 +36,7 @@ class CompletionMng(AbstractCompletionMng):
         self.completionEnvMng = CompletionEnvMng(cli_flags, configMng)
         self.completionSvcMng = CompletionSvcMng(cli_flags, configMng)
         self.completionDbMng = CompletionDbMng(cli_flags, configMng)
+        self.completionSystemMng = CompletionSystemMng(cli_flags, configMng)
 
     def is_category_chosen(self, args: list[str]) -> bool:
         """
@@ -58,6 +60,8 @@ class CompletionMng(AbstractCompletionMng):
             return self.completionSvcMng
         elif category == "db":
             return self.completionDbMng
+        elif category == "system":
+            return self.completionSystemMng
         else:
             return None
 
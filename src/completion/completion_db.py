@@ -16,15 +16,25 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
 from typing import override
 
 from completion.completion_mng import AbstractCompletionMng
 from config import ConfigMng
+from database.checkpoint import CheckpointStore
 
 
 class CompletionDbMng(AbstractCompletionMng):
 
-    COMMANDS_DB = ["sql-shell"]
+    COMMANDS_DB = [
+        "sql-shell",
+        "import",
+        "provision",
+        "checkpoint",
+        "rollback",
+        "checkpoints",
+        "prune",
+    ]
 
     def __init__(self, cli_flags: dict[str, bool], configMng: ConfigMng):
         self.cli_flags = cli_flags
@@ -47,8 +57,16 @@ class CompletionDbMng(AbstractCompletionMng):
 
         command = args[0]
         match command:
-            case "sql-shell":
+            case (
+                "sql-shell"
+                | "import"
+                | "provision"
+                | "checkpoint"
+                | "checkpoints"
+            ):
                 return self.get_sql_shell_completions(args[1:])
+            case "rollback" | "prune":
+                return self.get_checkpoint_completions(args[1:])
             case _:
                 return []
 
@@ -68,3 +86,14 @@ class CompletionDbMng(AbstractCompletionMng):
         if not self.is_svc_tag_chosen(args):
             return self.get_svc_tags(args)
         return []
+
+    def get_checkpoint_completions(self, args: list[str]) -> list[str]:
+        if not self.is_svc_tag_chosen(args):
+            return self.get_svc_tags(args)
+        env = self.configMng.get_active_environment()
+        if not env:
+            return []
+        root = os.path.join(
+            self.configMng.constants.SHPD_CHECKPOINTS_DIR, env.tag, args[0]
+        )
+        return [c.name for c in CheckpointStore(root).list()]
@@ -37,8 +37,24 @@ class CompletionEnvMng(AbstractCompletionMng):
         "reload",
         "status",
         "add",
+        "idle",
+        "pool",
+        "logs",
+        "prefetch",
+        "pack",
+        "import",
+        "push",
+        "pull",
+        "fetch",
+        "publish",
+        "images",
+        "verify",
+        "materialize",
+        "serve",
     ]
 
+    POOL_ACTIONS = ["status", "fill", "drain"]
+
     def __init__(self, cli_flags: dict[str, bool], configMng: ConfigMng):
         self.cli_flags = cli_flags
         self.configMng = configMng
@@ -84,6 +100,12 @@ class CompletionEnvMng(AbstractCompletionMng):
                 return self.get_status_completions(args[1:])
             case "add":
                 return self.get_add_resource_completions(args[1:])
+            case "pool":
+                return self.get_pool_completions(args[1:])
+            case "prefetch":
+                return [env.tag for env in self.configMng.get_environments()]
+            case "pack" | "push" | "verify" | "materialize":
+                return self.get_render_completions(args[1:])
             case _:
                 return []
 
@@ -106,6 +128,11 @@ class CompletionEnvMng(AbstractCompletionMng):
             return self.configMng.get_environment_template_tags()
         return []
 
+    def get_pool_completions(self, args: list[str]) -> list[str]:
+        if not args or args[0] not in self.POOL_ACTIONS:
+            return self.POOL_ACTIONS
+        return []
+
     def get_clone_completions(self, args: list[str]) -> list[str]:
         if not self.is_src_env_tag_chosen(args):
             return [env.tag for env in self.configMng.get_environments()]
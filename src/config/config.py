@@ -230,6 +230,63 @@ class Config:
     envs: list[EnvironmentCfg] = field(default_factory=list)
 
 
+def parse_upstream(item: Any) -> UpstreamCfg:
+    return UpstreamCfg(
+        type=item["type"],
+        tag=item["tag"],
+        properties=item.get("properties", {}),
+        enabled=item["enabled"],
+    )
+
+
+def parse_service(item: Any) -> ServiceCfg:
+    return ServiceCfg(
+        template=item["template"],
+        factory=item["factory"],
+        tag=item["tag"],
+        service_class=item.get("service_class"),
+        image=item["image"],
+        hostname=item.get("hostname"),
+        container_name=item.get("container_name"),
+        labels=item.get("labels", []),
+        workdir=item.get("workdir"),
+        volumes=item.get("volumes", []),
+        ingress=item.get("ingress"),
+        empty_env=item.get("empty_env"),
+        environment=item.get("environment", []),
+        ports=item.get("ports", []),
+        properties=item.get("properties", {}),
+        networks=item.get("networks", []),
+        extra_hosts=item.get("extra_hosts", []),
+        subject_alternative_name=item.get("subject_alternative_name"),
+        upstreams=[
+            parse_upstream(upstream) for upstream in item.get("upstreams", [])
+        ],
+    )
+
+
+def parse_network(item: Any) -> NetworkCfg:
+    return NetworkCfg(
+        key=item["key"], name=item["name"], external=item["external"]
+    )
+
+
+def parse_environment(item: Any) -> EnvironmentCfg:
+    return EnvironmentCfg(
+        template=item["template"],
+        factory=item["factory"],
+        tag=item["tag"],
+        services=[
+            parse_service(service) for service in item.get("services", [])
+        ],
+        networks=[
+            parse_network(network) for network in item.get("networks", [])
+        ],
+        archived=item["archived"],
+        active=item["active"],
+    )
+
+
 def parse_config(json_str: str) -> Config:
     """
     Parses a JSON string into a `Config` object.
@@ -254,14 +311,6 @@ def parse_config(json_str: str) -> Config:
             format=item["format"],
         )
 
-    def parse_upstream(item: Any) -> UpstreamCfg:
-        return UpstreamCfg(
-            type=item["type"],
-            tag=item["tag"],
-            properties=item.get("properties", {}),
-            enabled=item["enabled"],
-        )
-
     def parse_service_template(item: Any) -> ServiceTemplateCfg:
         return ServiceTemplateCfg(
             tag=item["tag"],
@@ -282,37 +331,6 @@ def parse_config(json_str: str) -> Config:
             subject_alternative_name=item.get("subject_alternative_name"),
         )
 
-    def parse_service(item: Any) -> ServiceCfg:
-        return ServiceCfg(
-            template=item["template"],
-            factory=item["factory"],
-            tag=item["tag"],
-            service_class=item.get("service_class"),
-            image=item["image"],
-            hostname=item.get("hostname"),
-            container_name=item.get("container_name"),
-            labels=item.get("labels", []),
-            workdir=item.get("workdir"),
-            volumes=item.get("volumes", []),
-            ingress=item.get("ingress"),
-            empty_env=item.get("empty_env"),
-            environment=item.get("environment", []),
-            ports=item.get("ports", []),
-            properties=item.get("properties", {}),
-            networks=item.get("networks", []),
-            extra_hosts=item.get("extra_hosts", []),
-            subject_alternative_name=item.get("subject_alternative_name"),
-            upstreams=[
-                parse_upstream(upstream)
-                for upstream in item.get("upstreams", [])
-            ],
-        )
-
-    def parse_network(item: Any) -> NetworkCfg:
-        return NetworkCfg(
-            key=item["key"], name=item["name"], external=item["external"]
-        )
-
     def parse_service_template_refs(item: Any) -> ServiceTemplateRefCfg:
         return ServiceTemplateRefCfg(template=item["template"], tag=item["tag"])
 
@@ -329,21 +347,6 @@ def parse_config(json_str: str) -> Config:
             ],
         )
 
-    def parse_environment(item: Any) -> EnvironmentCfg:
-        return EnvironmentCfg(
-            template=item["template"],
-            factory=item["factory"],
-            tag=item["tag"],
-            services=[
-                parse_service(service) for service in item.get("services", [])
-            ],
-            networks=[
-                parse_network(network) for network in item.get("networks", [])
-            ],
-            archived=item["archived"],
-            active=item["active"],
-        )
-
     def parse_shpd_registry(item: Any) -> ShpdRegistryCfg:
         return ShpdRegistryCfg(
             ftp_server=item["ftp_server"],
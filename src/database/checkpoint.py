@@ -0,0 +1,246 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+import re
+import shutil
+import time
+from dataclasses import asdict, dataclass
+from typing import Iterable, Optional
+
+# linux/fs.h: share the extents of a file with another one
+FICLONE = 0x40049409
+
+CHECKPOINT_FILE = "checkpoint.json"
+DATA_DIR = "data"
+NAME = re.compile(r"[A-Za-z0-9][A-Za-z0-9_.-]*")
+
+
+@dataclass
+class CloneStats:
+    """What cloning a directory tree took: files and their bytes."""
+
+    files: int = 0
+    size: int = 0
+    reflinked: int = 0
+
+    @property
+    def copied(self) -> int:
+        return self.size - self.reflinked
+
+
+def clone_file(src: str, dst: str) -> bool:
+    """
+    Copy a file, sharing its extents through a reflink where the
+    filesystem supports it, copying its bytes otherwise.
+
+    :return: Whether the file was reflinked.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        try:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+            return True
+        except OSError:
+            pass
+    shutil.copyfile(src, dst)
+    return False
+
+
+def copy_owner(src: str, dst: str):
+    """Give `dst` the owner of `src` when allowed to."""
+    st = os.lstat(src)
+    try:
+        os.chown(dst, st.st_uid, st.st_gid, follow_symlinks=False)
+    except PermissionError:
+        pass
+
+
+def clone_tree(
+    src: str, dst: str, stats: Optional[CloneStats] = None
+) -> CloneStats:
+    """
+    Clone the directory tree `src` to `dst`, which must not exist: files
+    are reflinked or copied, symlinks recreated and modes, times and
+    owners kept.
+    """
+    stats = stats if stats is not None else CloneStats()
+    os.mkdir(dst)
+    for entry in os.scandir(src):
+        target = os.path.join(dst, entry.name)
+        if entry.is_symlink():
+            os.symlink(os.readlink(entry.path), target)
+        elif entry.is_dir():
+            clone_tree(entry.path, target, stats)
+            continue
+        else:
+            size = entry.stat().st_size
+            stats.files += 1
+            stats.size += size
+            if clone_file(entry.path, target):
+                stats.reflinked += size
+            shutil.copystat(entry.path, target)
+        copy_owner(entry.path, target)
+    shutil.copystat(src, dst)
+    copy_owner(src, dst)
+    return stats
+
+
+@dataclass
+class Checkpoint:
+    """A copy of the data volume of a database service."""
+
+    name: str
+    created: float
+    size: int
+    reflinked: int
+    source: str
+
+
+class CheckpointStore:
+    """
+    The checkpoints of a database service, one directory each holding
+    the copy of the data volume and its `checkpoint.json` record.
+
+    A checkpoint is cloned to a hidden directory renamed in place once
+    complete, an interrupted one is never listed.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def path(self, name: str) -> str:
+        """
+        The directory of a checkpoint.
+
+        :raises ValueError: If the name is not valid.
+        """
+        if not NAME.fullmatch(name):
+            raise ValueError(f"Invalid checkpoint name '{name}'.")
+        return os.path.join(self.root, name)
+
+    def data(self, name: str) -> str:
+        return os.path.join(self.path(name), DATA_DIR)
+
+    def get(self, name: str) -> Optional[Checkpoint]:
+        record = os.path.join(self.path(name), CHECKPOINT_FILE)
+        try:
+            with open(record, "r", encoding="utf-8") as f:
+                return Checkpoint(**json.load(f))
+        except (OSError, ValueError, TypeError):
+            return None
+
+    def list(self) -> list[Checkpoint]:
+        """Return the checkpoints, oldest first."""
+        if not os.path.isdir(self.root):
+            return []
+        checkpoints = [
+            c
+            for n in os.listdir(self.root)
+            if NAME.fullmatch(n) and (c := self.get(n))
+        ]
+        return sorted(checkpoints, key=lambda c: c.created)
+
+    def create(
+        self, name: str, source: str, replace: bool = False
+    ) -> Checkpoint:
+        """
+        Clone the directory `source` to a new checkpoint, replacing the
+        one with the same name only when `replace` is set.
+
+        :raises ValueError: If the name is not valid or already taken.
+        """
+        if os.path.exists(self.path(name)) and not replace:
+            raise ValueError(f"Checkpoint '{name}' already exists.")
+        os.makedirs(self.root, exist_ok=True)
+        staging = os.path.join(self.root, f".{name}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.mkdir(staging)
+        try:
+            stats = clone_tree(source, os.path.join(staging, DATA_DIR))
+            checkpoint = Checkpoint(
+                name, time.time(), stats.size, stats.reflinked, source
+            )
+            with open(
+                os.path.join(staging, CHECKPOINT_FILE), "w", encoding="utf-8"
+            ) as f:
+                json.dump(asdict(checkpoint), f, indent=2)
+            if os.path.exists(self.path(name)):
+                self.remove(name)
+            os.rename(staging, self.path(name))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        return checkpoint
+
+    def stage(self, name: str, target: str) -> str:
+        """
+        Clone a checkpoint next to the directory `target` it is restored
+        to, on its filesystem.
+
+        :return: The directory `target` is to be swapped with.
+        """
+        staging = f"{target.rstrip(os.sep)}.shpd-rollback"
+        shutil.rmtree(staging, ignore_errors=True)
+        clone_tree(self.data(name), staging)
+        return staging
+
+    def remove(self, name: str):
+        shutil.rmtree(self.path(name))
+
+    def prune(
+        self,
+        names: Iterable[str] = (),
+        keep: Optional[int] = None,
+        before: Optional[float] = None,
+    ) -> list[Checkpoint]:
+        """
+        Remove the named checkpoints, those older than the `keep` newest
+        and those created before `before`.
+
+        :return: The removed checkpoints.
+        """
+        names = set(names)
+        checkpoints = self.list()
+        newest = checkpoints[::-1][:keep] if keep is not None else checkpoints
+        removed: list[Checkpoint] = []
+        for c in checkpoints:
+            if (
+                c.name in names
+                or c not in newest
+                or (before is not None and c.created < before)
+            ):
+                self.remove(c.name)
+                removed.append(c)
+        return removed
+
+
+def swap_dir(staging: str, target: str):
+    """Replace the directory `target` with `staging`."""
+    target = target.rstrip(os.sep)
+    old = f"{target}.shpd-old"
+    shutil.rmtree(old, ignore_errors=True)
+    os.rename(target, old)
+    try:
+        os.rename(staging, target)
+    except OSError:
+        os.rename(old, target)
+        raise
+    shutil.rmtree(old, ignore_errors=True)
@@ -16,10 +16,29 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import os
+import time
+from typing import Any, Optional
+
+from rich.table import Table
+
 from config import ConfigMng
 from config.config import EnvironmentCfg
+from docker.docker_engine import DockerNotFoundError
 from docker.docker_svc import DockerSvc
-from service import ServiceMng
+from service import ServiceFactory, ServiceMng, ServiceNotCreatedError
+from util import Util
+
+from .checkpoint import Checkpoint, CheckpointStore, swap_dir
+from .dump import DumpImporter, ImportProgress
+from .engines import PROP_DB_DATA, db_engine
+from .provision import (
+    DirectorySpec,
+    ProvisionManifest,
+    UserSpec,
+    parse_changes,
+    session_error,
+)
 
 
 class DatabaseService(DockerSvc):
@@ -28,25 +47,129 @@ class DatabaseService(DockerSvc):
         """Get a SQL shell session."""
         pass
 
-    def create_user(self, user: str, psw: str):
+    def create_user(self, user: str, psw: str) -> list[str]:
         """Create a new database user."""
-        pass
+        return self.provision(ProvisionManifest(users=[UserSpec(user, psw)]))
 
-    def create_directory(self, user: str, directory_name: str):
+    def create_directory(
+        self, user: str, directory_name: str, path: str
+    ) -> list[str]:
         """Create a directory object in the database."""
-        pass
+        return self.provision(
+            ProvisionManifest(
+                directories=[DirectorySpec(directory_name, path, user)]
+            )
+        )
 
-    def remove_user(self, user: str):
+    def remove_user(self, user: str) -> list[str]:
         """Drop an existing database user."""
-        pass
+        return self.provision(ProvisionManifest(remove_users=[user]))
+
+    def provision(self, manifest: ProvisionManifest) -> list[str]:
+        """
+        Provision the users, directories and grants of a manifest through
+        a single client session, creating what is missing only.
+
+        :return: The changes made.
+        :raises ValueError: If the manifest cannot be provisioned.
+        :raises RuntimeError: If the session failed.
+        """
+        engine = db_engine(self.svcCfg)
+        script = engine.provision_script(manifest)
+        code, output = self.exec_input(engine.sql_command(), [script])
+        if error := session_error(code, output):
+            raise RuntimeError(error)
+        return parse_changes(output)
+
+    def container_state(self) -> dict[str, Any]:
+        try:
+            return self.engine.inspect_container(self.container_name)
+        except DockerNotFoundError:
+            raise ServiceNotCreatedError(
+                f"Container '{self.container_name}' does not exist, "
+                f"start the environment first."
+            )
+
+    def data_volume(self) -> str:
+        """
+        Return the host directory of the volume mounted at the `db.data`
+        container path, the data directory of the engine by default.
+
+        :raises RuntimeError: If no volume is mounted there.
+        """
+        target = (self.svcCfg.properties or {}).get(PROP_DB_DATA) or db_engine(
+            self.svcCfg
+        ).data_dir
+        mounts: list[dict[str, str]] = (
+            self.container_state().get("Mounts") or []
+        )
+        for mount in mounts:
+            if mount.get("Destination", "").rstrip("/") == target.rstrip("/"):
+                return mount["Source"]
+        raise RuntimeError(
+            f"Service '{self.svcCfg.tag}' has no volume mounted at "
+            f"'{target}', set its '{PROP_DB_DATA}' property."
+        )
+
+    def checkpoint_store(self) -> CheckpointStore:
+        return CheckpointStore(
+            os.path.join(
+                self.configMng.constants.SHPD_CHECKPOINTS_DIR,
+                self.envCfg.tag,
+                self.svcCfg.tag,
+            )
+        )
+
+    def checkpoint(self, name: str, replace: bool = False) -> Checkpoint:
+        """
+        Checkpoint the data volume, the container being paused while it
+        is cloned: the copy is what a crash would have left on disk,
+        which the database recovers from when rolled back. Without
+        reflinks the files are copied, the pause lasting as long.
+        """
+        source = self.data_volume()
+        state = self.container_state().get("State", {})
+        running = state.get("Running") and not state.get("Paused")
+        if running:
+            self.engine.pause_container(self.container_name)
+        try:
+            return self.checkpoint_store().create(name, source, replace)
+        finally:
+            if running:
+                self.engine.unpause_container(self.container_name)
+
+    def rollback(self, name: str) -> Checkpoint:
+        """
+        Roll the data volume back to a checkpoint: the checkpoint is
+        cloned next to the volume first, the container is stopped only
+        while the two are swapped.
+        """
+        store = self.checkpoint_store()
+        checkpoint = store.get(name)
+        if not checkpoint:
+            raise ValueError(f"Checkpoint '{name}' does not exist.")
+        target = self.data_volume()
+        staging = store.stage(name, target)
+        running = self.container_state().get("State", {}).get("Running")
+        if running:
+            self.engine.stop_container(self.container_name)
+        try:
+            swap_dir(staging, target)
+        finally:
+            if running:
+                self.engine.start_container(self.container_name)
+        return checkpoint
 
 
 class DatabaseMng(ServiceMng):
 
-    def __init__(self, cli_flags: dict[str, bool], configMng: ConfigMng):
-        self.cli_flags = cli_flags
-        self.configMng = configMng
-        pass
+    def __init__(
+        self,
+        cli_flags: dict[str, bool],
+        configMng: ConfigMng,
+        svcFactory: ServiceFactory,
+    ):
+        super().__init__(cli_flags, configMng, svcFactory)
 
     def sql_shell_svc(self, envCfg: EnvironmentCfg, svc_tag: str):
         """Get a SQL shell session."""
@@ -56,7 +179,9 @@ class DatabaseMng(ServiceMng):
         self, envCfg: EnvironmentCfg, svc_tag: str, user: str, psw: str
     ):
         """Create a new database user."""
-        pass
+        self.apply_manifest(
+            envCfg, svc_tag, ProvisionManifest(users=[UserSpec(user, psw)])
+        )
 
     def create_database_directory_svc(
         self,
@@ -64,12 +189,225 @@ class DatabaseMng(ServiceMng):
         svc_tag: str,
         user: str,
         directory_name: str,
+        path: str,
     ):
         """Create a directory object in a database."""
-        pass
+        self.apply_manifest(
+            envCfg,
+            svc_tag,
+            ProvisionManifest(
+                directories=[DirectorySpec(directory_name, path, user)]
+            ),
+        )
 
     def remove_database_user_svc(
         self, envCfg: EnvironmentCfg, svc_tag: str, user: str
     ):
         """Drop an existing user."""
-        pass
+        self.apply_manifest(
+            envCfg, svc_tag, ProvisionManifest(remove_users=[user])
+        )
+
+    def provision_svc(
+        self, envCfg: EnvironmentCfg, svc_tag: str, manifest_path: str
+    ):
+        """Provision a database service with the manifest at a path."""
+        try:
+            manifest = ProvisionManifest.load(manifest_path)
+        except OSError as e:
+            Util.print_error_and_die(f"Failed to read manifest: {e}")
+            return
+        except ValueError as e:
+            Util.print_error_and_die(str(e))
+            return
+        self.apply_manifest(envCfg, svc_tag, manifest)
+
+    def apply_manifest(
+        self, envCfg: EnvironmentCfg, svc_tag: str, manifest: ProvisionManifest
+    ):
+        """Provision a database service, printing the changes made only."""
+        service = self.get_db_service_or_die(envCfg, svc_tag)
+        try:
+            manifest.validate()
+            changes = service.provision(manifest)
+        except (RuntimeError, ValueError) as e:
+            Util.print_error_and_die(f"Failed to provision {svc_tag}: {e}")
+            return
+        if not changes:
+            Util.print(f"Provisioned: {svc_tag} (no changes)")
+            return
+        Util.print(f"Provisioned: {svc_tag} ({len(changes)} changes)")
+        for change in changes:
+            Util.print(f" - {change}")
+
+    def import_dump_svc(
+        self,
+        envCfg: EnvironmentCfg,
+        svc_tag: str,
+        dump: str,
+        jobs: Optional[int] = None,
+    ):
+        """
+        Import a dump, plain, gzip or zstd, into a database service,
+        streaming it to the service container and restoring its
+        independent objects in parallel, `db_import_jobs` by default.
+        """
+        service = self.get_service_or_die(envCfg, svc_tag)
+        try:
+            engine = db_engine(service.svcCfg)
+        except ValueError as e:
+            Util.print_error_and_die(str(e))
+            return
+        if not os.path.isfile(dump):
+            Util.print_error_and_die(f"Dump '{dump}' not found.")
+            return
+        jobs = jobs or int(self.configMng.values.get("db_import_jobs") or 4)
+        name = os.path.basename(dump)
+        try:
+            if Util.console.is_terminal:
+                with Util.console.status(f"Importing {name}") as status:
+
+                    def show(p: ImportProgress):
+                        status.update(
+                            f"Importing {name}: {p.read_bytes / 1e6:.1f}/"
+                            f"{p.total_bytes / 1e6:.1f} MB, "
+                            f"{p.restored}/{p.objects} objects"
+                        )
+
+                    result = DumpImporter(
+                        engine, service.exec_input, jobs, show
+                    ).import_dump(dump)
+            else:
+                result = DumpImporter(
+                    engine, service.exec_input, jobs
+                ).import_dump(dump)
+        except (OSError, RuntimeError) as e:
+            Util.print_error_and_die(f"Failed to import dump: {e}")
+            return
+        Util.print(
+            f"Imported: {name} into {svc_tag} ({result.compression}, "
+            f"{result.read_bytes / 1e6:.1f} MB in {result.duration:.1f}s, "
+            f"{result.throughput:.1f} MB/s, {result.objects} objects, "
+            f"up to {result.sessions} parallel sessions)"
+        )
+
+    def get_db_service_or_die(
+        self, envCfg: EnvironmentCfg, svc_tag: str
+    ) -> DatabaseService:
+        """
+        Get a database service, exit with an error when it does not
+        exist or does not run in a container.
+        """
+        service = self.get_service_or_die(envCfg, svc_tag)
+        if not isinstance(service, DockerSvc):
+            Util.print_error_and_die(
+                f"Service '{svc_tag}' does not run in a container."
+            )
+        return DatabaseService(self.configMng, envCfg, service.svcCfg)
+
+    def checkpoint_svc(self, envCfg: EnvironmentCfg, svc_tag: str, name: str):
+        """
+        Checkpoint the data volume of a database service, replacing the
+        checkpoint with the same name with the `replace` flag.
+        """
+        service = self.get_db_service_or_die(envCfg, svc_tag)
+        started = time.monotonic()
+        try:
+            checkpoint = service.checkpoint(
+                name, bool(self.cli_flags.get("replace"))
+            )
+        except (OSError, RuntimeError, ValueError) as e:
+            Util.print_error_and_die(f"Failed to checkpoint {svc_tag}: {e}")
+            return
+        Util.print(
+            f"Checkpointed: {svc_tag} to {name} "
+            f"({checkpoint.size / 1e6:.1f} MB, "
+            f"{checkpoint.reflinked / 1e6:.1f} MB reflinked, "
+            f"in {time.monotonic() - started:.1f}s)"
+        )
+
+    def rollback_svc(self, envCfg: EnvironmentCfg, svc_tag: str, name: str):
+        """Roll the data volume of a database service back to a checkpoint."""
+        service = self.get_db_service_or_die(envCfg, svc_tag)
+        started = time.monotonic()
+        try:
+            checkpoint = service.rollback(name)
+        except (OSError, RuntimeError, ValueError) as e:
+            Util.print_error_and_die(f"Failed to roll {svc_tag} back: {e}")
+            return
+        Util.print(
+            f"Rolled back: {svc_tag} to {name} "
+            f"({checkpoint.size / 1e6:.1f} MB, "
+            f"in {time.monotonic() - started:.1f}s)"
+        )
+
+    def list_checkpoints_svc(self, envCfg: EnvironmentCfg, svc_tag: str):
+        """List the checkpoints of a database service, oldest first."""
+        service = self.get_db_service_or_die(envCfg, svc_tag)
+        checkpoints = service.checkpoint_store().list()
+        if self.cli_flags.get("porcelain"):
+            for c in checkpoints:
+                Util.print(
+                    f"{c.name}\t{c.created:.0f}\t{c.size}\t{c.reflinked}"
+                )
+            return
+        if not checkpoints:
+            Util.print(f"No checkpoints of {svc_tag}.")
+            return
+        table = Table(title=f"{svc_tag} checkpoints")
+        table.add_column("Checkpoint")
+        table.add_column("Created")
+        table.add_column("Size", justify="right")
+        table.add_column("Reflinked", justify="right")
+        for c in checkpoints:
+            table.add_row(
+                c.name,
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(c.created)),
+                f"{c.size / 1e6:.1f} MB",
+                f"{c.reflinked / 1e6:.1f} MB",
+            )
+        Util.console.print(table)
+
+    def prune_checkpoints_svc(
+        self,
+        envCfg: EnvironmentCfg,
+        svc_tag: str,
+        names: list[str],
+        keep: Optional[int] = None,
+        older_than: Optional[str] = None,
+    ):
+        """
+        Remove the named checkpoints of a database service, those older
+        than the `keep` newest and those older than `older_than`.
+        """
+        if not names and keep is None and not older_than:
+            Util.print_error_and_die(
+                "Nothing to prune, give checkpoint names, --keep or "
+                "--older-than."
+            )
+            return
+        service = self.get_db_service_or_die(envCfg, svc_tag)
+        store = service.checkpoint_store()
+        for name in names:
+            try:
+                checkpoint = store.get(name)
+            except ValueError as e:
+                Util.print_error_and_die(str(e))
+                return
+            if not checkpoint:
+                Util.print_error_and_die(f"Checkpoint '{name}' does not exist.")
+                return
+        try:
+            before = Util.parse_age(older_than) if older_than else None
+        except ValueError as e:
+            Util.print_error_and_die(str(e))
+            return
+        try:
+            removed = store.prune(names, keep, before)
+        except OSError as e:
+            Util.print_error_and_die(f"Failed to prune checkpoints: {e}")
+            return
+        if not removed:
+            Util.print("No checkpoints to prune.")
+        for c in removed:
+            Util.print(f"Pruned: {c.name} ({c.size / 1e6:.1f} MB)")
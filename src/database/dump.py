@@ -0,0 +1,420 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import io
+import os
+import queue
+import re
+import shutil
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+from typing import IO, Any, Callable, Iterable, Iterator, Optional, cast
+
+from .engines import DbEngine
+
+COPY_SIZE = 1 << 20
+# Lines are sent to the sessions in batches, every session queues a few
+# of them: this bounds how far the dump is read ahead of the slowest one.
+BATCH_SIZE = 256 * 1024
+QUEUE_BATCHES = 32
+PREAMBLE_MAX = 1 << 20
+PROGRESS_INTERVAL = 0.2
+COMPRESSIONS = {b"\x1f\x8b": "gzip", b"\x28\xb5\x2f\xfd": "zstd"}
+DECOMPRESSORS = {"gzip": ["gzip", "-dc"], "zstd": ["zstd", "-dcq"]}
+# The comment heading every entry of a plain pg_dump script.
+ENTRY = re.compile(rb"-- (?:Data for )?Name: .*?; Type: (.*?);")
+PARALLEL_ENTRIES = (b"TABLE DATA", b"INDEX")
+COPY_END = (b"\\.\n", b"\\.\r\n")
+
+Runner = Callable[[list[str], Iterable[bytes]], tuple[int, bytes]]
+
+
+def detect_compression(head: bytes) -> Optional[str]:
+    """Return the compression of a file starting with `head`, if any."""
+    for magic, compression in COMPRESSIONS.items():
+        if head.startswith(magic):
+            return compression
+    return None
+
+
+class DumpReader(io.RawIOBase):
+    """
+    A dump file read decompressed, plain, gzip or zstd as told by its
+    first bytes, counting the bytes of the file consumed so far.
+    """
+
+    def __init__(self, path: str):
+        self.file = open(path, "rb")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.consumed = 0
+        self.compression = detect_compression(self.file.read(4))
+        self.file.seek(0)
+        self.proc: Optional[subprocess.Popen[bytes]] = None
+        self.feeder: Optional[threading.Thread] = None
+        if self.compression:
+            tool, *args = DECOMPRESSORS[self.compression]
+            command = shutil.which(tool)
+            if not command:
+                self.file.close()
+                raise RuntimeError(f"{tool} not found")
+            self.proc = subprocess.Popen(
+                [command] + args,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+            )
+            self.feeder = threading.Thread(target=self.feed, daemon=True)
+            self.feeder.start()
+
+    def feed(self):
+        assert self.proc and self.proc.stdin
+        try:
+            while chunk := self.file.read(COPY_SIZE):
+                self.consumed += len(chunk)
+                self.proc.stdin.write(chunk)
+        except OSError:
+            pass
+        finally:
+            try:
+                self.proc.stdin.close()
+            except OSError:
+                pass
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        if self.proc:
+            return cast(io.BufferedReader, self.proc.stdout).readinto(buffer)
+        n = self.file.readinto(buffer)
+        self.consumed += n
+        return n
+
+    def check(self):
+        """
+        :raises RuntimeError: If the dump could not be decompressed.
+        """
+        if self.proc and self.proc.wait():
+            raise RuntimeError(f"corrupted {self.compression} dump")
+
+    def close(self):
+        if self.proc:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+            if self.proc.stdout:
+                self.proc.stdout.close()
+        self.file.close()
+        super().close()
+
+
+@dataclass
+class ImportProgress:
+    read_bytes: int = 0
+    total_bytes: int = 0
+    objects: int = 0
+    restored: int = 0
+
+
+@dataclass
+class DumpImportResult:
+    """
+    Outcome of a dump import: the dump bytes read, the objects restored
+    and the most sessions restoring them at once.
+    """
+
+    compression: str
+    read_bytes: int
+    objects: int
+    sessions: int
+    duration: float
+
+    @property
+    def throughput(self) -> float:
+        """Read dump in MB/s."""
+        return self.read_bytes / 1e6 / max(self.duration, 1e-6)
+
+
+class DumpSession:
+    """
+    A client session of the database restoring part of a dump, fed from
+    a bounded queue by the dump reader.
+    """
+
+    def __init__(
+        self,
+        run: Runner,
+        command: list[str],
+        head: bytes,
+        parallel: bool,
+    ):
+        self.head = head
+        self.parallel = parallel
+        self.objects = 0
+        self.error: Optional[str] = None
+        self.queue: queue.Queue[Optional[bytes]] = queue.Queue(QUEUE_BATCHES)
+        self.done = threading.Event()
+        self.cancelled = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, args=(run, command), daemon=True
+        )
+        self.thread.start()
+
+    def chunks(self) -> Iterator[bytes]:
+        if self.head:
+            yield self.head
+        while (chunk := self.queue.get()) is not None:
+            if self.cancelled.is_set():
+                return
+            yield chunk
+
+    def run(self, run: Runner, command: list[str]):
+        try:
+            code, output = run(command, self.chunks())
+            if code:
+                lines = output.decode(errors="replace").strip().splitlines()
+                self.error = lines[-1] if lines else f"exit code {code}"
+        except (OSError, RuntimeError) as e:
+            self.error = str(e)
+        finally:
+            self.done.set()
+
+    def send(self, chunk: Optional[bytes]):
+        """
+        Queue a chunk of the dump, None ending the session input.
+
+        :raises RuntimeError: If the session ended.
+        """
+        while True:
+            if self.done.is_set():
+                raise RuntimeError(self.error or "session ended early")
+            try:
+                self.queue.put(chunk, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def cancel(self):
+        """
+        End the session input at once, dropping the chunks still queued,
+        and wait for the session to end.
+        """
+        self.cancelled.set()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+        self.queue.put(None)
+        self.thread.join()
+
+    def wait(self):
+        """
+        :raises RuntimeError: If the session failed.
+        """
+        self.thread.join()
+        if self.error:
+            raise RuntimeError(self.error)
+
+
+class DumpImporter:
+    """
+    Restore a dump into a database service while it is read.
+
+    The dump is decompressed on the fly and streamed to client sessions
+    run in the service container, nothing is copied there first. Plain
+    dumps of the engines telling their entries apart are split on the
+    entry headers: table data and indexes are restored by parallel
+    sessions, up to `jobs` at once, the other entries in order by a single
+    session once the entries before them are restored. Every session
+    starts with the preamble of the dump, its settings. Other scripts and
+    archives go to a single session as they are.
+    """
+
+    def __init__(
+        self,
+        engine: DbEngine,
+        run: Runner,
+        jobs: int = 4,
+        progress: Optional[Callable[[ImportProgress], None]] = None,
+    ):
+        self.engine = engine
+        self.run = run
+        self.jobs = max(1, jobs)
+        self.progress = progress
+        self.state = ImportProgress()
+        self.reader: Optional[DumpReader] = None
+        self.sessions: list[DumpSession] = []
+        self.current: Optional[DumpSession] = None
+        self.peak = 0
+        self.reported = 0.0
+
+    def import_dump(self, path: str) -> DumpImportResult:
+        """
+        :raises RuntimeError: If the dump cannot be read or restored.
+        """
+        start = time.monotonic()
+        with DumpReader(path) as reader:
+            self.reader = reader
+            self.state.total_bytes = reader.size
+            stream = io.BufferedReader(reader, COPY_SIZE)
+            try:
+                command = self.engine.archive_command(stream.peek(16)[:16])
+                if command:
+                    self.restore_script(stream, command, b"")
+                elif self.engine.dump_entries:
+                    self.restore_entries(stream)
+                else:
+                    self.restore_script(
+                        stream,
+                        self.engine.sql_command(),
+                        self.engine.script_preamble(),
+                    )
+                self.wait_all()
+            except RuntimeError:
+                self.abort()
+                raise
+            reader.check()
+        self.report(force=True)
+        return DumpImportResult(
+            reader.compression or "plain",
+            reader.consumed,
+            self.state.restored,
+            self.peak,
+            time.monotonic() - start,
+        )
+
+    def report(self, force: bool = False):
+        if not self.progress or not self.reader:
+            return
+        now = time.monotonic()
+        if force or now - self.reported >= PROGRESS_INTERVAL:
+            self.reported = now
+            self.state.read_bytes = self.reader.consumed
+            self.progress(self.state)
+
+    def begin(
+        self, command: list[str], head: bytes, parallel: bool
+    ) -> DumpSession:
+        """
+        End the input of the current session and start the next one once
+        the sessions it depends on are done: a parallel session after the
+        sequential one before it and when a parallel slot is free, a
+        sequential session after all of them.
+        """
+        if self.current:
+            self.current.send(None)
+        if not parallel or (self.current and not self.current.parallel):
+            self.wait_all()
+        while len(self.sessions) >= self.jobs:
+            done = [s for s in self.sessions if s.done.is_set()]
+            self.finish(done[0] if done else self.sessions[0])
+        self.current = DumpSession(self.run, command, head, parallel)
+        self.sessions.append(self.current)
+        self.peak = max(self.peak, len(self.sessions))
+        return self.current
+
+    def end(self):
+        """End the input of the current session."""
+        if self.current:
+            self.current.send(None)
+            self.current = None
+
+    def abort(self):
+        """Cancel the sessions still running, waiting for them to end."""
+        for session in self.sessions:
+            session.cancel()
+        self.sessions, self.current = [], None
+
+    def finish(self, session: DumpSession):
+        self.sessions.remove(session)
+        session.wait()
+        self.state.restored += session.objects
+        self.report()
+
+    def wait_all(self):
+        while self.sessions:
+            self.finish(self.sessions[0])
+
+    def check_failed(self):
+        for session in self.sessions:
+            if session.done.is_set() and session.error:
+                raise RuntimeError(session.error)
+
+    def restore_script(
+        self,
+        stream: IO[bytes],
+        command: list[str],
+        head: bytes,
+        first: bytes = b"",
+    ):
+        """Restore the rest of the dump, after `first`, as one object."""
+        session = self.begin(command, head, False)
+        session.objects = 1
+        self.state.objects += 1
+        if first:
+            session.send(first)
+        while chunk := stream.read(COPY_SIZE):
+            session.send(chunk)
+            self.report()
+        self.end()
+
+    def restore_entries(self, stream: IO[bytes]):
+        command = self.engine.sql_command()
+        preamble = bytearray()
+        batch = bytearray()
+        copying = False
+        for line in stream:
+            if copying:
+                copying = line not in COPY_END
+            elif match := ENTRY.match(line):
+                parallel = match.group(1) in PARALLEL_ENTRIES
+                current = self.current
+                if not current or parallel or current.parallel:
+                    if current and batch:
+                        current.send(bytes(batch))
+                        batch.clear()
+                    self.begin(command, bytes(preamble), parallel)
+                assert self.current
+                self.current.objects += 1
+                self.state.objects += 1
+            elif line.startswith(b"COPY ") and line.rstrip().endswith(
+                b"FROM stdin;"
+            ):
+                copying = True
+            if not self.current:
+                preamble += line
+                if len(preamble) > PREAMBLE_MAX:
+                    break
+                continue
+            batch += line
+            if len(batch) >= BATCH_SIZE:
+                self.check_failed()
+                self.current.send(bytes(batch))
+                batch.clear()
+                self.report()
+        if not self.current:
+            # a script without entries to tell apart
+            self.restore_script(stream, command, b"", bytes(preamble))
+            return
+        if batch:
+            self.current.send(bytes(batch))
+        self.end()
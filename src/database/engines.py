@@ -0,0 +1,312 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+from typing import Optional
+
+from config import ServiceCfg
+
+from .provision import CHANGE_MARKER, GrantSpec, ProvisionManifest
+
+PROP_DB_ENGINE = "db.engine"
+PROP_DB_USER = "db.user"
+PROP_DB_NAME = "db.name"
+PROP_DB_DATA = "db.data"
+
+
+class DbEngine(ABC):
+    """
+    The client commands of a database engine, run in the container of
+    its service and configured by the `db.*` service properties.
+    """
+
+    name = ""
+    # Where the engine keeps its data in the container.
+    data_dir = ""
+    # Plain dumps of the engine tell their entries apart.
+    dump_entries = False
+
+    def __init__(self, properties: dict[str, str]):
+        self.properties = properties
+
+    @abstractmethod
+    def sql_command(self) -> list[str]:
+        """The command running the SQL script read from its input."""
+        pass
+
+    def script_preamble(self) -> bytes:
+        """SQL sent first to every session running a script."""
+        return b""
+
+    def archive_command(self, head: bytes) -> Optional[list[str]]:
+        """
+        The command restoring a dump starting with `head` when it is an
+        archive of the engine, None when it is a SQL script.
+        """
+        return None
+
+    @abstractmethod
+    def provision_script(self, manifest: ProvisionManifest) -> bytes:
+        """
+        The script provisioning a manifest in a single session, creating
+        what is missing only and reporting each change with a line
+        starting with `CHANGE_MARKER`.
+
+        :raises ValueError: If the manifest cannot be provisioned.
+        """
+        pass
+
+
+def sql_string(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+class PostgresEngine(DbEngine):
+
+    name = "postgres"
+    data_dir = "/var/lib/postgresql/data"
+    dump_entries = True
+
+    @property
+    def user(self) -> str:
+        return self.properties.get(PROP_DB_USER) or "postgres"
+
+    @property
+    def database(self) -> str:
+        return self.properties.get(PROP_DB_NAME) or self.user
+
+    def sql_command(self) -> list[str]:
+        return [
+            "psql",
+            "-X",
+            "-q",
+            "-v",
+            "ON_ERROR_STOP=1",
+            "-U",
+            self.user,
+            "-d",
+            self.database,
+        ]
+
+    def provision_script(self, manifest: ProvisionManifest) -> bytes:
+        """
+        Provision the manifest in a transaction, every step being a `DO`
+        block checking the catalogs first. Names are case sensitive.
+        """
+        if manifest.directories:
+            raise ValueError("Postgres has no directory objects.")
+        steps: list[str] = []
+
+        def step(condition: str, statements: str, change: str):
+            steps.append(
+                f"DO $shpd$ BEGIN IF {condition} THEN {statements}; "
+                f"RAISE NOTICE '%', {sql_string(CHANGE_MARKER + change)}; "
+                f"END IF; END $shpd$;"
+            )
+
+        for u in manifest.users:
+            if "$shpd$" in u.password:
+                raise ValueError(f"Invalid password of user '{u.name}'.")
+            password = (
+                f" PASSWORD {sql_string(u.password)}" if u.password else ""
+            )
+            step(
+                f"NOT EXISTS (SELECT FROM pg_roles WHERE rolname = "
+                f"{sql_string(u.name)})",
+                f'CREATE ROLE "{u.name}" LOGIN{password}',
+                f"created user {u.name}",
+            )
+        for g in manifest.grants:
+            for privilege in g.privileges:
+                step(*self.grant_step(g, privilege))
+        for name in manifest.remove_users:
+            step(
+                f"EXISTS (SELECT FROM pg_roles WHERE rolname = "
+                f"{sql_string(name)})",
+                f'DROP OWNED BY "{name}"; DROP ROLE "{name}"',
+                f"removed user {name}",
+            )
+        return "\n".join(["BEGIN;", *steps, "COMMIT;", ""]).encode()
+
+    def grant_step(self, g: GrantSpec, privilege: str) -> tuple[str, str, str]:
+        """The condition, statement and change of granting a privilege."""
+        kind, name = g.target
+        user = sql_string(g.to)
+        if not kind:
+            return (
+                f"NOT pg_has_role({user}, {sql_string(privilege)}, 'MEMBER')",
+                f'GRANT "{privilege}" TO "{g.to}"',
+                f"granted {privilege} to {g.to}",
+            )
+        if kind == "directory":
+            raise ValueError("Postgres has no directory objects.")
+        quoted = ".".join(f'"{part}"' for part in name.split("."))
+        # the table form is parsed as an identifier, the others are names
+        checked = quoted if kind == "table" else name
+        return (
+            f"NOT has_{kind}_privilege({user}, {sql_string(checked)}, "
+            f"{sql_string(privilege)})",
+            f'GRANT {privilege} ON {kind.upper()} {quoted} TO "{g.to}"',
+            f"granted {privilege} on {kind} {name} to {g.to}",
+        )
+
+    def archive_command(self, head: bytes) -> Optional[list[str]]:
+        if not head.startswith(b"PGDMP"):
+            return None
+        return [
+            "pg_restore",
+            "--exit-on-error",
+            "--no-owner",
+            "-U",
+            self.user,
+            "-d",
+            self.database,
+        ]
+
+
+class OracleEngine(DbEngine):
+
+    name = "oracle"
+    data_dir = "/opt/oracle/oradata"
+
+    def sql_command(self) -> list[str]:
+        return [
+            "sqlplus",
+            "-S",
+            "-L",
+            self.properties.get(PROP_DB_USER) or "/ as sysdba",
+        ]
+
+    def script_preamble(self) -> bytes:
+        preamble = "WHENEVER SQLERROR EXIT FAILURE\n"
+        if database := self.properties.get(PROP_DB_NAME):
+            preamble += f"ALTER SESSION SET CONTAINER = {database};\n"
+        return preamble.encode()
+
+    def provision_script(self, manifest: ProvisionManifest) -> bytes:
+        """
+        Provision the manifest in a PL/SQL block checking the dictionary
+        views first. DDL commits on its own: the steps done before an
+        error are kept, running the manifest again completes it.
+        """
+        lines = ["DECLARE", "  n NUMBER;", "BEGIN"]
+
+        def step(count: str, statement: str, change: str, missing: bool = True):
+            lines.extend(
+                [
+                    f"  SELECT COUNT(*) INTO n FROM {count};",
+                    f"  IF n {'=' if missing else '>'} 0 THEN",
+                    f"    EXECUTE IMMEDIATE {sql_string(statement)};",
+                    f"    dbms_output.put_line("
+                    f"{sql_string(CHANGE_MARKER + change)});",
+                    "  END IF;",
+                ]
+            )
+
+        def grant(privilege: str, to: str, kind: str, name: str):
+            user = sql_string(to.upper())
+            if not kind:
+                step(
+                    f"(SELECT privilege FROM dba_sys_privs WHERE grantee = "
+                    f"{user} UNION ALL SELECT granted_role FROM "
+                    f"dba_role_privs WHERE grantee = {user}) WHERE "
+                    f"privilege = {sql_string(privilege.upper())}",
+                    f"GRANT {privilege} TO {to}",
+                    f"granted {privilege} to {to}",
+                )
+                return
+            if kind not in ("table", "directory"):
+                raise ValueError(f"Oracle has no {kind} privileges.")
+            owner, _, table = name.rpartition(".")
+            owned = f" AND owner = {sql_string(owner.upper())}" if owner else ""
+            on = f"DIRECTORY {name}" if kind == "directory" else name
+            step(
+                f"dba_tab_privs WHERE grantee = {user} AND table_name = "
+                f"{sql_string(table.upper())}{owned} AND privilege = "
+                f"{sql_string(privilege.upper())}",
+                f"GRANT {privilege} ON {on} TO {to}",
+                f"granted {privilege} on {kind} {name} to {to}",
+            )
+
+        for u in manifest.users:
+            if '"' in u.password:
+                raise ValueError(f"Invalid password of user '{u.name}'.")
+            step(
+                f"dba_users WHERE username = {sql_string(u.name.upper())}",
+                (
+                    f'CREATE USER {u.name} IDENTIFIED BY "{u.password}"'
+                    if u.password
+                    else f"CREATE USER {u.name} NO AUTHENTICATION"
+                ),
+                f"created user {u.name}",
+            )
+        for d in manifest.directories:
+            step(
+                f"dba_directories WHERE directory_name = "
+                f"{sql_string(d.name.upper())} AND directory_path = "
+                f"{sql_string(d.path)}",
+                f"CREATE OR REPLACE DIRECTORY {d.name} AS {sql_string(d.path)}",
+                f"created directory {d.name} at {d.path}",
+            )
+            if d.owner:
+                for privilege in ("READ", "WRITE"):
+                    grant(privilege, d.owner, "directory", d.name)
+        for g in manifest.grants:
+            kind, name = g.target
+            for privilege in g.privileges:
+                grant(privilege, g.to, kind, name)
+        for name in manifest.remove_users:
+            step(
+                f"dba_users WHERE username = {sql_string(name.upper())}",
+                f"DROP USER {name} CASCADE",
+                f"removed user {name}",
+                missing=False,
+            )
+        lines += ["END;", "/", "EXIT", ""]
+        return (
+            self.script_preamble()
+            + b"SET SERVEROUTPUT ON FEEDBACK OFF\n"
+            + "\n".join(lines).encode()
+        )
+
+
+ENGINES: dict[str, type[DbEngine]] = {
+    PostgresEngine.name: PostgresEngine,
+    OracleEngine.name: OracleEngine,
+}
+
+
+def db_engine(svcCfg: ServiceCfg) -> DbEngine:
+    """
+    Return the database engine of a service: its `db.engine` property,
+    guessed from its image otherwise.
+
+    :raises ValueError: If the service is not a known database.
+    """
+    properties = svcCfg.properties or {}
+    name = properties.get(PROP_DB_ENGINE)
+    if not name:
+        image = svcCfg.image.lower()
+        name = next((n for n in ENGINES if n in image), "")
+    if name not in ENGINES:
+        raise ValueError(
+            f"Service '{svcCfg.tag}' is not a known database, "
+            f"set its '{PROP_DB_ENGINE}' property ({', '.join(ENGINES)})."
+        )
+    return ENGINES[name](properties)
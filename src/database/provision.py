@@ -0,0 +1,235 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import re
+from dataclasses import dataclass, field
+from typing import Any, Optional, cast
+
+import yaml
+
+# Printed by the provisioning script for every change it makes.
+CHANGE_MARKER = "shpd-change: "
+
+IDENTIFIER = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*")
+QUALIFIED = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*(\.[A-Za-z_][A-Za-z0-9_$]*)?")
+PRIVILEGE = re.compile(r"[A-Za-z_][A-Za-z0-9_$]*( [A-Za-z_]+)*")
+OBJECT_KINDS = ("table", "schema", "database", "directory")
+MANIFEST_KEYS = ("users", "directories", "grants", "remove_users")
+
+
+@dataclass
+class UserSpec:
+    """A user to create, its password being set on creation only."""
+
+    name: str
+    password: str = ""
+
+
+@dataclass
+class DirectorySpec:
+    """A directory object, read and write granted to its owner."""
+
+    name: str
+    path: str
+    owner: str = ""
+
+
+@dataclass
+class GrantSpec:
+    """
+    Privileges granted to a user: system privileges or roles when `on` is
+    empty, privileges on the object `on`, `<kind> <name>`, otherwise.
+    """
+
+    privileges: list[str]
+    to: str
+    on: str = ""
+
+    @property
+    def target(self) -> tuple[str, str]:
+        """The kind and name of the object, a table by default."""
+        if not self.on:
+            return "", ""
+        kind, _, name = self.on.partition(" ")
+        return (kind.lower(), name) if name else ("table", kind)
+
+
+@dataclass
+class ProvisionManifest:
+    """The users, directories and grants a database is provisioned with."""
+
+    users: list[UserSpec] = field(default_factory=list[UserSpec])
+    directories: list[DirectorySpec] = field(
+        default_factory=list[DirectorySpec]
+    )
+    grants: list[GrantSpec] = field(default_factory=list[GrantSpec])
+    remove_users: list[str] = field(default_factory=list[str])
+
+    @staticmethod
+    def load(path: str) -> ProvisionManifest:
+        """
+        Load a YAML manifest.
+
+        :raises OSError: If the manifest cannot be read.
+        :raises ValueError: If the manifest is not valid.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            try:
+                data: Any = yaml.safe_load(f) or {}
+            except yaml.YAMLError as e:
+                raise ValueError(f"Invalid manifest: {e}")
+        return ProvisionManifest.from_dict(data)
+
+    @staticmethod
+    def from_dict(data: Any) -> ProvisionManifest:
+        """:raises ValueError: If the manifest is not valid."""
+        items = mapping(data, "manifest", MANIFEST_KEYS)
+        users = [
+            mapping(
+                {"name": u} if isinstance(u, str) else u,
+                "user",
+                ("name", "password"),
+            )
+            for u in sequence(items, "users")
+        ]
+        directories = [
+            mapping(d, "directory", ("name", "path", "owner"))
+            for d in sequence(items, "directories")
+        ]
+        grants = [
+            mapping(yaml_keys(g), "grant", ("privileges", "on", "to"))
+            for g in sequence(items, "grants")
+        ]
+        manifest = ProvisionManifest(
+            users=[
+                UserSpec(text(u, "name"), text(u, "password")) for u in users
+            ],
+            directories=[
+                DirectorySpec(
+                    text(d, "name"), text(d, "path"), text(d, "owner")
+                )
+                for d in directories
+            ],
+            grants=[
+                GrantSpec(
+                    (
+                        [text(g, "privileges")]
+                        if isinstance(g.get("privileges"), str)
+                        else [str(p) for p in sequence(g, "privileges")]
+                    ),
+                    text(g, "to"),
+                    text(g, "on"),
+                )
+                for g in grants
+            ],
+            remove_users=[str(u) for u in sequence(items, "remove_users")],
+        )
+        manifest.validate()
+        return manifest
+
+    def validate(self):
+        """
+        Check the names the manifest puts in SQL statements.
+
+        :raises ValueError: If a name is not valid.
+        """
+
+        def check(pattern: re.Pattern[str], value: str, what: str):
+            if not pattern.fullmatch(value):
+                raise ValueError(f"Invalid {what} '{value}' in manifest.")
+
+        for u in self.users:
+            check(IDENTIFIER, u.name, "user")
+            if "\n" in u.password:
+                raise ValueError(f"Invalid password of user '{u.name}'.")
+        for d in self.directories:
+            check(IDENTIFIER, d.name, "directory")
+            if not d.path or "'" in d.path:
+                raise ValueError(f"Invalid path of directory '{d.name}'.")
+            if d.owner:
+                check(IDENTIFIER, d.owner, "user")
+        for g in self.grants:
+            check(IDENTIFIER, g.to, "user")
+            if not g.privileges:
+                raise ValueError(f"Grant to '{g.to}' without privileges.")
+            for privilege in g.privileges:
+                check(PRIVILEGE, privilege, "privilege")
+            kind, name = g.target
+            if g.on and kind not in OBJECT_KINDS:
+                raise ValueError(f"Invalid object '{g.on}' in manifest.")
+            if g.on:
+                check(QUALIFIED if kind == "table" else IDENTIFIER, name, kind)
+        for name in self.remove_users:
+            check(IDENTIFIER, name, "user")
+
+    def is_empty(self) -> bool:
+        return not (
+            self.users or self.directories or self.grants or self.remove_users
+        )
+
+
+def mapping(data: Any, what: str, keys: tuple[str, ...]) -> dict[str, Any]:
+    if not isinstance(data, dict):
+        raise ValueError(f"Invalid manifest: {what} is not a mapping.")
+    items = cast(dict[str, Any], data)
+    if unknown := set(items) - set(keys):
+        raise ValueError(
+            f"Invalid manifest: unknown {what} keys "
+            f"{', '.join(sorted(map(str, unknown)))}."
+        )
+    return items
+
+
+def yaml_keys(data: Any) -> Any:
+    """Undo YAML 1.1 reading an `on` key as true."""
+    if not isinstance(data, dict):
+        return data
+    items = cast(dict[Any, Any], data)
+    return {"on" if k is True else k: v for k, v in items.items()}
+
+
+def sequence(items: dict[str, Any], key: str) -> list[Any]:
+    values: Any = items.get(key) or []
+    if not isinstance(values, list):
+        raise ValueError(f"Invalid manifest: '{key}' is not a list.")
+    return cast(list[Any], values)
+
+
+def text(items: dict[str, Any], key: str) -> str:
+    value = items.get(key)
+    return "" if value is None else str(value)
+
+
+def parse_changes(output: bytes) -> list[str]:
+    """Return the changes reported by a provisioning script output."""
+    changes: list[str] = []
+    for line in output.decode(errors="replace").splitlines():
+        _, marker, change = line.partition(CHANGE_MARKER)
+        if marker:
+            changes.append(change.strip())
+    return changes
+
+
+def session_error(code: int, output: bytes) -> Optional[str]:
+    """The error a client session ended with, None when it succeeded."""
+    if not code:
+        return None
+    lines = output.decode(errors="replace").strip().splitlines()
+    errors = [line for line in lines if CHANGE_MARKER not in line]
+    return errors[-1] if errors else f"exit code {code}"
@@ -16,7 +16,30 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from .docker_build import BuildIndex, DockerImageBuilder
 from .docker_compose_env import DockerComposeEnv
+from .docker_engine import (
+    DockerEngineClient,
+    DockerEngineError,
+    DockerNotFoundError,
+)
+from .docker_logs import DockerLogMux, LogSource
+from .docker_pull import PullProgress
+from .docker_reconcile import DockerReconciler
+from .docker_status import DockerStatusCache
 from .docker_svc import DockerSvc
 
-__all__ = ["DockerComposeEnv", "DockerSvc"]
+__all__ = [
+    "BuildIndex",
+    "DockerComposeEnv",
+    "DockerEngineClient",
+    "DockerEngineError",
+    "DockerImageBuilder",
+    "DockerLogMux",
+    "DockerNotFoundError",
+    "DockerReconciler",
+    "DockerStatusCache",
+    "DockerSvc",
+    "LogSource",
+    "PullProgress",
+]
@@ -0,0 +1,653 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import re
+import tarfile
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor
+from concurrent.futures import wait as wait_futures
+from dataclasses import asdict, dataclass, field
+from typing import Any, Iterator, Optional
+
+from config import ServiceTemplateCfg
+from service import PROP_BUILD_CONTEXT, PROP_BUILD_DOCKERFILE, ImageBuildResult
+
+from .docker_engine import (
+    DockerEngineClient,
+    DockerEngineError,
+    DockerNotFoundError,
+)
+
+DEFAULT_DOCKERFILE = "Dockerfile"
+STEP_RE = re.compile(r"^Step \d+/\d+ : (\S+)")
+CONTEXT_CHUNK_SIZE = 65536
+
+
+def read_instructions(path: str) -> list[str]:
+    """
+    Read the instructions of a Dockerfile, continuation lines joined and
+    whitespace normalized.
+    """
+    instructions: list[str] = []
+    current = ""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped or stripped.startswith("#"):
+                continue
+            if stripped.endswith("\\"):
+                current += stripped[:-1] + " "
+                continue
+            instructions.append(" ".join((current + stripped).split()))
+            current = ""
+    if current.strip():
+        instructions.append(" ".join(current.split()))
+    return instructions
+
+
+def from_images(instructions: list[str]) -> list[str]:
+    """Return the images the build stages start from."""
+    images: list[str] = []
+    stages: set[str] = set()
+    for instruction in instructions:
+        words = instruction.split()
+        if words[0].upper() != "FROM":
+            continue
+        args = [w for w in words[1:] if not w.startswith("--")]
+        if not args:
+            continue
+        image = args[0]
+        # images set through build arguments are resolved by the engine
+        if (
+            image.lower() not in stages
+            and image != "scratch"
+            and "$" not in image
+            and image not in images
+        ):
+            images.append(image)
+        if len(args) >= 3 and args[1].upper() == "AS":
+            stages.add(args[2].lower())
+    return images
+
+
+def hash_file(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(CONTEXT_CHUNK_SIZE):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def ignore_pattern(pattern: str) -> re.Pattern[str]:
+    """
+    Compile a .dockerignore pattern the way docker does: `*` and `?`
+    match within a path component, `**` any number of directories and
+    `\\` escapes the next character.
+    """
+    regex = ""
+    i = 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if pattern.startswith("**", i):
+            i += 2
+            if i == len(pattern):
+                regex += ".*"
+                break
+            if pattern[i] == "/":
+                i += 1
+            regex += "(.*/)?"
+            continue
+        if ch == "*":
+            regex += "[^/]*"
+        elif ch == "?":
+            regex += "[^/]"
+        elif ch == "\\" and i + 1 < len(pattern):
+            i += 1
+            regex += re.escape(pattern[i])
+        elif ch == "[":
+            end = pattern.find("]", i + 1)
+            if end < 0:
+                raise re.error("unterminated character set")
+            regex += pattern[i : end + 1]
+            i = end
+        else:
+            regex += re.escape(ch)
+        i += 1
+    return re.compile(f"^{regex}$")
+
+
+def read_dockerignore(path: str) -> list[tuple[re.Pattern[str], bool]]:
+    """
+    Read the patterns of a .dockerignore, each with whether it is an
+    exception (`!`) including back files matched by earlier patterns.
+
+    :raises RuntimeError: If a pattern is invalid.
+    """
+    patterns: list[tuple[re.Pattern[str], bool]] = []
+    if not os.path.exists(path):
+        return patterns
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            pattern = line.strip()
+            if not pattern or pattern.startswith("#"):
+                continue
+            exception = pattern.startswith("!")
+            if exception:
+                pattern = pattern[1:].strip()
+            cleaned = os.path.normpath(pattern).lstrip("/")
+            if not pattern or cleaned in ("", "."):
+                raise RuntimeError(
+                    f"invalid .dockerignore pattern '{line.strip()}'"
+                )
+            try:
+                patterns.append((ignore_pattern(cleaned), exception))
+            except re.error:
+                raise RuntimeError(
+                    f"invalid .dockerignore pattern '{line.strip()}'"
+                )
+    return patterns
+
+
+def is_ignored(patterns: list[tuple[re.Pattern[str], bool]], path: str) -> bool:
+    """
+    Tell whether the last pattern matching a path of the build context,
+    or one of its parent directories, excludes it.
+    """
+    parts = path.split(os.sep)
+    parents = ["/".join(parts[: i + 1]) for i in range(len(parts))]
+    ignored = False
+    for regex, exception in patterns:
+        if any(regex.match(p) for p in parents):
+            ignored = not exception
+    return ignored
+
+
+class BuildIndex:
+    """
+    Persistent record of the images built, by digest of their inputs.
+
+    The digests of the context files are cached too, a file is hashed
+    again only when its modification time or size changed.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.images: dict[str, str] = {}
+        self.files: dict[str, tuple[int, int, str]] = {}
+        self.lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data: dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.images = data.get("images", {})
+        self.files = {
+            path: (v[0], v[1], v[2])
+            for path, v in data.get("files", {}).items()
+        }
+
+    def store(self):
+        with self.lock:
+            data = {"images": self.images, "files": self.files}
+            tmp = f"{self.path}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f, indent=2)
+            os.replace(tmp, self.path)
+
+    def image_for(self, digest: str) -> Optional[str]:
+        with self.lock:
+            return self.images.get(digest)
+
+    def record(self, digest: str, image_id: str):
+        with self.lock:
+            self.images[digest] = image_id
+
+    def file_digest(self, path: str) -> str:
+        """Return the digest of a file, hashing it only if it changed."""
+        st = os.stat(path)
+        with self.lock:
+            cached = self.files.get(path)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        digest = hash_file(path)
+        with self.lock:
+            self.files[path] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+
+def common_prefix(a: list[str], b: list[str]) -> int:
+    size = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        size += 1
+    return size
+
+
+@dataclass
+class BuildUnit:
+    """
+    A single build producing the image of one or more service templates.
+    """
+
+    context: str
+    dockerfile: str
+    instructions: list[str]
+    images: list[str] = field(default_factory=list[str])
+    templates: list[str] = field(default_factory=list[str])
+    svcTmplCfgs: list[ServiceTemplateCfg] = field(
+        default_factory=list[ServiceTemplateCfg]
+    )
+    # units producing a base image of this one
+    requires: set[int] = field(default_factory=set[int])
+    # units to build first, the required ones and those sharing layers
+    after: set[int] = field(default_factory=set[int])
+
+    @property
+    def image(self) -> str:
+        return self.images[0]
+
+    @property
+    def bases(self) -> list[str]:
+        return from_images(self.instructions)
+
+
+class DockerImageBuilder:
+    """
+    Build the images of many service templates at once.
+
+    Templates with the same build context and Dockerfile are built once and
+    tagged for each of them. Builds start after those producing their base
+    images, the external base images are pulled once up front, and builds
+    sharing their first layers wait for the first of them so that the
+    others find those layers in the build cache. Independent builds run in
+    parallel, up to `max_workers` at a time.
+
+    With a build index, a build whose inputs have the same digest as an
+    earlier one only tags the image built then.
+    """
+
+    def __init__(
+        self,
+        engine: DockerEngineClient,
+        base_dir: str,
+        max_workers: int = 4,
+        index: Optional[BuildIndex] = None,
+    ):
+        self.engine = engine
+        self.base_dir = base_dir
+        self.max_workers = max(1, max_workers)
+        self.index = index
+
+    def context_dir(self, svcTmplCfg: ServiceTemplateCfg) -> Optional[str]:
+        """Return the build context of a template, relative to SHPD_DIR."""
+        context = (svcTmplCfg.properties or {}).get(PROP_BUILD_CONTEXT)
+        if not context:
+            return None
+        if context.startswith("~"):
+            context = os.path.expanduser(context)
+        return os.path.normpath(os.path.join(self.base_dir, context))
+
+    def plan(
+        self, svcTmplCfgs: list[ServiceTemplateCfg]
+    ) -> tuple[list[BuildUnit], list[ImageBuildResult]]:
+        """
+        Group the templates into build units and order them.
+
+        :return: The units and the results of the templates that can't be
+            built.
+        """
+        units: dict[tuple[str, str], BuildUnit] = {}
+        invalid: list[ImageBuildResult] = []
+        for svcTmplCfg in svcTmplCfgs:
+            context = self.context_dir(svcTmplCfg)
+            dockerfile = (svcTmplCfg.properties or {}).get(
+                PROP_BUILD_DOCKERFILE, DEFAULT_DOCKERFILE
+            )
+            if not context or not svcTmplCfg.image:
+                invalid.append(
+                    ImageBuildResult(
+                        svcTmplCfg.image,
+                        [svcTmplCfg.tag],
+                        False,
+                        error=(
+                            "no image configured"
+                            if context
+                            else "no build context configured"
+                        ),
+                    )
+                )
+                continue
+            unit = units.get((context, dockerfile))
+            if not unit:
+                try:
+                    instructions = read_instructions(
+                        os.path.join(context, dockerfile)
+                    )
+                except OSError as e:
+                    invalid.append(
+                        ImageBuildResult(
+                            svcTmplCfg.image,
+                            [svcTmplCfg.tag],
+                            False,
+                            error=f"cannot read {dockerfile}: {e.strerror}",
+                        )
+                    )
+                    continue
+                unit = units[(context, dockerfile)] = BuildUnit(
+                    context, dockerfile, instructions
+                )
+            if svcTmplCfg.image not in unit.images:
+                unit.images.append(svcTmplCfg.image)
+            unit.templates.append(svcTmplCfg.tag)
+            unit.svcTmplCfgs.append(svcTmplCfg)
+
+        ordered = list(units.values())
+        producers = {
+            image: i for i, unit in enumerate(ordered) for image in unit.images
+        }
+        for i, unit in enumerate(ordered):
+            for base in unit.bases:
+                if base in producers and producers[base] != i:
+                    unit.requires.add(producers[base])
+            unit.after |= unit.requires
+            for j, other in enumerate(ordered[:i]):
+                # same base and at least one more layer in common
+                same_files = other.context == unit.context
+                shared = common_prefix(other.instructions, unit.instructions)
+                if shared >= 2 and (
+                    same_files or not self.uses_context(unit, shared)
+                ):
+                    unit.after.add(j)
+                    break
+        return ordered, invalid
+
+    def uses_context(self, unit: BuildUnit, size: int) -> bool:
+        """Whether the first instructions copy files from the context."""
+        return any(
+            i.split()[0].upper() in ("COPY", "ADD")
+            and "--from=" not in i.lower()
+            for i in unit.instructions[:size]
+        )
+
+    def pull_bases(self, units: list[BuildUnit]) -> dict[str, str]:
+        """
+        Pull once the missing external base images of the units.
+
+        :return: The errors of the failed pulls, by image.
+        """
+        produced = {image for unit in units for image in unit.images}
+        bases = sorted(
+            {b for unit in units for b in unit.bases if b not in produced}
+        )
+        errors: dict[str, str] = {}
+
+        def pull(image: str):
+            try:
+                self.engine.inspect_image(image)
+            except DockerNotFoundError:
+                self.engine.pull_image(image)
+
+        if not bases:
+            return errors
+        workers = min(self.max_workers, len(bases))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = {image: pool.submit(pull, image) for image in bases}
+            for image, future in futures.items():
+                try:
+                    future.result()
+                except RuntimeError as e:
+                    errors[image] = str(e)
+        return errors
+
+    def context_files(
+        self, context: str, dockerfile: str = DEFAULT_DOCKERFILE
+    ) -> list[tuple[str, str]]:
+        """
+        List the files of the build context not excluded by its
+        .dockerignore, as (relative path, path) pairs in a stable order.
+        The Dockerfile and the .dockerignore are always listed, as docker
+        always sends them.
+
+        :raises RuntimeError: If the .dockerignore has an invalid pattern.
+        """
+        patterns = read_dockerignore(os.path.join(context, ".dockerignore"))
+        kept = {".dockerignore", os.path.normpath(dockerfile)}
+        # a directory excluded may still hold files an exception includes
+        prune = not any(exception for _, exception in patterns)
+
+        def pruned(path: str) -> bool:
+            return (
+                prune
+                and is_ignored(patterns, path)
+                and not any(k.startswith(path + os.sep) for k in kept)
+            )
+
+        files: list[tuple[str, str]] = []
+        for root, dirs, names in os.walk(context):
+            rel_root = os.path.relpath(root, context)
+            rel_root = "" if rel_root == "." else rel_root
+            dirs[:] = sorted(
+                d for d in dirs if not pruned(os.path.join(rel_root, d))
+            )
+            for name in sorted(names):
+                path = os.path.join(rel_root, name)
+                if path in kept or not is_ignored(patterns, path):
+                    files.append((path, os.path.join(root, name)))
+        return files
+
+    def tar_context(
+        self, context: str, dockerfile: str = DEFAULT_DOCKERFILE
+    ) -> Iterator[bytes]:
+        """
+        Stream a tar archive of the build context as it is read, a piece
+        of a file at a time.
+
+        :raises RuntimeError: If a file shrinks while it is sent.
+        """
+        # only describes the files, the archive itself is never written
+        tar = tarfile.TarFile(fileobj=io.BytesIO(), mode="w")
+        offset = 0
+        for rel_path, path in self.context_files(context, dockerfile):
+            info = tar.gettarinfo(path, rel_path)
+            header = info.tobuf(tar.format, tar.encoding, tar.errors)
+            offset += len(header)
+            yield header
+            if not info.isreg():
+                continue
+            remaining = info.size
+            with open(path, "rb") as f:
+                while remaining and (
+                    chunk := f.read(min(CONTEXT_CHUNK_SIZE, remaining))
+                ):
+                    remaining -= len(chunk)
+                    yield chunk
+            if remaining:
+                raise RuntimeError(f"'{rel_path}' changed while sent")
+            padding = -info.size % tarfile.BLOCKSIZE
+            offset += info.size + padding
+            yield tarfile.NUL * padding
+        # two empty blocks end the archive, padded to a full record
+        end = offset + 2 * tarfile.BLOCKSIZE
+        yield tarfile.NUL * (end - offset + -end % tarfile.RECORDSIZE)
+
+    def digest(self, unit: BuildUnit) -> str:
+        """
+        Compute the digest of the build inputs of a unit: its templates,
+        the files of its context and the images it starts from.
+        """
+        sha = hashlib.sha256()
+        for svcTmplCfg in sorted(unit.svcTmplCfgs, key=lambda t: t.tag):
+            sha.update(json.dumps(asdict(svcTmplCfg), sort_keys=True).encode())
+        sha.update(f"{unit.dockerfile}\0".encode())
+        for rel_path, path in self.context_files(unit.context, unit.dockerfile):
+            file_digest = (
+                self.index.file_digest(path) if self.index else hash_file(path)
+            )
+            sha.update(f"{rel_path}\0{file_digest}\n".encode())
+        for base in unit.bases:
+            sha.update(
+                f"{base}\0{self.engine.inspect_image(base)['Id']}\n".encode()
+            )
+        return f"sha256:{sha.hexdigest()}"
+
+    def reuse(self, unit: BuildUnit, digest: str) -> bool:
+        """
+        Tag the image already built from the same inputs, if any.
+
+        :return: Whether the build can be skipped.
+        """
+        image_id = self.index.image_for(digest) if self.index else None
+        if not image_id:
+            return False
+        try:
+            self.engine.inspect_image(image_id)
+        except DockerNotFoundError:
+            # removed from the engine since
+            return False
+        for image in unit.images:
+            self.engine.tag_image(image_id, image)
+        return True
+
+    def build_unit(self, unit: BuildUnit) -> ImageBuildResult:
+        """
+        Build a unit and tag its image for every template, only tagging
+        the image built earlier when its inputs did not change.
+        """
+        result = ImageBuildResult(unit.image, unit.templates)
+        started = time.monotonic()
+        try:
+            digest = self.digest(unit)
+            if self.reuse(unit, digest):
+                result.reused = True
+            else:
+                image_id = self.run_build(unit, result)
+                for image in unit.images[1:]:
+                    self.engine.tag_image(unit.image, image)
+                if self.index:
+                    self.index.record(digest, image_id)
+        except RuntimeError as e:
+            result.ok = False
+            result.error = str(e)
+        result.duration = time.monotonic() - started
+        return result
+
+    def run_build(self, unit: BuildUnit, result: ImageBuildResult) -> str:
+        """
+        Run the build on the engine, counting the steps and cache hits.
+
+        :return: The ID of the built image.
+        """
+        image_id = ""
+        response = self.engine.build_image(
+            self.tar_context(unit.context, unit.dockerfile),
+            unit.image,
+            unit.dockerfile,
+        )
+        for message in response.iter_json():
+            if "error" in message:
+                response.close()
+                raise DockerEngineError(str(message["error"]).strip())
+            if aux := message.get("aux"):
+                image_id = aux.get("ID", image_id)
+            for line in str(message.get("stream", "")).splitlines():
+                if match := STEP_RE.match(line):
+                    if match.group(1).upper() != "FROM":
+                        result.steps += 1
+                elif line.strip() == "---> Using cache":
+                    result.cached += 1
+        return image_id or self.engine.inspect_image(unit.image)["Id"]
+
+    def blocked(
+        self,
+        unit: BuildUnit,
+        units: list[BuildUnit],
+        done: dict[int, ImageBuildResult],
+        pull_errors: dict[str, str],
+    ) -> Optional[str]:
+        """Return why a unit can't be built, if its bases are missing."""
+        for j in sorted(unit.requires):
+            if not done[j].ok:
+                return f"base image {units[j].image} not built"
+        for base in unit.bases:
+            if base in pull_errors:
+                return pull_errors[base]
+        return None
+
+    def build(
+        self, svcTmplCfgs: list[ServiceTemplateCfg]
+    ) -> list[ImageBuildResult]:
+        """
+        Build the images of the templates.
+
+        :return: The results, one per built image.
+        """
+        units, results = self.plan(svcTmplCfgs)
+        try:
+            return results + self.build_units(units)
+        finally:
+            if self.index:
+                self.index.store()
+
+    def build_units(self, units: list[BuildUnit]) -> list[ImageBuildResult]:
+        pull_errors = self.pull_bases(units)
+        done: dict[int, ImageBuildResult] = {}
+        futures: dict[Future[ImageBuildResult], int] = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while len(done) < len(units):
+                progress = False
+                for i, unit in enumerate(units):
+                    if i in done or i in futures.values():
+                        continue
+                    if not unit.after <= done.keys():
+                        continue
+                    progress = True
+                    if error := self.blocked(unit, units, done, pull_errors):
+                        done[i] = ImageBuildResult(
+                            unit.image, unit.templates, False, error=error
+                        )
+                    else:
+                        futures[pool.submit(self.build_unit, unit)] = i
+                if not futures:
+                    if progress:
+                        continue
+                    for i, unit in enumerate(units):
+                        if i not in done:
+                            done[i] = ImageBuildResult(
+                                unit.image,
+                                unit.templates,
+                                False,
+                                error="circular base images",
+                            )
+                    break
+                finished, _ = wait_futures(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    done[futures.pop(future)] = future.result()
+        return [done[i] for i in range(len(units))]
@@ -18,13 +18,26 @@
 
 from __future__ import annotations
 
-from typing import Any, override
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, override
 
 import yaml
 
 from config import ConfigMng, EnvironmentCfg
 from environment import Environment
-from service import ServiceFactory
+from service import ServiceFactory, ServiceStatus
+from util import Constants, Util
+
+from .docker_engine import (
+    DockerEngineClient,
+    DockerEngineError,
+    DockerNotFoundError,
+)
+from .docker_logs import DEFAULT_BUFFER_LINES, DockerLogMux, LogSource
+from .docker_reconcile import DockerReconciler
+from .docker_status import DockerStatusCache
 
 
 class DockerComposeEnv(Environment):
@@ -50,20 +63,167 @@ class DockerComposeEnv(Environment):
         )
         return clonedEnv
 
+    @property
+    def engine(self) -> DockerEngineClient:
+        return DockerEngineClient.shared()
+
+    def for_each_container(self, action: Callable[[str], Any]):
+        """
+        Run an engine action on every service container in parallel.
+        """
+        names = [svc.container_name for svc in self.services]
+        if not names:
+            return
+
+        def run(name: str):
+            with self.slot():
+                action(name)
+
+        with ThreadPoolExecutor(max_workers=len(names)) as pool:
+            for _ in pool.map(run, names):
+                pass
+
+    def containers_exist(self) -> bool:
+        """Check whether every service container has been created."""
+        for svc in self.services:
+            try:
+                self.engine.inspect_container(svc.container_name)
+            except DockerNotFoundError:
+                return False
+        return True
+
+    def compose_up(self):
+        """Create and start the environment with docker compose."""
+        compose_file = os.path.join(self.get_dir(), "docker-compose.yml")
+        with open(compose_file, "w") as f:
+            f.write(self.render())
+        # compose pulls missing images one service at a time
+        self.prepare()
+        with self.slot():
+            self.run_compose_up(compose_file)
+
+    def run_compose_up(self, compose_file: str):
+        Util.run_command(
+            [
+                "docker",
+                "compose",
+                "-p",
+                self.envCfg.tag,
+                "-f",
+                compose_file,
+                "up",
+                "-d",
+            ]
+        )
+
+    def is_native(self) -> bool:
+        """
+        Whether the lifecycle is driven through the Engine API alone
+        instead of docker compose.
+        """
+        return (
+            self.configMng.values.get(
+                "docker_lifecycle", Constants.DOCKER_LIFECYCLE_COMPOSE
+            )
+            == Constants.DOCKER_LIFECYCLE_NATIVE
+        )
+
     @override
     def start(self):
         """Start the environment."""
-        pass
+        if self.is_native():
+            DockerReconciler(self.engine, self.scheduler).reconcile(
+                [self], running=True
+            )
+        elif self.containers_exist():
+            self.for_each_container(self.engine.start_container)
+        else:
+            self.compose_up()
+
+    @override
+    def prepare(self):
+        """Pull the missing images of the services."""
+        DockerReconciler(self.engine, self.scheduler).pull_images([self])
 
     @override
     def halt(self):
         """Halt the environment."""
-        pass
+        if self.is_native():
+            DockerReconciler(self.engine, self.scheduler).reconcile(
+                [self], running=False
+            )
+        else:
+            self.for_each_container(self.engine.stop_container)
+
+    @override
+    def pause(self):
+        """Pause the environment."""
+        self.for_each_container(
+            lambda name: self.ignore_conflict(self.engine.pause_container, name)
+        )
+
+    @override
+    def unpause(self):
+        """Unpause the environment."""
+        self.for_each_container(
+            lambda name: self.ignore_conflict(
+                self.engine.unpause_container, name
+            )
+        )
+
+    def ignore_conflict(self, action: Callable[[str], Any], name: str):
+        """Run an action, a container in the wrong state is not an error."""
+        try:
+            action(name)
+        except DockerNotFoundError:
+            pass
+        except DockerEngineError as e:
+            if e.status != 409:
+                raise
+
+    @override
+    def memory_usage(self) -> int:
+        """Get the memory used by the environment containers."""
+        usage: list[int] = []
+
+        def sample(name: str):
+            try:
+                stats = self.engine.container_stats(name)
+            except DockerNotFoundError:
+                return
+            memory: dict[str, Any] = stats.get("memory_stats") or {}
+            details: dict[str, int] = memory.get("stats") or {}
+            used: int = memory.get("usage", 0)
+            usage.append(max(0, used - details.get("inactive_file", 0)))
+
+        self.for_each_container(sample)
+        return sum(usage)
 
     @override
     def reload(self):
         """Reload the environment."""
-        pass
+        if self.is_native():
+            DockerReconciler(self.engine, self.scheduler).restart([self])
+        else:
+            self.for_each_container(self.engine.restart_container)
+
+    @override
+    def show_logs(self, follow: bool = False):
+        """Show the output of every service container, multiplexed."""
+        mux = DockerLogMux(
+            self.engine,
+            [LogSource(s.svcCfg.tag, s.container_name) for s in self.services],
+            sys.stdout.buffer,
+            color=sys.stdout.isatty(),
+            buffer_lines=int(
+                self.configMng.values.get("logs_buffer_lines")
+                or DEFAULT_BUFFER_LINES
+            ),
+        )
+        try:
+            mux.run(follow)
+        except KeyboardInterrupt:
+            pass
 
     @override
     def render(self) -> str:
@@ -82,6 +242,35 @@ class DockerComposeEnv(Environment):
         return yaml.dump(compose_config, sort_keys=False)
 
     @override
-    def status(self):
+    def status(self) -> list[ServiceStatus]:
         """Get environment status."""
-        pass
+        cache = DockerStatusCache.shared()
+        cache.ensure_synced()
+        statuses: list[ServiceStatus] = []
+        for svc in self.services:
+            status = cache.get_svc_status(self.envCfg.tag, svc.svcCfg.tag)
+            statuses.append(
+                status
+                if status
+                else ServiceStatus(
+                    env_tag=self.envCfg.tag,
+                    svc_tag=svc.svcCfg.tag,
+                    container_name=svc.container_name,
+                    state=Constants.SVC_STATE_ABSENT,
+                )
+            )
+        return statuses
+
+    @override
+    def watch_status(
+        self, on_change: Callable[[ServiceStatus], None]
+    ) -> Callable[[], None]:
+        """Notify the environment status changes."""
+        cache = DockerStatusCache.shared()
+        cache.start()
+
+        def listener(status: ServiceStatus):
+            if status.env_tag == self.envCfg.tag:
+                on_change(status)
+
+        return cache.subscribe(listener)
@@ -0,0 +1,829 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+import codecs
+import http.client
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional, Union
+from urllib.parse import quote, urlencode, urlparse
+
+DEFAULT_DOCKER_HOST = "unix:///var/run/docker.sock"
+API_VERSION = "v1.41"
+
+STREAM_STDIN = 0
+STREAM_STDOUT = 1
+STREAM_STDERR = 2
+
+# An exec session may still be reported running once its output ended.
+EXEC_EXIT_TIMEOUT = 10.0
+EXEC_EXIT_POLL = 0.05
+
+Body = Union[None, bytes, dict[str, Any], list[Any], Iterable[bytes]]
+
+
+def split_image(image: str) -> tuple[str, Optional[str]]:
+    """Split an image reference into repository and tag."""
+    if "@" in image:
+        return image, None
+    name, sep, tag = image.rpartition(":")
+    if not sep or "/" in tag:
+        return image, "latest"
+    return name, tag
+
+
+class DockerEngineError(RuntimeError):
+    """
+    Raised when the engine can't be reached or rejects a request.
+    """
+
+    def __init__(self, message: str, status: int = 0):
+        super().__init__(message)
+        self.status = status
+
+
+class DockerNotFoundError(DockerEngineError):
+    """
+    Raised when the engine reports a missing object.
+    """
+
+    pass
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix domain socket.
+    """
+
+    def __init__(self, socket_path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of idle keep-alive connections.
+    """
+
+    def __init__(self, host: str, maxsize: int, timeout: Optional[float]):
+        url = urlparse(host)
+        if url.scheme not in ("unix", "tcp", "http"):
+            raise DockerEngineError(f"Unsupported docker host: {host}")
+        self.url = url
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.idle: list[http.client.HTTPConnection] = []
+        self.lock = threading.Lock()
+        self.created = 0
+
+    def new_connection(self) -> http.client.HTTPConnection:
+        with self.lock:
+            self.created += 1
+        if self.url.scheme == "unix":
+            return UnixHTTPConnection(self.url.path, timeout=self.timeout)
+        return http.client.HTTPConnection(
+            self.url.hostname or "localhost",
+            self.url.port or 2375,
+            timeout=self.timeout,
+        )
+
+    def get(self) -> tuple[http.client.HTTPConnection, bool]:
+        """
+        Take a connection from the pool.
+
+        :return: The connection and whether it was reused.
+        """
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return self.new_connection(), False
+
+    def put(self, conn: http.client.HTTPConnection):
+        with self.lock:
+            if len(self.idle) < self.maxsize:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            conn.close()
+
+
+class DockerEngineResponse:
+    """
+    A response whose body can be consumed at once or streamed.
+
+    The underlying connection goes back to the pool once the body has been
+    entirely read, it is dropped when the response is closed early.
+    """
+
+    def __init__(
+        self,
+        pool: ConnectionPool,
+        conn: http.client.HTTPConnection,
+        resp: http.client.HTTPResponse,
+    ):
+        self.pool = pool
+        self.conn = conn
+        self.resp = resp
+        self.status = resp.status
+        self.released = False
+        self.reading = False
+        self.interrupted = False
+        self.lock = threading.Lock()
+
+    def __enter__(self) -> DockerEngineResponse:
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    def header(self, name: str) -> Optional[str]:
+        return self.resp.getheader(name)
+
+    def release(self):
+        with self.lock:
+            if self.released:
+                return
+            self.released = True
+            self.reading = False
+        if (
+            self.resp.isclosed()
+            and not self.resp.will_close
+            and not self.interrupted
+        ):
+            self.pool.put(self.conn)
+        else:
+            self.conn.close()
+
+    def read_some(self, read: Callable[[int], bytes], size: int) -> bytes:
+        """Read from the body, an interrupted stream reads as ended."""
+        self.reading = True
+        try:
+            return read(size)
+        except (OSError, ValueError, http.client.HTTPException):
+            if self.interrupted:
+                return b""
+            raise
+
+    def read(self) -> bytes:
+        """Read the whole body."""
+        try:
+            return self.resp.read()
+        finally:
+            self.release()
+
+    def json(self) -> Any:
+        data = self.read()
+        return json.loads(data) if data else None
+
+    def iter_chunks(self, size: int = 65536) -> Iterator[bytes]:
+        """Stream the body as it arrives."""
+        try:
+            while chunk := self.read_some(self.resp.read1, size):
+                yield chunk
+        finally:
+            self.release()
+
+    def iter_lines(self) -> Iterator[bytes]:
+        try:
+            while line := self.resp.readline():
+                yield line
+        finally:
+            self.release()
+
+    def iter_json(self) -> Iterator[Any]:
+        """Stream a body made of concatenated JSON documents."""
+        decoder = json.JSONDecoder()
+        # a character may be split between chunks
+        text = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        buf = ""
+        for chunk in self.iter_chunks():
+            buf += text.decode(chunk)
+            while True:
+                buf = buf.lstrip()
+                if not buf:
+                    break
+                try:
+                    obj, end = decoder.raw_decode(buf)
+                except ValueError:
+                    break
+                yield obj
+                buf = buf[end:]
+
+    def iter_frames(self, tty: bool = False) -> Iterator[tuple[int, bytes]]:
+        """
+        Stream the body of an attach/logs/exec response.
+
+        Unless the container has a TTY, the engine multiplexes stdout and
+        stderr prefixing each frame with an 8 bytes header.
+        """
+        if tty:
+            for chunk in self.iter_chunks():
+                yield STREAM_STDOUT, chunk
+            return
+        try:
+            while header := self.read_exactly(8):
+                stream, size = struct.unpack(">BxxxL", header)
+                yield stream, self.read_exactly(size)
+        finally:
+            self.release()
+
+    def read_exactly(self, size: int) -> bytes:
+        data = b""
+        while len(data) < size:
+            chunk = self.read_some(self.resp.read, size - len(data))
+            if not chunk:
+                break
+            data += chunk
+        return data
+
+    def close(self):
+        """
+        Close the response, interrupting a blocked reader if any.
+
+        A reader in another thread sees the end of the stream and releases
+        the connection itself.
+        """
+        with self.lock:
+            if self.released:
+                return
+            self.interrupted = True
+            reading = self.reading
+        if self.conn.sock:
+            try:
+                self.conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if not reading:
+            self.release()
+
+
+class HijackedConnection:
+    """
+    Raw bidirectional stream obtained upgrading an HTTP connection.
+    """
+
+    def __init__(self, sock: socket.socket, pending: bytes):
+        self.sock = sock
+        self.pending = pending
+
+    def recv(self, size: int = 65536) -> bytes:
+        if self.pending:
+            data, self.pending = self.pending[:size], self.pending[size:]
+            return data
+        return self.sock.recv(size)
+
+    def sendall(self, data: bytes):
+        self.sock.sendall(data)
+
+    def close_write(self):
+        try:
+            self.sock.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    def close(self):
+        self.sock.close()
+
+
+class DockerEngineClient:
+    """
+    Minimal Docker Engine API client.
+
+    Requests are sent over persistent HTTP/1.1 connections kept in a pool
+    shared across threads, so that consecutive calls don't pay the
+    connection setup, and bodies can be streamed as they are produced.
+    The engine address is taken from `DOCKER_HOST` when not provided.
+    """
+
+    _shared: Optional[DockerEngineClient] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(
+        self,
+        host: Optional[str] = None,
+        pool_size: int = 8,
+        timeout: Optional[float] = 60,
+    ):
+        self.host = host or os.environ.get("DOCKER_HOST", DEFAULT_DOCKER_HOST)
+        self.pool = ConnectionPool(self.host, pool_size, timeout)
+
+    @classmethod
+    def shared(cls) -> DockerEngineClient:
+        """Return the process wide client."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = DockerEngineClient()
+            return cls._shared
+
+    def close(self):
+        self.pool.close()
+
+    def url(self, path: str, params: Optional[dict[str, Any]] = None) -> str:
+        query = ""
+        if params:
+            encoded: dict[str, str] = {}
+            for key, value in params.items():
+                if value is None:
+                    continue
+                if isinstance(value, bool):
+                    encoded[key] = "1" if value else "0"
+                elif isinstance(value, (dict, list)):
+                    encoded[key] = json.dumps(value)
+                else:
+                    encoded[key] = str(value)
+            query = f"?{urlencode(encoded)}" if encoded else ""
+        return f"/{API_VERSION}{path}{query}"
+
+    def request(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict[str, Any]] = None,
+        body: Body = None,
+        headers: Optional[dict[str, str]] = None,
+        stream: bool = False,
+    ) -> DockerEngineResponse:
+        """
+        Send a request and return the response once headers are received.
+
+        Streamed responses, like events or followed logs, have no read
+        timeout.
+
+        :raises DockerNotFoundError: If the engine answers 404.
+        :raises DockerEngineError: On connection errors or other failures.
+        """
+        hdrs = dict(headers or {})
+        payload: Any = body
+        chunked = False
+        if isinstance(body, (dict, list)):
+            payload = json.dumps(body).encode()
+            hdrs.setdefault("Content-Type", "application/json")
+        elif body is not None and not isinstance(body, bytes):
+            chunked = True
+            hdrs.setdefault("Content-Type", "application/x-tar")
+
+        url = self.url(path, params)
+        while True:
+            conn, reused = self.pool.get()
+            try:
+                conn.timeout = None if stream else self.pool.timeout
+                if conn.sock:
+                    conn.sock.settimeout(conn.timeout)
+                conn.request(
+                    method,
+                    url,
+                    body=payload,
+                    headers=hdrs,
+                    encode_chunked=chunked,
+                )
+                resp = conn.getresponse()
+            except (
+                http.client.RemoteDisconnected,
+                BrokenPipeError,
+                ConnectionResetError,
+            ) as e:
+                conn.close()
+                if reused and not chunked:
+                    # the engine dropped an idle keep-alive connection
+                    continue
+                raise DockerEngineError(f"Docker engine error: {e}")
+            except OSError as e:
+                conn.close()
+                raise DockerEngineError(
+                    f"Cannot connect to the docker engine at "
+                    f"{self.host}: {e}"
+                )
+            break
+
+        response = DockerEngineResponse(self.pool, conn, resp)
+        if response.status >= 400:
+            data = response.read()
+            try:
+                message = json.loads(data).get("message", "")
+            except ValueError:
+                message = data.decode(errors="replace")
+            if response.status == 404:
+                raise DockerNotFoundError(message, response.status)
+            raise DockerEngineError(message, response.status)
+        return response
+
+    def call(
+        self,
+        method: str,
+        path: str,
+        params: Optional[dict[str, Any]] = None,
+        body: Body = None,
+    ) -> Any:
+        """Send a request and decode the JSON response."""
+        return self.request(method, path, params, body).json()
+
+    def hijack(
+        self, path: str, body: Optional[dict[str, Any]] = None
+    ) -> HijackedConnection:
+        """
+        Send a POST request upgrading the connection to a raw stream.
+        """
+        conn = self.pool.new_connection()
+        try:
+            conn.connect()
+        except OSError as e:
+            raise DockerEngineError(
+                f"Cannot connect to the docker engine at {self.host}: {e}"
+            )
+        assert conn.sock
+        sock: socket.socket = conn.sock
+        sock.settimeout(None)
+        payload = json.dumps(body or {}).encode()
+        request = (
+            f"POST {self.url(path)} HTTP/1.1\r\n"
+            "Host: localhost\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: Upgrade\r\n"
+            "Upgrade: tcp\r\n\r\n"
+        ).encode()
+        sock.sendall(request + payload)
+        data = b""
+        while b"\r\n\r\n" not in data:
+            chunk = sock.recv(4096)
+            if not chunk:
+                sock.close()
+                raise DockerEngineError("Docker engine closed the connection")
+            data += chunk
+        head, pending = data.split(b"\r\n\r\n", 1)
+        status = int(head.split(b" ", 2)[1])
+        if status not in (101, 200):
+            sock.close()
+            raise DockerEngineError(
+                f"Docker engine refused to attach: {head.decode()}", status
+            )
+        return HijackedConnection(sock, pending)
+
+    # System
+
+    def ping(self) -> bool:
+        try:
+            return self.request("GET", "/_ping").read() == b"OK"
+        except DockerEngineError:
+            return False
+
+    def version(self) -> dict[str, Any]:
+        return self.call("GET", "/version")
+
+    def events(
+        self,
+        filters: Optional[dict[str, list[str]]] = None,
+        since: Optional[str] = None,
+    ) -> DockerEventStream:
+        """Subscribe to the engine events."""
+        response = self.request(
+            "GET",
+            "/events",
+            {"filters": filters, "since": since},
+            stream=True,
+        )
+        return DockerEventStream(response)
+
+    # Containers
+
+    def list_containers(
+        self, all: bool = True, filters: Optional[dict[str, list[str]]] = None
+    ) -> list[dict[str, Any]]:
+        return self.call(
+            "GET", "/containers/json", {"all": all, "filters": filters}
+        )
+
+    def inspect_container(self, name: str) -> dict[str, Any]:
+        return self.call("GET", f"/containers/{quote(name)}/json")
+
+    def create_container(
+        self, name: str, config: dict[str, Any]
+    ) -> dict[str, Any]:
+        return self.call("POST", "/containers/create", {"name": name}, config)
+
+    def start_container(self, name: str):
+        self.request("POST", f"/containers/{quote(name)}/start").read()
+
+    def stop_container(self, name: str, timeout: Optional[int] = None):
+        self.request(
+            "POST", f"/containers/{quote(name)}/stop", {"t": timeout}
+        ).read()
+
+    def restart_container(self, name: str, timeout: Optional[int] = None):
+        self.request(
+            "POST", f"/containers/{quote(name)}/restart", {"t": timeout}
+        ).read()
+
+    def kill_container(self, name: str, signal: str = "SIGKILL"):
+        self.request(
+            "POST", f"/containers/{quote(name)}/kill", {"signal": signal}
+        ).read()
+
+    def pause_container(self, name: str):
+        self.request("POST", f"/containers/{quote(name)}/pause").read()
+
+    def unpause_container(self, name: str):
+        self.request("POST", f"/containers/{quote(name)}/unpause").read()
+
+    def container_stats(self, name: str) -> dict[str, Any]:
+        """Return a single stats sample of a container."""
+        return self.call(
+            "GET", f"/containers/{quote(name)}/stats", {"stream": False}
+        )
+
+    def remove_container(
+        self, name: str, force: bool = False, volumes: bool = False
+    ):
+        self.request(
+            "DELETE",
+            f"/containers/{quote(name)}",
+            {"force": force, "v": volumes},
+        ).read()
+
+    def logs(
+        self,
+        name: str,
+        follow: bool = False,
+        tail: Optional[Union[int, str]] = None,
+        since: Optional[Union[int, float, str]] = None,
+        until: Optional[Union[int, float, str]] = None,
+        timestamps: bool = False,
+    ) -> DockerEngineResponse:
+        """
+        Request the container output, the response is a frames stream.
+        """
+        return self.request(
+            "GET",
+            f"/containers/{quote(name)}/logs",
+            {
+                "stdout": True,
+                "stderr": True,
+                "follow": follow,
+                "tail": tail if tail is not None else "all",
+                "since": since,
+                "until": until,
+                "timestamps": timestamps,
+            },
+            stream=follow,
+        )
+
+    # Networks
+
+    def list_networks(
+        self, filters: Optional[dict[str, list[str]]] = None
+    ) -> list[dict[str, Any]]:
+        return self.call("GET", "/networks", {"filters": filters})
+
+    def inspect_network(self, name: str) -> dict[str, Any]:
+        return self.call("GET", f"/networks/{quote(name)}")
+
+    def create_network(
+        self, name: str, labels: Optional[dict[str, str]] = None
+    ) -> dict[str, Any]:
+        return self.call(
+            "POST",
+            "/networks/create",
+            body={"Name": name, "CheckDuplicate": True, "Labels": labels or {}},
+        )
+
+    def remove_network(self, name: str):
+        self.request("DELETE", f"/networks/{quote(name)}").read()
+
+    def connect_network(
+        self,
+        network: str,
+        container: str,
+        aliases: Optional[list[str]] = None,
+    ):
+        self.request(
+            "POST",
+            f"/networks/{quote(network)}/connect",
+            body={
+                "Container": container,
+                "EndpointConfig": {"Aliases": aliases or []},
+            },
+        ).read()
+
+    # Volumes
+
+    def list_volumes(
+        self, filters: Optional[dict[str, list[str]]] = None
+    ) -> list[dict[str, Any]]:
+        return (
+            self.call("GET", "/volumes", {"filters": filters}).get("Volumes")
+            or []
+        )
+
+    def create_volume(
+        self, name: str, labels: Optional[dict[str, str]] = None
+    ) -> dict[str, Any]:
+        return self.call(
+            "POST",
+            "/volumes/create",
+            body={"Name": name, "Labels": labels or {}},
+        )
+
+    def remove_volume(self, name: str, force: bool = False):
+        self.request(
+            "DELETE", f"/volumes/{quote(name)}", {"force": force}
+        ).read()
+
+    # Images
+
+    def inspect_image(self, name: str) -> dict[str, Any]:
+        return self.call("GET", f"/images/{quote(name)}/json")
+
+    def pull_image(
+        self,
+        image: str,
+        progress: Optional[Callable[[dict[str, Any]], None]] = None,
+    ) -> list[dict[str, Any]]:
+        """
+        Pull an image, waiting for the pull to complete.
+
+        :param progress: Called with every progress message as it arrives.
+        :return: The progress messages sent by the engine.
+        :raises DockerEngineError: If the engine reports a pull error.
+        """
+        name, tag = split_image(image)
+        response = self.request(
+            "POST",
+            "/images/create",
+            {"fromImage": name, "tag": tag},
+            stream=True,
+        )
+        messages: list[dict[str, Any]] = []
+        for message in response.iter_json():
+            if "error" in message:
+                response.close()
+                raise DockerEngineError(
+                    f"Failed to pull {image}: {message['error']}"
+                )
+            messages.append(message)
+            if progress:
+                progress(message)
+        return messages
+
+    def build_image(
+        self,
+        context: Iterable[bytes],
+        tag: str,
+        dockerfile: str = "Dockerfile",
+    ) -> DockerEngineResponse:
+        """
+        Start an image build from a tar stream of the build context.
+
+        :return: The response streaming the build output messages.
+        """
+        return self.request(
+            "POST",
+            "/build",
+            {"t": tag, "dockerfile": dockerfile},
+            body=context,
+            stream=True,
+        )
+
+    def tag_image(self, image: str, target: str):
+        repo, tag = split_image(target)
+        self.request(
+            "POST", f"/images/{quote(image)}/tag", {"repo": repo, "tag": tag}
+        ).read()
+
+    # Exec
+
+    def exec_create(
+        self,
+        name: str,
+        cmd: list[str],
+        tty: bool = False,
+        stdin: bool = False,
+        env: Optional[list[str]] = None,
+        user: Optional[str] = None,
+        workdir: Optional[str] = None,
+    ) -> str:
+        config: dict[str, Any] = {
+            "Cmd": cmd,
+            "AttachStdin": stdin,
+            "AttachStdout": True,
+            "AttachStderr": True,
+            "Tty": tty,
+        }
+        if env:
+            config["Env"] = env
+        if user:
+            config["User"] = user
+        if workdir:
+            config["WorkingDir"] = workdir
+        return self.call(
+            "POST", f"/containers/{quote(name)}/exec", None, config
+        )["Id"]
+
+    def exec_start(
+        self, exec_id: str, tty: bool = False
+    ) -> DockerEngineResponse:
+        return self.request(
+            "POST",
+            f"/exec/{exec_id}/start",
+            body={"Detach": False, "Tty": tty},
+            stream=True,
+        )
+
+    def exec_attach(
+        self, exec_id: str, tty: bool = False
+    ) -> HijackedConnection:
+        return self.hijack(
+            f"/exec/{exec_id}/start", {"Detach": False, "Tty": tty}
+        )
+
+    def exec_inspect(self, exec_id: str) -> dict[str, Any]:
+        return self.call("GET", f"/exec/{exec_id}/json")
+
+    def exec_exit_code(
+        self, exec_id: str, timeout: float = EXEC_EXIT_TIMEOUT
+    ) -> int:
+        """
+        Wait for an exec session to end and return its exit code.
+
+        :raises DockerEngineError: If the session does not end in time or
+            ends without an exit code.
+        """
+        deadline = time.monotonic() + timeout
+        while (info := self.exec_inspect(exec_id)).get("Running"):
+            if time.monotonic() > deadline:
+                raise DockerEngineError(
+                    f"Exec session {exec_id[:12]} still running"
+                )
+            time.sleep(EXEC_EXIT_POLL)
+        code = info.get("ExitCode")
+        if code is None:
+            raise DockerEngineError(
+                f"Exec session {exec_id[:12]} ended without an exit code"
+            )
+        return code
+
+    def exec_resize(self, exec_id: str, height: int, width: int):
+        self.request(
+            "POST", f"/exec/{exec_id}/resize", {"h": height, "w": width}
+        ).read()
+
+    def exec_run(self, name: str, cmd: list[str]) -> tuple[int, bytes, bytes]:
+        """
+        Run a command in a container and wait for it.
+
+        :return: The exit code, stdout and stderr.
+        """
+        exec_id = self.exec_create(name, cmd)
+        out, err = b"", b""
+        for stream, data in self.exec_start(exec_id).iter_frames():
+            if stream == STREAM_STDERR:
+                err += data
+            else:
+                out += data
+        return self.exec_exit_code(exec_id), out, err
+
+
+class DockerEventStream:
+    """
+    Stream of engine events, it can be closed from another thread.
+    """
+
+    def __init__(self, response: DockerEngineResponse):
+        self.response = response
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        return self.response.iter_json()
+
+    def close(self):
+        self.response.close()
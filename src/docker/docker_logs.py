@@ -0,0 +1,454 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+import asyncio
+import bisect
+import calendar
+import json
+import os
+import struct
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, AsyncIterator, BinaryIO, Iterator, Optional
+from urllib.parse import quote
+
+from .docker_engine import (
+    DockerEngineClient,
+    DockerEngineError,
+    DockerNotFoundError,
+)
+
+# ANSI colors cycled over the sources: cyan, yellow, green, magenta, blue,
+# red.
+COLORS = [36, 33, 32, 35, 34, 31]
+DEFAULT_BUFFER_LINES = 1024
+READ_SIZE = 65536
+INDEX_STRIDE = 65536
+
+
+def parse_timestamp(stamp: bytes) -> float:
+    """
+    Parse an engine RFC 3339 UTC timestamp with nanoseconds.
+
+    :raises ValueError: If the stamp is not a timestamp.
+    """
+    base, _, frac = stamp.decode("ascii").rstrip("Z").partition(".")
+    seconds = calendar.timegm(time.strptime(base, "%Y-%m-%dT%H:%M:%S"))
+    return seconds + float(f"0.{frac or 0}")
+
+
+def split_stamp(line: bytes) -> tuple[float, bytes]:
+    """Split an engine timestamped output line in its time and data."""
+    stamp, _, data = line.partition(b" ")
+    return parse_timestamp(stamp), data
+
+
+@dataclass
+class LogSource:
+    """
+    A container whose output is multiplexed, shown as `name`.
+    """
+
+    name: str
+    container: str
+
+
+class LineRing:
+    """
+    Bounded ring buffer of output lines.
+
+    Adding lines to a full ring waits until the writer takes some, so a
+    slow output stops the reads of the sources instead of growing memory.
+    """
+
+    def __init__(self, capacity: int, ready: asyncio.Event):
+        self.slots: list[bytes] = [b""] * max(1, capacity)
+        self.head = 0
+        self.size = 0
+        self.ready = ready
+        self.space = asyncio.Event()
+        self.space.set()
+
+    async def put(self, lines: list[bytes]):
+        capacity = len(self.slots)
+        i = 0
+        while i < len(lines):
+            if self.size == capacity:
+                self.space.clear()
+                await self.space.wait()
+                continue
+            while i < len(lines) and self.size < capacity:
+                self.slots[(self.head + self.size) % capacity] = lines[i]
+                self.size += 1
+                i += 1
+            self.ready.set()
+
+    def drain(self) -> list[bytes]:
+        capacity = len(self.slots)
+        lines = [
+            self.slots[(self.head + i) % capacity] for i in range(self.size)
+        ]
+        self.head = (self.head + self.size) % capacity
+        self.size = 0
+        self.space.set()
+        return lines
+
+
+class DockerLogMux:
+    """
+    Stream the output of many containers at once to a single output.
+
+    Every stream is read on the same event loop over its own engine
+    connection, lines are prefixed with the source name and collected in a
+    bounded ring per source, a single writer drains the rings in batches.
+    """
+
+    def __init__(
+        self,
+        engine: DockerEngineClient,
+        sources: list[LogSource],
+        out: BinaryIO,
+        color: bool = False,
+        buffer_lines: int = DEFAULT_BUFFER_LINES,
+    ):
+        self.engine = engine
+        self.sources = sources
+        self.out = out
+        self.color = color
+        self.buffer_lines = buffer_lines
+        width = max((len(s.name) for s in sources), default=0)
+        self.prefixes = [
+            self.format_prefix(s.name.ljust(width), i)
+            for i, s in enumerate(sources)
+        ]
+
+    def format_prefix(self, name: str, index: int) -> bytes:
+        if self.color:
+            code = COLORS[index % len(COLORS)]
+            return f"\x1b[{code}m{name} |\x1b[0m ".encode()
+        return f"{name} | ".encode()
+
+    async def open(self) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        url = self.engine.pool.url
+        if url.scheme == "unix":
+            return await asyncio.open_unix_connection(url.path, limit=READ_SIZE)
+        return await asyncio.open_connection(
+            url.hostname or "localhost", url.port or 2375, limit=READ_SIZE
+        )
+
+    async def get(
+        self, path: str, params: Optional[dict[str, Any]] = None
+    ) -> AsyncIterator[bytes]:
+        """
+        Send a GET to the engine and iterate over the response body.
+
+        :raises DockerEngineError: If the engine answers with an error.
+        """
+        reader, writer = await self.open()
+        try:
+            writer.write(
+                f"GET {self.engine.url(path, params)} HTTP/1.1\r\n"
+                f"Host: docker\r\nConnection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers: dict[str, str] = {}
+            while (line := await reader.readline()) not in (b"\r\n", b""):
+                key, _, value = line.decode("latin-1").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = self.iter_body(reader, headers)
+            if status >= 400:
+                data = b"".join([chunk async for chunk in body])
+                try:
+                    message = json.loads(data).get("message", "")
+                except ValueError:
+                    message = data.decode(errors="replace")
+                if status == 404:
+                    raise DockerNotFoundError(message, status)
+                raise DockerEngineError(message, status)
+            async for chunk in body:
+                yield chunk
+        finally:
+            writer.close()
+
+    async def iter_body(
+        self, reader: asyncio.StreamReader, headers: dict[str, str]
+    ) -> AsyncIterator[bytes]:
+        if headers.get("transfer-encoding") == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    await reader.readline()
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+        elif "content-length" in headers:
+            remaining = int(headers["content-length"])
+            while remaining > 0:
+                data = await reader.read(min(READ_SIZE, remaining))
+                if not data:
+                    return
+                remaining -= len(data)
+                yield data
+        else:
+            while data := await reader.read(READ_SIZE):
+                yield data
+
+    async def is_tty(self, container: str) -> bool:
+        data = b"".join(
+            [c async for c in self.get(f"/containers/{quote(container)}/json")]
+        )
+        return bool(json.loads(data).get("Config", {}).get("Tty"))
+
+    async def read_source(
+        self, index: int, ring: LineRing, params: dict[str, Any]
+    ):
+        source = self.sources[index]
+        prefix = self.prefixes[index]
+        try:
+            tty = await self.is_tty(source.container)
+            partial: dict[int, bytes] = {}
+            pending = b""
+            async for chunk in self.get(
+                f"/containers/{quote(source.container)}/logs", params
+            ):
+                frames: list[tuple[int, bytes]] = []
+                if tty:
+                    frames.append((1, chunk))
+                else:
+                    pending += chunk
+                    offset = 0
+                    while len(pending) - offset >= 8:
+                        stream, size = struct.unpack_from(
+                            ">BxxxL", pending, offset
+                        )
+                        if len(pending) - offset - 8 < size:
+                            break
+                        start = offset + 8
+                        frames.append((stream, pending[start : start + size]))
+                        offset = start + size
+                    pending = pending[offset:]
+                lines: list[bytes] = []
+                for stream, data in frames:
+                    parts = (partial.pop(stream, b"") + data).split(b"\n")
+                    if parts[-1]:
+                        partial[stream] = parts[-1]
+                    lines += [prefix + p + b"\n" for p in parts[:-1]]
+                if lines:
+                    await ring.put(lines)
+            await ring.put([prefix + p + b"\n" for p in partial.values()])
+        except DockerNotFoundError:
+            await ring.put([prefix + b"(no container)\n"])
+        except (DockerEngineError, OSError, ValueError) as e:
+            await ring.put([prefix + f"(log stream failed: {e})\n".encode()])
+
+    async def stream(self, params: dict[str, Any]):
+        ready = asyncio.Event()
+        rings = [LineRing(self.buffer_lines, ready) for _ in self.sources]
+        readers = [
+            asyncio.create_task(self.read_source(i, ring, params))
+            for i, ring in enumerate(rings)
+        ]
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1) as output:
+            try:
+                while True:
+                    finished = all(r.done() for r in readers)
+                    batch = [line for ring in rings for line in ring.drain()]
+                    if batch:
+                        await loop.run_in_executor(
+                            output, self.write, b"".join(batch)
+                        )
+                    elif finished:
+                        break
+                    else:
+                        waiter = asyncio.create_task(ready.wait())
+                        await asyncio.wait(
+                            [waiter, *[r for r in readers if not r.done()]],
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                        waiter.cancel()
+                        ready.clear()
+            finally:
+                for r in readers:
+                    r.cancel()
+                await asyncio.gather(*readers, return_exceptions=True)
+
+    def write(self, data: bytes):
+        self.out.write(data)
+        self.out.flush()
+
+    def run(self, follow: bool = False):
+        """Stream the output of every source until all streams end."""
+        params: dict[str, Any] = {
+            "stdout": True,
+            "stderr": True,
+            "follow": follow,
+            "tail": "all",
+        }
+        asyncio.run(self.stream(params))
+
+
+class LogIndex:
+    """
+    Locally captured output of a container, with a sparse offset index.
+
+    Every captured line is `<timestamp> <stream> <data>`. The index keeps
+    the timestamp and byte offset of the first line of every `stride`
+    bytes of the capture, so a time window is found by a binary search
+    and a seek instead of a scan of the whole capture.
+    """
+
+    def __init__(self, path: str, stride: int = INDEX_STRIDE):
+        self.path = path
+        self.index_path = f"{path}.idx"
+        self.stride = stride
+        self.entries: list[tuple[float, int]] = []
+        self.size = 0
+        self.last = 0.0
+        self.load()
+
+    def load(self):
+        self.entries, self.size, self.last = [], 0, 0.0
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data: dict[str, Any] = json.load(f)
+            self.entries = [(ts, off) for ts, off in data["entries"]]
+            self.size = data["size"]
+            self.last = data["last"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        actual = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if actual != self.size:
+            self.rebuild()
+
+    def store(self):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"size": self.size, "last": self.last, "entries": self.entries},
+                f,
+            )
+        os.replace(tmp, self.index_path)
+
+    def rebuild(self):
+        """Index the whole capture again, after it changed elsewhere."""
+        self.entries, self.size, self.last = [], 0, 0.0
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    self.track(line)
+            os.truncate(self.path, self.size)
+        self.store()
+
+    def track(self, line: bytes):
+        try:
+            ts, _ = split_stamp(line)
+        except ValueError:
+            ts = self.last
+        if not self.entries or self.size - self.entries[-1][1] >= self.stride:
+            self.entries.append((ts, self.size))
+        self.size += len(line)
+        self.last = max(self.last, ts)
+
+    def append(self, lines: list[tuple[int, bytes]]):
+        """Capture `(stream, timestamped data)` lines at the end."""
+        with open(self.path, "ab") as f:
+            for stream, data in lines:
+                stamp, _, rest = data.partition(b" ")
+                line = b"%s %d %s\n" % (stamp, stream, rest.rstrip(b"\n"))
+                f.write(line)
+                self.track(line)
+        self.store()
+
+    def seek(self, since: float) -> int:
+        """Return an offset of the capture before any line from `since`."""
+        i = bisect.bisect_left(self.entries, since, key=lambda e: e[0])
+        return self.entries[i - 1][1] if i else 0
+
+    def bound(self, until: float) -> int:
+        """Return an offset of the capture after any line before `until`."""
+        i = bisect.bisect_right(self.entries, until, key=lambda e: e[0])
+        return self.entries[i][1] if i < len(self.entries) else self.size
+
+    def parse(self, line: bytes) -> tuple[float, int, bytes]:
+        ts, rest = split_stamp(line)
+        stream, _, data = rest.partition(b" ")
+        return ts, int(stream), data
+
+    def read(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        tail: Optional[int] = None,
+    ) -> Iterator[tuple[int, bytes]]:
+        """
+        Iterate over the `(stream, data)` captured lines from `since` and
+        before `until`, only the last `tail` ones when given.
+        """
+        start = self.seek(since) if since is not None else 0
+        end = self.bound(until) if until is not None else self.size
+
+        def wanted(ts: float) -> bool:
+            return (since is None or ts >= since) and (
+                until is None or ts < until
+            )
+
+        if tail is not None:
+            yield from self.read_tail(start, end, tail, wanted)
+            return
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            offset = start
+            for line in f:
+                if offset >= end:
+                    break
+                offset += len(line)
+                ts, stream, data = self.parse(line)
+                if wanted(ts):
+                    yield stream, data
+
+    def read_tail(
+        self, start: int, end: int, count: int, wanted: Any
+    ) -> Iterator[tuple[int, bytes]]:
+        """Read the capture backwards from `end` until `count` lines."""
+        lines: list[tuple[int, bytes]] = []
+        with open(self.path, "rb") as f:
+            rest = b""
+            pos = end
+            while pos > start and len(lines) < count:
+                size = min(READ_SIZE, pos - start)
+                pos -= size
+                f.seek(pos)
+                block = f.read(size) + rest
+                parts = block.split(b"\n")
+                rest = parts[0] if pos > start else b""
+                for line in reversed(parts[1:] if pos > start else parts):
+                    if not line:
+                        continue
+                    ts, stream, data = self.parse(line + b"\n")
+                    if wanted(ts):
+                        lines.append((stream, data))
+                        if len(lines) == count:
+                            break
+        yield from reversed(lines)
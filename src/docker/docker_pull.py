@@ -0,0 +1,88 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Optional
+
+LAYER_DONE = ("Pull complete", "Already exists")
+
+
+class PullProgress:
+    """
+    Layer progress aggregated over concurrent image pulls.
+
+    Pulls report their engine progress messages, every update renders
+    the overall status and hands it to `report`.
+    """
+
+    def __init__(self, report: Optional[Callable[[str], None]] = None):
+        self.report = report
+        self.lock = threading.Lock()
+        self.images: set[str] = set()
+        self.pulled: set[str] = set()
+        # (image, layer) -> (current bytes, total bytes, done)
+        self.layers: dict[tuple[str, str], tuple[int, int, bool]] = {}
+
+    def start(self, image: str):
+        with self.lock:
+            self.images.add(image)
+        self.emit()
+
+    def update(self, image: str, message: dict[str, Any]):
+        """Account a progress message of the pull of an image."""
+        layer = message.get("id")
+        status = message.get("status", "")
+        if not layer or status.startswith("Pulling from"):
+            return
+        with self.lock:
+            current, total, done = self.layers.get(
+                (image, layer), (0, 0, False)
+            )
+            detail: dict[str, int] = message.get("progressDetail") or {}
+            if status == "Downloading":
+                current = detail.get("current", current)
+                total = detail.get("total", total)
+            elif status in ("Download complete", "Verifying Checksum"):
+                current = total
+            elif status in LAYER_DONE:
+                current, done = total, True
+            self.layers[(image, layer)] = (current, total, done)
+        self.emit()
+
+    def finish(self, image: str):
+        with self.lock:
+            self.pulled.add(image)
+        self.emit()
+
+    def status(self) -> str:
+        with self.lock:
+            layers = list(self.layers.values())
+            images, pulled = len(self.images), len(self.pulled)
+        done = sum(1 for _, _, d in layers if d)
+        current = sum(c for c, _, _ in layers) / 1e6
+        total = sum(t for _, t, _ in layers) / 1e6
+        return (
+            f"Pulled {pulled}/{images} images, {done}/{len(layers)} layers, "
+            f"{current:.1f}/{total:.1f} MB"
+        )
+
+    def emit(self):
+        if self.report:
+            self.report(self.status())
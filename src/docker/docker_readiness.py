@@ -0,0 +1,172 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from datetime import datetime
+from typing import Any, Optional
+
+from service.readiness import (
+    DEFAULT_TIMEOUT,
+    ProbeError,
+    ReadinessProbe,
+    TcpProbe,
+)
+
+from .docker_engine import DockerEngineClient
+
+
+class ExecProbe(ReadinessProbe):
+    """
+    Ready once a command run in the container exits with 0, e.g.
+    `readiness.exec=pg_isready -U postgres`.
+    """
+
+    def __init__(
+        self,
+        svc_tag: str,
+        engine: DockerEngineClient,
+        container: str,
+        command: str,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        super().__init__(svc_tag, timeout)
+        self.engine = engine
+        self.container = container
+        self.command = command
+
+    def describe(self) -> str:
+        return f"exec {self.command}"
+
+    async def check(self) -> None:
+        code, _, err = await asyncio.to_thread(
+            self.engine.exec_run,
+            self.container,
+            ["/bin/sh", "-c", self.command],
+        )
+        if code != 0:
+            message = err.decode(errors="replace").strip()
+            raise ProbeError(f"exit code {code}: {message}".rstrip(": "))
+
+
+class PortProbe(TcpProbe):
+    """
+    Ready once the container accepts TCP connections on one of its ports,
+    e.g. `readiness.tcp=5432`.
+
+    The port is reached on the host port it is published to or, when it
+    is not published, on the container address.
+    """
+
+    def __init__(
+        self,
+        svc_tag: str,
+        engine: DockerEngineClient,
+        container: str,
+        port: int,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        super().__init__(svc_tag, container, port, timeout)
+        self.engine = engine
+        self.container = container
+
+    def address(self, info: dict[str, Any]) -> tuple[str, int]:
+        """Return where the port is reached, from the container inspect."""
+        settings: dict[str, Any] = info.get("NetworkSettings") or {}
+        ports: dict[str, Any] = settings.get("Ports") or {}
+        bindings: list[dict[str, str]] = ports.get(f"{self.port}/tcp") or []
+        for binding in bindings:
+            host = binding.get("HostIp") or "127.0.0.1"
+            if host in ("0.0.0.0", "::"):
+                host = "127.0.0.1"
+            return host, int(binding["HostPort"])
+        networks: dict[str, Any] = settings.get("Networks") or {}
+        for network in networks.values():
+            if address := network.get("IPAddress"):
+                return address, self.port
+        raise ProbeError(
+            f"port {self.port} is not published "
+            "and the container has no address"
+        )
+
+    async def check(self) -> None:
+        info = await asyncio.to_thread(
+            self.engine.inspect_container, self.container
+        )
+        await self.connect(*self.address(info))
+
+
+class LogProbe(ReadinessProbe):
+    """
+    Ready once the container output matches a pattern, e.g.
+    `readiness.log=database system is ready`.
+
+    Each attempt only fetches the output produced since the previous one.
+    """
+
+    def __init__(
+        self,
+        svc_tag: str,
+        engine: DockerEngineClient,
+        container: str,
+        pattern: str,
+        timeout: float = DEFAULT_TIMEOUT,
+        since: Optional[float] = None,
+    ):
+        super().__init__(svc_tag, timeout)
+        self.engine = engine
+        self.container = container
+        self.pattern = re.compile(pattern)
+        self.since = since
+        self.tail = b""
+
+    def describe(self) -> str:
+        return f"log /{self.pattern.pattern}/"
+
+    def started_at(self) -> float:
+        """Return when the container was last started."""
+        state = self.engine.inspect_container(self.container).get("State", {})
+        try:
+            return datetime.fromisoformat(
+                state.get("StartedAt", "")
+            ).timestamp()
+        except ValueError:
+            return 0
+
+    def scan(self) -> bool:
+        if self.since is None:
+            # ignore the output of previous runs
+            self.since = self.started_at()
+        checked_at = time.time()
+        response = self.engine.logs(self.container, since=self.since)
+        data = self.tail + b"".join(d for _, d in response.iter_frames())
+        self.since = checked_at
+        lines = data.split(b"\n")
+        # keep a partial last line for the next attempt
+        self.tail = lines.pop()
+        return any(
+            self.pattern.search(line.decode(errors="replace"))
+            for line in lines + [self.tail]
+        )
+
+    async def check(self) -> None:
+        if not await asyncio.to_thread(self.scan):
+            raise ProbeError("pattern not found in the output")
@@ -0,0 +1,454 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+import hashlib
+import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Optional
+
+from util import Constants
+
+from .docker_engine import (
+    DockerEngineClient,
+    DockerEngineError,
+    DockerNotFoundError,
+)
+from .docker_pull import PullProgress
+from .docker_svc import DockerSvc
+
+if TYPE_CHECKING:
+    from environment import FleetScheduler
+
+    from .docker_compose_env import DockerComposeEnv
+
+# Actions in a phase depend on the resources created by earlier phases.
+PHASE_RESOURCES = 0
+PHASE_CONTAINERS = 1
+
+
+@dataclass
+class ContainerSpec:
+    """
+    Desired state of a service container.
+    """
+
+    env_tag: str
+    svc_tag: str
+    name: str
+    image: str
+    config: dict[str, Any]
+    networks: list[str]
+    aliases: list[str]
+
+    @property
+    def config_hash(self) -> str:
+        return self.config["Labels"][Constants.LABEL_CONFIG_HASH]
+
+
+@dataclass
+class DesiredState:
+    """
+    Containers, networks and volumes the environments should have.
+    """
+
+    env_tags: list[str] = field(default_factory=list[str])
+    containers: list[ContainerSpec] = field(default_factory=list[ContainerSpec])
+    networks: dict[str, dict[str, str]] = field(
+        default_factory=dict[str, dict[str, str]]
+    )
+    external_networks: set[str] = field(default_factory=set[str])
+    volumes: dict[str, dict[str, str]] = field(
+        default_factory=dict[str, dict[str, str]]
+    )
+
+
+@dataclass
+class ObservedState:
+    """
+    What the engine currently has for the environments.
+    """
+
+    containers: dict[str, dict[str, Any]] = field(
+        default_factory=dict[str, dict[str, Any]]
+    )
+    networks: set[str] = field(default_factory=set[str])
+    volumes: set[str] = field(default_factory=set[str])
+    images: set[str] = field(default_factory=set[str])
+
+
+@dataclass
+class ReconcileAction:
+    """
+    A single engine change needed to reach the desired state.
+    """
+
+    kind: str
+    target: str
+    phase: int
+    env_tag: str
+    run: Callable[[], None] = field(repr=False, compare=False)
+
+    def __str__(self) -> str:
+        return f"{self.kind} {self.target}"
+
+
+def env_labels(env_tag: str) -> dict[str, str]:
+    return {Constants.LABEL_ENV_TAG: env_tag}
+
+
+class DockerReconciler:
+    """
+    Drive docker environments through the Engine API without compose.
+
+    The desired state is computed from the environments configuration and
+    compared with what the engine reports, only the missing or outdated
+    resources are acted upon. Containers whose configuration changed are
+    recognized by a hash label and recreated. Independent actions run in
+    parallel, resources (images, networks, volumes) before containers.
+    Several environments can be reconciled in the same pass, a fleet
+    scheduler bounding the actions applied concurrently.
+    """
+
+    def __init__(
+        self,
+        engine: DockerEngineClient,
+        scheduler: Optional[FleetScheduler] = None,
+        max_workers: int = 8,
+    ):
+        self.engine = engine
+        self.scheduler = scheduler
+        self.max_workers = max_workers
+        self.progress: Optional[PullProgress] = None
+
+    def desired(self, envs: list[DockerComposeEnv]) -> DesiredState:
+        """Compute the desired state of the environments."""
+        state = DesiredState()
+        for env in envs:
+            env_tag = env.envCfg.tag
+            state.env_tags.append(env_tag)
+            declared = {n.key: n for n in env.envCfg.networks or []}
+            for svc in env.services:
+                if not isinstance(svc, DockerSvc):
+                    continue
+                networks: list[str] = []
+                for key in svc.svcCfg.networks or ["default"]:
+                    netCfg = declared.get(key)
+                    name = netCfg.name if netCfg else f"{env_tag}_{key}"
+                    if netCfg and netCfg.external:
+                        state.external_networks.add(name)
+                    else:
+                        state.networks.setdefault(name, env_labels(env_tag))
+                    networks.append(name)
+                for volume in svc.named_volumes():
+                    state.volumes.setdefault(volume, env_labels(env_tag))
+
+                config = svc.container_config(networks)
+                digest = hashlib.sha256(
+                    json.dumps(config, sort_keys=True).encode()
+                ).hexdigest()
+                config["Labels"][Constants.LABEL_CONFIG_HASH] = digest
+                state.containers.append(
+                    ContainerSpec(
+                        env_tag=env_tag,
+                        svc_tag=svc.svcCfg.tag,
+                        name=svc.container_name,
+                        image=svc.svcCfg.image,
+                        config=config,
+                        networks=networks,
+                        aliases=[svc.svcCfg.tag, svc.hostname],
+                    )
+                )
+        return state
+
+    def observe(self, desired: DesiredState) -> ObservedState:
+        """Query the engine for the current state of the environments."""
+        state = ObservedState()
+        for item in self.engine.list_containers(
+            all=True, filters={"label": [Constants.LABEL_ENV_TAG]}
+        ):
+            labels: dict[str, str] = item.get("Labels") or {}
+            if labels.get(Constants.LABEL_ENV_TAG) in desired.env_tags:
+                name: str = (item.get("Names") or [""])[0].lstrip("/")
+                state.containers[name] = item
+        state.networks = {n["Name"] for n in self.engine.list_networks()}
+        state.volumes = {v["Name"] for v in self.engine.list_volumes()}
+        state.images = self.observe_images(desired)
+        return state
+
+    def observe_images(self, desired: DesiredState) -> set[str]:
+        """Return the images of the environments present on the engine."""
+
+        def has_image(image: str) -> bool:
+            try:
+                self.engine.inspect_image(image)
+                return True
+            except DockerNotFoundError:
+                return False
+
+        images = sorted({c.image for c in desired.containers if c.image})
+        if not images:
+            return set()
+        workers = min(self.max_workers, len(images))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return {
+                image
+                for image, present in zip(images, pool.map(has_image, images))
+                if present
+            }
+
+    def plan(
+        self, desired: DesiredState, observed: ObservedState, running: bool
+    ) -> list[ReconcileAction]:
+        """
+        Compute the minimal actions leading to the desired state.
+
+        :param running: Whether the containers should be running or only
+            stopped, halted environments do not get missing resources.
+        """
+        actions: list[ReconcileAction] = []
+        if running:
+            missing = sorted(desired.external_networks - observed.networks)
+            if missing:
+                raise DockerEngineError(
+                    f"External networks not found: {', '.join(missing)}"
+                )
+            actions += self.plan_pulls(desired, observed)
+            for name, labels in sorted(desired.networks.items()):
+                if name not in observed.networks:
+                    actions.append(
+                        ReconcileAction(
+                            "create-network",
+                            name,
+                            PHASE_RESOURCES,
+                            labels[Constants.LABEL_ENV_TAG],
+                            lambda n=name, lb=labels: self.create_network(
+                                n, lb
+                            ),
+                        )
+                    )
+            for name, labels in sorted(desired.volumes.items()):
+                if name not in observed.volumes:
+                    actions.append(
+                        ReconcileAction(
+                            "create-volume",
+                            name,
+                            PHASE_RESOURCES,
+                            labels[Constants.LABEL_ENV_TAG],
+                            lambda n=name, lb=labels: self.create_volume(n, lb),
+                        )
+                    )
+
+        wanted = {c.name for c in desired.containers}
+        for spec in desired.containers:
+            current = observed.containers.get(spec.name)
+            state: str = current.get("State", "") if current else ""
+            labels: dict[str, str] = (
+                current.get("Labels") or {} if current else {}
+            )
+            if not running:
+                if state in ("running", "paused", "restarting"):
+                    actions.append(
+                        ReconcileAction(
+                            "stop",
+                            spec.name,
+                            PHASE_CONTAINERS,
+                            spec.env_tag,
+                            lambda n=spec.name: self.engine.stop_container(n),
+                        )
+                    )
+                continue
+            if not current:
+                kind = "create"
+            elif labels.get(Constants.LABEL_CONFIG_HASH) != spec.config_hash:
+                kind = "recreate"
+            elif state == "paused":
+                kind = "unpause"
+            elif state != "running":
+                kind = "start"
+            else:
+                continue
+            actions.append(
+                ReconcileAction(
+                    kind,
+                    spec.name,
+                    PHASE_CONTAINERS,
+                    spec.env_tag,
+                    lambda k=kind, s=spec: self.converge(k, s),
+                )
+            )
+
+        if running:
+            for name in sorted(observed.containers.keys() - wanted):
+                actions.append(
+                    ReconcileAction(
+                        "remove",
+                        name,
+                        PHASE_CONTAINERS,
+                        observed.containers[name]["Labels"][
+                            Constants.LABEL_ENV_TAG
+                        ],
+                        lambda n=name: self.engine.remove_container(
+                            n, force=True
+                        ),
+                    )
+                )
+        return actions
+
+    def plan_pulls(
+        self, desired: DesiredState, observed: ObservedState
+    ) -> list[ReconcileAction]:
+        """Plan a single pull of every missing image."""
+        images: dict[str, str] = {}
+        for spec in desired.containers:
+            if spec.image:
+                images.setdefault(spec.image, spec.env_tag)
+        return [
+            ReconcileAction(
+                "pull",
+                image,
+                PHASE_RESOURCES,
+                images[image],
+                lambda i=image: self.pull(i),
+            )
+            for image in sorted(images.keys() - observed.images)
+        ]
+
+    def apply(self, actions: list[ReconcileAction]):
+        """
+        Run the actions phase by phase, in parallel within each phase.
+
+        :raises DockerEngineError: Listing every failed action.
+        """
+        for phase in sorted({a.phase for a in actions}):
+            batch = [a for a in actions if a.phase == phase]
+            errors: list[str] = []
+            workers = min(self.max_workers, len(batch))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {pool.submit(self.run, a): a for a in batch}
+                for future in as_completed(futures):
+                    try:
+                        future.result()
+                    except RuntimeError as e:
+                        errors.append(f"{futures[future]}: {e}")
+            if errors:
+                raise DockerEngineError("; ".join(sorted(errors)))
+
+    def run(self, action: ReconcileAction):
+        slot = (
+            self.scheduler.slot(action.env_tag)
+            if self.scheduler
+            else nullcontext()
+        )
+        with slot:
+            action.run()
+
+    def reconcile(
+        self, envs: list[DockerComposeEnv], running: bool = True
+    ) -> list[ReconcileAction]:
+        """
+        Bring the environments to the desired state.
+
+        :return: The actions that have been applied.
+        """
+        desired = self.desired(envs)
+        actions = self.plan(desired, self.observe(desired), running)
+        self.apply(actions)
+        return actions
+
+    def restart(self, envs: list[DockerComposeEnv]) -> list[ReconcileAction]:
+        """
+        Bring the environments to the running state, restarting the
+        containers the reconcile leaves as they are.
+
+        :return: The actions that have been applied.
+        """
+        desired = self.desired(envs)
+        actions = self.plan(desired, self.observe(desired), True)
+        converged = {a.target for a in actions}
+        actions += [
+            ReconcileAction(
+                "restart",
+                spec.name,
+                PHASE_CONTAINERS,
+                spec.env_tag,
+                lambda n=spec.name: self.engine.restart_container(n),
+            )
+            for spec in desired.containers
+            if spec.name not in converged
+        ]
+        self.apply(actions)
+        return actions
+
+    def pull_images(
+        self,
+        envs: list[DockerComposeEnv],
+        progress: Optional[PullProgress] = None,
+    ) -> list[ReconcileAction]:
+        """
+        Pull the images of the environments missing from the engine, each
+        image once however many services use it.
+
+        :return: The pulls that have been applied.
+        """
+        desired = self.desired(envs)
+        observed = ObservedState(images=self.observe_images(desired))
+        actions = self.plan_pulls(desired, observed)
+        self.progress = progress
+        try:
+            self.apply(actions)
+        finally:
+            self.progress = None
+        return actions
+
+    def pull(self, image: str):
+        if not self.progress:
+            self.engine.pull_image(image)
+            return
+        self.progress.start(image)
+        self.engine.pull_image(
+            image, lambda m, p=self.progress: p.update(image, m)
+        )
+        self.progress.finish(image)
+
+    def create_network(self, name: str, labels: dict[str, str]):
+        try:
+            self.engine.create_network(name, labels)
+        except DockerEngineError as e:
+            # created meanwhile by a concurrent reconcile
+            if e.status != 409:
+                raise
+
+    def create_volume(self, name: str, labels: dict[str, str]):
+        self.engine.create_volume(name, labels)
+
+    def converge(self, kind: str, spec: ContainerSpec):
+        """Bring a single container to its desired state."""
+        if kind == "unpause":
+            self.engine.unpause_container(spec.name)
+            return
+        if kind in ("create", "recreate"):
+            if kind == "recreate":
+                self.engine.remove_container(spec.name, force=True)
+            self.engine.create_container(spec.name, spec.config)
+            for network in spec.networks[1:]:
+                self.engine.connect_network(network, spec.name, spec.aliases)
+        self.engine.start_container(spec.name)
@@ -0,0 +1,317 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Callable, Iterator, Optional, Protocol
+
+from service import ServiceStatus
+from util import Constants
+
+from .docker_engine import DockerEngineClient
+
+# Container state reached after a lifecycle event, events not listed here
+# (kill, oom, exec_*, ...) do not change the container state.
+EVENT_STATES: dict[str, str] = {
+    "create": "created",
+    "start": "running",
+    "restart": "running",
+    "unpause": "running",
+    "pause": "paused",
+    "die": "exited",
+    "stop": "exited",
+}
+
+
+class EventStream(Protocol):
+    """
+    A stream of engine events which can be interrupted from another thread.
+    """
+
+    def __iter__(self) -> Iterator[dict[str, Any]]: ...
+
+    def close(self) -> None: ...
+
+
+class StatusSource(Protocol):
+    """
+    The engine operations the status cache relies on.
+    """
+
+    def list_containers(
+        self, all: bool = True, filters: Optional[dict[str, list[str]]] = None
+    ) -> list[dict[str, Any]]: ...
+
+    def events(
+        self,
+        filters: Optional[dict[str, list[str]]] = None,
+        since: Optional[str] = None,
+    ) -> EventStream: ...
+
+
+def parse_health(status: str) -> Optional[str]:
+    """Extract the health state from a container status string."""
+    for health in ("healthy", "unhealthy", "starting"):
+        if f"({health})" in status or f"(health: {health})" in status:
+            return health
+    return None
+
+
+class DockerStatusCache:
+    """
+    In-memory state table of every shepherd managed container.
+
+    The cache subscribes once to the engine events stream, filtered by the
+    shepherd labels, and keeps the table up to date so that status queries
+    are served from memory. Whenever the stream breaks, the table is
+    resynchronized from a full container listing before subscribing again.
+    """
+
+    _shared: Optional[DockerStatusCache] = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, source: StatusSource, resync_delay: float = 1.0):
+        self.source = source
+        self.resync_delay = resync_delay
+        self.table: dict[tuple[str, str], ServiceStatus] = {}
+        self.containers: dict[str, tuple[str, str]] = {}
+        self.listeners: list[Callable[[ServiceStatus], None]] = []
+        self.cond = threading.Condition()
+        self.version = 0
+        self.synced = False
+        self.since: Optional[str] = None
+        self.stream: Optional[EventStream] = None
+        self.thread: Optional[threading.Thread] = None
+        self.stopped = threading.Event()
+
+    @classmethod
+    def shared(cls) -> DockerStatusCache:
+        """Return the process wide status cache."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = DockerStatusCache(DockerEngineClient.shared())
+            return cls._shared
+
+    @property
+    def filters(self) -> dict[str, list[str]]:
+        return {"type": ["container"], "label": [Constants.LABEL_ENV_TAG]}
+
+    def sync(self):
+        """Rebuild the state table from a full container listing."""
+        started = time.time()
+        containers = self.source.list_containers(
+            all=True, filters={"label": [Constants.LABEL_ENV_TAG]}
+        )
+        table: dict[tuple[str, str], ServiceStatus] = {}
+        ids: dict[str, tuple[str, str]] = {}
+        for item in containers:
+            labels: dict[str, str] = item.get("Labels") or {}
+            key = (
+                labels.get(Constants.LABEL_ENV_TAG, ""),
+                labels.get(Constants.LABEL_SVC_TAG, ""),
+            )
+            names: list[str] = item.get("Names") or [""]
+            table[key] = ServiceStatus(
+                env_tag=key[0],
+                svc_tag=key[1],
+                container_name=names[0].lstrip("/"),
+                state=item.get("State", ""),
+                health=parse_health(item.get("Status", "")),
+                updated_at=started,
+            )
+            ids[item["Id"]] = key
+
+        changed: list[ServiceStatus] = []
+        with self.cond:
+            for key in self.table.keys() - table.keys():
+                changed.append(self.absent(self.table[key], started))
+            for key, status in table.items():
+                previous = self.table.get(key)
+                if not previous or (previous.state, previous.health) != (
+                    status.state,
+                    status.health,
+                ):
+                    changed.append(status)
+            self.table = table
+            self.containers = ids
+            self.since = f"{started:.9f}"
+            self.synced = True
+        self.notify(changed)
+
+    def ensure_synced(self):
+        """Sync the table unless it is already being maintained."""
+        if not self.synced:
+            self.sync()
+
+    def absent(self, status: ServiceStatus, when: float) -> ServiceStatus:
+        return ServiceStatus(
+            env_tag=status.env_tag,
+            svc_tag=status.svc_tag,
+            container_name=status.container_name,
+            state=Constants.SVC_STATE_ABSENT,
+            updated_at=when,
+        )
+
+    def apply_event(self, event: dict[str, Any]) -> Optional[ServiceStatus]:
+        """Apply an engine event to the table, return the changed entry."""
+        if event.get("Type", "container") != "container":
+            return None
+        actor: dict[str, Any] = event.get("Actor") or {}
+        attrs: dict[str, str] = actor.get("Attributes") or {}
+        cid: str = actor.get("ID") or event.get("id", "")
+        action: str = event.get("Action") or event.get("status", "")
+        when = event.get("timeNano", event.get("time", 0) * 1e9) / 1e9
+        if Constants.LABEL_ENV_TAG not in attrs:
+            return None
+
+        key = (
+            attrs[Constants.LABEL_ENV_TAG],
+            attrs.get(Constants.LABEL_SVC_TAG, ""),
+        )
+        with self.cond:
+            self.since = f"{when:.9f}"
+            current = self.table.get(key)
+            if action == "destroy":
+                self.containers.pop(cid, None)
+                if not current:
+                    return None
+                status = self.absent(current, when)
+                del self.table[key]
+            else:
+                status = ServiceStatus(
+                    env_tag=key[0],
+                    svc_tag=key[1],
+                    container_name=attrs.get("name", key[1]),
+                    state=current.state if current else "created",
+                    health=current.health if current else None,
+                    updated_at=when,
+                )
+                if action in EVENT_STATES:
+                    status.state = EVENT_STATES[action]
+                    if action in ("die", "stop"):
+                        status.health = None
+                elif action.startswith("health_status:"):
+                    status.health = action.split(":", 1)[1].strip()
+                elif action != "rename":
+                    return None
+                if current and (current.state, current.health) == (
+                    status.state,
+                    status.health,
+                ):
+                    if current.container_name == status.container_name:
+                        return None
+                self.table[key] = status
+                self.containers[cid] = key
+        self.notify([status])
+        return status
+
+    def notify(self, changed: list[ServiceStatus]):
+        if not changed:
+            return
+        with self.cond:
+            self.version += 1
+            listeners = list(self.listeners)
+            self.cond.notify_all()
+        for status in changed:
+            for listener in listeners:
+                try:
+                    listener(status)
+                except Exception:
+                    logging.exception("status listener failed")
+
+    def follow(self):
+        """Consume the events stream, resyncing after every gap."""
+        while not self.stopped.is_set():
+            try:
+                self.stream = self.source.events(self.filters, self.since)
+                for event in self.stream:
+                    self.apply_event(event)
+            except Exception as e:
+                logging.debug("docker events stream broken: %s", e)
+            if self.stopped.wait(self.resync_delay):
+                break
+            try:
+                self.sync()
+            except Exception as e:
+                logging.debug("docker status resync failed: %s", e)
+
+    def start(self):
+        """Sync the table and keep it updated in background."""
+        if self.thread and self.thread.is_alive():
+            return
+        self.stopped.clear()
+        self.sync()
+        self.thread = threading.Thread(
+            target=self.follow, name="shpd-status-cache", daemon=True
+        )
+        self.thread.start()
+
+    def stop(self):
+        """Stop following the events stream."""
+        self.stopped.set()
+        if self.stream:
+            self.stream.close()
+        if self.thread:
+            self.thread.join(timeout=5)
+            self.thread = None
+
+    def subscribe(
+        self, listener: Callable[[ServiceStatus], None]
+    ) -> Callable[[], None]:
+        """
+        Register a change listener.
+
+        :return: A callable removing the listener.
+        """
+        with self.cond:
+            self.listeners.append(listener)
+
+        def unsubscribe():
+            with self.cond:
+                if listener in self.listeners:
+                    self.listeners.remove(listener)
+
+        return unsubscribe
+
+    def wait_for_change(self, version: int, timeout: Optional[float]) -> int:
+        """
+        Block until the table moves past `version` or the timeout expires.
+
+        :return: The current table version.
+        """
+        with self.cond:
+            self.cond.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def get_svc_status(
+        self, env_tag: str, svc_tag: str
+    ) -> Optional[ServiceStatus]:
+        """Get the status of a service from the table."""
+        with self.cond:
+            return self.table.get((env_tag, svc_tag))
+
+    def get_env_status(self, env_tag: str) -> list[ServiceStatus]:
+        """Get the status of all the known services of an environment."""
+        with self.cond:
+            return sorted(
+                (s for (e, _), s in self.table.items() if e == env_tag),
+                key=lambda s: s.svc_tag,
+            )
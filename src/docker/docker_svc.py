@@ -18,12 +18,120 @@
 
 from __future__ import annotations
 
-from typing import Any, override
+import os
+import select
+import struct
+import sys
+import termios
+import threading
+import tty
+from typing import Any, BinaryIO, Iterable, Iterator, Optional, override
 
 import yaml
 
 from config import ConfigMng, EnvironmentCfg, ServiceCfg
-from service import Service
+from service import ReadinessProbe, Service, ServiceNotCreatedError
+from service.readiness import (
+    DEFAULT_TIMEOUT,
+    PROP_EXEC,
+    PROP_LOG,
+    PROP_TCP,
+    PROP_TIMEOUT,
+    TcpProbe,
+)
+from util import Constants
+
+from .docker_build import BuildIndex, DockerImageBuilder
+from .docker_engine import (
+    STREAM_STDERR,
+    DockerEngineClient,
+    DockerEngineError,
+    DockerNotFoundError,
+    HijackedConnection,
+)
+from .docker_logs import DEFAULT_BUFFER_LINES, LogIndex, split_stamp
+from .docker_readiness import ExecProbe, LogProbe, PortProbe
+
+
+def parse_port(port: str) -> tuple[str, str, str]:
+    """
+    Parse a compose style port mapping.
+
+    :return: The host ip, host port and container port with protocol.
+    """
+    spec, _, proto = port.partition("/")
+    parts = spec.rsplit(":", 2)
+    container_port = f"{parts[-1]}/{proto or 'tcp'}"
+    host_port = parts[-2] if len(parts) > 1 else ""
+    host_ip = parts[0] if len(parts) > 2 else ""
+    return host_ip, host_port, container_port
+
+
+SHELL_CMD = [
+    "/bin/sh",
+    "-c",
+    "command -v bash >/dev/null && exec bash || exec sh",
+]
+
+
+def split_frames(data: bytes) -> Iterator[tuple[int, bytes]]:
+    """Split the multiplexed output of a non tty exec session."""
+    while len(data) >= 8:
+        stream, size = struct.unpack(">BxxxL", data[:8])
+        yield stream, data[8 : 8 + size]
+        data = data[8 + size :]
+
+
+def relay_terminal(conn: HijackedConnection, is_tty: bool):
+    """
+    Relay the local terminal to an attached exec session until it ends.
+    """
+    stdin_fd = sys.stdin.fileno()
+    outputs: dict[int, BinaryIO] = {
+        1: sys.stdout.buffer,
+        STREAM_STDERR: sys.stderr.buffer,
+    }
+    buf = b""
+
+    def write(data: bytes):
+        nonlocal buf
+        if is_tty:
+            outputs[1].write(data)
+        else:
+            buf += data
+            while len(buf) >= 8:
+                stream, size = struct.unpack(">BxxxL", buf[:8])
+                if len(buf) < 8 + size:
+                    break
+                outputs.get(stream, outputs[1]).write(buf[8 : 8 + size])
+                buf = buf[8 + size :]
+        for out in outputs.values():
+            out.flush()
+
+    saved = termios.tcgetattr(stdin_fd) if is_tty else None
+    try:
+        if is_tty:
+            tty.setraw(stdin_fd)
+        if conn.pending:
+            write(conn.recv())
+        readers: list[Any] = [conn.sock, stdin_fd]
+        while True:
+            ready, _, _ = select.select(readers, [], [])
+            if conn.sock in ready:
+                data = conn.sock.recv(65536)
+                if not data:
+                    break
+                write(data)
+            if stdin_fd in ready:
+                data = os.read(stdin_fd, 65536)
+                if data:
+                    conn.sendall(data)
+                else:
+                    conn.close_write()
+                    readers.remove(stdin_fd)
+    finally:
+        if saved:
+            termios.tcsetattr(stdin_fd, termios.TCSADRAIN, saved)
 
 
 class DockerSvc(Service):
@@ -55,10 +163,9 @@ class DockerSvc(Service):
             "image": self.svcCfg.image,
             "hostname": self.hostname,
             "container_name": self.container_name,
+            "labels": self.get_labels(),
         }
 
-        if self.svcCfg.labels:
-            service_def["labels"] = self.svcCfg.labels
         if self.svcCfg.environment:
             service_def["environment"] = self.svcCfg.environment
         if self.svcCfg.volumes:
@@ -74,32 +181,348 @@ class DockerSvc(Service):
             {"services": {self.name: service_def}}, sort_keys=False
         )
 
+    def container_config(self, networks: list[str]) -> dict[str, Any]:
+        """
+        Build the Engine API create payload for the service container.
+
+        The container is attached to the first of `networks` at creation,
+        the others have to be connected afterwards.
+        """
+        cfg = self.svcCfg
+        labels = dict(
+            (label.split("=", 1) + [""])[:2] for label in self.get_labels()
+        )
+        exposed: dict[str, dict[str, Any]] = {}
+        bindings: dict[str, list[dict[str, str]]] = {}
+        for port in cfg.ports or []:
+            host_ip, host_port, container_port = parse_port(port)
+            exposed[container_port] = {}
+            if host_port:
+                bindings.setdefault(container_port, []).append(
+                    {"HostIp": host_ip, "HostPort": host_port}
+                )
+
+        config: dict[str, Any] = {
+            "Image": cfg.image,
+            "Hostname": self.hostname,
+            "Labels": labels,
+            "Env": list(cfg.environment or []),
+            "ExposedPorts": exposed,
+            "HostConfig": {
+                "Binds": [self.resolve_bind(v) for v in cfg.volumes or []],
+                "PortBindings": bindings,
+                "ExtraHosts": list(cfg.extra_hosts or []),
+            },
+        }
+        if cfg.workdir:
+            config["WorkingDir"] = cfg.workdir
+        if networks:
+            config["HostConfig"]["NetworkMode"] = networks[0]
+            config["NetworkingConfig"] = {
+                "EndpointsConfig": {
+                    networks[0]: {"Aliases": [cfg.tag, self.hostname]}
+                }
+            }
+        return config
+
+    @override
+    def claims(self) -> set[str]:
+        """
+        Return the published host ports and the explicitly set hostname.
+        """
+        claims: set[str] = set()
+        for port in self.svcCfg.ports or []:
+            _, host_port, container_port = parse_port(port)
+            if host_port:
+                proto = container_port.split("/")[1]
+                claims.add(f"port:{host_port}/{proto}")
+        if self.svcCfg.hostname:
+            claims.add(f"hostname:{self.svcCfg.hostname}")
+        return claims
+
+    def resolve_bind(self, volume: str) -> str:
+        """Resolve a compose style volume to an engine bind."""
+        source, sep, rest = volume.partition(":")
+        if source.startswith("~"):
+            source = os.environ.get("HOME", "") + source[1:]
+        elif source.startswith("."):
+            source = os.path.normpath(
+                os.path.join(
+                    self.configMng.constants.SHPD_ENVS_DIR,
+                    self.envCfg.tag,
+                    source,
+                )
+            )
+        return f"{source}{sep}{rest}"
+
+    def named_volumes(self) -> list[str]:
+        """Return the named volumes mounted by the service."""
+        names: list[str] = []
+        for volume in self.svcCfg.volumes or []:
+            source, sep, _ = volume.partition(":")
+            if sep and not source.startswith(("/", ".", "~", "$")):
+                names.append(source)
+        return names
+
+    def get_labels(self) -> list[str]:
+        """
+        Return the container labels, shepherd's own labels included.
+        """
+        return list(self.svcCfg.labels or []) + [
+            f"{Constants.LABEL_ENV_TAG}={self.envCfg.tag}",
+            f"{Constants.LABEL_SVC_TAG}={self.svcCfg.tag}",
+        ]
+
+    @property
+    def engine(self) -> DockerEngineClient:
+        return DockerEngineClient.shared()
+
+    def exists(self) -> bool:
+        """Check whether the service container has been created."""
+        try:
+            self.engine.inspect_container(self.container_name)
+            return True
+        except DockerNotFoundError:
+            return False
+
+    @override
+    def readiness_probes(self) -> list[ReadinessProbe]:
+        """
+        Return the readiness probes, `readiness.exec`, `readiness.log` and
+        a `readiness.tcp` port without a host being checked on the
+        container.
+        """
+        probes = super().readiness_probes()
+        properties = self.svcCfg.properties or {}
+        timeout = float(properties.get(PROP_TIMEOUT) or DEFAULT_TIMEOUT)
+        target = properties.get(PROP_TCP) or ""
+        if target.strip().isdigit():
+            probes = [p for p in probes if not isinstance(p, TcpProbe)]
+            probes.insert(
+                0,
+                PortProbe(
+                    self.svcCfg.tag,
+                    self.engine,
+                    self.container_name,
+                    int(target),
+                    timeout,
+                ),
+            )
+        if command := properties.get(PROP_EXEC):
+            probes.append(
+                ExecProbe(
+                    self.svcCfg.tag,
+                    self.engine,
+                    self.container_name,
+                    command,
+                    timeout,
+                )
+            )
+        if pattern := properties.get(PROP_LOG):
+            probes.append(
+                LogProbe(
+                    self.svcCfg.tag,
+                    self.engine,
+                    self.container_name,
+                    pattern,
+                    timeout,
+                )
+            )
+        return probes
+
     @override
     def build(self):
-        """Build the service."""
-        pass
+        """Build the service image from its template build context."""
+        svcTmplCfg = self.configMng.get_service_template(self.svcCfg.template)
+        if not svcTmplCfg:
+            raise RuntimeError(
+                f"Service Template '{self.svcCfg.template}' does not exist."
+            )
+        builder = DockerImageBuilder(
+            self.engine,
+            self.configMng.constants.SHPD_DIR,
+            index=BuildIndex(self.configMng.constants.SHPD_BUILD_INDEX_FILE),
+        )
+        result = builder.build([svcTmplCfg])[0]
+        if not result.ok:
+            raise DockerEngineError(
+                f"Failed to build {result.image}: {result.error}"
+            )
 
     @override
     def start(self):
         """Start the service."""
-        pass
+        try:
+            self.engine.start_container(self.container_name)
+        except DockerNotFoundError:
+            raise ServiceNotCreatedError(
+                f"Container '{self.container_name}' does not exist, "
+                f"start the environment first."
+            )
 
     @override
     def halt(self):
         """Stop the service."""
-        pass
+        try:
+            self.engine.stop_container(self.container_name)
+        except DockerNotFoundError:
+            raise ServiceNotCreatedError(
+                f"Container '{self.container_name}' does not exist."
+            )
 
     @override
     def reload(self):
         """Reload the service."""
-        pass
+        try:
+            self.engine.restart_container(self.container_name)
+        except DockerNotFoundError:
+            raise ServiceNotCreatedError(
+                f"Container '{self.container_name}' does not exist, "
+                f"start the environment first."
+            )
+
+    @override
+    def show_stdout(
+        self,
+        follow: bool = False,
+        tail: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        captured: bool = False,
+    ):
+        """Show the service stdout, asking the engine for the window only."""
+        if captured:
+            index = self.capture_stdout()
+            for stream, data in index.read(since, until, tail):
+                self.write_output(stream, data)
+            return
+        response = self.engine.logs(
+            self.container_name,
+            follow=follow,
+            tail=tail,
+            since=since,
+            until=until,
+        )
+        try:
+            for stream, data in response.iter_frames(self.has_tty()):
+                self.write_output(stream, data)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            response.close()
+
+    def has_tty(self) -> bool:
+        return bool(
+            self.engine.inspect_container(self.container_name)
+            .get("Config", {})
+            .get("Tty")
+        )
+
+    def write_output(self, stream: int, data: bytes):
+        out = sys.stderr if stream == STREAM_STDERR else sys.stdout
+        out.buffer.write(data)
+        out.flush()
+
+    def capture_path(self) -> str:
+        return os.path.join(
+            self.configMng.constants.SHPD_LOGS_DIR,
+            self.envCfg.tag,
+            f"{self.svcCfg.tag}.log",
+        )
+
+    def capture_stdout(self) -> LogIndex:
+        """
+        Append to the local capture the container output newer than the
+        captured one.
+        """
+        path = self.capture_path()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        index = LogIndex(path)
+        last = index.last
+        response = self.engine.logs(
+            self.container_name,
+            since=last or None,
+            timestamps=True,
+        )
+        partial: dict[int, bytes] = {}
+        lines: list[tuple[int, bytes]] = []
+        try:
+            for stream, data in response.iter_frames(self.has_tty()):
+                parts = (partial.pop(stream, b"") + data).split(b"\n")
+                if parts[-1]:
+                    partial[stream] = parts[-1]
+                for line in parts[:-1]:
+                    if split_stamp(line)[0] > last:
+                        lines.append((stream, line))
+                if len(lines) >= DEFAULT_BUFFER_LINES:
+                    index.append(lines)
+                    lines = []
+        finally:
+            response.close()
+        lines += [
+            (stream, line)
+            for stream, line in partial.items()
+            if split_stamp(line)[0] > last
+        ]
+        index.append(lines)
+        return index
+
+    def exec_interactive(self, cmd: list[str]) -> int:
+        """
+        Run a command in the service container attached to the terminal.
+
+        :return: The command exit code.
+        """
+        is_tty = sys.stdin.isatty() and sys.stdout.isatty()
+        exec_id = self.engine.exec_create(
+            self.container_name, cmd, tty=is_tty, stdin=True
+        )
+        conn = self.engine.exec_attach(exec_id, tty=is_tty)
+        try:
+            if is_tty:
+                size = os.get_terminal_size()
+                self.engine.exec_resize(exec_id, size.lines, size.columns)
+            relay_terminal(conn, is_tty)
+        finally:
+            conn.close()
+        return self.engine.exec_exit_code(exec_id)
 
     @override
-    def show_stdout(self):
-        """Show the service stdout."""
-        pass
+    def exec_input(
+        self, cmd: list[str], data: Iterable[bytes]
+    ) -> tuple[int, bytes]:
+        """
+        Run a command in the service container, streaming `data` to its
+        input while its output is collected.
+        """
+        exec_id = self.engine.exec_create(self.container_name, cmd, stdin=True)
+        conn = self.engine.exec_attach(exec_id)
+        received: list[bytes] = []
+
+        def receive():
+            try:
+                while chunk := conn.recv():
+                    received.append(chunk)
+            except OSError:
+                pass
+
+        reader = threading.Thread(target=receive, daemon=True)
+        reader.start()
+        try:
+            try:
+                for chunk in data:
+                    conn.sendall(chunk)
+            except OSError:
+                # the command stopped reading, its exit code tells why
+                pass
+            conn.close_write()
+            reader.join()
+        finally:
+            conn.close()
+        output = b"".join(d for _, d in split_frames(b"".join(received)))
+        return self.engine.exec_exit_code(exec_id), output
 
     @override
     def get_shell(self):
         """Get a shell session for the service."""
-        pass
+        self.exec_interactive(SHELL_CMD)
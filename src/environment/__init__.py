@@ -16,6 +16,28 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from .cache import ImageCacheMng
+from .catalog import ImageRegistryMng
+from .chunks import ChunkStore, ImageManifest
 from .environment import Environment, EnvironmentFactory, EnvironmentMng
+from .fleet import FleetResult, FleetScheduler
+from .image import EnvImageImporter, EnvImagePacker, ImportResult, PackResult
+from .pool import PooledEnv, PoolRegistry
 
-__all__ = ["EnvironmentMng", "Environment", "EnvironmentFactory"]
+__all__ = [
+    "ChunkStore",
+    "EnvironmentMng",
+    "Environment",
+    "EnvironmentFactory",
+    "EnvImageImporter",
+    "EnvImagePacker",
+    "FleetResult",
+    "FleetScheduler",
+    "ImageCacheMng",
+    "ImageManifest",
+    "ImageRegistryMng",
+    "ImportResult",
+    "PackResult",
+    "PooledEnv",
+    "PoolRegistry",
+]
@@ -0,0 +1,424 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import os
+import time
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+from typing import Any, Iterable, Optional
+from urllib.parse import unquote, urlparse
+
+from rich.table import Table
+
+from config import ConfigMng
+from util import Util
+from util.jsonfile import LockedJsonFile
+
+from .chunks import (
+    CHUNKED,
+    MANIFEST_SUFFIX,
+    MANIFESTS_DIR,
+    ImageManifest,
+    chunk_path,
+)
+from .image import CHECKSUM_SUFFIX, PACK_FORMATS
+from .integrity import INTEGRITY_SUFFIX
+from .seekable import LazyEnv
+
+CACHE_FILE = "cache.json"
+SIDECAR_SUFFIXES = (INTEGRITY_SUFFIX, CHECKSUM_SUFFIX)
+
+
+@dataclass
+class CachedImage:
+    """
+    An image of the local cache: a packed image file, its sidecars
+    included in its size, or the manifest of a chunked image with the
+    chunks it is made of. `envs` are the environments realized from it.
+    """
+
+    path: str
+    kind: str
+    size: int
+    atime: float
+    chunks: list[str] = field(default_factory=list[str])
+    envs: list[str] = field(default_factory=list[str])
+
+
+@dataclass
+class CachedChunk:
+    size: int
+    atime: float
+
+
+@dataclass
+class CacheUsage:
+    images: int = 0
+    pinned: int = 0
+    images_bytes: int = 0
+    chunks: int = 0
+    chunks_bytes: int = 0
+
+    @property
+    def total(self) -> int:
+        return self.images_bytes + self.chunks_bytes
+
+
+@dataclass
+class Eviction:
+    """The images evicted, with the bytes each freed."""
+
+    images: dict[str, int] = field(default_factory=dict[str, int])
+
+    @property
+    def freed(self) -> int:
+        return sum(self.images.values())
+
+
+def image_kind(path: str) -> Optional[str]:
+    """Return the kind of a cached image path, None for other files."""
+    if path.startswith(f"{MANIFESTS_DIR}/"):
+        return CHUNKED if path.endswith(MANIFEST_SUFFIX) else None
+    for fmt, suffix in PACK_FORMATS.items():
+        if path.endswith(suffix):
+            return fmt
+    return None
+
+
+class ImageCache(LockedJsonFile):
+    """
+    Index of the environment images of SHPD_ENV_IMGS_DIR, with their size
+    on disk and last access, kept within a size budget by evicting the
+    least recently used images.
+
+    Chunks are indexed apart, once however many images share them, and
+    leave with the last image using them. Images whose environments still
+    exist are pinned. Reports and evictions read the index, the images
+    directory itself is only listed to notice the images added or removed
+    behind its back.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.images: dict[str, CachedImage] = {}
+        self.chunks: dict[str, CachedChunk] = {}
+        super().__init__(os.path.join(root, CACHE_FILE))
+
+    def decode(self, data: dict[str, Any]):
+        self.images = {
+            i["path"]: CachedImage(**i) for i in data.get("images", [])
+        }
+        self.chunks = {
+            d: CachedChunk(**c) for d, c in data.get("chunks", {}).items()
+        }
+
+    def encode(self) -> dict[str, Any]:
+        return {
+            "images": [asdict(i) for i in self.images.values()],
+            "chunks": {d: asdict(c) for d, c in self.chunks.items()},
+        }
+
+    def local(self, path: str) -> str:
+        return os.path.join(self.root, *path.split("/"))
+
+    def file_size(self, path: str) -> int:
+        try:
+            return os.stat(self.local(path)).st_size
+        except FileNotFoundError:
+            return 0
+
+    def record(
+        self,
+        path: str,
+        envs: Iterable[str] = (),
+        now: Optional[float] = None,
+    ) -> Optional[CachedImage]:
+        """
+        Index an image of the cache as just used, by the environments
+        `envs` when realized from it.
+
+        :param path: The image path relative to the cache, a packed image
+            file or the manifest of a chunked image.
+        :return: The cached image, None when there is no such image.
+        """
+        kind = image_kind(path)
+        if not kind or not os.path.isfile(self.local(path)):
+            return None
+        now = now or time.time()
+        image = self.images.get(path) or CachedImage(path, kind, 0, now)
+        image.atime = now
+        image.envs = sorted(set(image.envs).union(envs))
+        if kind == CHUNKED:
+            image.size = self.file_size(path)
+            with open(self.local(path), "rb") as f:
+                image.chunks = ImageManifest.from_json(f.read()).digests()
+            for digest in image.chunks:
+                chunk = self.chunks.get(digest)
+                if not chunk:
+                    chunk = CachedChunk(self.file_size(chunk_path(digest)), 0)
+                    self.chunks[digest] = chunk
+                chunk.atime = now
+        else:
+            image.size = sum(
+                self.file_size(p)
+                for p in (path, *(f"{path}{s}" for s in SIDECAR_SUFFIXES))
+            )
+        self.images[path] = image
+        return image
+
+    def listing(self) -> set[str]:
+        """The image paths found in the cache directory."""
+        paths: set[str] = set()
+        for base in ("", MANIFESTS_DIR):
+            try:
+                names = os.listdir(os.path.join(self.root, base))
+            except OSError:
+                continue
+            prefix = f"{base}/" if base else ""
+            paths.update(
+                f"{prefix}{n}"
+                for n in names
+                if not n.startswith(".") and image_kind(f"{prefix}{n}")
+            )
+        return paths
+
+    def sync(self):
+        """
+        Forget the images removed from the cache directory and index the
+        ones added to it, as last used when last modified. The chunks no
+        image uses anymore are removed.
+        """
+        found = self.listing()
+        for path in set(self.images) - found:
+            del self.images[path]
+        for path in found - set(self.images):
+            mtime = os.stat(self.local(path)).st_mtime
+            self.record(path, now=mtime)
+        used = {d for i in self.images.values() for d in i.chunks}
+        for digest in set(self.chunks) - used:
+            del self.chunks[digest]
+            try:
+                os.remove(self.local(chunk_path(digest)))
+            except FileNotFoundError:
+                pass
+
+    def pinned(
+        self, env_tags: Iterable[str], image_files: Iterable[str] = ()
+    ) -> set[str]:
+        """
+        Return the images pinned by existing environments: the ones they
+        were realized from and the image files they still read from.
+        """
+        tags = set(env_tags)
+        files = {os.path.abspath(f) for f in image_files}
+        return {
+            path
+            for path, image in self.images.items()
+            if tags.intersection(image.envs)
+            or os.path.abspath(self.local(path)) in files
+        }
+
+    def rename_env(self, src_env_tag: str, dst_env_tag: str):
+        """Move the references of an environment to its new tag."""
+        for image in self.images.values():
+            if src_env_tag in image.envs:
+                image.envs = sorted(
+                    {t for t in image.envs if t != src_env_tag} | {dst_env_tag}
+                )
+
+    def image_size(self, image: CachedImage) -> int:
+        """The size of an image, with the chunks it shares."""
+        return image.size + sum(
+            self.chunks[d].size for d in image.chunks if d in self.chunks
+        )
+
+    def usage(self, pinned: Iterable[str] = ()) -> CacheUsage:
+        return CacheUsage(
+            len(self.images),
+            len(set(pinned).intersection(self.images)),
+            sum(i.size for i in self.images.values()),
+            len(self.chunks),
+            sum(c.size for c in self.chunks.values()),
+        )
+
+    def lru(self) -> list[CachedImage]:
+        """The images, least recently used first."""
+        return sorted(self.images.values(), key=lambda i: (i.atime, i.path))
+
+    def remove(self, image: CachedImage) -> int:
+        """
+        Remove an image, and the chunks no other image uses, from the
+        cache.
+
+        :return: The bytes freed.
+        """
+        del self.images[image.path]
+        paths = [image.path]
+        freed = image.size
+        if image.kind == CHUNKED:
+            used = {d for i in self.images.values() for d in i.chunks}
+            for digest in image.chunks:
+                if digest not in used and digest in self.chunks:
+                    freed += self.chunks.pop(digest).size
+                    paths.append(chunk_path(digest))
+        else:
+            paths += [f"{image.path}{s}" for s in SIDECAR_SUFFIXES]
+        for path in paths:
+            try:
+                os.remove(self.local(path))
+            except FileNotFoundError:
+                pass
+        return freed
+
+    def evict(self, budget: int, pinned: Iterable[str] = ()) -> Eviction:
+        """
+        Remove the least recently used images not pinned until the cache
+        fits the budget, in bytes.
+        """
+        pinned = set(pinned)
+        eviction = Eviction()
+        usage = self.usage().total
+        for image in self.lru():
+            if usage <= budget:
+                break
+            if image.path in pinned:
+                continue
+            freed = self.remove(image)
+            usage -= freed
+            eviction.images[image.path] = freed
+        return eviction
+
+
+class ImageCacheMng:
+    """
+    Keep the environment images of SHPD_ENV_IMGS_DIR, packed or chunked,
+    within the `env_imgs_budget` of the local cache.
+    """
+
+    def __init__(self, cli_flags: dict[str, bool], configMng: ConfigMng):
+        self.cli_flags = cli_flags
+        self.configMng = configMng
+
+    def image_cache(self) -> ImageCache:
+        return ImageCache(self.configMng.constants.SHPD_ENV_IMGS_DIR)
+
+    def imgs_budget(self) -> int:
+        return int(self.configMng.values.get("env_imgs_budget") or 0) << 20
+
+    def pinned_images(self, cache: ImageCache) -> set[str]:
+        """
+        Return the cached images the environments still need: the ones
+        they were realized from and the seekable images they read lazily.
+        """
+        envs_dir = self.configMng.constants.SHPD_ENVS_DIR
+        tags = [envCfg.tag for envCfg in self.configMng.get_environments()]
+        lazy = [LazyEnv(os.path.join(envs_dir, tag)) for tag in tags]
+        return cache.pinned(tags, [e.image for e in lazy if e.load()])
+
+    def cache_images(self, paths: list[str], envs: Optional[list[str]] = None):
+        """
+        Index images of SHPD_ENV_IMGS_DIR as just used, by the environments
+        realized from them, then evict the least recently used images not
+        pinned until the cache fits `env_imgs_budget` MB.
+        """
+        cache = self.image_cache()
+        budget = self.imgs_budget()
+        try:
+            with cache.lock():
+                cache.sync()
+                for path in paths:
+                    cache.record(path, envs or [])
+                evicted: dict[str, int] = {}
+                if budget:
+                    pinned = self.pinned_images(cache).union(paths)
+                    evicted = cache.evict(budget, pinned).images
+                cache.store()
+        except (OSError, ValueError) as e:
+            Util.print_error_and_die(f"Failed to update the image cache: {e}")
+            return
+        for path, freed in evicted.items():
+            Util.print(f"Evicted: {path} ({freed / 1e6:.1f} MB freed)")
+
+    def cache_image_url(self, url: str, env_tag: str):
+        """Index an image imported from SHPD_ENV_IMGS_DIR, if it was."""
+        parsed = urlparse(url)
+        if parsed.scheme != "file":
+            return
+        path = Path(unquote(parsed.path))
+        imgs_dir = Path(self.configMng.constants.SHPD_ENV_IMGS_DIR).resolve()
+        if path.parent == imgs_dir:
+            self.cache_images([path.name], [env_tag])
+
+    def rename_env(self, src_env_tag: str, dst_env_tag: str):
+        """Move the images realized by an environment to its new tag."""
+        cache = self.image_cache()
+        if os.path.exists(cache.path):
+            with cache.lock():
+                cache.rename_env(src_env_tag, dst_env_tag)
+                cache.store()
+
+    def disk_usage(self):
+        """
+        Report the environment images of SHPD_ENV_IMGS_DIR from the cache
+        index, least recently used first.
+        """
+        cache = self.image_cache()
+        try:
+            with cache.lock():
+                cache.sync()
+                cache.store()
+        except (OSError, ValueError) as e:
+            Util.print_error_and_die(f"Failed to read the image cache: {e}")
+            return
+        pinned = self.pinned_images(cache)
+        images = cache.lru()
+        if self.cli_flags.get("porcelain"):
+            for i in images:
+                Util.print(
+                    f"{i.path}\t{i.kind}\t{cache.image_size(i)}\t"
+                    f"{i.atime:.0f}\t{'pinned' if i.path in pinned else ''}"
+                )
+            return
+        if not images:
+            Util.print("No local images available.")
+            return
+        table = Table(title="images")
+        table.add_column("Image")
+        table.add_column("Kind")
+        table.add_column("Size", justify="right")
+        table.add_column("Last used")
+        table.add_column("Pinned")
+        for i in images:
+            table.add_row(
+                i.path,
+                i.kind,
+                f"{cache.image_size(i) / 1e6:.1f} MB",
+                time.strftime("%Y-%m-%d %H:%M", time.localtime(i.atime)),
+                "yes" if i.path in pinned else "",
+            )
+        Util.console.print(table)
+        usage = cache.usage(pinned)
+        budget = self.imgs_budget()
+        limit = f"{budget / 1e6:.1f} MB" if budget else "unlimited"
+        Util.print(
+            f"Images: {usage.images} ({usage.pinned} pinned), "
+            f"{usage.images_bytes / 1e6:.1f} MB; chunks: {usage.chunks}, "
+            f"{usage.chunks_bytes / 1e6:.1f} MB; total "
+            f"{usage.total / 1e6:.1f} MB, budget {limit}"
+        )
@@ -0,0 +1,392 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Optional
+
+from config import ConfigMng
+from registry import Registry, RegistryEntry
+from util import Util
+from util.jsonfile import LockedJsonFile
+
+from .cache import ImageCacheMng
+from .chunks import CHUNKED, MANIFEST_SUFFIX, MANIFESTS_DIR, ChunkStore
+from .image import CHECKSUM_SUFFIX, PACK_FORMATS
+from .integrity import INTEGRITY_SUFFIX
+from .peers import PEER_PORT, TIMEOUT, ChunkServer, PeerSet
+
+CATALOG_FILE = "catalog.json"
+
+
+@dataclass
+class CatalogImage:
+    """
+    An environment image of the registry: a packed image, its format as
+    kind, or the manifest of a chunked one. The validator identifies the
+    version of the registry file it was read from.
+    """
+
+    name: str
+    kind: str
+    size: int
+    sha256: str
+    validator: str
+    path: str
+
+
+@dataclass
+class RefreshStats:
+    listed: int = 0
+    fetched: int = 0
+    changed: int = 0
+
+
+class RegistryCatalog(LockedJsonFile):
+    """
+    Local copy of the catalog of the registry images.
+
+    A refresh lists the registry root, where the packed images are, and
+    lists the manifests directory only when its modification time
+    changed. Only the checksums and manifests of the images added or
+    modified since the previous refresh are downloaded.
+    """
+
+    def __init__(self, path: str):
+        self.images: dict[str, CatalogImage] = {}
+        self.dirs: dict[str, str] = {}
+        self.refreshed = 0.0
+        super().__init__(path)
+
+    def decode(self, data: dict[str, Any]):
+        self.images = {
+            i["path"]: CatalogImage(**i) for i in data.get("images", [])
+        }
+        self.dirs = data.get("dirs", {})
+        self.refreshed = data.get("refreshed", 0.0)
+
+    def encode(self) -> dict[str, Any]:
+        return {
+            "refreshed": self.refreshed,
+            "dirs": self.dirs,
+            "images": [asdict(i) for i in self.images.values()],
+        }
+
+    def stale(self, ttl: float, now: Optional[float] = None) -> bool:
+        return (now or time.time()) - self.refreshed > ttl
+
+    def list(self) -> list[CatalogImage]:
+        return sorted(self.images.values(), key=lambda i: (i.name, i.kind))
+
+    def validator(self, entry: RegistryEntry) -> str:
+        return f"{entry.size}:{entry.modified}" if entry.modified else ""
+
+    def cached(self, entry: RegistryEntry, path: str) -> Optional[CatalogImage]:
+        """Return the cached image if the entry did not change."""
+        image = self.images.get(path)
+        validator = self.validator(entry)
+        if image and validator and image.validator == validator:
+            return image
+        return None
+
+    def refresh(self, registry: Registry) -> RefreshStats:
+        """Revalidate the catalog against the registry and store it."""
+        stats = RefreshStats()
+        images: dict[str, CatalogImage] = {}
+        dirs: dict[str, str] = {}
+        root = registry.entries("")
+        stats.listed += 1
+        names = {e.name for e in root}
+        suffixes = tuple(PACK_FORMATS.values())
+        for entry in root:
+            if entry.name.startswith("."):
+                continue
+            if entry.is_dir:
+                if entry.name == MANIFESTS_DIR:
+                    dirs[MANIFESTS_DIR] = entry.modified
+                continue
+            if not entry.name.endswith(suffixes):
+                continue
+            if image := self.cached(entry, entry.name):
+                images[entry.name] = image
+                continue
+            sha256 = ""
+            if f"{entry.name}{CHECKSUM_SUFFIX}" in names:
+                sha256 = self.fetch_checksum(registry, entry.name)
+                stats.fetched += 1
+            fmt = next(
+                f for f, s in PACK_FORMATS.items() if entry.name.endswith(s)
+            )
+            images[entry.name] = CatalogImage(
+                entry.name[: -len(PACK_FORMATS[fmt])],
+                fmt,
+                entry.size,
+                sha256,
+                self.validator(entry),
+                entry.name,
+            )
+        modified = dirs.get(MANIFESTS_DIR)
+        if modified and modified == self.dirs.get(MANIFESTS_DIR):
+            images.update(
+                (path, image)
+                for path, image in self.images.items()
+                if image.kind == CHUNKED
+            )
+        elif modified:
+            stats.listed += 1
+            for entry in registry.entries(MANIFESTS_DIR):
+                if entry.is_dir or entry.name.startswith("."):
+                    continue
+                if not entry.name.endswith(MANIFEST_SUFFIX):
+                    continue
+                path = f"{MANIFESTS_DIR}/{entry.name}"
+                image = self.cached(entry, path)
+                if not image:
+                    stats.fetched += 1
+                    image = self.fetch_manifest(registry, entry, path)
+                if image:
+                    images[path] = image
+        stats.changed = len(images.keys() ^ self.images.keys()) + sum(
+            1
+            for path, image in images.items()
+            if path in self.images and self.images[path] != image
+        )
+        self.images, self.dirs, self.refreshed = images, dirs, time.time()
+        self.store()
+        return stats
+
+    def fetch_checksum(self, registry: Registry, name: str) -> str:
+        try:
+            data = registry.get(f"{name}{CHECKSUM_SUFFIX}")
+            return data.decode().split()[0].lower()
+        except (FileNotFoundError, UnicodeDecodeError, IndexError):
+            return ""
+
+    def fetch_manifest(
+        self, registry: Registry, entry: RegistryEntry, path: str
+    ) -> Optional[CatalogImage]:
+        try:
+            item: dict[str, Any] = json.loads(registry.get(path))
+            return CatalogImage(
+                item["name"],
+                CHUNKED,
+                item["size"],
+                item["sha256"],
+                self.validator(entry),
+                path,
+            )
+        except (FileNotFoundError, ValueError, KeyError):
+            return None
+
+
+class ImageRegistryMng:
+    """
+    Move environment images between SHPD_ENV_IMGS_DIR, the registry and
+    the peers, and list the registry ones from the cached catalog.
+    """
+
+    def __init__(
+        self,
+        cli_flags: dict[str, bool],
+        configMng: ConfigMng,
+        cacheMng: ImageCacheMng,
+        spawn: Callable[[list[str]], None],
+    ):
+        self.cli_flags = cli_flags
+        self.configMng = configMng
+        self.cacheMng = cacheMng
+        self.spawn = spawn
+
+    def image_file(self, image: str) -> str:
+        """Return the file name of an environment image, zstd by default."""
+        if not image.endswith(tuple(PACK_FORMATS.values())):
+            image += PACK_FORMATS["zstd"]
+        return image
+
+    def open_registry(self) -> Registry:
+        values = self.configMng.values
+        return Registry.from_config(
+            self.configMng.config.shpd_registry,
+            self.registry_connections(),
+            int(values.get("registry_part_size") or 16) << 20,
+        )
+
+    def registry_connections(self) -> int:
+        return int(self.configMng.values.get("registry_connections") or 4)
+
+    def fetch_images(self, images: list[str]):
+        """
+        Download environment images from the registry to
+        SHPD_ENV_IMGS_DIR, concurrently, resuming interrupted downloads.
+        """
+        imgs_dir = self.configMng.constants.SHPD_ENV_IMGS_DIR
+        os.makedirs(imgs_dir, exist_ok=True)
+        files = [self.image_file(image) for image in images]
+        start = time.monotonic()
+        try:
+            registry = self.open_registry()
+            try:
+                received = registry.download_many(
+                    [(f, os.path.join(imgs_dir, f)) for f in files],
+                    self.registry_connections(),
+                )
+                for sidecar in (
+                    f"{f}{suffix}"
+                    for f in files
+                    for suffix in (INTEGRITY_SUFFIX, CHECKSUM_SUFFIX)
+                ):
+                    try:
+                        registry.download(
+                            sidecar, os.path.join(imgs_dir, sidecar)
+                        )
+                    except FileNotFoundError:
+                        pass
+            finally:
+                registry.close()
+        except FileNotFoundError as e:
+            missing = os.path.basename(e.filename or str(e))
+            Util.print_error_and_die(f"Image '{missing}' not found.")
+            return
+        except (OSError, RuntimeError) as e:
+            Util.print_error_and_die(f"Failed to fetch images: {e}")
+            return
+        for f, size in zip(files, received):
+            Util.print(f"Fetched: {f} ({size / 1e6:.1f} MB received)")
+        self.print_transfer(sum(received), time.monotonic() - start)
+        self.cacheMng.cache_images(files)
+
+    def publish_images(self, images: list[str]):
+        """
+        Upload environment images of SHPD_ENV_IMGS_DIR to the registry,
+        concurrently, resuming interrupted uploads.
+        """
+        imgs_dir = self.configMng.constants.SHPD_ENV_IMGS_DIR
+        files = [self.image_file(image) for image in images]
+        for f in files:
+            if not os.path.isfile(os.path.join(imgs_dir, f)):
+                Util.print_error_and_die(f"Image '{f}' not found.")
+                return
+        sidecars = [
+            f"{f}{suffix}"
+            for f in files
+            for suffix in (INTEGRITY_SUFFIX, CHECKSUM_SUFFIX)
+            if os.path.isfile(os.path.join(imgs_dir, f"{f}{suffix}"))
+        ]
+        start = time.monotonic()
+        try:
+            registry = self.open_registry()
+            try:
+                sent = registry.upload_many(
+                    [(os.path.join(imgs_dir, f), f) for f in files],
+                    self.registry_connections(),
+                )
+                # Sidecars last, so that they never describe a partial upload.
+                for sidecar in sidecars:
+                    registry.upload(os.path.join(imgs_dir, sidecar), sidecar)
+            finally:
+                registry.close()
+        except (OSError, RuntimeError) as e:
+            Util.print_error_and_die(f"Failed to publish images: {e}")
+            return
+        for f, size in zip(files, sent):
+            Util.print(f"Published: {f} ({size / 1e6:.1f} MB sent)")
+        self.print_transfer(sum(sent), time.monotonic() - start)
+        self.cacheMng.cache_images(files)
+
+    def print_transfer(self, size: int, duration: float):
+        rate = size / 1e6 / duration if duration > 0 else 0.0
+        Util.print(
+            f"Transferred: {size / 1e6:.1f} MB in {duration:.1f}s, "
+            f"{rate:.1f} MB/s"
+        )
+
+    def peer_set(self) -> PeerSet:
+        """The peers of `env_peers` to pull chunks from."""
+        values = self.configMng.values
+        return PeerSet(
+            (values.get("env_peers") or "").split(","),
+            float(values.get("env_peer_timeout") or TIMEOUT),
+        )
+
+    def serve_chunks(self, store: ChunkStore, port: Optional[int] = None):
+        """
+        Serve the chunks of a chunk store to the peers pulling the same
+        images, until interrupted.
+        """
+        if port is None:
+            port = int(self.configMng.values.get("env_peer_port") or PEER_PORT)
+        try:
+            server = ChunkServer(store, "", port)
+        except OSError as e:
+            Util.print_error_and_die(f"Failed to serve chunks: {e}")
+            return
+        Util.print(f"Serving chunks on port {server.port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    def registry_catalog(self) -> RegistryCatalog:
+        return RegistryCatalog(
+            os.path.join(
+                self.configMng.constants.SHPD_ENV_IMGS_DIR, CATALOG_FILE
+            )
+        )
+
+    def list_images(self, refresh: bool = False):
+        """
+        List the registry images from the cached catalog.
+
+        A catalog older than `env_catalog_ttl` seconds is refreshed in
+        background, it is refreshed first when it was never fetched or
+        with `refresh`.
+        """
+        catalog = self.registry_catalog()
+        if refresh or not catalog.refreshed:
+            try:
+                registry = self.open_registry()
+                try:
+                    with catalog.lock():
+                        catalog.refresh(registry)
+                finally:
+                    registry.close()
+            except (OSError, RuntimeError) as e:
+                Util.print_error_and_die(
+                    f"Failed to refresh the registry catalog: {e}"
+                )
+                return
+        elif catalog.stale(
+            float(self.configMng.values.get("env_catalog_ttl") or 0)
+        ):
+            self.spawn(["env", "images", "--remote", "--refresh"])
+        images = catalog.list()
+        if not images:
+            Util.print("No registry images available.")
+            return
+        Util.print("Registry images:")
+        for image in images:
+            digest = f", sha256 {image.sha256[:12]}" if image.sha256 else ""
+            Util.print(
+                f" - {image.name} ({image.kind}, "
+                f"{image.size / 1e6:.1f} MB{digest})"
+            )
@@ -0,0 +1,465 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Optional
+
+from registry import Registry
+
+from .image import write_env_tar
+from .peers import PeerSet
+
+MIN_CHUNK = 256 * 1024
+MAX_CHUNK = 4 * 1024 * 1024
+# Chunk boundaries are cut after the windows of WINDOW bytes whose hash
+# has its low 20 bits clear: about once per MiB past the minimum size.
+# The hash is the sum of COEFS[k] * BYTE_HASH[byte] over the window, so a
+# boundary only depends on the bytes before it and moves along with
+# insertions and deletions. It is computed for a whole span at once by
+# multiplying the span, one byte per 32-bit lane, with the coefficients:
+# WINDOW * 255 * 2**20 stays below 2**32, so lanes never carry into each
+# other, and the big integer product runs at C speed where a per-byte
+# rolling hash in Python would not keep up.
+WINDOW = 16
+LANE = 4
+SCAN_SIZE = 256 * 1024
+_SEED = b"".join(
+    hashlib.sha256(b"shpd-chunks-%d" % i).digest() for i in range(10)
+)
+BYTE_HASH = _SEED[:256]
+COEFS = sum(
+    (int.from_bytes(_SEED[256 + 4 * k : 259 + 4 * k], "little") >> 4 | 1)
+    << (8 * LANE * k)
+    for k in range(WINDOW)
+)
+LOW_NIBBLE = bytes(b & 0x0F for b in range(256))
+COMPRESS_LEVEL = 3
+CHUNKED = "chunked"
+CHUNKS_DIR = "chunks"
+MANIFESTS_DIR = "manifests"
+MANIFEST_SUFFIX = ".json"
+
+
+def window_marks(data: bytes | bytearray) -> bytes:
+    """
+    A byte per window ending in data, zero where a chunk boundary falls
+    after it; the first WINDOW - 1 windows are partial.
+    """
+    size = len(data)
+    lanes = bytearray(LANE * size)
+    lanes[::LANE] = data.translate(BYTE_HASH)
+    sums = (int.from_bytes(lanes, "little") * COEFS).to_bytes(
+        LANE * (size + WINDOW), "little"
+    )
+    end = LANE * size
+    low = (
+        int.from_bytes(sums[0:end:LANE], "little")
+        | int.from_bytes(sums[1:end:LANE], "little")
+        | int.from_bytes(sums[2:end:LANE].translate(LOW_NIBBLE), "little")
+    )
+    return low.to_bytes(size, "little")
+
+
+class Chunker:
+    """
+    Split a byte stream in content-defined chunks as it is fed.
+    """
+
+    def __init__(self, min_size: int = MIN_CHUNK, max_size: int = MAX_CHUNK):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.buf = bytearray()
+        self.scanned = 0
+
+    def boundary(self) -> Optional[int]:
+        end = min(len(self.buf), self.max_size)
+        while (start := max(self.scanned, self.min_size, WINDOW)) < end:
+            stop = min(start + SCAN_SIZE, end)
+            marks = window_marks(self.buf[start - WINDOW : stop])
+            if (found := marks.find(0, WINDOW - 1)) >= 0:
+                return start - WINDOW + 1 + found
+            self.scanned = stop
+        if len(self.buf) >= self.max_size:
+            return self.max_size
+        return None
+
+    def cut(self, size: int) -> bytes:
+        chunk = bytes(self.buf[:size])
+        del self.buf[:size]
+        self.scanned = 0
+        return chunk
+
+    def feed(self, data: bytes) -> list[bytes]:
+        """Add data, returning the chunks it completes."""
+        self.buf += data
+        chunks: list[bytes] = []
+        while (size := self.boundary()) is not None:
+            chunks.append(self.cut(size))
+        return chunks
+
+    def flush(self) -> list[bytes]:
+        """Return the last chunk of the stream."""
+        return [self.cut(len(self.buf))] if self.buf else []
+
+
+@dataclass
+class ImageManifest:
+    """
+    An environment image as the ordered chunks of its tar stream.
+    """
+
+    name: str
+    size: int
+    sha256: str
+    chunks: list[tuple[str, int]] = field(default_factory=list[tuple[str, int]])
+    created: float = 0.0
+
+    def to_json(self) -> bytes:
+        return json.dumps(asdict(self), indent=2).encode()
+
+    @staticmethod
+    def from_json(data: bytes) -> ImageManifest:
+        item: dict[str, Any] = json.loads(data)
+        return ImageManifest(
+            name=item["name"],
+            size=item["size"],
+            sha256=item["sha256"],
+            chunks=[(digest, size) for digest, size in item["chunks"]],
+            created=item.get("created", 0.0),
+        )
+
+    def digests(self) -> list[str]:
+        """The distinct chunks of the image, in order."""
+        return list(dict.fromkeys(digest for digest, _ in self.chunks))
+
+
+@dataclass
+class TransferStats:
+    """
+    Chunks of an image and the ones actually stored or transferred, with
+    the ones received from peers.
+    """
+
+    chunks: int = 0
+    transferred: int = 0
+    transferred_bytes: int = 0
+    duration: float = 0.0
+    from_peers: int = 0
+
+
+def chunk_path(digest: str) -> str:
+    return f"{CHUNKS_DIR}/{digest[:2]}/{digest}"
+
+
+def manifest_path(name: str) -> str:
+    return f"{MANIFESTS_DIR}/{name}{MANIFEST_SUFFIX}"
+
+
+class ChunkWriter(io.RawIOBase):
+    """
+    Stream written into the chunk store, chunk by chunk.
+    """
+
+    def __init__(self, store: ChunkStore, pool: ThreadPoolExecutor):
+        self.store = store
+        self.pool = pool
+        self.chunker = Chunker(store.min_size, store.max_size)
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.futures: list[Future[tuple[str, int, bool]]] = []
+        # chunks compressed at once, bounding the memory held
+        self.slots = threading.Semaphore(store.workers * 2)
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        data = bytes(data)
+        self.digest.update(data)
+        self.size += len(data)
+        for chunk in self.chunker.feed(data):
+            self.submit(chunk)
+        return len(data)
+
+    def submit(self, chunk: bytes):
+        self.slots.acquire()
+
+        def store() -> tuple[str, int, bool]:
+            try:
+                return self.store.store(chunk)
+            finally:
+                self.slots.release()
+
+        self.futures.append(self.pool.submit(store))
+
+    def finish(self) -> list[tuple[str, int, bool]]:
+        """
+        Wait for every chunk to be stored.
+
+        :return: The digest, size and whether it was new of every chunk.
+        """
+        for chunk in self.chunker.flush():
+            self.submit(chunk)
+        return [f.result() for f in self.futures]
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    Stream of an image read back from the chunk store, the next chunks
+    being read and decompressed ahead.
+    """
+
+    def __init__(
+        self,
+        store: ChunkStore,
+        manifest: ImageManifest,
+        pool: ThreadPoolExecutor,
+        lookahead: int = 8,
+    ):
+        self.store = store
+        self.manifest = manifest
+        self.pool = pool
+        self.lookahead = lookahead
+        self.pending: deque[Future[bytes]] = deque()
+        self.next = 0
+        self.current = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def fill(self):
+        chunks = self.manifest.chunks
+        while len(self.pending) < self.lookahead and self.next < len(chunks):
+            digest = chunks[self.next][0]
+            self.pending.append(self.pool.submit(self.store.get, digest))
+            self.next += 1
+
+    def readinto(self, buffer: Any) -> int:
+        if not self.current:
+            self.fill()
+            if not self.pending:
+                return 0
+            self.current = memoryview(self.pending.popleft().result())
+            self.fill()
+        size = min(len(buffer), len(self.current))
+        buffer[:size] = self.current[:size]
+        self.current = self.current[size:]
+        return size
+
+
+class ChunkStore:
+    """
+    Content-addressed store of environment images.
+
+    Images are kept as manifests listing the content-defined chunks of
+    their tar stream, every chunk is stored once, compressed, whichever
+    images and environments it comes from. Pushes and pulls transfer only
+    the chunks missing on the other side.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        workers: int = 4,
+        min_size: int = MIN_CHUNK,
+        max_size: int = MAX_CHUNK,
+    ):
+        self.root = root
+        self.workers = workers
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def local(self, path: str) -> str:
+        return os.path.join(self.root, *path.split("/"))
+
+    def has(self, digest: str) -> bool:
+        return os.path.exists(self.local(chunk_path(digest)))
+
+    def write_file(self, path: str, data: bytes):
+        target = self.local(path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".", dir=os.path.dirname(target))
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, target)
+        except OSError:
+            os.remove(tmp)
+            raise
+
+    def store(self, chunk: bytes) -> tuple[str, int, bool]:
+        """
+        Store a chunk unless already there.
+
+        :return: The chunk digest, size and whether it was new.
+        """
+        digest = hashlib.sha256(chunk).hexdigest()
+        if self.has(digest):
+            return digest, len(chunk), False
+        self.write_file(
+            chunk_path(digest), zlib.compress(chunk, COMPRESS_LEVEL)
+        )
+        return digest, len(chunk), True
+
+    def read_blob(self, digest: str) -> bytes:
+        with open(self.local(chunk_path(digest)), "rb") as f:
+            return f.read()
+
+    def unpack_blob(self, digest: str, blob: bytes) -> bytes:
+        """
+        :raises RuntimeError: If the blob is not the chunk.
+        """
+        try:
+            chunk = zlib.decompress(blob)
+        except zlib.error:
+            raise RuntimeError(f"corrupted chunk {digest}")
+        if hashlib.sha256(chunk).hexdigest() != digest:
+            raise RuntimeError(f"corrupted chunk {digest}")
+        return chunk
+
+    def get(self, digest: str) -> bytes:
+        return self.unpack_blob(digest, self.read_blob(digest))
+
+    def save_manifest(self, manifest: ImageManifest):
+        self.write_file(manifest_path(manifest.name), manifest.to_json())
+
+    def load_manifest(self, name: str) -> Optional[ImageManifest]:
+        try:
+            with open(self.local(manifest_path(name)), "rb") as f:
+                return ImageManifest.from_json(f.read())
+        except FileNotFoundError:
+            return None
+
+    def manifests(self) -> list[str]:
+        try:
+            names = os.listdir(self.local(MANIFESTS_DIR))
+        except OSError:
+            return []
+        return sorted(
+            n[: -len(MANIFEST_SUFFIX)]
+            for n in names
+            if n.endswith(MANIFEST_SUFFIX) and not n.startswith(".")
+        )
+
+    def add_image(
+        self, name: str, env_dir: str, config: dict[str, Any]
+    ) -> tuple[ImageManifest, TransferStats]:
+        """
+        Store an environment directory as the image `name`.
+
+        :return: The image manifest and the chunks newly stored, with
+            their uncompressed size.
+        """
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            writer = ChunkWriter(self, pool)
+            write_env_tar(writer, env_dir, config)
+            results = writer.finish()
+        manifest = ImageManifest(
+            name,
+            writer.size,
+            writer.digest.hexdigest(),
+            [(digest, size) for digest, size, _ in results],
+            time.time(),
+        )
+        self.save_manifest(manifest)
+        new = {digest: size for digest, size, new in results if new}
+        return manifest, TransferStats(
+            len(results),
+            len(new),
+            sum(new.values()),
+            time.monotonic() - start,
+        )
+
+    def open_image(
+        self, manifest: ImageManifest, pool: ThreadPoolExecutor
+    ) -> ChunkReader:
+        return ChunkReader(self, manifest, pool, self.workers * 2)
+
+    def push(
+        self, manifest: ImageManifest, registry: Registry
+    ) -> TransferStats:
+        """
+        Upload an image, only the chunks missing from the registry, then
+        its manifest.
+        """
+        start = time.monotonic()
+        missing = registry.missing([chunk_path(d) for d in manifest.digests()])
+
+        def upload(path: str) -> int:
+            blob = self.read_blob(path.rsplit("/", 1)[1])
+            registry.put(path, blob)
+            return len(blob)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            sent = sum(pool.map(upload, missing))
+        registry.put(manifest_path(manifest.name), manifest.to_json())
+        return TransferStats(
+            len(manifest.chunks), len(missing), sent, time.monotonic() - start
+        )
+
+    def pull(
+        self, name: str, registry: Registry, peers: Optional[PeerSet] = None
+    ) -> tuple[ImageManifest, TransferStats]:
+        """
+        Download an image, only the chunks missing from the store: from
+        the peers having them when given, from the registry otherwise.
+
+        :raises FileNotFoundError: If the registry has no such image.
+        :raises RuntimeError: If a chunk is corrupted.
+        """
+        start = time.monotonic()
+        manifest = ImageManifest.from_json(registry.get(manifest_path(name)))
+        missing = [d for d in manifest.digests() if not self.has(d)]
+
+        def download(digest: str) -> tuple[int, bool]:
+            for blob in peers.blobs(digest) if peers else ():
+                try:
+                    self.unpack_blob(digest, blob)
+                except RuntimeError as e:
+                    logging.warning("discarding a peer chunk: %s", e)
+                    continue
+                self.write_file(chunk_path(digest), blob)
+                return len(blob), True
+            blob = registry.get(chunk_path(digest))
+            self.unpack_blob(digest, blob)
+            self.write_file(chunk_path(digest), blob)
+            return len(blob), False
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            received = list(pool.map(download, missing))
+        self.save_manifest(manifest)
+        return manifest, TransferStats(
+            len(manifest.chunks),
+            len(missing),
+            sum(size for size, _ in received),
+            time.monotonic() - start,
+            sum(1 for _, from_peer in received if from_peer),
+        )
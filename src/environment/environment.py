@@ -19,13 +19,55 @@
 from __future__ import annotations
 
 import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
 from abc import ABC, abstractmethod
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import AbstractContextManager, nullcontext
+from dataclasses import asdict
+from fnmatch import fnmatch
+from pathlib import Path
+from typing import IO, Any, Callable, Optional, cast
+from urllib.parse import quote, unquote, urlparse
+
+from rich.table import Table
 
 from config import ConfigMng, EnvironmentCfg, EnvironmentTemplateCfg
-from service import Service, ServiceFactory
+from config.config import parse_environment
+from service import (
+    ReadinessGate,
+    Service,
+    ServiceFactory,
+    ServiceNotCreatedError,
+    ServiceStatus,
+    wait_ready,
+)
 from util import Constants, Util
 
+from .cache import ImageCacheMng
+from .catalog import ImageRegistryMng
+from .chunks import ChunkStore, manifest_path
+from .fleet import FleetResult, FleetScheduler
+from .image import PACK_FORMATS, EnvImageImporter, EnvImagePacker
+from .integrity import IntegrityRecord
+from .pool import PooledEnv, PoolRegistry
+from .seekable import (
+    SEEKABLE_FORMAT,
+    SEEKABLE_SUFFIX,
+    LazyEnv,
+    MaterializeResult,
+    SeekableImagePacker,
+    import_seekable,
+)
+from .suspend import SuspendRegistry
+
+
+def format_mb(size: int) -> str:
+    return f"{size / (1024 * 1024):.0f} MB"
+
 
 class Environment(ABC):
 
@@ -40,6 +82,7 @@ class Environment(ABC):
         self.configMng = configMng
         self.svcFactory = svcFactory
         self.envCfg = envCfg
+        self.scheduler: Optional[FleetScheduler] = None
         self.services = (
             [
                 self.svcFactory.new_service_from_cfg(envCfg, svcCfg)
@@ -69,6 +112,21 @@ class Environment(ABC):
         """Reload the environment."""
         pass
 
+    @abstractmethod
+    def pause(self):
+        """Freeze the running services of the environment."""
+        pass
+
+    @abstractmethod
+    def unpause(self):
+        """Resume the frozen services of the environment."""
+        pass
+
+    @abstractmethod
+    def memory_usage(self) -> int:
+        """Return the memory used by the environment services, in bytes."""
+        pass
+
     @abstractmethod
     def render(self) -> str:
         """
@@ -77,10 +135,43 @@ class Environment(ABC):
         pass
 
     @abstractmethod
-    def status(self):
+    def status(self) -> list[ServiceStatus]:
         """Get environment status."""
         pass
 
+    @abstractmethod
+    def watch_status(
+        self, on_change: Callable[[ServiceStatus], None]
+    ) -> Callable[[], None]:
+        """
+        Notify the environment status changes.
+
+        :param on_change: Called with the new status of a changed service.
+        :return: A callable to stop watching.
+        """
+        pass
+
+    @abstractmethod
+    def show_logs(self, follow: bool = False):
+        """Show the output of every service, each line prefixed."""
+        pass
+
+    def prepare(self):
+        """
+        Fetch in advance what the environment needs to start, so that its
+        first start is faster.
+        """
+        pass
+
+    def slot(self) -> AbstractContextManager[None]:
+        """
+        Hold a concurrency slot for an engine operation of the environment,
+        when it is part of a fleet run.
+        """
+        if self.scheduler:
+            return self.scheduler.slot(self.envCfg.tag)
+        return nullcontext()
+
     def to_config(self) -> EnvironmentCfg:
         """To config"""
         self.envCfg.services = [svc.svcCfg for svc in self.services]
@@ -96,6 +187,22 @@ class Environment(ABC):
         """Return the directory for the environment with a given tag."""
         return os.path.join(self.configMng.constants.SHPD_ENVS_DIR, env_tag)
 
+    def bind_paths(self) -> list[str]:
+        """
+        Return the paths of the environment directory bound by the
+        services, relative to it.
+        """
+        paths: list[str] = []
+        for svc in self.envCfg.services or []:
+            for volume in svc.volumes or []:
+                source = volume.partition(":")[0]
+                if not source.startswith("."):
+                    continue
+                path = os.path.normpath(source)
+                if path != ".." and not path.startswith("../"):
+                    paths.append(path)
+        return sorted(set(paths))
+
     def realize(self):
         """Realize the environment."""
         Util.create_dir(
@@ -193,6 +300,20 @@ class EnvironmentFactory(ABC):
         """
         pass
 
+    @abstractmethod
+    def pull_images(
+        self,
+        envs: list[Environment],
+        report: Optional[Callable[[str], None]] = None,
+    ) -> list[str]:
+        """
+        Pull at once the images missing for the environments.
+
+        :param report: Called with the overall progress of the pulls.
+        :return: The pulled images.
+        """
+        pass
+
 
 class EnvironmentMng:
 
@@ -207,6 +328,10 @@ class EnvironmentMng:
         self.configMng = configMng
         self.envFactory = envFactory
         self.svcFactory = svcFactory
+        self.cacheMng = ImageCacheMng(cli_flags, configMng)
+        self.registryMng = ImageRegistryMng(
+            cli_flags, configMng, self.cacheMng, self.spawn
+        )
 
     def get_environment(self, env_tag: Optional[str]) -> Optional[Environment]:
         if env_tag and env_tag.strip():
@@ -233,18 +358,138 @@ class EnvironmentMng:
                 f"Environment with tag '{env_tag}' already exists."
             )
         if envTmplCfg := self.configMng.get_environment_template(env_template):
-            env = self.envFactory.new_environment(
-                envTmplCfg,
-                env_tag,
-            )
-            env.realize()
+            if not self.claim_pooled_env(env_template, env_tag):
+                env = self.envFactory.new_environment(
+                    envTmplCfg,
+                    env_tag,
+                )
+                env.realize()
             Util.print(f"{env_tag}")
+            if self.configMng.values.get("env_prefetch") == "true":
+                self.spawn(["env", "prefetch", env_tag])
+            self.refill_pool()
         else:
             Util.print_error_and_die(
                 f"Environment Template with tag '{env_template}' "
                 f"does not exist."
             )
 
+    def pool_size(self) -> int:
+        return int(self.configMng.values.get("env_pool_size") or 0)
+
+    def pool_templates(self) -> list[str]:
+        listed = self.configMng.values.get("env_pool_templates") or ""
+        templates = [t.strip() for t in listed.split(",") if t.strip()]
+        return templates or self.configMng.get_environment_template_tags()
+
+    def pool_registry(self) -> PoolRegistry:
+        return PoolRegistry(self.configMng.constants.SHPD_POOL_FILE)
+
+    def claim_pooled_env(self, env_template: str, env_tag: str) -> bool:
+        """
+        Rename a pooled environment of the template to the tag.
+
+        :return: Whether an environment has been claimed.
+        """
+        registry = self.pool_registry()
+        if not registry.pooled(env_template):
+            return False
+        with registry.lock():
+            # the refill process may have changed the configuration
+            self.configMng.load()
+            while pooled := registry.claim(env_template):
+                envCfg = self.configMng.get_environment(pooled.env_tag)
+                if envCfg:
+                    env = self.envFactory.new_environment_cfg(envCfg)
+                    env.move_to(env_tag)
+                    return True
+        return False
+
+    def spawn(self, args: list[str]):
+        """Run a shepctl command in a detached background process."""
+        if getattr(sys, "frozen", False):
+            command = [sys.executable]
+        else:
+            command = [sys.executable, os.path.abspath(sys.argv[0])]
+        subprocess.Popen(
+            command + args,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+
+    def refill_pool(self):
+        """Refill the pool in a background process."""
+        if self.pool_size() <= 0:
+            return
+        self.spawn(["env", "pool", "fill"])
+
+    def fill_pool(self):
+        """
+        Realize the environments missing from the pool of every template,
+        with `env_pool_warm` also pulling their images.
+        """
+        size = self.pool_size()
+        warm = self.configMng.values.get("env_pool_warm") == "true"
+        registry = self.pool_registry()
+        for template in self.pool_templates():
+            envTmplCfg = self.configMng.get_environment_template(template)
+            if not envTmplCfg:
+                Util.print(f"Environment Template '{template}' not found.")
+                continue
+            while True:
+                with registry.lock():
+                    if len(registry.pooled(template)) >= size:
+                        break
+                    self.configMng.load()
+                    env_tag = (
+                        f"{Constants.ENV_POOL_PREFIX}{template}-"
+                        f"{uuid.uuid4().hex[:8]}"
+                    )
+                    env = self.envFactory.new_environment(envTmplCfg, env_tag)
+                    env.realize()
+                    registry.add(
+                        PooledEnv(env_tag, template, time.time(), not warm)
+                    )
+                if warm:
+                    try:
+                        env.prepare()
+                    except RuntimeError as e:
+                        Util.print(f"Failed to prepare {env_tag}: {e}")
+                    with registry.lock():
+                        if pooled := registry.envs.get(env_tag):
+                            pooled.ready = True
+                            registry.store()
+                Util.print(f"Pooled: {env_tag} ({template})")
+
+    def drain_pool(self):
+        """Delete every pooled environment."""
+        registry = self.pool_registry()
+        with registry.lock():
+            self.configMng.load()
+            for pooled in list(registry.envs.values()):
+                envCfg = self.configMng.get_environment(pooled.env_tag)
+                if envCfg:
+                    self.envFactory.new_environment_cfg(envCfg).delete()
+                registry.remove(pooled.env_tag)
+                Util.print(f"Deleted: {pooled.env_tag}")
+
+    def pool_status(self):
+        """List the pooled environments of every template."""
+        registry = self.pool_registry()
+        templates = self.pool_templates()
+        templates += sorted(
+            {e.template for e in registry.envs.values()} - set(templates)
+        )
+        for template in templates:
+            pooled = registry.pooled(template)
+            ready = len([e for e in pooled if e.ready])
+            Util.print(
+                f" - {template}: {ready} ready, "
+                f"{len(pooled) - ready} warming (size {self.pool_size()})"
+            )
+
     def clone_env(self, src_env_tag: str, dst_env_tag: str):
         """Clone an environment."""
         envCfg = self.configMng.get_environment(src_env_tag)
@@ -268,19 +513,192 @@ class EnvironmentMng:
         else:
             env = self.envFactory.new_environment_cfg(envCfg)
             env.move_to(dst_env_tag)
+            self.cacheMng.rename_env(src_env_tag, dst_env_tag)
             Util.print(f"Renamed to: {dst_env_tag}")
 
-    def checkout_env(self, env_tag: str):
-        """Checkout an environment."""
+    def checkout_env(self, env_tag: str, start: bool = False):
+        """
+        Checkout an environment, optionally starting it while the
+        previously active one is halted.
+        """
         envCfg = self.configMng.get_environment(env_tag)
         if not envCfg:
             Util.print_error_and_die(
                 f"Environment with tag '{env_tag}' does not exist."
             )
         else:
+            previous = self.configMng.get_active_environment()
+            if start:
+                # a failed switch dies, the previous environment active
+                self.switch_env(previous, envCfg)
             envCfg.active = True
             self.configMng.set_active_environment(env_tag)
             Util.print(f"Switched to: {env_tag}")
+            if (
+                not start
+                and self.suspend_policy() == Constants.ENV_SUSPEND_PAUSE
+            ):
+                if previous and previous.tag != env_tag:
+                    self.suspend_env(previous)
+                self.resume_env(envCfg)
+                self.stop_idle_envs()
+
+    def switch_env(
+        self, previous: Optional[EnvironmentCfg], envCfg: EnvironmentCfg
+    ):
+        """
+        Start an environment while the previous one is halted.
+
+        Both run at the same time, except that a service holding a host
+        port or hostname also claimed by a new service is stopped before
+        that service starts.
+        """
+        started = time.monotonic()
+        registry = self.suspend_registry()
+        with registry.lock():
+            if registry.remove(envCfg.tag):
+                self.envFactory.new_environment_cfg(envCfg).unpause()
+            if previous:
+                registry.remove(previous.tag)
+        new_env = self.envFactory.new_environment_cfg(envCfg)
+        old_env = (
+            self.envFactory.new_environment_cfg(previous)
+            if previous and previous.tag != envCfg.tag
+            else None
+        )
+        old_svcs = old_env.get_services() if old_env else []
+
+        released = {svc.svcCfg.tag: threading.Event() for svc in old_svcs}
+        blockers = {
+            svc.svcCfg.tag: [
+                released[old.svcCfg.tag]
+                for old in old_svcs
+                if svc.claims() & old.claims()
+            ]
+            for svc in new_env.get_services()
+        }
+
+        def stop_old(svc: Service):
+            try:
+                svc.halt()
+            except ServiceNotCreatedError:
+                # never brought up, nothing to release
+                pass
+            finally:
+                released[svc.svcCfg.tag].set()
+
+        def start_new(svc: Service):
+            for event in blockers[svc.svcCfg.tag]:
+                event.wait()
+            svc.start()
+
+        errors: list[str] = []
+        missing = False
+        tasks = [(stop_old, svc) for svc in old_svcs] + [
+            (start_new, svc) for svc in new_env.get_services()
+        ]
+        with ThreadPoolExecutor(max_workers=max(1, len(tasks))) as pool:
+            futures = {pool.submit(task, svc): svc for task, svc in tasks}
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                except ServiceNotCreatedError:
+                    # never started, the environment creates it
+                    missing = True
+                except RuntimeError as e:
+                    errors.append(f"{futures[future].svcCfg.tag}: {e}")
+        if missing and not errors:
+            try:
+                new_env.start()
+            except RuntimeError as e:
+                errors.append(str(e))
+        if errors:
+            Util.print_error_and_die(
+                f"Failed to switch environment: {'; '.join(errors)}"
+            )
+        if old_env:
+            Util.print(f"Halted: {old_env.envCfg.tag}")
+        Util.print(f"Started: {envCfg.tag} ({time.monotonic() - started:.1f}s)")
+        if self.cli_flags.get("wait"):
+            wait_ready(new_env.get_services())
+
+    def suspend_policy(self) -> str:
+        return self.configMng.values.get(
+            "env_suspend", Constants.ENV_SUSPEND_NONE
+        )
+
+    def suspend_registry(self) -> SuspendRegistry:
+        return SuspendRegistry(self.configMng.constants.SHPD_SUSPEND_FILE)
+
+    def suspend_env(self, envCfg: EnvironmentCfg):
+        """Pause an environment, recording the memory it keeps."""
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            memory = env.memory_usage()
+            env.pause()
+        except RuntimeError as e:
+            Util.print(f"Failed to pause {envCfg.tag}: {e}")
+            return
+        registry = self.suspend_registry()
+        with registry.lock():
+            registry.add(envCfg.tag, time.time(), memory)
+        Util.print(f"Paused: {envCfg.tag} ({format_mb(memory)} held)")
+
+    def resume_env(self, envCfg: EnvironmentCfg):
+        """Unpause an environment previously suspended."""
+        registry = self.suspend_registry()
+        with registry.lock():
+            if not registry.remove(envCfg.tag):
+                return
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            env.unpause()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to resume {envCfg.tag}: {e}")
+        Util.print(f"Resumed: {envCfg.tag}")
+
+    def stop_idle_envs(self):
+        """Stop the suspended environments idle past `env_idle_ttl`."""
+        ttl = float(self.configMng.values.get("env_idle_ttl") or 0)
+        if ttl <= 0:
+            return
+        registry = self.suspend_registry()
+        with registry.lock():
+            for suspended in registry.idle(time.time(), ttl):
+                envCfg = self.configMng.get_environment(suspended.env_tag)
+                if envCfg:
+                    try:
+                        self.envFactory.new_environment_cfg(envCfg).halt()
+                    except RuntimeError as e:
+                        Util.print(f"Failed to stop {suspended.env_tag}: {e}")
+                        continue
+                    registry.reclaimed += suspended.memory
+                    Util.print(
+                        f"Stopped idle: {suspended.env_tag} "
+                        f"({format_mb(suspended.memory)} reclaimed)"
+                    )
+                registry.remove(suspended.env_tag)
+            registry.store()
+
+    def idle_envs(self):
+        """
+        Stop the environments idle past the TTL and list the suspended ones.
+        """
+        self.stop_idle_envs()
+        registry = self.suspend_registry()
+        if not registry.envs:
+            Util.print("No suspended environments.")
+        now = time.time()
+        for suspended in sorted(registry.envs.values(), key=lambda e: e.since):
+            Util.print(
+                f" - {suspended.env_tag}: paused for "
+                f"{int(now - suspended.since)}s, "
+                f"{format_mb(suspended.memory)}"
+            )
+        Util.print(
+            f"Held: {format_mb(registry.held)}, "
+            f"reclaimed: {format_mb(registry.reclaimed)}"
+        )
 
     def delete_env(self, env_tag: str):
         """Delete an environment."""
@@ -304,7 +722,10 @@ class EnvironmentMng:
 
     def list_envs(self):
         """List all available environments."""
-        envs = self.configMng.get_environments()
+        pooled = self.pool_registry().envs
+        envs = [
+            e for e in self.configMng.get_environments() if e.tag not in pooled
+        ]
         if not envs:
             Util.print("No environments available.")
             return
@@ -314,15 +735,529 @@ class EnvironmentMng:
 
     def start_env(self, envCfg: EnvironmentCfg):
         """Start an environment."""
-        pass
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            self.materialize_env(env, env.bind_paths())
+            env.start()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to start environment: {e}")
+        Util.print(f"Started: {envCfg.tag}")
+        if self.cli_flags.get("wait"):
+            wait_ready(env.get_services())
 
     def halt_env(self, envCfg: EnvironmentCfg):
         """Halt an environment."""
-        pass
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            env.halt()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to halt environment: {e}")
+        Util.print(f"Halted: {envCfg.tag}")
 
     def reload_env(self, envCfg: EnvironmentCfg):
         """Reload an environment."""
-        pass
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            env.reload()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to reload environment: {e}")
+        Util.print(f"Reloaded: {envCfg.tag}")
+
+    def pack_env(self, env_tag: str, fmt: Optional[str] = None):
+        """Pack an environment as an environment image."""
+        envCfg = self.configMng.get_environment(env_tag)
+        if not envCfg:
+            Util.print_error_and_die(f"Environment '{env_tag}' does not exist.")
+            return
+        env = self.envFactory.new_environment_cfg(envCfg)
+        values = self.configMng.values
+        fmt = fmt or values.get("env_pack_format") or "zstd"
+        algorithm = values.get("env_hash_algorithm") or "blake2b"
+        try:
+            self.materialize_env(env)
+            level = values.get("env_pack_level")
+            packer: EnvImagePacker | SeekableImagePacker
+            if fmt == SEEKABLE_FORMAT:
+                packer = SeekableImagePacker(
+                    self.configMng.constants.SHPD_ENV_IMGS_DIR,
+                    int(level) if level else None,
+                    self.imgs_workers(),
+                    algorithm,
+                )
+            else:
+                packer = EnvImagePacker(
+                    self.configMng.constants.SHPD_ENV_IMGS_DIR,
+                    fmt,
+                    int(level) if level else None,
+                    int(values.get("env_pack_threads") or 0),
+                    algorithm,
+                    self.imgs_workers(),
+                )
+            result = packer.pack(
+                env.get_dir(), asdict(env.to_config()), env_tag
+            )
+        except (RuntimeError, ValueError) as e:
+            Util.print_error_and_die(f"Failed to pack environment: {e}")
+            return
+        Util.print(
+            f"Packed: {result.path} ({result.raw_bytes / 1e6:.1f} MB "
+            f"in {result.duration:.1f}s, {result.throughput:.1f} MB/s, "
+            f"{result.packed_bytes / 1e6:.1f} MB packed)"
+        )
+        self.cacheMng.cache_images([os.path.basename(result.path)])
+
+    def env_image_url(self, image: str) -> str:
+        """
+        Locate an environment image given as a URL, a file, an image of
+        SHPD_ENV_IMGS_DIR or an image of the registry.
+        """
+        if "://" in image:
+            return image
+        if os.path.isfile(image):
+            return Path(image).resolve().as_uri()
+        image = self.registryMng.image_file(image)
+        local = os.path.join(self.configMng.constants.SHPD_ENV_IMGS_DIR, image)
+        if os.path.isfile(local):
+            return Path(local).resolve().as_uri()
+        registry = self.configMng.config.shpd_registry
+        auth = ""
+        if registry.ftp_user:
+            auth = f"{quote(registry.ftp_user)}:{quote(registry.ftp_psw)}@"
+        path = registry.ftp_env_imgs_path.strip("/")
+        return f"ftp://{auth}{registry.ftp_server}/{path}/{image}"
+
+    def image_place(
+        self, env_tag: Optional[str]
+    ) -> Callable[[dict[str, Any]], str]:
+        """
+        Return where an imported image goes, under its own tag unless one
+        is given.
+        """
+        envs_dir = self.configMng.constants.SHPD_ENVS_DIR
+        os.makedirs(envs_dir, exist_ok=True)
+
+        def place(config: dict[str, Any]) -> str:
+            tag = env_tag or config.get("tag", "")
+            dest = os.path.join(envs_dir, tag)
+            if not tag or self.configMng.get_environment(tag):
+                raise RuntimeError(f"environment '{tag}' already exists")
+            if os.path.exists(dest):
+                raise RuntimeError(f"directory '{dest}' already exists")
+            return dest
+
+        return place
+
+    def add_imported_env(self, config: dict[str, Any], env_dir: str) -> str:
+        """
+        Add the configuration of an imported environment.
+
+        :return: The environment tag.
+        """
+        envCfg = parse_environment(config)
+        envCfg.tag = os.path.basename(env_dir)
+        envCfg.active = False
+        envCfg.archived = False
+        self.configMng.add_or_set_environment(envCfg.tag, envCfg)
+        return envCfg.tag
+
+    def import_env(
+        self,
+        image: str,
+        env_tag: Optional[str] = None,
+        sha256: Optional[str] = None,
+        lazy: bool = False,
+    ):
+        """
+        Import an environment image as a new environment, with `lazy`
+        leaving the files of a seekable image in it until first used.
+        """
+        url = self.env_image_url(image)
+        if urlparse(url).path.endswith(SEEKABLE_SUFFIX):
+            self.import_seekable_env(url, env_tag, lazy)
+            return
+        if lazy:
+            Util.print_error_and_die(
+                "Lazy imports need a seekable image, "
+                "pack it with --format seekable."
+            )
+            return
+        try:
+            result = EnvImageImporter(
+                hash_workers=self.imgs_workers()
+            ).import_image(url, self.image_place(env_tag), sha256)
+            tag = self.add_imported_env(result.config, result.path)
+        except (RuntimeError, KeyError, TypeError) as e:
+            Util.print_error_and_die(f"Failed to import environment: {e}")
+            return
+        checked = "verified" if result.verified else "not verified"
+        Util.print(
+            f"Imported: {tag} ({result.received_bytes / 1e6:.1f} MB "
+            f"in {result.duration:.1f}s, {result.throughput:.1f} MB/s, "
+            f"{result.chunks_verified} chunks verified, checksum {checked})"
+        )
+        self.cacheMng.cache_image_url(url, tag)
+
+    def import_seekable_env(self, url: str, env_tag: Optional[str], lazy: bool):
+        parsed = urlparse(url)
+        if parsed.scheme != "file":
+            Util.print_error_and_die(
+                "Seekable images are imported from files, env fetch it first."
+            )
+            return
+        try:
+            result = import_seekable(
+                unquote(parsed.path),
+                self.image_place(env_tag),
+                lazy,
+                self.imgs_workers(),
+            )
+            tag = self.add_imported_env(result.config, result.path)
+        except (RuntimeError, KeyError, TypeError) as e:
+            Util.print_error_and_die(f"Failed to import environment: {e}")
+            return
+        pending = f", {result.pending} left in the image" if lazy else ""
+        Util.print(
+            f"Imported: {tag} ({result.files} files{pending} "
+            f"in {result.duration:.1f}s)"
+        )
+        self.cacheMng.cache_image_url(url, tag)
+
+    def materialize_env(
+        self, env: Environment, paths: Optional[list[str]] = None
+    ) -> MaterializeResult:
+        """
+        Extract from its image the files of a lazily imported environment
+        under `paths`, all of them when None.
+
+        :raises RuntimeError: If the image is missing or corrupted.
+        """
+        result = LazyEnv(env.get_dir()).materialize(paths, self.imgs_workers())
+        if result.files:
+            Util.print(
+                f"Materialized: {env.envCfg.tag} ({result.files} files, "
+                f"{result.bytes / 1e6:.1f} MB in {result.duration:.1f}s)"
+            )
+        return result
+
+    def materialize_paths(self, env_tag: str, paths: list[str]):
+        """Materialize paths of a lazily imported environment, or all."""
+        envCfg = self.configMng.get_environment(env_tag)
+        if not envCfg:
+            Util.print_error_and_die(f"Environment '{env_tag}' does not exist.")
+            return
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            result = self.materialize_env(env, paths or None)
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to materialize environment: {e}")
+            return
+        if not result.files:
+            Util.print("Nothing to materialize.")
+        if not result.pending:
+            Util.print(f"Environment '{env_tag}' is fully materialized.")
+
+    def verify_env(self, env_tag: str, full: bool = False):
+        """
+        Check the files of an environment against the integrity manifest
+        of the image it was packed as or imported from, hashing only the
+        files changed since last found intact unless `full`.
+        """
+        envCfg = self.configMng.get_environment(env_tag)
+        if not envCfg:
+            Util.print_error_and_die(f"Environment '{env_tag}' does not exist.")
+            return
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            self.materialize_env(env)
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to materialize environment: {e}")
+            return
+        record = IntegrityRecord(env.get_dir())
+        if not record.load():
+            Util.print_error_and_die(
+                f"Environment '{env_tag}' has no integrity record, "
+                "pack or import it first."
+            )
+            return
+        try:
+            result = record.verify(self.imgs_workers(), full)
+        except (OSError, ValueError) as e:
+            Util.print_error_and_die(f"Failed to verify environment: {e}")
+            return
+        for kind, paths in (
+            ("modified", result.modified),
+            ("missing", result.missing),
+            ("added", result.added),
+        ):
+            for path in paths:
+                Util.print(f" - {kind}: {path}")
+        if not result.ok:
+            Util.print_error_and_die(
+                f"Environment '{env_tag}' does not match its image "
+                f"({len(result.modified)} modified, "
+                f"{len(result.missing)} missing, {len(result.added)} added)."
+            )
+            return
+        Util.print(
+            f"Verified: {env_tag} ({result.files} files, "
+            f"{result.hashed} hashed, {result.skipped} unchanged)"
+        )
+
+    def imgs_workers(self) -> int:
+        return int(self.configMng.values.get("env_imgs_workers") or 4)
+
+    def chunk_store(self) -> ChunkStore:
+        return ChunkStore(
+            self.configMng.constants.SHPD_ENV_IMGS_DIR, self.imgs_workers()
+        )
+
+    def serve_chunks(self, port: Optional[int] = None):
+        """Serve the chunks of the local chunk store to the peers."""
+        self.registryMng.serve_chunks(self.chunk_store(), port)
+
+    def list_images(self, remote: bool = False, refresh: bool = False):
+        """
+        List the environment images of SHPD_ENV_IMGS_DIR or, with
+        `remote`, the registry ones.
+        """
+        if remote:
+            self.registryMng.list_images(refresh)
+        else:
+            self.list_local_images()
+
+    def list_local_images(self):
+        imgs_dir = self.configMng.constants.SHPD_ENV_IMGS_DIR
+        images: list[tuple[str, str, int]] = []
+        for fmt, suffix in PACK_FORMATS.items():
+            for path in sorted(Path(imgs_dir).glob(f"*{suffix}")):
+                images.append(
+                    (path.name[: -len(suffix)], fmt, path.stat().st_size)
+                )
+        store = self.chunk_store()
+        for name in store.manifests():
+            if manifest := store.load_manifest(name):
+                images.append((name, "chunked", manifest.size))
+        if not images:
+            Util.print("No local images available.")
+            return
+        Util.print("Local images:")
+        for name, kind, size in sorted(images):
+            Util.print(f" - {name} ({kind}, {size / 1e6:.1f} MB)")
+
+    def push_env(self, env_tag: str, image: Optional[str] = None):
+        """
+        Store an environment in the chunk store and push it to the
+        registry as `image`, its tag by default.
+        """
+        envCfg = self.configMng.get_environment(env_tag)
+        if not envCfg:
+            Util.print_error_and_die(f"Environment '{env_tag}' does not exist.")
+            return
+        env = self.envFactory.new_environment_cfg(envCfg)
+        store = self.chunk_store()
+        try:
+            self.materialize_env(env)
+            registry = self.registryMng.open_registry()
+            try:
+                manifest, stored = store.add_image(
+                    image or env_tag, env.get_dir(), asdict(env.to_config())
+                )
+                pushed = store.push(manifest, registry)
+            finally:
+                registry.close()
+        except (OSError, RuntimeError) as e:
+            Util.print_error_and_die(f"Failed to push environment: {e}")
+            return
+        Util.print(
+            f"Pushed: {manifest.name} ({pushed.chunks} chunks, "
+            f"{stored.transferred} new, {pushed.transferred} uploaded, "
+            f"{pushed.transferred_bytes / 1e6:.1f} MB sent)"
+        )
+        self.cacheMng.cache_images([manifest_path(manifest.name)])
+
+    def pull_env(self, image: str, env_tag: Optional[str] = None):
+        """
+        Pull an image from the registry into the chunk store and realize
+        it as a new environment.
+        """
+        store = self.chunk_store()
+        try:
+            registry = self.registryMng.open_registry()
+            try:
+                manifest, pulled = store.pull(
+                    image, registry, self.registryMng.peer_set()
+                )
+            finally:
+                registry.close()
+            with ThreadPoolExecutor(max_workers=store.workers) as pool:
+                config, env_dir = EnvImageImporter().unpack(
+                    cast(IO[bytes], store.open_image(manifest, pool)),
+                    self.image_place(env_tag),
+                )
+            tag = self.add_imported_env(config, env_dir)
+        except FileNotFoundError:
+            Util.print_error_and_die(f"Image '{image}' not found.")
+            return
+        except (OSError, RuntimeError, KeyError, TypeError) as e:
+            Util.print_error_and_die(f"Failed to pull environment: {e}")
+            return
+        Util.print(
+            f"Pulled: {tag} ({pulled.chunks} chunks, "
+            f"{pulled.transferred} fetched, "
+            f"{pulled.from_peers} from peers, "
+            f"{pulled.transferred_bytes / 1e6:.1f} MB received)"
+        )
+        self.cacheMng.cache_images([manifest_path(manifest.name)], [tag])
+
+    def prefetch_envs(self, env_tags: list[str]):
+        """
+        Pull at once the images missing for the environments matching the
+        tags, every environment with --all, the active one otherwise.
+        """
+        if env_tags or self.cli_flags.get("all"):
+            envs = self.select_envs(env_tags)
+        elif envCfg := self.configMng.get_active_environment():
+            envs = [self.envFactory.new_environment_cfg(envCfg)]
+        else:
+            Util.print_error_and_die("No active environment found.")
+            return
+        try:
+            if Util.console.is_terminal:
+                with Util.console.status("Pulling images") as status:
+                    pulled = self.envFactory.pull_images(envs, status.update)
+            else:
+                pulled = self.envFactory.pull_images(envs)
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to prefetch images: {e}")
+            return
+        for image in pulled:
+            Util.print(f"Pulled: {image}")
+        if not pulled:
+            Util.print("Images up to date.")
+
+    def logs_env(self, envCfg: EnvironmentCfg):
+        """Show the output of every service of an environment."""
+        env = self.envFactory.new_environment_cfg(envCfg)
+        try:
+            env.show_logs(follow=self.cli_flags.get("follow", False))
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to get environment logs: {e}")
+
+    def select_envs(self, patterns: list[str]) -> list[Environment]:
+        """
+        Select the environments whose tag matches any of the patterns,
+        every non archived environment when no pattern is given.
+        """
+        selected: list[Environment] = []
+        pooled = self.pool_registry().envs
+        for envCfg in self.configMng.get_environments():
+            if envCfg.tag in pooled:
+                continue
+            if patterns:
+                if not any(fnmatch(envCfg.tag, p) for p in patterns):
+                    continue
+            elif envCfg.archived:
+                continue
+            selected.append(self.envFactory.new_environment_cfg(envCfg))
+        return selected
+
+    def fleet_operation(
+        self, operation: str
+    ) -> Callable[[Environment], Optional[str]]:
+        def up(env: Environment) -> Optional[str]:
+            LazyEnv(env.get_dir()).materialize(
+                env.bind_paths(), self.imgs_workers()
+            )
+            env.start()
+            if self.cli_flags.get("wait"):
+                probes = [
+                    p
+                    for svc in env.get_services()
+                    for p in svc.readiness_probes()
+                ]
+                failed = [r for r in ReadinessGate(probes).run() if not r.ready]
+                if failed:
+                    raise RuntimeError(
+                        "not ready: "
+                        + ", ".join(f"{r.svc_tag} ({r.error})" for r in failed)
+                    )
+            return None
+
+        def halt(env: Environment) -> Optional[str]:
+            env.halt()
+            return None
+
+        def reload(env: Environment) -> Optional[str]:
+            env.reload()
+            return None
+
+        def status(env: Environment) -> Optional[str]:
+            return "\n".join(
+                [f"Environment: {env.envCfg.tag}"]
+                + [self.format_status(s) for s in env.status()]
+            )
+
+        def render(env: Environment) -> Optional[str]:
+            return env.render()
+
+        operations: dict[str, Callable[[Environment], Optional[str]]] = {
+            "up": up,
+            "halt": halt,
+            "reload": reload,
+            "status": status,
+            "render": render,
+        }
+        return operations[operation]
+
+    def print_fleet_summary(self, operation: str, results: list[FleetResult]):
+        if self.cli_flags.get("porcelain"):
+            for r in results:
+                Util.print(
+                    f"{r.env_tag}\t{'ok' if r.ok else 'failed'}\t"
+                    f"{r.duration:.3f}\t{r.error or ''}"
+                )
+            return
+        table = Table(title=f"env {operation}")
+        table.add_column("Environment")
+        table.add_column("Result")
+        table.add_column("Duration", justify="right")
+        table.add_column("Error")
+        for result in results:
+            table.add_row(
+                result.env_tag,
+                "ok" if result.ok else "failed",
+                f"{result.duration:.1f}s",
+                result.error or "",
+            )
+        Util.console.print(table)
+
+    def fleet_env(self, operation: str, patterns: list[str]):
+        """
+        Run an operation on every environment matching the patterns.
+
+        Global and per environment concurrency are bounded by the
+        `fleet_max_parallel` and `fleet_max_parallel_env` values.
+        """
+        envs = self.select_envs(patterns)
+        if not envs:
+            Util.print_error_and_die("No environments matching.")
+        scheduler = FleetScheduler(
+            int(self.configMng.values.get("fleet_max_parallel") or 8),
+            int(self.configMng.values.get("fleet_max_parallel_env") or 4),
+        )
+        results = scheduler.run(envs, self.fleet_operation(operation))
+        for result in results:
+            if result.output is not None:
+                Util.print(result.output)
+        if operation in ("up", "halt", "reload") or not all(
+            r.ok for r in results
+        ):
+            self.print_fleet_summary(operation, results)
+        failed = [r for r in results if not r.ok]
+        if failed:
+            Util.print_error_and_die(
+                f"{len(failed)} of {len(results)} environments failed."
+            )
 
     def render_env(self, env_tag: str) -> Optional[str]:
         """Render an environment configuration."""
@@ -331,9 +1266,32 @@ class EnvironmentMng:
             return env.render()
         return None
 
+    def format_status(self, status: ServiceStatus) -> str:
+        health = f" ({status.health})" if status.health else ""
+        return (
+            f" - {status.svc_tag} ({status.container_name}): "
+            f"{status.state}{health}"
+        )
+
+    def print_status(self, status: ServiceStatus):
+        Util.print(self.format_status(status))
+
     def status_env(self, envCfg: EnvironmentCfg):
         """Get environment status."""
-        pass
+        env = self.envFactory.new_environment_cfg(envCfg)
+        Util.print(f"Environment: {envCfg.tag}")
+        for status in env.status():
+            self.print_status(status)
+
+        if self.cli_flags.get("follow"):
+            unsubscribe = env.watch_status(self.print_status)
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                unsubscribe()
 
     def add_service(
         self,
@@ -0,0 +1,109 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Callable, Generator, Optional
+
+if TYPE_CHECKING:
+    from .environment import Environment
+
+
+@dataclass
+class FleetResult:
+    """
+    Outcome of an operation on one environment of a fleet.
+    """
+
+    env_tag: str
+    ok: bool
+    duration: float
+    error: Optional[str] = None
+    output: Optional[str] = None
+
+
+class FleetScheduler:
+    """
+    Run an operation on many environments at once.
+
+    Environments are processed in parallel, while the engine operations
+    they issue are bounded both globally and per environment: every such
+    operation holds a slot of its environment and a global slot.
+    """
+
+    def __init__(self, max_parallel: int, max_parallel_env: int):
+        self.max_parallel = max(1, max_parallel)
+        self.max_parallel_env = max(1, max_parallel_env)
+        self.global_slots = threading.BoundedSemaphore(self.max_parallel)
+        self.env_slots: dict[str, threading.BoundedSemaphore] = {}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def slot(self, env_tag: str) -> Generator[None]:
+        """Hold a slot for an operation of the environment."""
+        with self.lock:
+            env_slots = self.env_slots.setdefault(
+                env_tag, threading.BoundedSemaphore(self.max_parallel_env)
+            )
+        with env_slots, self.global_slots:
+            yield
+
+    def run_one(
+        self,
+        env: Environment,
+        operation: Callable[[Environment], Optional[str]],
+    ) -> FleetResult:
+        started = time.monotonic()
+        try:
+            output = operation(env)
+            return FleetResult(
+                env.envCfg.tag, True, time.monotonic() - started, None, output
+            )
+        except Exception as e:
+            return FleetResult(
+                env.envCfg.tag, False, time.monotonic() - started, str(e)
+            )
+        except SystemExit:
+            return FleetResult(
+                env.envCfg.tag,
+                False,
+                time.monotonic() - started,
+                "aborted",
+            )
+
+    def run(
+        self,
+        envs: list[Environment],
+        operation: Callable[[Environment], Optional[str]],
+    ) -> list[FleetResult]:
+        """
+        Apply the operation to every environment.
+
+        :return: The results, in the environments order.
+        """
+        if not envs:
+            return []
+        for env in envs:
+            env.scheduler = self
+        workers = min(len(envs), self.max_parallel)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(self.run_one, envs, [operation] * len(envs)))
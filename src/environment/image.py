@@ -0,0 +1,519 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import io
+import json
+import os
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from typing import IO, TYPE_CHECKING, Any, Callable, Optional, cast
+from urllib.parse import urlparse
+from urllib.request import urlopen
+
+if TYPE_CHECKING:
+    from _typeshed import SupportsRead
+
+from .integrity import (
+    INTEGRITY_FILE,
+    INTEGRITY_SUFFIX,
+    HashingReader,
+    HashPool,
+    IntegrityBuilder,
+    IntegrityManifest,
+    IntegrityRecord,
+    VerifyingReader,
+)
+
+# Image formats, by name, with their file suffix: compressed tar streams
+# and seekable images.
+PACK_FORMATS = {"zstd": ".tar.zst", "gzip": ".tar.gz", "seekable": ".simg"}
+TAR_FORMATS = ("zstd", "gzip")
+DEFAULT_LEVELS = {"zstd": 3, "gzip": 6}
+# Members of an environment image: its configuration and its directory.
+IMAGE_CONFIG = "env.json"
+IMAGE_DATA = "data"
+COPY_SIZE = 1 << 20
+CHECKSUM_SUFFIX = ".sha256"
+
+
+class EnvTarFile(tarfile.TarFile):
+    """
+    Tar writer handing the environment files it adds to an integrity
+    builder.
+    """
+
+    integrity: Optional[IntegrityBuilder] = None
+    copybufsize: Optional[int]
+
+    def addfile(
+        self,
+        tarinfo: tarfile.TarInfo,
+        fileobj: Optional[SupportsRead[bytes]] = None,
+    ):
+        prefix = f"{IMAGE_DATA}/"
+        if (
+            self.integrity is None
+            or fileobj is None
+            or not tarinfo.isreg()
+            or not tarinfo.name.startswith(prefix)
+        ):
+            super().addfile(tarinfo, fileobj)
+            return
+        st = os.fstat(cast(IO[bytes], fileobj).fileno())
+        stream = self.integrity.file(tarinfo.name[len(prefix) :], st)
+        super().addfile(
+            tarinfo,
+            cast(IO[bytes], HashingReader(cast(IO[bytes], fileobj), stream)),
+        )
+        stream.finish()
+
+
+def write_env_tar(
+    out: io.RawIOBase,
+    env_dir: str,
+    config: dict[str, Any],
+    integrity: Optional[IntegrityBuilder] = None,
+):
+    """
+    Write the tar stream of an environment image: the configuration
+    first, then the environment directory, without its integrity record.
+    """
+    record = f"{IMAGE_DATA}/{INTEGRITY_FILE}"
+    with EnvTarFile.open(
+        fileobj=cast(IO[bytes], out), mode="w|", bufsize=COPY_SIZE
+    ) as tar:
+        tar.integrity = integrity
+        tar.copybufsize = COPY_SIZE
+        data = json.dumps(config, indent=2).encode()
+        info = tarfile.TarInfo(IMAGE_CONFIG)
+        info.size = len(data)
+        info.mtime = int(time.time())
+        tar.addfile(info, io.BytesIO(data))
+        tar.add(
+            env_dir,
+            IMAGE_DATA,
+            filter=lambda info: None if info.name == record else info,
+        )
+
+
+@dataclass
+class PackResult:
+    """
+    Outcome of packing an environment image.
+    """
+
+    path: str
+    raw_bytes: int
+    packed_bytes: int
+    duration: float
+    sha256: str = ""
+    integrity: Optional[IntegrityManifest] = None
+
+    @property
+    def throughput(self) -> float:
+        """Packed data in MB/s."""
+        return self.raw_bytes / 1e6 / max(self.duration, 1e-6)
+
+
+class CountingWriter(io.RawIOBase):
+    """
+    Pass the writes through to `out`, counting the bytes.
+    """
+
+    def __init__(self, out: Callable[[bytes], object]):
+        self.out = out
+        self.count = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data: Any) -> int:
+        self.out(data)
+        size = len(data)
+        self.count += size
+        return size
+
+
+class EnvImagePacker:
+    """
+    Pack environment directories into environment images.
+
+    The tar stream is written straight into the compressor, zstd runs with
+    a worker per core and gzip is kept for the images meant for older
+    consumers. On the way, a pool of hashing workers computes the
+    integrity manifest of the image.
+    """
+
+    def __init__(
+        self,
+        out_dir: str,
+        fmt: str = "zstd",
+        level: Optional[int] = None,
+        threads: int = 0,
+        algorithm: str = "blake2b",
+        hash_workers: int = 4,
+    ):
+        if fmt not in TAR_FORMATS:
+            raise ValueError(f"Unknown image format '{fmt}'")
+        self.out_dir = out_dir
+        self.fmt = fmt
+        self.level = level if level is not None else DEFAULT_LEVELS[fmt]
+        self.threads = threads
+        self.algorithm = algorithm
+        self.hash_workers = hash_workers
+
+    def image_path(self, name: str) -> str:
+        return os.path.join(self.out_dir, f"{name}{PACK_FORMATS[self.fmt]}")
+
+    def open_compressor(
+        self, sink: Callable[[bytes], object]
+    ) -> tuple[Callable[[bytes], object], Callable[[], None]]:
+        """
+        Start a compressor handing its output to `sink`.
+
+        :return: The functions writing to the compressor and closing it.
+        :raises RuntimeError: If the compressor cannot run or fails.
+        """
+        if self.fmt == "gzip":
+            out = gzip.GzipFile(
+                fileobj=CountingWriter(sink),
+                mode="wb",
+                compresslevel=self.level,
+            )
+            return out.write, out.close
+        zstd = shutil.which("zstd")
+        if not zstd:
+            raise RuntimeError("zstd not found, pack with the gzip format")
+        proc = subprocess.Popen(
+            [zstd, "-q", "-c", f"-T{self.threads}", f"-{self.level}"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        assert proc.stdin and proc.stdout
+        errors: list[OSError] = []
+
+        def pump(stdout: IO[bytes]):
+            try:
+                while data := stdout.read(COPY_SIZE):
+                    sink(data)
+            except OSError as e:
+                errors.append(e)
+                proc.kill()
+
+        pumping = threading.Thread(target=pump, args=(proc.stdout,))
+        pumping.start()
+
+        def close():
+            assert proc.stdin
+            try:
+                proc.stdin.close()
+            finally:
+                pumping.join()
+            if errors:
+                raise errors[0]
+            if proc.wait() != 0:
+                raise RuntimeError(f"zstd failed with code {proc.returncode}")
+
+        return proc.stdin.write, close
+
+    def pack(
+        self, env_dir: str, config: dict[str, Any], name: str
+    ) -> PackResult:
+        """
+        Pack an environment directory and its configuration as the image
+        `name`, replacing an existing one only once complete, along with
+        its integrity manifest and SHA-256 checksum. The manifest is also
+        recorded in the environment directory for `env verify`.
+
+        :raises RuntimeError: If packing fails.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = self.image_path(name)
+        part = f"{path}.part"
+        digest = hashlib.sha256()
+        start = time.monotonic()
+        try:
+            with HashPool(self.algorithm, self.hash_workers) as pool:
+                integrity = IntegrityBuilder(pool)
+                with open(part, "wb") as f:
+
+                    def sink(data: bytes):
+                        digest.update(data)
+                        f.write(data)
+
+                    write, close = self.open_compressor(sink)
+
+                    def tee(data: bytes):
+                        integrity.write(bytes(data))
+                        write(data)
+
+                    counter = CountingWriter(tee)
+                    try:
+                        write_env_tar(counter, env_dir, config, integrity)
+                    finally:
+                        close()
+                manifest = integrity.manifest()
+        except (OSError, RuntimeError, tarfile.TarError) as e:
+            if os.path.exists(part):
+                os.remove(part)
+            raise RuntimeError(f"Failed to pack {name}: {e}")
+        os.replace(part, path)
+        with open(f"{path}{INTEGRITY_SUFFIX}", "wb") as out:
+            out.write(manifest.to_json())
+        with open(f"{path}{CHECKSUM_SUFFIX}", "w", encoding="utf-8") as out:
+            out.write(f"{digest.hexdigest()}  {os.path.basename(path)}\n")
+        IntegrityRecord(env_dir).reset(manifest, integrity.stats)
+        return PackResult(
+            path,
+            counter.count,
+            os.path.getsize(path),
+            time.monotonic() - start,
+            digest.hexdigest(),
+            manifest,
+        )
+
+
+@dataclass
+class ImportResult:
+    """
+    Outcome of importing an environment image.
+    """
+
+    config: dict[str, Any]
+    path: str
+    received_bytes: int
+    duration: float
+    sha256: str
+    verified: bool
+    chunks_verified: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Received data in MB/s."""
+        return self.received_bytes / 1e6 / max(self.duration, 1e-6)
+
+
+class EnvImageImporter:
+    """
+    Import environment images from a URL as a single pipeline.
+
+    The image is downloaded, decompressed and extracted concurrently: the
+    download feeds the decompressor as bytes arrive, hashing them on the
+    way, while the tar stream coming out of it is extracted into a staging
+    directory next to the destination. When the image has an integrity
+    manifest, the chunks of the tar stream are checked as they are
+    extracted. The staging directory is renamed into place only once the
+    whole image has been checked.
+    """
+
+    def __init__(self, timeout: float = 60, hash_workers: int = 4):
+        self.timeout = timeout
+        self.hash_workers = hash_workers
+
+    def decompressor(self, url: str) -> list[str]:
+        path = urlparse(url).path
+        if path.endswith(PACK_FORMATS["zstd"]):
+            tool, args = "zstd", ["-dcq"]
+        elif path.endswith(PACK_FORMATS["gzip"]):
+            tool, args = "gzip", ["-dc"]
+        else:
+            raise RuntimeError(f"Unknown image format of '{url}'")
+        command = shutil.which(tool)
+        if not command:
+            raise RuntimeError(f"{tool} not found")
+        return [command] + args
+
+    def fetch_checksum(self, url: str) -> Optional[str]:
+        """Return the published checksum of an image, if any."""
+        try:
+            with urlopen(f"{url}{CHECKSUM_SUFFIX}", timeout=self.timeout) as r:
+                return r.read().decode().split()[0].lower()
+        except (OSError, ValueError, IndexError):
+            return None
+
+    def fetch_integrity(self, url: str) -> Optional[IntegrityManifest]:
+        """Return the integrity manifest of an image, if any."""
+        try:
+            with urlopen(f"{url}{INTEGRITY_SUFFIX}", timeout=self.timeout) as r:
+                return IntegrityManifest.from_json(r.read())
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def import_image(
+        self,
+        url: str,
+        place: Callable[[dict[str, Any]], str],
+        sha256: Optional[str] = None,
+    ) -> ImportResult:
+        """
+        Import the image at `url`.
+
+        :param place: Called with the image environment configuration,
+            returns the directory the environment goes to.
+        :param sha256: The expected checksum, the published one otherwise.
+        :raises RuntimeError: If the import fails, nothing is left behind.
+        """
+        expected = (sha256 or self.fetch_checksum(url) or "").lower()
+        manifest = self.fetch_integrity(url)
+        start = time.monotonic()
+        proc = subprocess.Popen(
+            self.decompressor(url),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        assert proc.stdin and proc.stdout
+        digest = hashlib.sha256()
+        received = [0]
+        errors: list[Exception] = []
+
+        def download(stdin: IO[bytes]):
+            try:
+                with urlopen(url, timeout=self.timeout) as response:
+                    while chunk := response.read(COPY_SIZE):
+                        digest.update(chunk)
+                        received[0] += len(chunk)
+                        stdin.write(chunk)
+            except BrokenPipeError:
+                pass
+            except (OSError, ValueError) as e:
+                errors.append(e)
+            finally:
+                try:
+                    stdin.close()
+                except OSError:
+                    pass
+
+        downloading = threading.Thread(target=download, args=(proc.stdin,))
+        downloading.start()
+
+        pool = HashPool(
+            manifest.algorithm if manifest else "sha256", self.hash_workers
+        )
+        stream: IO[bytes] = proc.stdout
+        verifier: Optional[VerifyingReader] = None
+        if manifest:
+            verifier = VerifyingReader(proc.stdout, manifest, pool)
+            stream = cast(IO[bytes], verifier)
+
+        def check():
+            # the tar end may come before the end of the compressed stream
+            while stream.read(COPY_SIZE):
+                pass
+            downloading.join()
+            if errors:
+                raise RuntimeError(f"download failed: {errors[0]}")
+            if proc.wait() != 0:
+                raise RuntimeError("corrupted image, decompression failed")
+            actual = digest.hexdigest()
+            if expected and actual != expected:
+                raise RuntimeError(
+                    f"checksum mismatch, expected {expected} got {actual}"
+                )
+            if verifier:
+                verifier.verify()
+
+        try:
+            config, dest = self.unpack(stream, place, check)
+            if manifest:
+                IntegrityRecord(dest).reset(manifest)
+            return ImportResult(
+                config,
+                dest,
+                received[0],
+                time.monotonic() - start,
+                digest.hexdigest(),
+                bool(expected),
+                len(manifest.chunks) if manifest else 0,
+            )
+        except (OSError, RuntimeError, tarfile.TarError, ValueError) as e:
+            raise RuntimeError(f"Failed to import {url}: {e}")
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+            proc.stdout.close()
+            downloading.join()
+            proc.wait()
+            pool.close()
+
+    def unpack(
+        self,
+        stream: IO[bytes],
+        place: Callable[[dict[str, Any]], str],
+        check: Callable[[], None] = lambda: None,
+    ) -> tuple[dict[str, Any], str]:
+        """
+        Extract an image tar stream and move the environment into place
+        once `check` accepts it.
+
+        :return: The environment configuration and directory.
+        """
+        staging: list[str] = []
+        try:
+            config, dest = self.extract(stream, place, staging)
+            check()
+            os.rename(os.path.join(staging[0], IMAGE_DATA), dest)
+            return config, dest
+        finally:
+            for path in staging:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def extract(
+        self,
+        stream: IO[bytes],
+        place: Callable[[dict[str, Any]], str],
+        staging: list[str],
+    ) -> tuple[dict[str, Any], str]:
+        """
+        Extract an image tar stream into a staging directory, created next
+        to the destination of the environment and added to `staging`.
+
+        :return: The environment configuration and destination.
+        """
+        config: Optional[dict[str, Any]] = None
+        dest = ""
+        with tarfile.open(fileobj=stream, mode="r|", bufsize=COPY_SIZE) as tar:
+            for member in tar:
+                if config is None:
+                    if member.name != IMAGE_CONFIG:
+                        raise RuntimeError("not an environment image")
+                    data = tar.extractfile(member)
+                    loaded: dict[str, Any] = json.loads(
+                        data.read() if data else b"{}"
+                    )
+                    config, dest = loaded, place(loaded)
+                    staging.append(
+                        tempfile.mkdtemp(
+                            prefix=f".{os.path.basename(dest)}.import-",
+                            dir=os.path.dirname(dest),
+                        )
+                    )
+                    os.makedirs(os.path.join(staging[0], IMAGE_DATA))
+                elif member.name.split("/")[0] == IMAGE_DATA:
+                    tar.extract(member, staging[0], filter="data")
+        if config is None:
+            raise RuntimeError("empty image")
+        return config, dest
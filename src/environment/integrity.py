@@ -0,0 +1,418 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import queue
+import stat
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import IO, Any, Callable, Optional
+
+# Digests of the tar stream of an image, by chunks of CHUNK_SIZE bytes.
+CHUNK_SIZE = 4 << 20
+READ_SIZE = 1 << 20
+# Sidecar of a packed image and record of an environment directory.
+INTEGRITY_SUFFIX = ".integrity.json"
+INTEGRITY_FILE = ".integrity.json"
+
+ALGORITHMS: dict[str, Callable[[], Any]] = {
+    "blake2b": lambda: hashlib.blake2b(digest_size=32),
+    "sha256": hashlib.sha256,
+}
+
+
+def new_hasher(algorithm: str) -> Any:
+    try:
+        return ALGORITHMS[algorithm]()
+    except KeyError:
+        raise ValueError(f"Unknown digest algorithm '{algorithm}'")
+
+
+class HashStream:
+    """
+    A digest computed by a lane of a hash pool, fed in order.
+    """
+
+    def __init__(self, lane: queue.Queue[Any], hasher: Any):
+        self.lane = lane
+        self.hasher = hasher
+        self.future: Future[str] = Future()
+
+    def update(self, data: bytes):
+        self.lane.put((self, data))
+
+    def finish(self) -> Future[str]:
+        self.lane.put((self, None))
+        return self.future
+
+
+class HashPool:
+    """
+    Hashing workers, each one serving a lane of digests.
+
+    The blocks of a digest all go through the lane it was assigned, in
+    order, while digests on different lanes are computed in parallel:
+    hashlib releases the GIL on large buffers. Lanes are bounded, so a
+    producer faster than the workers waits for them.
+    """
+
+    def __init__(self, algorithm: str = "blake2b", workers: int = 4):
+        new_hasher(algorithm)
+        self.algorithm = algorithm
+        self.lanes: list[queue.Queue[Any]] = [
+            queue.Queue(maxsize=16) for _ in range(max(1, workers))
+        ]
+        self.next = 0
+        self.threads = [
+            threading.Thread(target=self.work, args=(lane,), daemon=True)
+            for lane in self.lanes
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def __enter__(self) -> HashPool:
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    def work(self, lane: queue.Queue[Any]):
+        while (item := lane.get()) is not None:
+            stream, data = item
+            if data is None:
+                stream.future.set_result(stream.hasher.hexdigest())
+            else:
+                stream.hasher.update(data)
+
+    def stream(self) -> HashStream:
+        lane = self.lanes[self.next % len(self.lanes)]
+        self.next += 1
+        return HashStream(lane, new_hasher(self.algorithm))
+
+    def digest(self, data: bytes) -> Future[str]:
+        stream = self.stream()
+        stream.update(data)
+        return stream.finish()
+
+    def close(self):
+        for lane in self.lanes:
+            lane.put(None)
+        for thread in self.threads:
+            thread.join()
+
+
+@dataclass
+class IntegrityManifest:
+    """
+    Digests of an environment image: of its tar stream by chunks and of
+    each file of its environment, by path relative to the environment.
+    """
+
+    algorithm: str
+    chunk_size: int
+    chunks: list[str] = field(default_factory=list[str])
+    files: dict[str, tuple[int, str]] = field(
+        default_factory=dict[str, tuple[int, str]]
+    )
+
+    def to_json(self) -> bytes:
+        return json.dumps(
+            {
+                "algorithm": self.algorithm,
+                "chunk_size": self.chunk_size,
+                "chunks": self.chunks,
+                "files": {p: list(f) for p, f in sorted(self.files.items())},
+            },
+            indent=2,
+        ).encode()
+
+    @staticmethod
+    def from_json(data: bytes) -> IntegrityManifest:
+        item: dict[str, Any] = json.loads(data)
+        new_hasher(item["algorithm"])
+        return IntegrityManifest(
+            algorithm=item["algorithm"],
+            chunk_size=int(item["chunk_size"]),
+            chunks=list(item["chunks"]),
+            files={p: (int(s), d) for p, (s, d) in item["files"].items()},
+        )
+
+
+class ChunkDigests:
+    """
+    Cut a stream in chunks and hash them on a pool.
+    """
+
+    def __init__(self, pool: HashPool, chunk_size: int = CHUNK_SIZE):
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.buffer = bytearray()
+        self.digests: list[Future[str]] = []
+
+    def write(self, data: bytes):
+        self.buffer += data
+        while len(self.buffer) >= self.chunk_size:
+            self.submit(bytes(self.buffer[: self.chunk_size]))
+            del self.buffer[: self.chunk_size]
+
+    def submit(self, chunk: bytes):
+        self.digests.append(self.pool.digest(chunk))
+
+    def finish(self) -> list[str]:
+        if self.buffer:
+            self.submit(bytes(self.buffer))
+            self.buffer.clear()
+        return [digest.result() for digest in self.digests]
+
+
+class IntegrityBuilder:
+    """
+    Collect the integrity manifest of an image while its tar stream is
+    written: the stream goes through `write`, the environment files
+    through the streams of `file`.
+    """
+
+    def __init__(self, pool: HashPool, chunk_size: int = CHUNK_SIZE):
+        self.pool = pool
+        self.chunks = ChunkDigests(pool, chunk_size)
+        self.files: dict[str, tuple[int, Future[str]]] = {}
+        self.stats: dict[str, tuple[int, int]] = {}
+
+    def write(self, data: bytes):
+        self.chunks.write(data)
+
+    def file(self, path: str, st: os.stat_result) -> HashStream:
+        stream = self.pool.stream()
+        self.files[path] = (st.st_size, stream.future)
+        self.stats[path] = (st.st_size, st.st_mtime_ns)
+        return stream
+
+    def manifest(self) -> IntegrityManifest:
+        return IntegrityManifest(
+            self.pool.algorithm,
+            self.chunks.chunk_size,
+            self.chunks.finish(),
+            {p: (size, d.result()) for p, (size, d) in self.files.items()},
+        )
+
+
+class HashingReader:
+    """
+    Read a file, feeding what is read to a digest.
+    """
+
+    def __init__(self, f: IO[bytes], stream: HashStream):
+        self.f = f
+        self.stream = stream
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        if data:
+            self.stream.update(data)
+        return data
+
+
+class VerifyingReader:
+    """
+    Read a tar stream checking its chunks against a manifest as they go
+    by, the digests being computed on a pool.
+
+    :raises RuntimeError: From a read once a corrupted chunk is found,
+        from `verify` for the remaining ones.
+    """
+
+    def __init__(
+        self, f: IO[bytes], manifest: IntegrityManifest, pool: HashPool
+    ):
+        self.f = f
+        self.manifest = manifest
+        self.chunks = ChunkDigests(pool, manifest.chunk_size)
+        self.checked = 0
+
+    def read(self, size: int = -1) -> bytes:
+        data = self.f.read(size)
+        self.chunks.write(data)
+        self.check(wait=False)
+        return data
+
+    def check(self, wait: bool):
+        digests = self.chunks.digests
+        while self.checked < len(digests):
+            digest = digests[self.checked]
+            if not wait and not digest.done():
+                return
+            index = self.checked
+            expected = self.manifest.chunks[index : index + 1]
+            if expected != [digest.result()]:
+                raise RuntimeError(f"corrupted image, chunk {index} mismatch")
+            self.checked += 1
+
+    def verify(self):
+        """Check the whole stream was read and matches the manifest."""
+        self.chunks.finish()
+        self.check(wait=True)
+        if self.checked != len(self.manifest.chunks):
+            raise RuntimeError("corrupted image, truncated stream")
+
+
+def walk_files(env_dir: str) -> dict[str, os.stat_result]:
+    """Return the regular files of an environment by relative path."""
+    files: dict[str, os.stat_result] = {}
+    for root, dirs, names in os.walk(env_dir):
+        dirs.sort()
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, env_dir)
+            if rel == INTEGRITY_FILE:
+                continue
+            st = os.lstat(path)
+            if stat.S_ISREG(st.st_mode):
+                files[rel] = st
+    return files
+
+
+def hash_file(path: str, algorithm: str) -> str:
+    hasher = new_hasher(algorithm)
+    with open(path, "rb") as f:
+        while data := f.read(READ_SIZE):
+            hasher.update(data)
+    return hasher.hexdigest()
+
+
+@dataclass
+class VerifyResult:
+    files: int = 0
+    hashed: int = 0
+    skipped: int = 0
+    modified: list[str] = field(default_factory=list[str])
+    missing: list[str] = field(default_factory=list[str])
+    added: list[str] = field(default_factory=list[str])
+
+    @property
+    def ok(self) -> bool:
+        return not (self.modified or self.missing or self.added)
+
+
+class IntegrityRecord:
+    """
+    The file digests of the image an environment directory comes from,
+    with the size and mtime of each file when last found intact: files
+    unchanged since are not hashed again.
+    """
+
+    def __init__(self, env_dir: str):
+        self.env_dir = env_dir
+        self.path = os.path.join(env_dir, INTEGRITY_FILE)
+        self.algorithm = ""
+        self.files: dict[str, tuple[int, str]] = {}
+        self.intact: dict[str, tuple[int, int]] = {}
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data: dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.algorithm = data["algorithm"]
+        self.files = {p: (int(s), d) for p, (s, d) in data["files"].items()}
+        self.intact = {
+            p: (int(s), int(m)) for p, (s, m) in data["intact"].items()
+        }
+        return True
+
+    def store(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "algorithm": self.algorithm,
+                    "files": {
+                        p: list(v) for p, v in sorted(self.files.items())
+                    },
+                    "intact": {
+                        p: list(v) for p, v in sorted(self.intact.items())
+                    },
+                },
+                f,
+            )
+        os.replace(tmp, self.path)
+
+    def reset(
+        self,
+        manifest: IntegrityManifest,
+        stats: Optional[dict[str, tuple[int, int]]] = None,
+    ):
+        """
+        Record the manifest of the image of the environment, its files
+        being intact as they are now unless `stats` tells when they were.
+        """
+        self.algorithm = manifest.algorithm
+        self.files = dict(manifest.files)
+        if stats is None:
+            stats = {
+                p: (st.st_size, st.st_mtime_ns)
+                for p, st in walk_files(self.env_dir).items()
+            }
+        self.intact = {p: s for p, s in stats.items() if p in self.files}
+        self.store()
+
+    def verify(self, workers: int = 4, full: bool = False) -> VerifyResult:
+        """
+        Hash in parallel the files changed since last found intact, every
+        file with `full`, and compare them with the image ones.
+        """
+        result = VerifyResult(files=len(self.files))
+        current = walk_files(self.env_dir)
+        result.added = sorted(set(current) - set(self.files))
+        result.missing = sorted(set(self.files) - set(current))
+        to_hash: list[str] = []
+        for path, (size, _) in sorted(self.files.items()):
+            st = current.get(path)
+            if st is None:
+                continue
+            now = (st.st_size, st.st_mtime_ns)
+            if st.st_size != size:
+                result.modified.append(path)
+                self.intact.pop(path, None)
+            elif not full and self.intact.get(path) == now:
+                result.skipped += 1
+            else:
+                to_hash.append(path)
+
+        def check(path: str) -> tuple[str, bool]:
+            digest = hash_file(os.path.join(self.env_dir, path), self.algorithm)
+            return path, digest == self.files[path][1]
+
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            for path, intact in pool.map(check, to_hash):
+                result.hashed += 1
+                if intact:
+                    st = current[path]
+                    self.intact[path] = (st.st_size, st.st_mtime_ns)
+                else:
+                    result.modified.append(path)
+                    self.intact.pop(path, None)
+        for path in result.missing:
+            self.intact.pop(path, None)
+        result.modified.sort()
+        self.store()
+        return result
@@ -0,0 +1,158 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import logging
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Any, Generator, Optional, cast
+from urllib.error import HTTPError
+from urllib.parse import urlsplit
+from urllib.request import urlopen
+
+if TYPE_CHECKING:
+    from .chunks import ChunkStore
+
+PEER_PORT = 7470
+TIMEOUT = 2.0
+CHUNK_URL = re.compile(r"/chunks/([0-9a-f]{64})")
+
+
+def peer_address(peer: str) -> str:
+    """Return `host:port` for a peer given as host or host:port."""
+    netloc = urlsplit(f"//{peer.strip()}").netloc
+    if urlsplit(f"//{netloc}").port:
+        return netloc
+    return f"{netloc}:{PEER_PORT}"
+
+
+class ChunkRequestHandler(BaseHTTPRequestHandler):
+    """Answer `GET /chunks/<digest>` with the chunk blob, as stored."""
+
+    def do_GET(self):
+        self.serve_chunk(body=True)
+
+    def do_HEAD(self):
+        self.serve_chunk(body=False)
+
+    def serve_chunk(self, body: bool):
+        match = CHUNK_URL.fullmatch(self.path)
+        if not match:
+            self.send_error(404)
+            return
+        server = cast(ChunkServer, self.server)
+        try:
+            blob = server.store.read_blob(match.group(1))
+        except FileNotFoundError:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(blob)))
+        self.end_headers()
+        if body:
+            self.wfile.write(blob)
+        server.served += 1
+
+    def log_message(self, format: str, *args: Any):
+        logging.debug("peer %s: %s", self.address_string(), format % args)
+
+
+class ChunkServer(ThreadingHTTPServer):
+    """
+    Serve the chunks of a local chunk store to the other peers.
+
+    Chunks are served as stored, compressed: the peers check them against
+    the digests of the manifests they pull, so nothing served is trusted.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, store: ChunkStore, host: str = "", port: int = 0):
+        super().__init__((host, port), ChunkRequestHandler)
+        self.store = store
+        self.served = 0
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def port(self) -> int:
+        return self.server_address[1]
+
+    def start(self) -> ChunkServer:
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class PeerSet:
+    """
+    The peers of a static list, asked for chunks before the registry.
+
+    Every chunk is asked first to a different peer, spreading the load,
+    then to the others in turn. A peer that cannot be reached is not asked
+    again.
+    """
+
+    def __init__(self, peers: list[str], timeout: float = TIMEOUT):
+        self.peers = [peer_address(p) for p in peers if p.strip()]
+        self.timeout = timeout
+        self.down: set[str] = set()
+        self.lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.peers)
+
+    def order(self, digest: str) -> list[str]:
+        start = int(digest[:8], 16) % len(self.peers)
+        return self.peers[start:] + self.peers[:start]
+
+    def fetch(self, peer: str, digest: str) -> Optional[bytes]:
+        """
+        :return: The chunk blob, None when the peer does not have it.
+        :raises OSError: If the peer cannot be reached.
+        """
+        try:
+            with urlopen(
+                f"http://{peer}/chunks/{digest}", timeout=self.timeout
+            ) as response:
+                return response.read()
+        except HTTPError as e:
+            if e.code == 404:
+                return None
+            raise
+
+    def blobs(self, digest: str) -> Generator[bytes]:
+        """Yield the blob of a chunk from every peer having it, in turn."""
+        for peer in self.order(digest):
+            with self.lock:
+                if peer in self.down:
+                    continue
+            try:
+                blob = self.fetch(peer, digest)
+            except OSError as e:
+                logging.debug("peer %s unreachable: %s", peer, e)
+                with self.lock:
+                    self.down.add(peer)
+                continue
+            if blob is not None:
+                yield blob
@@ -0,0 +1,80 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+from util.jsonfile import LockedJsonFile
+
+
+@dataclass
+class PooledEnv:
+    """
+    An environment realized in advance, waiting to be claimed by an
+    `env init` of its template.
+    """
+
+    env_tag: str
+    template: str
+    since: float
+    ready: bool = True
+
+
+class PoolRegistry(LockedJsonFile):
+    """
+    Persistent record of the pooled environments.
+
+    The pool is filled by a background process while claims happen in the
+    foreground: both hold the registry lock while they change the registry
+    or the environments configuration.
+    """
+
+    def __init__(self, path: str):
+        self.envs: dict[str, PooledEnv] = {}
+        super().__init__(path)
+
+    def decode(self, data: dict[str, Any]):
+        self.envs = {e["env_tag"]: PooledEnv(**e) for e in data.get("envs", [])}
+
+    def encode(self) -> dict[str, Any]:
+        return {"envs": [asdict(e) for e in self.envs.values()]}
+
+    def add(self, pooled: PooledEnv):
+        self.envs[pooled.env_tag] = pooled
+        self.store()
+
+    def remove(self, env_tag: str) -> Optional[PooledEnv]:
+        pooled = self.envs.pop(env_tag, None)
+        if pooled:
+            self.store()
+        return pooled
+
+    def pooled(self, template: str) -> list[PooledEnv]:
+        """Return the environments pooled for a template, oldest first."""
+        return sorted(
+            (e for e in self.envs.values() if e.template == template),
+            key=lambda e: e.since,
+        )
+
+    def claim(self, template: str) -> Optional[PooledEnv]:
+        """Take the oldest ready environment pooled for a template."""
+        for pooled in self.pooled(template):
+            if pooled.ready:
+                return self.remove(pooled.env_tag)
+        return None
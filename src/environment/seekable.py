@@ -0,0 +1,597 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import stat
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Generator, Iterator, Optional
+
+from .image import PACK_FORMATS
+from .integrity import (
+    INTEGRITY_FILE,
+    HashPool,
+    IntegrityManifest,
+    IntegrityRecord,
+)
+
+SEEKABLE_FORMAT = "seekable"
+SEEKABLE_SUFFIX = PACK_FORMATS[SEEKABLE_FORMAT]
+MAGIC = b"SHPDSIMG1\n"
+# Trailer: offset and length of the compressed table of contents.
+TRAILER = struct.Struct("<QQ8s")
+TRAILER_MAGIC = b"SHPDTOC1"
+FRAME_SIZE = 4 << 20
+DEFAULT_LEVEL = 6
+FRAMES_AHEAD = 8
+# State of an environment imported lazily.
+LAZY_FILE = ".lazy.json"
+
+
+def frame_digest(data: bytes) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+@dataclass
+class TocEntry:
+    """
+    A member of a seekable image: a directory, a symlink or a file with
+    its compressed frames (offset, compressed size, size, digest).
+    """
+
+    path: str
+    type: str
+    mode: int
+    mtime: float
+    size: int = 0
+    target: str = ""
+    digest: str = ""
+    frames: list[tuple[int, int, int, str]] = field(
+        default_factory=list[tuple[int, int, int, str]]
+    )
+
+
+def inside(path: str) -> bool:
+    """Whether a relative path stays inside the directory it is under."""
+    norm = os.path.normpath(path)
+    return not (os.path.isabs(path) or norm == ".." or norm.startswith("../"))
+
+
+def check_entry(entry: TocEntry):
+    """
+    Reject an entry leaving the tree it is extracted to: an absolute
+    path, a `..` component or a symlink pointing outside the tree.
+
+    :raises ValueError: If the entry is not safe.
+    """
+    if entry.type not in ("dir", "symlink", "file"):
+        raise ValueError(f"unknown entry type '{entry.type}'")
+    parts = entry.path.split("/")
+    if not entry.path or os.path.isabs(entry.path) or ".." in parts:
+        raise ValueError(f"unsafe path '{entry.path}'")
+    if entry.type == "symlink" and not inside(
+        os.path.join(os.path.dirname(entry.path), entry.target)
+    ):
+        raise ValueError(
+            f"symlink '{entry.path}' points outside the image: "
+            f"'{entry.target}'"
+        )
+
+
+def safe_target(dest_dir: str, path: str) -> str:
+    """
+    Return where an entry is extracted under `dest_dir`, refusing to go
+    through a symlinked parent directory.
+
+    :raises RuntimeError: If a parent of the entry is a symlink.
+    """
+    parent = dest_dir
+    for part in path.split("/")[:-1]:
+        parent = os.path.join(parent, part)
+        if os.path.islink(parent):
+            raise RuntimeError(f"'{path}' is under the symlink '{parent}'")
+    return os.path.join(dest_dir, path)
+
+
+@dataclass
+class Toc:
+    """The table of contents of a seekable image."""
+
+    config: dict[str, Any]
+    algorithm: str
+    entries: list[TocEntry] = field(default_factory=list[TocEntry])
+
+    def to_json(self) -> bytes:
+        return json.dumps(asdict(self)).encode()
+
+    @staticmethod
+    def from_json(data: bytes) -> Toc:
+        """:raises ValueError: If an entry would land outside the tree."""
+        item: dict[str, Any] = json.loads(data)
+        toc = Toc(
+            config=item["config"],
+            algorithm=item["algorithm"],
+            entries=[
+                TocEntry(
+                    **{k: v for k, v in e.items() if k != "frames"},
+                    frames=[
+                        (offset, csize, size, digest)
+                        for offset, csize, size, digest in e["frames"]
+                    ],
+                )
+                for e in item["entries"]
+            ],
+        )
+        for entry in toc.entries:
+            check_entry(entry)
+        return toc
+
+    def files(self) -> list[TocEntry]:
+        return [e for e in self.entries if e.type == "file"]
+
+    def integrity(self) -> IntegrityManifest:
+        return IntegrityManifest(
+            self.algorithm,
+            FRAME_SIZE,
+            files={e.path: (e.size, e.digest) for e in self.files()},
+        )
+
+
+@dataclass
+class SeekablePackResult:
+    path: str
+    raw_bytes: int
+    packed_bytes: int
+    duration: float
+    files: int
+
+    @property
+    def throughput(self) -> float:
+        """Packed data in MB/s."""
+        return self.raw_bytes / 1e6 / max(self.duration, 1e-6)
+
+
+class SeekableImagePacker:
+    """
+    Pack environment directories into seekable images.
+
+    Each file is cut in frames compressed independently, by a pool of
+    workers, and the table of contents at the end of the image locates
+    the frames of every file: a file can be extracted without reading
+    the rest of the image.
+    """
+
+    def __init__(
+        self,
+        out_dir: str,
+        level: Optional[int] = None,
+        workers: int = 4,
+        algorithm: str = "blake2b",
+        frame_size: int = FRAME_SIZE,
+    ):
+        self.out_dir = out_dir
+        self.level = level if level is not None else DEFAULT_LEVEL
+        self.workers = max(1, workers)
+        self.algorithm = algorithm
+        self.frame_size = frame_size
+
+    def image_path(self, name: str) -> str:
+        return os.path.join(self.out_dir, f"{name}{SEEKABLE_SUFFIX}")
+
+    def compress(self, data: bytes) -> tuple[bytes, str]:
+        return zlib.compress(data, self.level), frame_digest(data)
+
+    def pack(
+        self, env_dir: str, config: dict[str, Any], name: str
+    ) -> SeekablePackResult:
+        """
+        Pack an environment directory and its configuration as the image
+        `name`, replacing an existing one only once complete, and record
+        its file digests in the environment directory for `env verify`.
+
+        :raises RuntimeError: If packing fails.
+        """
+        os.makedirs(self.out_dir, exist_ok=True)
+        path = self.image_path(name)
+        part = f"{path}.part"
+        start = time.monotonic()
+        toc = Toc(config, self.algorithm)
+        raw = 0
+        stats: dict[str, tuple[int, int]] = {}
+        try:
+            with (
+                open(part, "wb") as out,
+                HashPool(self.algorithm, self.workers) as hashes,
+                ThreadPoolExecutor(max_workers=self.workers) as pool,
+            ):
+                out.write(MAGIC)
+                pending: deque[tuple[TocEntry, int, Future[tuple[bytes, str]]]]
+                pending = deque()
+
+                def drain(keep: int):
+                    while len(pending) > keep:
+                        entry, size, compressing = pending.popleft()
+                        data, digest = compressing.result()
+                        entry.frames.append(
+                            (out.tell(), len(data), size, digest)
+                        )
+                        out.write(data)
+
+                digests: list[tuple[TocEntry, Future[str]]] = []
+                for rel, full, st in walk_entries(env_dir):
+                    entry = TocEntry(
+                        rel, "dir", stat.S_IMODE(st.st_mode), st.st_mtime
+                    )
+                    toc.entries.append(entry)
+                    if stat.S_ISLNK(st.st_mode):
+                        entry.type, entry.target = "symlink", os.readlink(full)
+                    elif stat.S_ISREG(st.st_mode):
+                        entry.type = "file"
+                        stats[rel] = (st.st_size, st.st_mtime_ns)
+                        stream = hashes.stream()
+                        with open(full, "rb") as f:
+                            while data := f.read(self.frame_size):
+                                stream.update(data)
+                                entry.size += len(data)
+                                pending.append(
+                                    (
+                                        entry,
+                                        len(data),
+                                        pool.submit(self.compress, data),
+                                    )
+                                )
+                                drain(FRAMES_AHEAD)
+                        digests.append((entry, stream.finish()))
+                        raw += entry.size
+                drain(0)
+                for entry, digest in digests:
+                    entry.digest = digest.result()
+                data = zlib.compress(toc.to_json(), self.level)
+                offset = out.tell()
+                out.write(data)
+                out.write(TRAILER.pack(offset, len(data), TRAILER_MAGIC))
+        except OSError as e:
+            if os.path.exists(part):
+                os.remove(part)
+            raise RuntimeError(f"Failed to pack {name}: {e}")
+        os.replace(part, path)
+        IntegrityRecord(env_dir).reset(toc.integrity(), stats)
+        return SeekablePackResult(
+            path,
+            raw,
+            os.path.getsize(path),
+            time.monotonic() - start,
+            len(stats),
+        )
+
+
+def walk_entries(env_dir: str) -> Iterator[tuple[str, str, os.stat_result]]:
+    """
+    Walk an environment directory, directories before their content,
+    leaving out the shepherd records.
+    """
+    for root, dirs, names in os.walk(env_dir):
+        dirs.sort()
+        rel_root = os.path.relpath(root, env_dir)
+        for name in sorted(dirs + names):
+            full = os.path.join(root, name)
+            rel = name if rel_root == "." else f"{rel_root}/{name}"
+            if rel in (INTEGRITY_FILE, LAZY_FILE):
+                continue
+            yield rel, full, os.lstat(full)
+
+
+class SeekableImage:
+    """
+    A seekable image opened for random access.
+
+    :raises RuntimeError: If the file is not a seekable image.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = os.open(path, os.O_RDONLY)
+        try:
+            self.toc = self.read_toc()
+        except BaseException:
+            os.close(self.fd)
+            raise
+
+    def __enter__(self) -> SeekableImage:
+        return self
+
+    def __exit__(self, *args: Any):
+        self.close()
+
+    def close(self):
+        os.close(self.fd)
+
+    def read_toc(self) -> Toc:
+        size = os.fstat(self.fd).st_size
+        if size < len(MAGIC) + TRAILER.size or (
+            os.pread(self.fd, len(MAGIC), 0) != MAGIC
+        ):
+            raise RuntimeError(f"'{self.path}' is not a seekable image")
+        offset, length, magic = TRAILER.unpack(
+            os.pread(self.fd, TRAILER.size, size - TRAILER.size)
+        )
+        if magic != TRAILER_MAGIC or offset + length > size:
+            raise RuntimeError(f"'{self.path}' is truncated")
+        try:
+            return Toc.from_json(
+                zlib.decompress(os.pread(self.fd, length, offset))
+            )
+        except (zlib.error, ValueError, KeyError, TypeError) as e:
+            raise RuntimeError(f"corrupted table of contents: {e}")
+
+    @property
+    def config(self) -> dict[str, Any]:
+        return self.toc.config
+
+    def read_frames(self, entry: TocEntry) -> Iterator[bytes]:
+        """
+        Read the content of a file, checking its frames.
+
+        :raises RuntimeError: If a frame is corrupted.
+        """
+        for offset, csize, size, digest in entry.frames:
+            try:
+                data = zlib.decompress(os.pread(self.fd, csize, offset))
+            except zlib.error as e:
+                raise RuntimeError(f"corrupted frame of {entry.path}: {e}")
+            if len(data) != size or frame_digest(data) != digest:
+                raise RuntimeError(f"corrupted frame of {entry.path}")
+            yield data
+
+    def extract(self, entry: TocEntry, dest_dir: str) -> int:
+        """
+        Extract a file under `dest_dir`, atomically, leaving an existing
+        one alone.
+
+        :return: The bytes extracted.
+        """
+        target = safe_target(dest_dir, entry.path)
+        if os.path.lexists(target):
+            return 0
+        fd, tmp = tempfile.mkstemp(
+            prefix=f".{os.path.basename(target)}.", dir=os.path.dirname(target)
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                for data in self.read_frames(entry):
+                    f.write(data)
+            os.chmod(tmp, entry.mode)
+            os.utime(tmp, (entry.mtime, entry.mtime))
+            os.rename(tmp, target)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return entry.size
+
+    def skeleton(self, dest_dir: str):
+        """
+        Create the directories and symlinks of the image under
+        `dest_dir`, and its empty files.
+        """
+        os.makedirs(dest_dir, exist_ok=True)
+        for entry in self.toc.entries:
+            target = safe_target(dest_dir, entry.path)
+            if entry.type == "dir":
+                os.makedirs(target, exist_ok=True)
+            elif entry.type == "symlink":
+                os.symlink(entry.target, target)
+            elif entry.type == "file" and not entry.frames:
+                open(target, "wb").close()
+                os.chmod(target, entry.mode)
+        # files may still be materialized in the directories
+        for entry in reversed(self.toc.entries):
+            if entry.type == "dir":
+                target = os.path.join(dest_dir, entry.path)
+                os.chmod(target, entry.mode | stat.S_IRWXU)
+                os.utime(target, (entry.mtime, entry.mtime))
+
+    def extract_all(
+        self,
+        entries: list[TocEntry],
+        dest_dir: str,
+        workers: int = 4,
+    ) -> int:
+        """Extract files in parallel, return the bytes extracted."""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return sum(
+                pool.map(self.extract, entries, [dest_dir] * len(entries))
+            )
+
+
+def under(path: str, prefixes: list[str]) -> bool:
+    return any(
+        p in (".", "") or path == p or path.startswith(f"{p}/")
+        for p in prefixes
+    )
+
+
+@dataclass
+class MaterializeResult:
+    files: int = 0
+    bytes: int = 0
+    duration: float = 0.0
+    pending: int = 0
+
+
+class LazyEnv:
+    """
+    An environment directory imported lazily from a seekable image: its
+    directories exist, its files are extracted from the image on demand.
+    """
+
+    def __init__(self, env_dir: str):
+        self.env_dir = env_dir
+        self.path = os.path.join(env_dir, LAZY_FILE)
+        self.image = ""
+        self.materialized: list[str] = []
+
+    @staticmethod
+    def create(env_dir: str, image: str):
+        lazy = LazyEnv(env_dir)
+        lazy.image = os.path.abspath(image)
+        lazy.store()
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data: dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            return False
+        self.image = data["image"]
+        self.materialized = list(data.get("materialized", []))
+        return True
+
+    def store(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(
+                {"image": self.image, "materialized": self.materialized}, f
+            )
+        os.replace(tmp, self.path)
+
+    @contextmanager
+    def lock(self) -> Generator[None]:
+        """Hold the lock of the environment directory."""
+        fd = os.open(self.env_dir, os.O_RDONLY)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    def materialize(
+        self,
+        paths: Optional[list[str]] = None,
+        workers: int = 4,
+        progress: Optional[Callable[[int], None]] = None,
+    ) -> MaterializeResult:
+        """
+        Extract the files under `paths`, relative to the environment, all
+        of them when None. Once every file is there, the environment is
+        no longer lazy and its integrity record is written.
+
+        :raises RuntimeError: If the image is missing or corrupted.
+        """
+        start = time.monotonic()
+        result = MaterializeResult()
+        prefixes = ["."] if paths is None else [p.strip("/") for p in paths]
+        if not os.path.exists(self.path):
+            return result
+        with self.lock():
+            if not self.load():
+                return result
+            try:
+                image = SeekableImage(self.image)
+            except OSError as e:
+                raise RuntimeError(f"image of the environment unavailable: {e}")
+            with image:
+                wanted = [
+                    e
+                    for e in image.toc.files()
+                    if e.frames
+                    and not under(e.path, self.materialized)
+                    and under(e.path, prefixes)
+                ]
+                result.bytes = image.extract_all(wanted, self.env_dir, workers)
+                result.files = len(wanted)
+                self.materialized = sorted(set(self.materialized + prefixes))
+                result.pending = sum(
+                    1
+                    for e in image.toc.files()
+                    if e.frames and not under(e.path, self.materialized)
+                )
+                if result.pending:
+                    self.store()
+                else:
+                    IntegrityRecord(self.env_dir).reset(image.toc.integrity())
+                    os.remove(self.path)
+        if progress:
+            progress(result.files)
+        result.duration = time.monotonic() - start
+        return result
+
+
+@dataclass
+class SeekableImportResult:
+    config: dict[str, Any]
+    path: str
+    files: int
+    pending: int
+    duration: float
+
+
+def import_seekable(
+    path: str,
+    place: Callable[[dict[str, Any]], str],
+    lazy: bool = False,
+    workers: int = 4,
+) -> SeekableImportResult:
+    """
+    Import a seekable image: its directories at once, then its files, or
+    with `lazy` only the empty ones and a record of the image to
+    materialize the others from.
+
+    :raises RuntimeError: If the import fails, nothing is left behind.
+    """
+    start = time.monotonic()
+    staging = ""
+    try:
+        with SeekableImage(path) as image:
+            config = image.config
+            dest = place(config)
+            staging = tempfile.mkdtemp(
+                prefix=f".{os.path.basename(dest)}.import-",
+                dir=os.path.dirname(dest),
+            )
+            root = os.path.join(staging, "data")
+            image.skeleton(root)
+            files = [e for e in image.toc.files() if e.frames]
+            if lazy:
+                LazyEnv.create(root, path)
+            else:
+                image.extract_all(files, root, workers)
+                IntegrityRecord(root).reset(image.toc.integrity())
+            os.rename(root, dest)
+        return SeekableImportResult(
+            config,
+            dest,
+            len(image.toc.files()),
+            len(files) if lazy else 0,
+            time.monotonic() - start,
+        )
+    except (OSError, ValueError) as e:
+        raise RuntimeError(f"Failed to import {path}: {e}")
+    finally:
+        if staging:
+            shutil.rmtree(staging, ignore_errors=True)
@@ -0,0 +1,80 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from dataclasses import asdict, dataclass
+from typing import Any, Optional
+
+from util.jsonfile import LockedJsonFile
+
+
+@dataclass
+class SuspendedEnv:
+    """
+    An environment paused when it stopped being the active one.
+    """
+
+    env_tag: str
+    since: float
+    memory: int
+
+
+class SuspendRegistry(LockedJsonFile):
+    """
+    Persistent record of the suspended environments and of the memory
+    reclaimed stopping the idle ones.
+
+    Checkouts and idle sweeps may run at the same time: both hold the
+    registry lock while they change the registry.
+    """
+
+    def __init__(self, path: str):
+        self.envs: dict[str, SuspendedEnv] = {}
+        self.reclaimed = 0
+        super().__init__(path)
+
+    def decode(self, data: dict[str, Any]):
+        self.envs = {
+            e["env_tag"]: SuspendedEnv(**e) for e in data.get("envs", [])
+        }
+        self.reclaimed = data.get("reclaimed", 0)
+
+    def encode(self) -> dict[str, Any]:
+        return {
+            "envs": [asdict(e) for e in self.envs.values()],
+            "reclaimed": self.reclaimed,
+        }
+
+    def add(self, env_tag: str, since: float, memory: int):
+        self.envs[env_tag] = SuspendedEnv(env_tag, since, memory)
+        self.store()
+
+    def remove(self, env_tag: str) -> Optional[SuspendedEnv]:
+        suspended = self.envs.pop(env_tag, None)
+        if suspended:
+            self.store()
+        return suspended
+
+    def idle(self, now: float, ttl: float) -> list[SuspendedEnv]:
+        """Return the environments suspended for longer than the TTL."""
+        return [e for e in self.envs.values() if now - e.since >= ttl]
+
+    @property
+    def held(self) -> int:
+        """Memory held by the suspended environments."""
+        return sum(e.memory for e in self.envs.values())
@@ -16,10 +16,10 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import override
+from typing import Callable, Optional, override
 
 from config import ConfigMng, EnvironmentCfg, EnvironmentTemplateCfg
-from docker import DockerComposeEnv
+from docker import DockerComposeEnv, DockerReconciler, PullProgress
 from environment import Environment, EnvironmentFactory
 from service import ServiceFactory
 from util import Constants
@@ -64,3 +64,21 @@ class ShpdEnvironmentFactory(EnvironmentFactory):
                 raise ValueError(
                     f"Unknown environment factory: {envCfg.factory}"
                 )
+
+    @override
+    def pull_images(
+        self,
+        envs: list[Environment],
+        report: Optional[Callable[[str], None]] = None,
+    ) -> list[str]:
+        """
+        Pull the images missing for the docker environments, in parallel
+        and each image once.
+        """
+        docker_envs = [e for e in envs if isinstance(e, DockerComposeEnv)]
+        if not docker_envs:
+            return []
+        actions = DockerReconciler(docker_envs[0].engine).pull_images(
+            docker_envs, PullProgress(report)
+        )
+        return [a.target for a in actions]
@@ -18,9 +18,9 @@
 
 from typing import override
 
-from config import ConfigMng, EnvironmentCfg, ServiceCfg
-from docker import DockerSvc
-from service import Service, ServiceFactory
+from config import ConfigMng, EnvironmentCfg, ServiceCfg, ServiceTemplateCfg
+from docker import BuildIndex, DockerEngineClient, DockerImageBuilder, DockerSvc
+from service import ImageBuildResult, Service, ServiceFactory
 from util import Constants
 
 
@@ -48,3 +48,34 @@ class ShpdServiceFactory(ServiceFactory):
                     f"""Unknown service type: {svcCfg.template},
                     plugins not supported yet!"""
                 )
+
+    @override
+    def build_images(
+        self, svcTmplCfgs: list[ServiceTemplateCfg], max_parallel: int
+    ) -> list[ImageBuildResult]:
+        """
+        Build the images of the service templates.
+        """
+        unsupported = [
+            ImageBuildResult(
+                t.image,
+                [t.tag],
+                False,
+                error=f"unknown service factory: {t.factory}",
+            )
+            for t in svcTmplCfgs
+            if t.factory != Constants.SVC_FACTORY_DEFAULT
+        ]
+        builder = DockerImageBuilder(
+            DockerEngineClient.shared(),
+            self.configMng.constants.SHPD_DIR,
+            max_parallel,
+            BuildIndex(self.configMng.constants.SHPD_BUILD_INDEX_FILE),
+        )
+        return unsupported + builder.build(
+            [
+                t
+                for t in svcTmplCfgs
+                if t.factory == Constants.SVC_FACTORY_DEFAULT
+            ]
+        )
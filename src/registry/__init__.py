@@ -14,3 +14,16 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from .ftp import FtpPool, FtpRegistry
+from .registry import DirRegistry, Registry, RegistryEntry, RegistryError
+
+__all__ = [
+    "DirRegistry",
+    "FtpPool",
+    "FtpRegistry",
+    "Registry",
+    "RegistryEntry",
+    "RegistryError",
+]
@@ -0,0 +1,463 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import errno
+import ftplib
+import io
+import json
+import os
+import posixpath
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Generator, Optional, TypeVar
+
+from .registry import Registry, RegistryEntry, RegistryError
+
+T = TypeVar("T")
+
+FTP_PORT = 21
+TIMEOUT = 30
+# Files larger than a part are transferred as parallel ranges.
+PART_SIZE = 16 << 20
+BLOCK_SIZE = 1 << 18
+RETRIES = 3
+PART_SUFFIX = ".part"
+STATE_SUFFIX = ".json"
+
+# Failures after which the transfer is retried on a new connection.
+TRANSIENT_ERRORS = (
+    OSError,
+    EOFError,
+    ftplib.error_temp,
+    ftplib.error_reply,
+    ftplib.error_proto,
+)
+
+
+def is_not_found(e: ftplib.error_perm) -> bool:
+    return str(e).startswith("550")
+
+
+def not_found(path: str) -> FileNotFoundError:
+    return FileNotFoundError(errno.ENOENT, os.strerror(errno.ENOENT), path)
+
+
+class FtpPool:
+    """
+    Pool of logged in FTP connections, at most `size` of them open at
+    once.
+
+    A connection goes back to the pool when its user is done with it,
+    unless the user failed with a transient error: the connection is
+    then in an unknown state and is closed.
+    """
+
+    def __init__(self, connect: Callable[[], ftplib.FTP], size: int):
+        self.connect = connect
+        self.size = max(1, size)
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.lock = threading.Lock()
+        self.idle: list[ftplib.FTP] = []
+        self.opened = 0
+
+    @contextmanager
+    def connection(self) -> Generator[ftplib.FTP]:
+        with self.slots:
+            with self.lock:
+                conn = self.idle.pop() if self.idle else None
+            if conn is None:
+                conn = self.connect()
+                with self.lock:
+                    self.opened += 1
+            try:
+                yield conn
+            except FileNotFoundError:
+                with self.lock:
+                    self.idle.append(conn)
+                raise
+            except TRANSIENT_ERRORS:
+                self.discard(conn)
+                raise
+            except BaseException:
+                with self.lock:
+                    self.idle.append(conn)
+                raise
+            with self.lock:
+                self.idle.append(conn)
+
+    def discard(self, conn: ftplib.FTP):
+        try:
+            conn.close()
+        except OSError:
+            pass
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for conn in idle:
+            try:
+                conn.quit()
+            except (*TRANSIENT_ERRORS, ftplib.error_perm):
+                self.discard(conn)
+
+
+class FtpRegistry(Registry):
+    """
+    A registry served over FTP.
+
+    Transfers share a pool of persistent connections. A file larger than
+    a part is downloaded as parallel ranges, each one a RETR from its REST
+    offset, and the ranges received are recorded next to the partial
+    file, so an interrupted download resumes where it stopped. Uploads go
+    to a partial file renamed into place when complete, and resume with a
+    REST from its size.
+    """
+
+    def __init__(
+        self,
+        host: str,
+        root: str,
+        user: str = "",
+        psw: str = "",
+        port: int = FTP_PORT,
+        connections: int = 4,
+        part_size: int = PART_SIZE,
+        retries: int = RETRIES,
+        timeout: float = TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.root = root.rstrip("/")
+        self.user = user
+        self.psw = psw
+        self.part_size = max(BLOCK_SIZE, part_size)
+        self.retries = retries
+        self.timeout = timeout
+        self.pool = FtpPool(self.connect, connections)
+        self.dirs: set[str] = set()
+
+    def connect(self) -> ftplib.FTP:
+        conn = ftplib.FTP(timeout=self.timeout)
+        try:
+            conn.connect(self.host, self.port)
+            conn.login(self.user or "anonymous", self.psw)
+            conn.voidcmd("TYPE I")
+        except ftplib.error_perm as e:
+            conn.close()
+            raise RegistryError(f"Login to {self.host} refused: {e}")
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def remote(self, path: str) -> str:
+        path = path.strip("/")
+        return posixpath.join(self.root, path) if self.root else path
+
+    def run(self, action: Callable[[ftplib.FTP], T]) -> T:
+        """
+        Run `action` on a pooled connection, again on a new one when it
+        fails with a transient error.
+
+        :raises RegistryError: If every attempt fails.
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                with self.pool.connection() as conn:
+                    return action(conn)
+            except FileNotFoundError:
+                raise
+            except TRANSIENT_ERRORS as e:
+                if attempt == self.retries:
+                    raise RegistryError(f"{self.host}: {e}")
+        raise AssertionError("unreachable")
+
+    def get(self, path: str) -> bytes:
+        remote = self.remote(path)
+
+        def retrieve(conn: ftplib.FTP) -> bytes:
+            buf = io.BytesIO()
+            try:
+                conn.retrbinary(f"RETR {remote}", buf.write, BLOCK_SIZE)
+            except ftplib.error_perm as e:
+                if is_not_found(e):
+                    raise not_found(path)
+                raise RegistryError(f"Failed to get {path}: {e}")
+            return buf.getvalue()
+
+        return self.run(retrieve)
+
+    def put(self, path: str, data: bytes):
+        remote = self.remote(path)
+        tmp = self.partial(remote)
+        self.makedirs(posixpath.dirname(remote))
+
+        def store(conn: ftplib.FTP):
+            try:
+                conn.storbinary(f"STOR {tmp}", io.BytesIO(data), BLOCK_SIZE)
+                self.rename(conn, tmp, remote)
+            except ftplib.error_perm as e:
+                raise RegistryError(f"Failed to put {path}: {e}")
+
+        self.run(store)
+
+    def exists(self, path: str) -> bool:
+        return self.size(path) is not None
+
+    def list(self, path: str) -> list[str]:
+        remote = self.remote(path)
+
+        def names(conn: ftplib.FTP) -> list[str]:
+            try:
+                return conn.nlst(remote)
+            except ftplib.error_perm:
+                return []
+
+        return sorted(
+            name
+            for name in (posixpath.basename(n) for n in self.run(names))
+            if name not in (".", "..")
+        )
+
+    def entries(self, path: str) -> list[RegistryEntry]:
+        remote = self.remote(path)
+
+        def listing(conn: ftplib.FTP) -> list[RegistryEntry]:
+            try:
+                facts = list(conn.mlsd(remote, ["type", "size", "modify"]))
+            except ftplib.error_perm as e:
+                if is_not_found(e):
+                    return []
+                return self.stat_entries(conn, remote)
+            return [
+                RegistryEntry(
+                    name,
+                    int(fact.get("size") or 0),
+                    fact.get("modify", ""),
+                    fact["type"] == "dir",
+                )
+                for name, fact in facts
+                if fact.get("type") in ("file", "dir")
+            ]
+
+        return sorted(self.run(listing), key=lambda e: e.name)
+
+    def stat_entries(
+        self, conn: ftplib.FTP, remote: str
+    ) -> list[RegistryEntry]:
+        """List a directory of a server without MLSD, a file at a time."""
+        try:
+            names = [posixpath.basename(n) for n in conn.nlst(remote)]
+        except ftplib.error_perm:
+            return []
+        entries: list[RegistryEntry] = []
+        for name in names:
+            if name in (".", ".."):
+                continue
+            path = posixpath.join(remote, name)
+            size = self.remote_size(conn, path)
+            entries.append(
+                RegistryEntry(
+                    name, size or 0, self.modified(conn, path), size is None
+                )
+            )
+        return entries
+
+    def size(self, path: str) -> Optional[int]:
+        """Return the size of a file, None if it does not exist."""
+        remote = self.remote(path)
+        return self.run(lambda conn: self.remote_size(conn, remote))
+
+    def remote_size(self, conn: ftplib.FTP, remote: str) -> Optional[int]:
+        try:
+            return conn.size(remote)
+        except ftplib.error_perm:
+            return None
+
+    def modified(self, conn: ftplib.FTP, remote: str) -> str:
+        try:
+            return conn.voidcmd(f"MDTM {remote}").split()[-1]
+        except ftplib.error_perm:
+            return ""
+
+    def partial(self, remote: str) -> str:
+        parent, name = posixpath.split(remote)
+        return posixpath.join(parent, f".{name}{PART_SUFFIX}")
+
+    def rename(self, conn: ftplib.FTP, source: str, target: str):
+        try:
+            conn.rename(source, target)
+        except ftplib.error_perm:
+            # Servers that do not replace an existing target.
+            conn.delete(target)
+            conn.rename(source, target)
+
+    def makedirs(self, remote: str):
+        """Create a remote directory and its parents, once per registry."""
+        if not remote or remote in self.dirs:
+            return
+
+        def make(conn: ftplib.FTP):
+            path = ""
+            for part in remote.split("/"):
+                path = posixpath.join(path, part) if path else part or "/"
+                if path == "/" or path in self.dirs:
+                    continue
+                try:
+                    conn.mkd(path)
+                except ftplib.error_perm:
+                    pass
+                self.dirs.add(path)
+
+        self.run(make)
+
+    def download(self, path: str, dest: str) -> int:
+        """
+        Download a file to `dest` as parallel ranges, resuming a previous
+        partial download of the same remote file.
+
+        :return: The bytes transferred.
+        :raises FileNotFoundError: If the file does not exist.
+        :raises RegistryError: If the transfer fails, what was received is
+            kept for the next attempt.
+        """
+        remote = self.remote(path)
+
+        def stat(conn: ftplib.FTP) -> tuple[Optional[int], str]:
+            return self.remote_size(conn, remote), self.modified(conn, remote)
+
+        size, modified = self.run(stat)
+        if size is None:
+            raise not_found(path)
+        part = f"{dest}{PART_SUFFIX}"
+        state = f"{part}{STATE_SUFFIX}"
+        done = self.load_state(state, size, modified)
+        if not os.path.exists(part):
+            done = {}
+        os.makedirs(os.path.dirname(os.path.abspath(dest)), exist_ok=True)
+        lock = threading.Lock()
+        received = [0]
+
+        with open(part, "r+b" if done else "w+b") as f:
+            f.truncate(size)
+            fd = f.fileno()
+
+            def fetch(start: int):
+                end = min(start + self.part_size, size)
+
+                def attempt(conn: ftplib.FTP):
+                    pos = start + done.get(start, 0)
+                    if pos >= end:
+                        return
+                    sock = conn.transfercmd(f"RETR {remote}", rest=pos or None)
+                    try:
+                        while pos < end:
+                            data = sock.recv(min(BLOCK_SIZE, end - pos))
+                            if not data:
+                                break
+                            os.pwrite(fd, data, pos)
+                            pos += len(data)
+                            with lock:
+                                done[start] = pos - start
+                                received[0] += len(data)
+                    finally:
+                        sock.close()
+                    try:
+                        conn.voidresp()
+                    except ftplib.error_temp:
+                        # The range ends before the file, the server
+                        # complains about the closed data connection.
+                        pass
+                    if pos < end:
+                        raise EOFError(f"{path} truncated at {pos}")
+
+                self.run(attempt)
+
+            try:
+                with ThreadPoolExecutor(max_workers=self.pool.size) as pool:
+                    list(pool.map(fetch, range(0, size, self.part_size)))
+            finally:
+                self.save_state(state, size, modified, done)
+        os.replace(part, dest)
+        os.remove(state)
+        return received[0]
+
+    def load_state(
+        self, state: str, size: int, modified: str
+    ) -> dict[int, int]:
+        """Return the bytes received by range of a partial download."""
+        try:
+            with open(state, "r", encoding="utf-8") as f:
+                data: dict[str, Any] = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if data.get("size") != size or data.get("modified") != modified:
+            return {}
+        return {int(start): int(n) for start, n in data["done"].items()}
+
+    def save_state(
+        self, state: str, size: int, modified: str, done: dict[int, int]
+    ):
+        with open(state, "w", encoding="utf-8") as f:
+            json.dump({"size": size, "modified": modified, "done": done}, f)
+
+    def upload(self, src: str, path: str) -> int:
+        """
+        Upload a file, resuming a previous partial upload.
+
+        :return: The bytes transferred.
+        :raises RegistryError: If the transfer fails, what was sent is
+            kept for the next attempt.
+        """
+        remote = self.remote(path)
+        tmp = self.partial(remote)
+        size = os.path.getsize(src)
+        self.makedirs(posixpath.dirname(remote))
+        sent = [0]
+
+        def count(block: bytes):
+            sent[0] += len(block)
+
+        with open(src, "rb") as f:
+
+            def store(conn: ftplib.FTP):
+                offset = self.remote_size(conn, tmp) or 0
+                if offset > size:
+                    offset = 0
+                f.seek(offset)
+                try:
+                    conn.storbinary(
+                        f"STOR {tmp}",
+                        f,
+                        BLOCK_SIZE,
+                        count,
+                        rest=offset or None,
+                    )
+                    if self.remote_size(conn, tmp) != size:
+                        raise EOFError(f"{path} partially stored")
+                    self.rename(conn, tmp, remote)
+                except ftplib.error_perm as e:
+                    raise RegistryError(f"Failed to upload {path}: {e}")
+
+            self.run(store)
+        return sent[0]
+
+    def close(self):
+        self.pool.close()
@@ -14,3 +14,253 @@
 #
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlparse
+
+from config import ShpdRegistryCfg
+
+
+class RegistryError(RuntimeError):
+    """A registry transfer failed."""
+
+
+@dataclass
+class RegistryEntry:
+    """
+    A file or directory of the registry, `modified` is an opaque value
+    changing with its content.
+    """
+
+    name: str
+    size: int
+    modified: str
+    is_dir: bool = False
+
+
+class Registry(ABC):
+    """
+    Storage of the shepherd registry, addressed by relative paths.
+    """
+
+    @abstractmethod
+    def get(self, path: str) -> bytes:
+        """
+        Download a file.
+
+        :raises FileNotFoundError: If the file does not exist.
+        :raises RegistryError: If the transfer fails.
+        """
+        pass
+
+    @abstractmethod
+    def put(self, path: str, data: bytes):
+        """
+        Upload a file, readers never see it partially written.
+
+        :raises RegistryError: If the transfer fails.
+        """
+        pass
+
+    @abstractmethod
+    def exists(self, path: str) -> bool:
+        pass
+
+    @abstractmethod
+    def list(self, path: str) -> list[str]:
+        """List the names in a directory, none if it does not exist."""
+        pass
+
+    @abstractmethod
+    def entries(self, path: str) -> list[RegistryEntry]:
+        """
+        List the files and directories in a directory, with their size
+        and modification time, none if it does not exist.
+        """
+        pass
+
+    def missing(self, paths: list[str]) -> list[str]:
+        """Return the paths not in the registry."""
+        listed: dict[str, set[str]] = {}
+        missing: list[str] = []
+        for path in paths:
+            parent, _, name = path.rpartition("/")
+            if parent not in listed:
+                listed[parent] = set(self.list(parent))
+            if name not in listed[parent]:
+                missing.append(path)
+        return missing
+
+    def download(self, path: str, dest: str) -> int:
+        """
+        Download a file to `dest`.
+
+        :return: The bytes transferred.
+        :raises FileNotFoundError: If the file does not exist.
+        :raises RegistryError: If the transfer fails.
+        """
+        data = self.get(path)
+        tmp = f"{dest}.part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, dest)
+        return len(data)
+
+    def upload(self, src: str, path: str) -> int:
+        """
+        Upload the file `src`.
+
+        :return: The bytes transferred.
+        :raises RegistryError: If the transfer fails.
+        """
+        with open(src, "rb") as f:
+            data = f.read()
+        self.put(path, data)
+        return len(data)
+
+    def download_many(
+        self, transfers: list[tuple[str, str]], workers: int = 4
+    ) -> list[int]:
+        """Download several (path, dest) files concurrently."""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return list(pool.map(self.download, *zip(*transfers)))
+
+    def upload_many(
+        self, transfers: list[tuple[str, str]], workers: int = 4
+    ) -> list[int]:
+        """Upload several (src, path) files concurrently."""
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            return list(pool.map(self.upload, *zip(*transfers)))
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def from_config(
+        cfg: ShpdRegistryCfg, connections: int = 4, part_size: int = 0
+    ) -> Registry:
+        """
+        Open the environment images directory of the registry of the
+        configuration: an FTP server, `host[:port]` or an ftp:// URL, or a
+        local or mounted registry, a path or a file:// URL.
+
+        :param connections: The FTP connections to keep open.
+        :param part_size: The size of the ranges of FTP downloads.
+        :raises RegistryError: If the registry is not supported.
+        """
+        from .ftp import PART_SIZE, FtpRegistry
+
+        server = cfg.ftp_server
+        if server.startswith("file://"):
+            server = server[len("file://") :]
+        if server.startswith("/"):
+            return DirRegistry(
+                os.path.join(server, cfg.ftp_env_imgs_path.strip("/"))
+            )
+        url = urlparse(server if "://" in server else f"ftp://{server}")
+        if url.scheme != "ftp" or not url.hostname:
+            raise RegistryError(f"Unsupported registry '{cfg.ftp_server}'")
+        try:
+            port = url.port
+        except ValueError:
+            raise RegistryError(f"Invalid registry '{cfg.ftp_server}'")
+        return FtpRegistry(
+            url.hostname,
+            cfg.ftp_env_imgs_path,
+            cfg.ftp_user,
+            cfg.ftp_psw,
+            port or 21,
+            connections,
+            part_size or PART_SIZE,
+        )
+
+
+class DirRegistry(Registry):
+    """
+    A registry kept in a directory, like a mounted share.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def local(self, path: str) -> str:
+        return os.path.join(self.root, *path.strip("/").split("/"))
+
+    def get(self, path: str) -> bytes:
+        try:
+            with open(self.local(path), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            raise RegistryError(f"Failed to get {path}: {e}")
+
+    def put(self, path: str, data: bytes):
+        target = self.local(path)
+        tmp: Optional[str] = None
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(prefix=".", dir=os.path.dirname(target))
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, target)
+        except OSError as e:
+            if tmp and os.path.exists(tmp):
+                os.remove(tmp)
+            raise RegistryError(f"Failed to put {path}: {e}")
+
+    def exists(self, path: str) -> bool:
+        return os.path.exists(self.local(path))
+
+    def entries(self, path: str) -> list[RegistryEntry]:
+        entries: list[RegistryEntry] = []
+        try:
+            with os.scandir(self.local(path)) as it:
+                for e in it:
+                    st = e.stat()
+                    entries.append(
+                        RegistryEntry(
+                            e.name, st.st_size, str(st.st_mtime_ns), e.is_dir()
+                        )
+                    )
+        except OSError:
+            return []
+        return sorted(entries, key=lambda e: e.name)
+
+    def download(self, path: str, dest: str) -> int:
+        tmp = f"{dest}.part"
+        try:
+            shutil.copyfile(self.local(path), tmp)
+            os.replace(tmp, dest)
+        except FileNotFoundError:
+            raise
+        except OSError as e:
+            raise RegistryError(f"Failed to download {path}: {e}")
+        return os.path.getsize(dest)
+
+    def upload(self, src: str, path: str) -> int:
+        target = self.local(path)
+        tmp = os.path.join(
+            os.path.dirname(target), f".{os.path.basename(target)}.part"
+        )
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(src, tmp)
+            os.replace(tmp, target)
+        except OSError as e:
+            raise RegistryError(f"Failed to upload {path}: {e}")
+        return os.path.getsize(target)
+
+    def list(self, path: str) -> list[str]:
+        try:
+            return sorted(os.listdir(self.local(path)))
+        except OSError:
+            return []
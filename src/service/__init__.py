@@ -16,6 +16,32 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from .service import Service, ServiceFactory, ServiceMng
+from .build import (
+    PROP_BUILD_CONTEXT,
+    PROP_BUILD_DOCKERFILE,
+    ImageBuildResult,
+)
+from .readiness import ProbeResult, ReadinessGate, ReadinessProbe
+from .service import (
+    Service,
+    ServiceFactory,
+    ServiceMng,
+    ServiceNotCreatedError,
+    ServiceStatus,
+    wait_ready,
+)
 
-__all__ = ["Service", "ServiceMng", "ServiceFactory"]
+__all__ = [
+    "ImageBuildResult",
+    "PROP_BUILD_CONTEXT",
+    "PROP_BUILD_DOCKERFILE",
+    "ProbeResult",
+    "ReadinessGate",
+    "ReadinessProbe",
+    "Service",
+    "ServiceMng",
+    "ServiceFactory",
+    "ServiceNotCreatedError",
+    "ServiceStatus",
+    "wait_ready",
+]
@@ -0,0 +1,49 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Optional
+
+# Service template properties locating the image build inputs, the
+# Dockerfile path being relative to the context.
+PROP_BUILD_CONTEXT = "build.context"
+PROP_BUILD_DOCKERFILE = "build.dockerfile"
+
+
+@dataclass
+class ImageBuildResult:
+    """
+    Outcome of the build of an image shared by one or more service
+    templates.
+    """
+
+    image: str
+    templates: list[str] = field(default_factory=list[str])
+    ok: bool = True
+    duration: float = 0.0
+    steps: int = 0
+    cached: int = 0
+    error: Optional[str] = None
+    # only tagged, its inputs did not change since it was built
+    reused: bool = False
+
+    @property
+    def cache_ratio(self) -> float:
+        """Share of the build steps found in the build cache."""
+        return self.cached / self.steps if self.steps else 0.0
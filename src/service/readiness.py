@@ -0,0 +1,250 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import asyncio
+import random
+import ssl
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Optional
+from urllib.parse import urlparse
+
+# Service properties configuring the readiness probes.
+PROP_TCP = "readiness.tcp"
+PROP_HTTP = "readiness.http"
+PROP_EXEC = "readiness.exec"
+PROP_LOG = "readiness.log"
+PROP_TIMEOUT = "readiness.timeout"
+
+DEFAULT_TIMEOUT = 120.0
+
+
+class ProbeError(Exception):
+    """A probe attempt found the service not ready."""
+
+
+@dataclass
+class ProbeResult:
+    """
+    Outcome of waiting for a probe.
+    """
+
+    svc_tag: str
+    probe: str
+    ready: bool
+    elapsed: float
+    attempts: int
+    error: Optional[str] = None
+
+
+class ReadinessProbe(ABC):
+    """
+    A check telling whether a service is usable.
+    """
+
+    def __init__(self, svc_tag: str, timeout: float = DEFAULT_TIMEOUT):
+        self.svc_tag = svc_tag
+        self.timeout = timeout
+
+    @abstractmethod
+    def describe(self) -> str:
+        pass
+
+    @abstractmethod
+    async def check(self) -> None:
+        """
+        Run a single attempt.
+
+        :raises ProbeError: If the service is not ready yet.
+        """
+        pass
+
+
+def split_host_port(target: str, default_host: str) -> tuple[str, int]:
+    host, sep, port = target.rpartition(":")
+    return (host if sep and host else default_host), int(port)
+
+
+class TcpProbe(ReadinessProbe):
+    """
+    Ready once a TCP connection is accepted, e.g.
+    `readiness.tcp=localhost:5432`.
+    """
+
+    def __init__(
+        self,
+        svc_tag: str,
+        host: str,
+        port: int,
+        timeout: float = DEFAULT_TIMEOUT,
+    ):
+        super().__init__(svc_tag, timeout)
+        self.host = host
+        self.port = port
+
+    def describe(self) -> str:
+        return f"tcp {self.host}:{self.port}"
+
+    async def check(self) -> None:
+        await self.connect(self.host, self.port)
+
+    async def connect(self, host: str, port: int) -> None:
+        _, writer = await asyncio.open_connection(host, port)
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except OSError:
+            pass
+
+
+class HttpProbe(ReadinessProbe):
+    """
+    Ready once a GET answers with a 2xx or 3xx status, e.g.
+    `readiness.http=http://localhost:8080/health`.
+    """
+
+    def __init__(
+        self, svc_tag: str, url: str, timeout: float = DEFAULT_TIMEOUT
+    ):
+        super().__init__(svc_tag, timeout)
+        self.url = url
+
+    def describe(self) -> str:
+        return f"http {self.url}"
+
+    async def check(self) -> None:
+        url = urlparse(self.url)
+        secure = url.scheme == "https"
+        context: Optional[ssl.SSLContext] = None
+        if secure:
+            # local services usually have self-signed certificates
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        reader, writer = await asyncio.open_connection(
+            url.hostname, url.port or (443 if secure else 80), ssl=context
+        )
+        try:
+            path = url.path or "/"
+            if url.query:
+                path += f"?{url.query}"
+            writer.write(
+                f"GET {path} HTTP/1.0\r\nHost: {url.netloc}\r\n"
+                f"Connection: close\r\n\r\n".encode()
+            )
+            await writer.drain()
+            parts = (await reader.readline()).split()
+            if len(parts) < 2 or not parts[1].isdigit():
+                raise ProbeError("invalid HTTP response")
+            status = int(parts[1])
+            if not 200 <= status < 400:
+                raise ProbeError(f"HTTP {status}")
+        finally:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except (OSError, ssl.SSLError):
+                pass
+
+
+def parse_probes(
+    svc_tag: str, properties: dict[str, str], default_host: str
+) -> list[ReadinessProbe]:
+    """
+    Build the network probes configured in the service properties, a
+    `readiness.tcp` port without a host being checked on `default_host`.
+    """
+    timeout = float(properties.get(PROP_TIMEOUT) or DEFAULT_TIMEOUT)
+    probes: list[ReadinessProbe] = []
+    if target := properties.get(PROP_TCP):
+        host, port = split_host_port(target, default_host)
+        probes.append(TcpProbe(svc_tag, host, port, timeout))
+    if url := properties.get(PROP_HTTP):
+        probes.append(HttpProbe(svc_tag, url, timeout))
+    return probes
+
+
+class ReadinessGate:
+    """
+    Wait for many probes at once.
+
+    Every probe is polled concurrently on the same event loop, attempts are
+    spaced by an exponential backoff with jitter so that slow services are
+    not hammered and fast ones are detected as soon as they are up.
+    """
+
+    def __init__(
+        self,
+        probes: list[ReadinessProbe],
+        initial_delay: float = 0.1,
+        max_delay: float = 5.0,
+        attempt_timeout: float = 5.0,
+    ):
+        self.probes = probes
+        self.initial_delay = initial_delay
+        self.max_delay = max_delay
+        self.attempt_timeout = attempt_timeout
+
+    async def wait_probe(self, probe: ReadinessProbe) -> ProbeResult:
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        deadline = started + probe.timeout
+        delay = self.initial_delay
+        attempts = 0
+        while True:
+            attempts += 1
+            remaining = deadline - loop.time()
+            try:
+                await asyncio.wait_for(
+                    probe.check(),
+                    max(0.01, min(self.attempt_timeout, remaining)),
+                )
+                return ProbeResult(
+                    probe.svc_tag,
+                    probe.describe(),
+                    True,
+                    loop.time() - started,
+                    attempts,
+                )
+            except (OSError, RuntimeError, ProbeError, TimeoutError) as e:
+                error = str(e) or type(e).__name__
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return ProbeResult(
+                    probe.svc_tag,
+                    probe.describe(),
+                    False,
+                    loop.time() - started,
+                    attempts,
+                    error,
+                )
+            pause = delay / 2 + random.uniform(0, delay / 2)
+            await asyncio.sleep(min(pause, remaining))
+            delay = min(self.max_delay, delay * 2)
+
+    async def wait_all(self) -> list[ProbeResult]:
+        return list(
+            await asyncio.gather(*(self.wait_probe(p) for p in self.probes))
+        )
+
+    def run(self) -> list[ProbeResult]:
+        """Wait for every probe, return the results in probes order."""
+        if not self.probes:
+            return []
+        return asyncio.run(self.wait_all())
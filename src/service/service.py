@@ -18,9 +18,37 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
-from typing import Optional
+from dataclasses import dataclass
+from typing import Iterable, Optional
 
-from config import ConfigMng, EnvironmentCfg, ServiceCfg
+from rich.table import Table
+
+from config import ConfigMng, EnvironmentCfg, ServiceCfg, ServiceTemplateCfg
+from util import Util
+
+from .build import PROP_BUILD_CONTEXT, ImageBuildResult
+from .readiness import ProbeResult, ReadinessGate, ReadinessProbe, parse_probes
+
+
+@dataclass
+class ServiceStatus:
+    """
+    Represents the observed runtime state of a service.
+    """
+
+    env_tag: str
+    svc_tag: str
+    container_name: str
+    state: str
+    health: Optional[str] = None
+    updated_at: float = 0.0
+
+
+class ServiceNotCreatedError(RuntimeError):
+    """
+    The service has never been brought up with its environment, so it
+    cannot be started on its own.
+    """
 
 
 class Service(ABC):
@@ -80,8 +108,21 @@ class Service(ABC):
         pass
 
     @abstractmethod
-    def show_stdout(self):
-        """Show the service stdout."""
+    def show_stdout(
+        self,
+        follow: bool = False,
+        tail: Optional[int] = None,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        captured: bool = False,
+    ):
+        """
+        Show the service stdout, the last `tail` lines and the lines from
+        `since` and before `until` only when given.
+
+        :param captured: Show the local capture of the output, bringing it
+            up to date first.
+        """
         pass
 
     @abstractmethod
@@ -89,10 +130,67 @@ class Service(ABC):
         """Get a shell session for the service."""
         pass
 
+    def exec_input(
+        self, cmd: list[str], data: Iterable[bytes]
+    ) -> tuple[int, bytes]:
+        """
+        Run a command in the service, streaming `data` to its input.
+
+        :return: The exit code and the output of the command.
+        :raises RuntimeError: If the service cannot run commands.
+        """
+        raise RuntimeError(f"Service '{self.svcCfg.tag}' cannot run commands.")
+
+    def claims(self) -> set[str]:
+        """
+        Return the host wide resources the running service holds, which
+        another service cannot hold at the same time.
+        """
+        return set()
+
+    def readiness_probes(self) -> list[ReadinessProbe]:
+        """
+        Return the probes telling when the service is ready, as configured
+        by the `readiness.*` properties.
+        """
+        return parse_probes(
+            self.svcCfg.tag, self.svcCfg.properties or {}, "127.0.0.1"
+        )
+
     def to_config(self) -> ServiceCfg:
         return self.svcCfg
 
 
+def wait_ready(services: list[Service]):
+    """
+    Wait until every service probe succeeds, exit with an error when a
+    service does not get ready in time.
+    """
+    probes = [p for svc in services for p in svc.readiness_probes()]
+    results: list[ProbeResult] = ReadinessGate(probes).run()
+    for result in results:
+        if result.ready:
+            Util.print(
+                f"Ready: {result.svc_tag} ({result.probe}, "
+                f"{result.elapsed:.1f}s)"
+            )
+    failed = [r for r in results if not r.ready]
+    if failed:
+        Util.print_error_and_die(
+            "; ".join(
+                f"{r.svc_tag} not ready after {r.elapsed:.0f}s "
+                f"({r.probe}): {r.error}"
+                for r in failed
+            )
+        )
+
+
+def build_outcome(result: ImageBuildResult) -> str:
+    if not result.ok:
+        return "failed"
+    return "unchanged" if result.reused else "ok"
+
+
 class ServiceFactory(ABC):
     """
     Factory class for services.
@@ -114,6 +212,16 @@ class ServiceFactory(ABC):
         """
         pass
 
+    @abstractmethod
+    def build_images(
+        self, svcTmplCfgs: list[ServiceTemplateCfg], max_parallel: int
+    ) -> list[ImageBuildResult]:
+        """
+        Build the images of the service templates, at most `max_parallel`
+        at a time.
+        """
+        pass
+
 
 class ServiceMng:
 
@@ -136,20 +244,113 @@ class ServiceMng:
         else:
             return None
 
-    def build_image_svc(self, service_template: str):
-        pass
+    def get_service_or_die(
+        self, envCfg: EnvironmentCfg, svc_tag: str
+    ) -> Service:
+        """Get a service, exit with an error when it does not exist."""
+        service = self.get_service(envCfg, svc_tag)
+        if not service:
+            Util.print_error_and_die(
+                f"Service with tag '{svc_tag}' does not exist in "
+                f"environment '{envCfg.tag}'."
+            )
+        assert service
+        return service
+
+    def build_image_svc(self, service_templates: list[str]):
+        """
+        Build the images of the service templates, of every template with
+        a build context when `--all` is given.
+        """
+        svcTmplCfgs: list[ServiceTemplateCfg] = []
+        if self.cli_flags.get("all"):
+            svcTmplCfgs = [
+                t
+                for t in self.configMng.get_service_templates() or []
+                if (t.properties or {}).get(PROP_BUILD_CONTEXT)
+            ]
+        for tag in dict.fromkeys(service_templates):
+            svcTmplCfg = self.configMng.get_service_template(tag)
+            if not svcTmplCfg:
+                Util.print_error_and_die(
+                    f"Service Template with tag '{tag}' does not exist."
+                )
+            elif svcTmplCfg not in svcTmplCfgs:
+                svcTmplCfgs.append(svcTmplCfg)
+        if not svcTmplCfgs:
+            Util.print_error_and_die("No service templates to build.")
+        max_parallel = int(self.configMng.values.get("build_max_parallel") or 4)
+        results = self.svcFactory.build_images(svcTmplCfgs, max_parallel)
+        self.print_build_summary(results)
+        failed = [r for r in results if not r.ok]
+        if failed:
+            Util.print_error_and_die(
+                "; ".join(f"{r.image}: {r.error}" for r in failed)
+            )
+
+    def print_build_summary(self, results: list[ImageBuildResult]):
+        steps = sum(r.steps for r in results)
+        cached = sum(r.cached for r in results)
+        if self.cli_flags.get("porcelain"):
+            for r in results:
+                Util.print(
+                    f"{r.image}\t{','.join(r.templates)}\t"
+                    f"{build_outcome(r)}\t{r.duration:.3f}\t"
+                    f"{r.cached}/{r.steps}\t{r.error or ''}"
+                )
+            return
+        table = Table(title="build")
+        table.add_column("Image")
+        table.add_column("Templates")
+        table.add_column("Result")
+        table.add_column("Duration", justify="right")
+        table.add_column("Cache hits", justify="right")
+        table.add_column("Error")
+        for r in results:
+            table.add_row(
+                r.image,
+                ", ".join(r.templates),
+                build_outcome(r),
+                f"{r.duration:.1f}s",
+                f"{r.cached}/{r.steps} ({r.cache_ratio:.0%})",
+                r.error or "",
+            )
+        Util.console.print(table)
+        ratio = cached / steps if steps else 0.0
+        reused = len([r for r in results if r.reused])
+        Util.print(
+            f"Cache hits: {cached}/{steps} steps ({ratio:.0%}), "
+            f"{reused} unchanged images"
+        )
 
     def start_svc(self, envCfg: EnvironmentCfg, service_tag: str):
         """Start a service."""
-        pass
+        service = self.get_service_or_die(envCfg, service_tag)
+        try:
+            service.start()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to start service: {e}")
+        Util.print(f"Started: {service_tag}")
+        if self.cli_flags.get("wait"):
+            wait_ready([service])
 
     def halt_svc(self, envCfg: EnvironmentCfg, service_tag: str):
         """Halt a service."""
-        pass
+        service = self.get_service_or_die(envCfg, service_tag)
+        try:
+            service.halt()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to halt service: {e}")
+        Util.print(f"Halted: {service_tag}")
 
     def reload_svc(self, envCfg: EnvironmentCfg, service_tag: str):
         """Reload a service."""
-        pass
+        service = self.get_service_or_die(envCfg, service_tag)
+        try:
+            service.reload()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to reload service: {e}")
+        Util.print(f"Reloaded: {service_tag}")
 
     def render_svc(self, envCfg: EnvironmentCfg, svc_tag: str) -> Optional[str]:
         """Render a service configuration."""
@@ -158,10 +359,41 @@ class ServiceMng:
             return service.render()
         return None
 
-    def stdout_svc(self, envCfg: EnvironmentCfg, svc_tag: str):
+    def stdout_svc(
+        self,
+        envCfg: EnvironmentCfg,
+        svc_tag: str,
+        tail: Optional[int] = None,
+        since: Optional[str] = None,
+        until: Optional[str] = None,
+        captured: bool = False,
+    ):
         """Get service stdout."""
-        pass
+        service = self.get_service_or_die(envCfg, svc_tag)
+        follow = self.cli_flags.get("follow", False)
+        if captured and follow:
+            Util.print_error_and_die("Captured output cannot be followed.")
+        try:
+            start = Util.parse_time(since) if since else None
+            end = Util.parse_time(until) if until else None
+        except ValueError as e:
+            Util.print_error_and_die(str(e))
+            return
+        try:
+            service.show_stdout(
+                follow=follow,
+                tail=tail,
+                since=start,
+                until=end,
+                captured=captured,
+            )
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to get service stdout: {e}")
 
     def shell_svc(self, envCfg: EnvironmentCfg, svc_tag: str):
         """Get a shell session for a service."""
-        pass
+        service = self.get_service_or_die(envCfg, svc_tag)
+        try:
+            service.get_shell()
+        except RuntimeError as e:
+            Util.print_error_and_die(f"Failed to get a shell: {e}")
@@ -59,7 +59,9 @@ class ShepherdMng:
         self.serviceMng = ServiceMng(
             self.cli_flags, self.configMng, self.svcFactory
         )
-        self.databaseMng = DatabaseMng(self.cli_flags, self.configMng)
+        self.databaseMng = DatabaseMng(
+            self.cli_flags, self.configMng, self.svcFactory
+        )
 
 
 def require_active_env(func: Callable[..., Any]) -> Callable[..., Any]:
@@ -75,6 +77,33 @@ def require_active_env(func: Callable[..., Any]) -> Callable[..., Any]:
     return wrapper
 
 
+def fleet_or_active_env(operation: str) -> Callable[..., Any]:
+    """
+    Run the command on the active environment or, with --all or tag
+    patterns, on every matching environment.
+    """
+
+    def decorator(func: Callable[..., Any]) -> Callable[..., Any]:
+        @functools.wraps(func)
+        def wrapper(
+            shepherd: ShepherdMng,
+            *args: list[str],
+            env_tags: tuple[str, ...] = (),
+            **kwargs: dict[str, str],
+        ) -> Any:
+            if shepherd.cli_flags.get("all") or env_tags:
+                shepherd.environmentMng.fleet_env(operation, list(env_tags))
+                return None
+            envCfg = shepherd.configMng.get_active_environment()
+            if not envCfg:
+                raise click.UsageError("No active environment found.")
+            return func(shepherd, envCfg, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
 @click.group()
 @click.option("-v", "--verbose", is_flag=True, help="Enable verbose mode.")
 @click.option(
@@ -98,6 +127,12 @@ def require_active_env(func: Callable[..., Any]) -> Callable[..., Any]:
     is_flag=True,
     help="Contextually checkout the environment.",
 )
+@click.option(
+    "-w",
+    "--wait",
+    is_flag=True,
+    help="Wait for the services to be ready.",
+)
 @click.pass_context
 def cli(
     ctx: click.Context,
@@ -109,6 +144,7 @@ def cli(
     keep: bool,
     replace: bool,
     checkout: bool,
+    wait: bool,
 ):
     """Shepherd CLI:
     A tool to manage your environments, services, and databases.
@@ -122,6 +158,7 @@ def cli(
         "keep": keep,
         "replace": replace,
         "checkout": checkout,
+        "wait": wait,
     }
 
     if ctx.obj is None:
@@ -171,6 +208,116 @@ def db_sql_shell(
     shepherd.databaseMng.sql_shell_svc(envCfg, service_tag)
 
 
+@db.command(name="import")
+@click.argument("service_tag", type=str, required=True)
+@click.argument("dump", type=str, required=True)
+@click.option(
+    "-j",
+    "--jobs",
+    type=click.IntRange(min=1),
+    help="Objects restored in parallel, db_import_jobs by default.",
+)
+@click.pass_obj
+@require_active_env
+def db_import(
+    shepherd: ShepherdMng,
+    envCfg: EnvironmentCfg,
+    service_tag: str,
+    dump: str,
+    jobs: Optional[int],
+):
+    """Import DUMP, plain, gzip or zstd, into the database service."""
+    shepherd.databaseMng.import_dump_svc(envCfg, service_tag, dump, jobs)
+
+
+@db.command(name="provision")
+@click.argument("service_tag", type=str, required=True)
+@click.argument("manifest", type=str, required=True)
+@click.pass_obj
+@require_active_env
+def db_provision(
+    shepherd: ShepherdMng,
+    envCfg: EnvironmentCfg,
+    service_tag: str,
+    manifest: str,
+):
+    """Provision the users, directories and grants of MANIFEST."""
+    shepherd.databaseMng.provision_svc(envCfg, service_tag, manifest)
+
+
+@db.command(name="checkpoint")
+@click.argument("service_tag", type=str, required=True)
+@click.argument("name", type=str, required=True)
+@click.pass_obj
+@require_active_env
+def db_checkpoint(
+    shepherd: ShepherdMng, envCfg: EnvironmentCfg, service_tag: str, name: str
+):
+    """
+    Checkpoint the data volume of the database service as NAME.
+
+    The container is paused while the volume is cloned. Files are
+    reflinked where the filesystem supports it, which takes moments;
+    elsewhere they are copied and the pause lasts as long as the copy.
+    """
+    shepherd.databaseMng.checkpoint_svc(envCfg, service_tag, name)
+
+
+@db.command(name="rollback")
+@click.argument("service_tag", type=str, required=True)
+@click.argument("name", type=str, required=True)
+@click.pass_obj
+@require_active_env
+def db_rollback(
+    shepherd: ShepherdMng, envCfg: EnvironmentCfg, service_tag: str, name: str
+):
+    """Roll the database service back to the checkpoint NAME."""
+    shepherd.databaseMng.rollback_svc(envCfg, service_tag, name)
+
+
+@db.command(name="checkpoints")
+@click.argument("service_tag", type=str, required=True)
+@click.pass_obj
+@require_active_env
+def db_checkpoints(
+    shepherd: ShepherdMng, envCfg: EnvironmentCfg, service_tag: str
+):
+    """List the checkpoints of the database service."""
+    shepherd.databaseMng.list_checkpoints_svc(envCfg, service_tag)
+
+
+@db.command(name="prune")
+@click.argument("service_tag", type=str, required=True)
+@click.argument("names", nargs=-1)
+@click.option(
+    "--keep",
+    type=click.IntRange(min=0),
+    help="Keep the newest checkpoints only.",
+)
+@click.option(
+    "--older-than",
+    type=str,
+    help=(
+        "Remove the checkpoints older than an age in seconds, "
+        "a duration (e.g. 7d) or a date."
+    ),
+)
+@click.pass_obj
+@require_active_env
+def db_prune(
+    shepherd: ShepherdMng,
+    envCfg: EnvironmentCfg,
+    service_tag: str,
+    names: tuple[str, ...],
+    keep: Optional[int],
+    older_than: Optional[str],
+):
+    """Remove checkpoints of the database service."""
+    shepherd.databaseMng.prune_checkpoints_svc(
+        envCfg, service_tag, list(names), keep, older_than
+    )
+
+
 # Environment commands
 @cli.group()
 def env():
@@ -207,10 +354,16 @@ def env_rename(shepherd: ShepherdMng, src_env_tag: str, dst_env_tag: str):
 
 @env.command(name="checkout")
 @click.argument("env_tag", required=True)
+@click.option(
+    "-s",
+    "--start",
+    is_flag=True,
+    help="Start it while halting the previous environment.",
+)
 @click.pass_obj
-def env_checkout(shepherd: ShepherdMng, env_tag: str):
+def env_checkout(shepherd: ShepherdMng, env_tag: str, start: bool):
     """Checkout an environment."""
-    shepherd.environmentMng.checkout_env(env_tag)
+    shepherd.environmentMng.checkout_env(env_tag, start)
 
 
 @env.command(name="delete")
@@ -221,6 +374,162 @@ def env_delete(shepherd: ShepherdMng, env_tag: str):
     shepherd.environmentMng.delete_env(env_tag)
 
 
+@env.command(name="idle")
+@click.pass_obj
+def env_idle(shepherd: ShepherdMng):
+    """Stop idle environments and list the suspended ones."""
+    shepherd.environmentMng.idle_envs()
+
+
+@env.command(name="pool")
+@click.argument(
+    "action", type=click.Choice(["status", "fill", "drain"]), default="status"
+)
+@click.pass_obj
+def env_pool(shepherd: ShepherdMng, action: str):
+    """Show, fill or drain the pool of pre-initialized environments."""
+    if action == "fill":
+        shepherd.environmentMng.fill_pool()
+    elif action == "drain":
+        shepherd.environmentMng.drain_pool()
+    else:
+        shepherd.environmentMng.pool_status()
+
+
+@env.command(name="prefetch")
+@click.argument("env_tags", nargs=-1)
+@click.pass_obj
+def env_prefetch(shepherd: ShepherdMng, env_tags: tuple[str, ...]):
+    """Pull the missing images of environments, --all for every one."""
+    shepherd.environmentMng.prefetch_envs(list(env_tags))
+
+
+@env.command(name="pack")
+@click.argument("env_tag", required=True)
+@click.option(
+    "--format",
+    "fmt",
+    type=click.Choice(["zstd", "gzip", "seekable"]),
+    help="Archive format, env_pack_format by default.",
+)
+@click.pass_obj
+def env_pack(shepherd: ShepherdMng, env_tag: str, fmt: Optional[str]):
+    """Pack environment ENV_TAG as an environment image."""
+    shepherd.environmentMng.pack_env(env_tag, fmt)
+
+
+@env.command(name="import")
+@click.argument("image", required=True)
+@click.argument("env_tag", required=False)
+@click.option("--sha256", help="Expected checksum of the image.")
+@click.option(
+    "--lazy",
+    is_flag=True,
+    help="Extract the files of a seekable image on first use.",
+)
+@click.pass_obj
+def env_import(
+    shepherd: ShepherdMng,
+    image: str,
+    env_tag: Optional[str],
+    sha256: Optional[str],
+    lazy: bool,
+):
+    """Import environment IMAGE, as ENV_TAG when given."""
+    shepherd.environmentMng.import_env(image, env_tag, sha256, lazy)
+
+
+@env.command(name="materialize")
+@click.argument("env_tag", required=True)
+@click.argument("paths", nargs=-1)
+@click.pass_obj
+def env_materialize(
+    shepherd: ShepherdMng, env_tag: str, paths: tuple[str, ...]
+):
+    """Extract PATHS of lazily imported ENV_TAG, every file by default."""
+    shepherd.environmentMng.materialize_paths(env_tag, list(paths))
+
+
+@env.command(name="verify")
+@click.argument("env_tag", required=True)
+@click.option(
+    "--full", is_flag=True, help="Hash every file, even the unchanged ones."
+)
+@click.pass_obj
+def env_verify(shepherd: ShepherdMng, env_tag: str, full: bool):
+    """Check environment ENV_TAG against the image it comes from."""
+    shepherd.environmentMng.verify_env(env_tag, full)
+
+
+@env.command(name="push")
+@click.argument("env_tag", required=True)
+@click.argument("image", required=False)
+@click.pass_obj
+def env_push(shepherd: ShepherdMng, env_tag: str, image: Optional[str]):
+    """Push environment ENV_TAG to the registry as IMAGE."""
+    shepherd.environmentMng.push_env(env_tag, image)
+
+
+@env.command(name="pull")
+@click.argument("image", required=True)
+@click.argument("env_tag", required=False)
+@click.pass_obj
+def env_pull(shepherd: ShepherdMng, image: str, env_tag: Optional[str]):
+    """Pull IMAGE from the registry as a new environment."""
+    shepherd.environmentMng.pull_env(image, env_tag)
+
+
+@env.command(name="images")
+@click.option(
+    "--remote", is_flag=True, help="List the registry images instead."
+)
+@click.option(
+    "--refresh",
+    is_flag=True,
+    help="Revalidate the registry catalog before listing it.",
+)
+@click.pass_obj
+def env_images(shepherd: ShepherdMng, remote: bool, refresh: bool):
+    """List the environment images."""
+    shepherd.environmentMng.list_images(remote, refresh)
+
+
+@env.command(name="fetch")
+@click.argument("images", nargs=-1, required=True)
+@click.pass_obj
+def env_fetch(shepherd: ShepherdMng, images: tuple[str, ...]):
+    """Download environment IMAGES from the registry."""
+    shepherd.environmentMng.registryMng.fetch_images(list(images))
+
+
+@env.command(name="publish")
+@click.argument("images", nargs=-1, required=True)
+@click.pass_obj
+def env_publish(shepherd: ShepherdMng, images: tuple[str, ...]):
+    """Upload packed environment IMAGES to the registry."""
+    shepherd.environmentMng.registryMng.publish_images(list(images))
+
+
+@env.command(name="serve")
+@click.option(
+    "--port",
+    type=click.IntRange(min=0, max=65535),
+    help="Port to listen on, env_peer_port by default.",
+)
+@click.pass_obj
+def env_serve(shepherd: ShepherdMng, port: Optional[int]):
+    """Serve the local image chunks to the peers."""
+    shepherd.environmentMng.serve_chunks(port)
+
+
+@env.command(name="logs")
+@click.pass_obj
+@require_active_env
+def env_logs(shepherd: ShepherdMng, envCfg: EnvironmentCfg):
+    """Show the output of every service, -f to follow it."""
+    shepherd.environmentMng.logs_env(envCfg)
+
+
 @env.command(name="list")
 @click.pass_obj
 def env_list(shepherd: ShepherdMng):
@@ -229,24 +538,27 @@ def env_list(shepherd: ShepherdMng):
 
 
 @env.command(name="up")
+@click.argument("env_tags", nargs=-1)
 @click.pass_obj
-@require_active_env
+@fleet_or_active_env("up")
 def env_up(shepherd: ShepherdMng, envCfg: EnvironmentCfg):
     """Start environment."""
     shepherd.environmentMng.start_env(envCfg)
 
 
 @env.command(name="halt")
+@click.argument("env_tags", nargs=-1)
 @click.pass_obj
-@require_active_env
+@fleet_or_active_env("halt")
 def env_halt(shepherd: ShepherdMng, envCfg: EnvironmentCfg):
     """Halt environment."""
     shepherd.environmentMng.halt_env(envCfg)
 
 
 @env.command(name="reload")
+@click.argument("env_tags", nargs=-1)
 @click.pass_obj
-@require_active_env
+@fleet_or_active_env("reload")
 def env_reload(shepherd: ShepherdMng, envCfg: EnvironmentCfg):
     """Reload environment."""
     shepherd.environmentMng.reload_env(envCfg)
@@ -257,12 +569,18 @@ def env_reload(shepherd: ShepherdMng, envCfg: EnvironmentCfg):
 @click.pass_obj
 def env_render(shepherd: ShepherdMng, env_tag: str):
     """Render environment configuration."""
+    if shepherd.cli_flags.get("all"):
+        shepherd.environmentMng.fleet_env(
+            "render", [env_tag] if env_tag else []
+        )
+        return
     click.echo(shepherd.environmentMng.render_env(env_tag))
 
 
 @env.command(name="status")
+@click.argument("env_tags", nargs=-1)
 @click.pass_obj
-@require_active_env
+@fleet_or_active_env("status")
 def env_status(shepherd: ShepherdMng, envCfg: EnvironmentCfg):
     """Print environment's status."""
     shepherd.environmentMng.status_env(envCfg)
@@ -305,11 +623,11 @@ def svc():
 
 
 @svc.command(name="build")
-@click.argument("service_template", type=str, required=True)
+@click.argument("service_templates", type=str, nargs=-1)
 @click.pass_obj
-def svc_build(shepherd: ShepherdMng, service_template: str):
-    """Build service image."""
-    shepherd.serviceMng.build_image_svc(service_template)
+def svc_build(shepherd: ShepherdMng, service_templates: tuple[str, ...]):
+    """Build the images of the service templates, or of all of them."""
+    shepherd.serviceMng.build_image_svc(list(service_templates))
 
 
 @svc.command(name="up")
@@ -350,11 +668,36 @@ def svc_render(shepherd: ShepherdMng, envCfg: EnvironmentCfg, service_tag: str):
 
 @svc.command(name="stdout")
 @click.argument("service_tag", type=str, required=True)
+@click.option(
+    "-n", "--tail", type=click.IntRange(min=0), help="Show the last N lines."
+)
+@click.option(
+    "--since", help="Show lines from a timestamp, date or duration ago."
+)
+@click.option(
+    "--until", help="Show lines before a timestamp, date or duration ago."
+)
+@click.option(
+    "-c",
+    "--captured",
+    is_flag=True,
+    help="Show the local capture, appending the output not captured yet.",
+)
 @click.pass_obj
 @require_active_env
-def svc_stdout(shepherd: ShepherdMng, envCfg: EnvironmentCfg, service_tag: str):
+def svc_stdout(
+    shepherd: ShepherdMng,
+    envCfg: EnvironmentCfg,
+    service_tag: str,
+    tail: Optional[int],
+    since: Optional[str],
+    until: Optional[str],
+    captured: bool,
+):
     """Show service stdout."""
-    shepherd.serviceMng.stdout_svc(envCfg, service_tag)
+    shepherd.serviceMng.stdout_svc(
+        envCfg, service_tag, tail, since, until, captured
+    )
 
 
 @svc.command(name="shell")
@@ -366,5 +709,18 @@ def svc_shell(shepherd: ShepherdMng, envCfg: EnvironmentCfg, service_tag: str):
     shepherd.serviceMng.shell_svc(envCfg, service_tag)
 
 
+@cli.group()
+def system():
+    """System related operations."""
+    pass
+
+
+@system.command(name="df")
+@click.pass_obj
+def system_df(shepherd: ShepherdMng):
+    """Show the disk usage of the environment images."""
+    shepherd.environmentMng.cacheMng.disk_usage()
+
+
 if __name__ == "__main__":
     cli(obj=None)
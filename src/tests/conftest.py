@@ -0,0 +1,54 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Fixtures shared by the test modules that run against the fake docker
+engine.
+"""
+
+from __future__ import annotations
+
+from typing import Iterator
+
+import pytest
+from pytest_mock import MockerFixture
+
+from docker import DockerEngineClient
+from tests.docker_fake_engine import FakeEngine
+
+
+@pytest.fixture
+def fake_engine() -> Iterator[FakeEngine]:
+    engine = FakeEngine().start()
+    yield engine
+    engine.stop()
+
+
+@pytest.fixture
+def client(fake_engine: FakeEngine) -> Iterator[DockerEngineClient]:
+    client = DockerEngineClient(fake_engine.host)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def shared_client(
+    client: DockerEngineClient, mocker: MockerFixture
+) -> DockerEngineClient:
+    """The client the CLI commands get, talking to the fake engine."""
+    mocker.patch.object(DockerEngineClient, "_shared", client)
+    return client
@@ -0,0 +1,789 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process stand-in for the Docker Engine API, served on a Unix socket.
+
+It keeps containers in memory, honours the lifecycle endpoints, streams
+logs and events and runs exec commands through a pluggable handler, so
+that the engine client and the code built on it can be tested without a
+docker daemon.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import io
+import json
+import os
+import queue
+import re
+import shutil
+import socketserver
+import struct
+import tarfile
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Callable, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+ExecHandler = Callable[
+    ["FakeContainer", list[str], bytes], tuple[int, bytes, bytes]
+]
+
+
+@dataclass
+class FakeContainer:
+    id: str
+    name: str
+    image: str = ""
+    state: str = "created"
+    labels: dict[str, str] = field(default_factory=dict[str, str])
+    config: dict[str, Any] = field(default_factory=dict[str, Any])
+    logs: list[tuple[float, int, bytes]] = field(
+        default_factory=list[tuple[float, int, bytes]]
+    )
+    memory: int = 64 * 1024 * 1024
+    started_at: float = 0
+    tty: bool = False
+    mounts: list[dict[str, Any]] = field(default_factory=list[dict[str, Any]])
+    ip_address: str = ""
+
+
+@dataclass
+class FakeExec:
+    id: str
+    container: FakeContainer
+    cmd: list[str]
+    stdin: bool
+    exit_code: Optional[int] = None
+    running: bool = False
+
+
+class FakeEngine:
+
+    def __init__(self):
+        self.dir = tempfile.mkdtemp(prefix="shpd-engine-")
+        self.socket_path = os.path.join(self.dir, "docker.sock")
+        self.containers: dict[str, FakeContainer] = {}
+        self.networks: dict[str, dict[str, Any]] = {}
+        self.volumes: dict[str, dict[str, Any]] = {}
+        self.images: dict[str, dict[str, Any]] = {}
+        self.execs: dict[str, FakeExec] = {}
+        self.subscribers: list[queue.Queue[Optional[dict[str, Any]]]] = []
+        self.requests: list[tuple[str, str]] = []
+        self.connections = 0
+        self.lock = threading.RLock()
+        self.logs_cond = threading.Condition(self.lock)
+        self.exec_handler: ExecHandler = lambda c, cmd, stdin: (0, b"", b"")
+        self.delays: dict[str, float] = {}
+        # how long an exec is still reported running once its output ended
+        self.exec_exit_delay = 0.0
+        self.build_cache: set[str] = set()
+        self.builds: list[tuple[str, float, float]] = []
+        self.server: Optional[socketserver.ThreadingUnixStreamServer] = None
+
+    @property
+    def host(self) -> str:
+        return f"unix://{self.socket_path}"
+
+    def start(self) -> FakeEngine:
+        engine = self
+
+        class Handler(FakeEngineHandler):
+            fake = engine
+
+        class Server(socketserver.ThreadingUnixStreamServer):
+            daemon_threads = True
+
+            def get_request(self):  # type: ignore[override]
+                with engine.lock:
+                    engine.connections += 1
+                return super().get_request()
+
+        self.server = Server(self.socket_path, Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        with self.lock:
+            for sub in self.subscribers:
+                sub.put(None)
+            self.logs_cond.notify_all()
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def add_container(
+        self,
+        name: str,
+        state: str = "created",
+        labels: Optional[dict[str, str]] = None,
+        image: str = "",
+    ) -> FakeContainer:
+        with self.lock:
+            container = FakeContainer(
+                id=uuid.uuid4().hex,
+                name=name,
+                image=image,
+                state=state,
+                labels=labels or {},
+            )
+            self.containers[container.id] = container
+            return container
+
+    def add_log(self, name: str, line: bytes, stream: int = 1, ts: float = 0):
+        with self.lock:
+            container = self.find(name)
+            assert container
+            container.logs.append((ts or time.time(), stream, line))
+            self.logs_cond.notify_all()
+
+    def find(self, name: str) -> Optional[FakeContainer]:
+        with self.lock:
+            for container in self.containers.values():
+                if name in (container.id, container.name):
+                    return container
+        return None
+
+    def emit(self, action: str, container: FakeContainer):
+        event = {
+            "Type": "container",
+            "Action": action,
+            "status": action,
+            "id": container.id,
+            "Actor": {
+                "ID": container.id,
+                "Attributes": {"name": container.name, **container.labels},
+            },
+            "time": int(time.time()),
+            "timeNano": time.time_ns(),
+        }
+        with self.lock:
+            for sub in self.subscribers:
+                sub.put(event)
+
+
+class FakeEngineHandler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+    fake: FakeEngine
+
+    def log_message(self, format: str, *args: Any):
+        pass
+
+    # Plumbing
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def do_DELETE(self):
+        self.dispatch("DELETE")
+
+    def dispatch(self, method: str):
+        url = urlparse(self.path)
+        path = re.sub(r"^/v[0-9.]+", "", url.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        with self.fake.lock:
+            self.fake.requests.append((method, path))
+        delay = self.fake.delays.get(path.rsplit("/", 1)[-1])
+        if delay:
+            time.sleep(delay)
+        length = int(self.headers.get("Content-Length") or 0)
+        if self.headers.get("Transfer-Encoding") == "chunked":
+            self.body = self.read_chunked()
+        else:
+            self.body = self.rfile.read(length) if length else b""
+        for pattern, route_method, handler in ROUTES:
+            match = re.fullmatch(pattern, path)
+            if match and route_method == method:
+                handler(self, *[unquote(g) for g in match.groups()])
+                return
+        self.send_json({"message": f"page not found: {path}"}, 404)
+
+    def read_chunked(self) -> bytes:
+        data = b""
+        while True:
+            size = int(self.rfile.readline().strip(), 16)
+            if size == 0:
+                self.rfile.readline()
+                return data
+            data += self.rfile.read(size)
+            self.rfile.readline()
+
+    def json_body(self) -> Any:
+        return json.loads(self.body) if self.body else {}
+
+    def send_json(self, obj: Any, status: int = 200):
+        data = json.dumps(obj).encode() if obj is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_empty(self, status: int = 204):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def start_chunked(self, content_type: str):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def container(self, name: str) -> Optional[FakeContainer]:
+        container = self.fake.find(name)
+        if not container:
+            self.send_json({"message": f"No such container: {name}"}, 404)
+        return container
+
+    def flag(self, name: str) -> bool:
+        return self.query.get(name, "0") in ("1", "true", "True")
+
+    # System
+
+    def ping(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"OK")
+
+    def events(self):
+        sub: queue.Queue[Optional[dict[str, Any]]] = queue.Queue()
+        with self.fake.lock:
+            self.fake.subscribers.append(sub)
+        self.start_chunked("application/json")
+        try:
+            while (event := sub.get()) is not None:
+                self.write_chunk(json.dumps(event).encode() + b"\n")
+            self.end_chunked()
+        except OSError:
+            pass
+        finally:
+            with self.fake.lock:
+                self.fake.subscribers.remove(sub)
+        self.close_connection = True
+
+    # Containers
+
+    def has_label(self, c: FakeContainer, label: str) -> bool:
+        key, _, value = label.partition("=")
+        return key in c.labels and (not value or c.labels[key] == value)
+
+    def list_containers(self):
+        filters: dict[str, list[str]] = json.loads(
+            self.query.get("filters", "{}")
+        )
+        labels = filters.get("label", [])
+        result: list[dict[str, Any]] = []
+        with self.fake.lock:
+            for c in self.fake.containers.values():
+                if not self.flag("all") and c.state != "running":
+                    continue
+                if not all(self.has_label(c, lbl) for lbl in labels):
+                    continue
+                result.append(
+                    {
+                        "Id": c.id,
+                        "Names": [f"/{c.name}"],
+                        "Image": c.image,
+                        "State": c.state,
+                        "Status": c.state,
+                        "Labels": c.labels,
+                    }
+                )
+        self.send_json(result)
+
+    def inspect_container(self, name: str):
+        if c := self.container(name):
+            self.send_json(
+                {
+                    "Id": c.id,
+                    "Name": f"/{c.name}",
+                    "Image": c.image,
+                    "State": {
+                        "Status": c.state,
+                        "Running": c.state == "running",
+                        "Paused": c.state == "paused",
+                        "StartedAt": datetime.fromtimestamp(
+                            c.started_at, timezone.utc
+                        ).isoformat(),
+                    },
+                    "Config": {
+                        "Labels": c.labels,
+                        "Tty": c.tty,
+                        **c.config,
+                    },
+                    "HostConfig": c.config.get("HostConfig", {}),
+                    "Mounts": c.mounts,
+                    "NetworkSettings": self.network_settings(c),
+                }
+            )
+
+    def network_settings(self, c: FakeContainer) -> dict[str, Any]:
+        running = c.state == "running"
+        host_config: dict[str, Any] = c.config.get("HostConfig", {})
+        return {
+            "Ports": host_config.get("PortBindings", {}) if running else {},
+            "Networks": (
+                {"bridge": {"IPAddress": c.ip_address}}
+                if running and c.ip_address
+                else {}
+            ),
+        }
+
+    def create_container(self):
+        name = self.query.get("name", "")
+        if self.fake.find(name):
+            self.send_json({"message": f"Conflict: {name} in use"}, 409)
+            return
+        config = self.json_body()
+        c = self.fake.add_container(
+            name,
+            labels=config.get("Labels") or {},
+            image=config.get("Image", ""),
+        )
+        c.config = config
+        c.tty = bool(config.get("Tty"))
+        self.fake.emit("create", c)
+        self.send_json({"Id": c.id, "Warnings": []}, 201)
+
+    def transition(
+        self, name: str, states: tuple[str, ...], new: str, *actions: str
+    ):
+        if not (c := self.container(name)):
+            return
+        if c.state not in states:
+            self.send_empty(304)
+            return
+        if new == "running" and c.state != "paused":
+            c.started_at = time.time()
+        c.state = new
+        for action in actions:
+            self.fake.emit(action, c)
+        with self.fake.lock:
+            self.fake.logs_cond.notify_all()
+        self.send_empty()
+
+    def start_container(self, name: str):
+        self.transition(name, ("created", "exited"), "running", "start")
+
+    def stop_container(self, name: str):
+        self.transition(name, ("running", "paused"), "exited", "die", "stop")
+
+    def restart_container(self, name: str):
+        self.transition(
+            name, ("created", "running", "exited"), "running", "restart"
+        )
+
+    def kill_container(self, name: str):
+        self.transition(name, ("running", "paused"), "exited", "kill", "die")
+
+    def pause_container(self, name: str):
+        self.transition(name, ("running",), "paused", "pause")
+
+    def unpause_container(self, name: str):
+        self.transition(name, ("paused",), "running", "unpause")
+
+    def remove_container(self, name: str):
+        if not (c := self.container(name)):
+            return
+        if c.state == "running" and not self.flag("force"):
+            self.send_json({"message": "container is running"}, 409)
+            return
+        with self.fake.lock:
+            del self.fake.containers[c.id]
+        self.fake.emit("destroy", c)
+        self.send_empty()
+
+    def rename_container(self, name: str):
+        if c := self.container(name):
+            c.name = self.query["name"]
+            self.fake.emit("rename", c)
+            self.send_empty()
+
+    def stats_container(self, name: str):
+        if c := self.container(name):
+            self.send_json({"memory_stats": {"usage": c.memory}})
+
+    def logs(self, name: str):
+        if not (c := self.container(name)):
+            return
+        tail = self.query.get("tail", "all")
+        since = float(self.query.get("since", 0) or 0)
+        until = float(self.query.get("until", 0) or 0)
+        stamps = self.flag("timestamps")
+
+        def select(entries: list[tuple[float, int, bytes]]):
+            chosen = [
+                e
+                for e in entries
+                if e[0] >= since and (not until or e[0] < until)
+            ]
+            return chosen
+
+        def frame(entry: tuple[float, int, bytes]) -> bytes:
+            ts, stream, line = entry
+            if stamps:
+                stamp = time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(ts))
+                line = f"{stamp}.{int(ts % 1 * 1e9):09d}Z ".encode() + line
+            return struct.pack(">BxxxL", stream, len(line)) + line
+
+        with self.fake.lock:
+            entries = select(c.logs)
+        if tail != "all":
+            entries = entries[-int(tail) :] if int(tail) else []
+        self.start_chunked("application/vnd.docker.multiplexed-stream")
+        try:
+            if entries:
+                self.write_chunk(b"".join(frame(e) for e in entries))
+            sent = len(c.logs)
+            while self.flag("follow"):
+                with self.fake.lock:
+                    self.fake.logs_cond.wait_for(
+                        lambda: len(c.logs) > sent
+                        or c.state != "running"
+                        or self.fake.server is None,
+                        timeout=0.5,
+                    )
+                    new = c.logs[sent:]
+                    sent = len(c.logs)
+                    running = c.state == "running"
+                if new:
+                    self.write_chunk(b"".join(frame(e) for e in new))
+                if not running:
+                    break
+            self.end_chunked()
+        except OSError:
+            self.close_connection = True
+
+    # Networks
+
+    def list_networks(self):
+        with self.fake.lock:
+            self.send_json(list(self.fake.networks.values()))
+
+    def inspect_network(self, name: str):
+        with self.fake.lock:
+            network = self.fake.networks.get(name)
+        if not network:
+            self.send_json({"message": f"network {name} not found"}, 404)
+            return
+        self.send_json(network)
+
+    def create_network(self):
+        config = self.json_body()
+        name = config["Name"]
+        with self.fake.lock:
+            if name in self.fake.networks:
+                self.send_json({"message": f"network {name} exists"}, 409)
+                return
+            self.fake.networks[name] = {
+                "Id": uuid.uuid4().hex,
+                "Name": name,
+                "Labels": config.get("Labels") or {},
+                "Containers": {},
+            }
+            self.send_json({"Id": self.fake.networks[name]["Id"]}, 201)
+
+    def remove_network(self, name: str):
+        with self.fake.lock:
+            if not self.fake.networks.pop(name, None):
+                self.send_json({"message": f"network {name} not found"}, 404)
+                return
+        self.send_empty()
+
+    def connect_network(self, name: str):
+        config = self.json_body()
+        with self.fake.lock:
+            network = self.fake.networks.get(name)
+            c = self.fake.find(config["Container"])
+            if not network or not c:
+                self.send_json({"message": "not found"}, 404)
+                return
+            network["Containers"][c.id] = {"Name": c.name}
+        self.send_empty(200)
+
+    # Volumes
+
+    def list_volumes(self):
+        with self.fake.lock:
+            self.send_json({"Volumes": list(self.fake.volumes.values())})
+
+    def create_volume(self):
+        config = self.json_body()
+        name = config.get("Name") or uuid.uuid4().hex
+        with self.fake.lock:
+            volume = self.fake.volumes.setdefault(
+                name, {"Name": name, "Labels": config.get("Labels") or {}}
+            )
+        self.send_json(volume, 201)
+
+    def remove_volume(self, name: str):
+        with self.fake.lock:
+            if not self.fake.volumes.pop(name, None):
+                self.send_json({"message": f"no such volume: {name}"}, 404)
+                return
+        self.send_empty()
+
+    # Images
+
+    def find_image(self, name: str) -> Optional[dict[str, Any]]:
+        with self.fake.lock:
+            if image := self.fake.images.get(name):
+                return image
+            return next(
+                (i for i in self.fake.images.values() if i["Id"] == name),
+                None,
+            )
+
+    def inspect_image(self, name: str):
+        image = self.find_image(name)
+        if not image:
+            self.send_json({"message": f"No such image: {name}"}, 404)
+            return
+        self.send_json(image)
+
+    def pull_image(self):
+        name = self.query["fromImage"]
+        if tag := self.query.get("tag"):
+            name = f"{name}:{tag}"
+        self.start_chunked("application/json")
+        if name.startswith("missing"):
+            error = {"error": f"pull access denied for {name}"}
+            self.write_chunk(json.dumps(error).encode())
+        else:
+            with self.fake.lock:
+                self.fake.images[name] = {
+                    "Id": f"sha256:{uuid.uuid4().hex}",
+                    "RepoTags": [name],
+                }
+            for layer in ("layer-a", "layer-b"):
+                for message in (
+                    {"status": "Pulling fs layer", "id": layer},
+                    {
+                        "status": "Downloading",
+                        "id": layer,
+                        "progressDetail": {"current": 500, "total": 1000},
+                    },
+                    {"status": "Pull complete", "id": layer},
+                ):
+                    self.write_chunk(json.dumps(message).encode())
+            status = {"status": f"Downloaded newer image for {name}"}
+            self.write_chunk(json.dumps(status).encode())
+        self.end_chunked()
+
+    def build_image(self):
+        tag = self.query["t"]
+        dockerfile = self.query.get("dockerfile", "Dockerfile")
+        with tarfile.open(fileobj=io.BytesIO(self.body)) as tar:
+            files: dict[str, bytes] = {}
+            for member in tar.getmembers():
+                if f := tar.extractfile(member):
+                    files[member.name] = f.read()
+        instructions = [
+            line.strip()
+            for line in files.get(dockerfile, b"").decode().splitlines()
+            if line.strip() and not line.strip().startswith("#")
+        ]
+        context = hashlib.sha256(
+            json.dumps({k: v.hex() for k, v in sorted(files.items())}).encode()
+        ).hexdigest()
+        started = time.monotonic()
+        self.start_chunked("application/json")
+        parent = ""
+        for n, instruction in enumerate(instructions, 1):
+            step = f"Step {n}/{len(instructions)} : {instruction}\n"
+            self.write_chunk(json.dumps({"stream": step}).encode())
+            keyword, _, arg = instruction.partition(" ")
+            if keyword.upper() == "FROM":
+                with self.fake.lock:
+                    base = self.fake.images.get(arg.split()[0])
+                if not base:
+                    error = {"error": f"pull access denied for {arg}"}
+                    self.write_chunk(json.dumps(error).encode())
+                    self.end_chunked()
+                    return
+                parent = base["Id"]
+                continue
+            if keyword.upper() in ("COPY", "ADD"):
+                instruction += context
+            layer = hashlib.sha256((parent + instruction).encode()).hexdigest()
+            with self.fake.lock:
+                cached = layer in self.fake.build_cache
+                self.fake.build_cache.add(layer)
+            if cached:
+                stream = {"stream": " ---> Using cache\n"}
+                self.write_chunk(json.dumps(stream).encode())
+            else:
+                time.sleep(self.fake.delays.get("build-step", 0))
+            parent = layer
+        image_id = f"sha256:{parent}"
+        with self.fake.lock:
+            self.fake.images[tag] = {"Id": image_id, "RepoTags": [tag]}
+            self.fake.builds.append((tag, started, time.monotonic()))
+        self.write_chunk(json.dumps({"aux": {"ID": image_id}}).encode())
+        stream = {"stream": f"Successfully tagged {tag}\n"}
+        self.write_chunk(json.dumps(stream).encode())
+        self.end_chunked()
+
+    def tag_image(self, name: str):
+        if image := self.find_image(name):
+            target = f"{self.query['repo']}:{self.query['tag']}"
+            with self.fake.lock:
+                self.fake.images[target] = image
+        if not image:
+            self.send_json({"message": f"No such image: {name}"}, 404)
+            return
+        self.send_json(None, 201)
+
+    # Exec
+
+    def exec_create(self, name: str):
+        if not (c := self.container(name)):
+            return
+        config = self.json_body()
+        ex = FakeExec(
+            id=uuid.uuid4().hex,
+            container=c,
+            cmd=config.get("Cmd", []),
+            stdin=bool(config.get("AttachStdin")),
+        )
+        with self.fake.lock:
+            self.fake.execs[ex.id] = ex
+        self.send_json({"Id": ex.id}, 201)
+
+    def exec_start(self, exec_id: str):
+        ex = self.fake.execs.get(exec_id)
+        if not ex:
+            self.send_json({"message": "No such exec instance"}, 404)
+            return
+        ex.running = True
+        if self.headers.get("Upgrade") == "tcp":
+            self.send_response(101)
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Upgrade", "tcp")
+            self.end_headers()
+            self.wfile.flush()
+            stdin = b""
+            if ex.stdin:
+                while chunk := self.rfile.read1(65536):
+                    stdin += chunk
+            code, out, err = self.fake.exec_handler(ex.container, ex.cmd, stdin)
+            self.end_exec(ex, code)
+            for stream, data in ((1, out), (2, err)):
+                if data:
+                    self.wfile.write(
+                        struct.pack(">BxxxL", stream, len(data)) + data
+                    )
+            self.wfile.flush()
+            self.close_connection = True
+            return
+        code, out, err = self.fake.exec_handler(ex.container, ex.cmd, b"")
+        self.end_exec(ex, code)
+        self.start_chunked("application/vnd.docker.multiplexed-stream")
+        for stream, data in ((1, out), (2, err)):
+            if data:
+                self.write_chunk(
+                    struct.pack(">BxxxL", stream, len(data)) + data
+                )
+        self.end_chunked()
+
+    def end_exec(self, ex: FakeExec, code: int):
+        def end():
+            ex.exit_code, ex.running = code, False
+
+        if self.fake.exec_exit_delay:
+            threading.Timer(self.fake.exec_exit_delay, end).start()
+        else:
+            end()
+
+    def exec_inspect(self, exec_id: str):
+        ex = self.fake.execs.get(exec_id)
+        if not ex:
+            self.send_json({"message": "No such exec instance"}, 404)
+            return
+        self.send_json({"ExitCode": ex.exit_code, "Running": ex.running})
+
+    def exec_resize(self, exec_id: str):
+        self.send_empty(201)
+
+
+ROUTES: list[tuple[str, str, Callable[..., None]]] = [
+    (r"/_ping", "GET", FakeEngineHandler.ping),
+    (r"/events", "GET", FakeEngineHandler.events),
+    (r"/containers/json", "GET", FakeEngineHandler.list_containers),
+    (r"/containers/create", "POST", FakeEngineHandler.create_container),
+    (r"/containers/([^/]+)/json", "GET", FakeEngineHandler.inspect_container),
+    (r"/containers/([^/]+)/start", "POST", FakeEngineHandler.start_container),
+    (r"/containers/([^/]+)/stop", "POST", FakeEngineHandler.stop_container),
+    (
+        r"/containers/([^/]+)/restart",
+        "POST",
+        FakeEngineHandler.restart_container,
+    ),
+    (r"/containers/([^/]+)/kill", "POST", FakeEngineHandler.kill_container),
+    (r"/containers/([^/]+)/pause", "POST", FakeEngineHandler.pause_container),
+    (
+        r"/containers/([^/]+)/unpause",
+        "POST",
+        FakeEngineHandler.unpause_container,
+    ),
+    (
+        r"/containers/([^/]+)/rename",
+        "POST",
+        FakeEngineHandler.rename_container,
+    ),
+    (r"/containers/([^/]+)/stats", "GET", FakeEngineHandler.stats_container),
+    (r"/containers/([^/]+)/logs", "GET", FakeEngineHandler.logs),
+    (r"/containers/([^/]+)", "DELETE", FakeEngineHandler.remove_container),
+    (r"/containers/([^/]+)/exec", "POST", FakeEngineHandler.exec_create),
+    (r"/exec/([^/]+)/start", "POST", FakeEngineHandler.exec_start),
+    (r"/exec/([^/]+)/json", "GET", FakeEngineHandler.exec_inspect),
+    (r"/exec/([^/]+)/resize", "POST", FakeEngineHandler.exec_resize),
+    (r"/networks", "GET", FakeEngineHandler.list_networks),
+    (r"/networks/create", "POST", FakeEngineHandler.create_network),
+    (r"/networks/([^/]+)", "GET", FakeEngineHandler.inspect_network),
+    (r"/networks/([^/]+)", "DELETE", FakeEngineHandler.remove_network),
+    (r"/networks/([^/]+)/connect", "POST", FakeEngineHandler.connect_network),
+    (r"/volumes", "GET", FakeEngineHandler.list_volumes),
+    (r"/volumes/create", "POST", FakeEngineHandler.create_volume),
+    (r"/volumes/([^/]+)", "DELETE", FakeEngineHandler.remove_volume),
+    (r"/images/create", "POST", FakeEngineHandler.pull_image),
+    (r"/images/(.+)/json", "GET", FakeEngineHandler.inspect_image),
+    (r"/images/(.+)/tag", "POST", FakeEngineHandler.tag_image),
+    (r"/build", "POST", FakeEngineHandler.build_image),
+]
@@ -0,0 +1,417 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+In-process stand-in for an FTP server, serving a directory.
+
+It implements the subset of RFC 959 and RFC 3659 the registry client
+uses, passive data connections, REST offsets on RETR and STOR, and can
+cut transfers to exercise resumption. Run as a script, it benchmarks
+the registry client against it.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import shutil
+import socket
+import socketserver
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+BLOCK_SIZE = 1 << 16
+
+
+class FakeFtpServer:
+
+    def __init__(self, root: str, user: str = "", psw: str = ""):
+        self.root = os.path.realpath(root)
+        self.user = user
+        self.psw = psw
+        self.server: Optional[socketserver.ThreadingTCPServer] = None
+        self.lock = threading.Lock()
+        self.logins = 0
+        self.commands: list[str] = []
+        # Bytes after which the next data transfers are cut, one per entry.
+        self.cuts: list[int] = []
+        self.sent = 0
+        self.stored = 0
+
+    @property
+    def port(self) -> int:
+        assert self.server
+        return self.server.server_address[1]
+
+    @property
+    def address(self) -> str:
+        return f"127.0.0.1:{self.port}"
+
+    def start(self) -> FakeFtpServer:
+        fake = self
+
+        class Handler(FakeFtpHandler):
+            server_fake = fake
+
+        class Server(socketserver.ThreadingTCPServer):
+            daemon_threads = True
+            allow_reuse_address = True
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def cut(self) -> Optional[int]:
+        with self.lock:
+            return self.cuts.pop(0) if self.cuts else None
+
+    def record(self, command: str):
+        with self.lock:
+            self.commands.append(command)
+
+    def count(self, verb: str) -> int:
+        return sum(1 for c in self.commands if c.split(" ", 1)[0] == verb)
+
+
+class FakeFtpHandler(socketserver.StreamRequestHandler):
+    server_fake: FakeFtpServer
+
+    def setup(self):
+        super().setup()
+        self.cwd = "/"
+        self.rest = 0
+        self.user = ""
+        self.logged = False
+        self.rename_from: Optional[str] = None
+        self.passive: Optional[socket.socket] = None
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode())
+        self.wfile.flush()
+
+    def handle(self):
+        self.reply("220 shepherd fake ftp")
+        while line := self.rfile.readline():
+            command = line.decode().rstrip("\r\n")
+            verb, _, arg = command.partition(" ")
+            verb = verb.upper()
+            self.server_fake.record(f"{verb} {arg}".rstrip())
+            if verb == "QUIT":
+                self.reply("221 bye")
+                break
+            if not self.logged and verb not in ("USER", "PASS"):
+                self.reply("530 not logged in")
+                continue
+            handler = getattr(self, f"do_{verb}", None)
+            if handler is None:
+                self.reply(f"502 {verb} not implemented")
+                continue
+            try:
+                handler(arg)
+            except OSError as e:
+                self.reply(f"451 {e}")
+            if verb != "REST":
+                self.rest = 0
+        if self.passive:
+            self.passive.close()
+
+    def local(self, arg: str) -> str:
+        path = os.path.normpath(os.path.join(self.cwd, arg or "."))
+        return os.path.join(self.server_fake.root, path.lstrip("/"))
+
+    def do_USER(self, arg: str):
+        self.user = arg
+        self.reply("331 password required")
+
+    def do_PASS(self, arg: str):
+        fake = self.server_fake
+        if fake.user and (self.user != fake.user or arg != fake.psw):
+            self.reply("530 login incorrect")
+            return
+        self.logged = True
+        with fake.lock:
+            fake.logins += 1
+        self.reply("230 logged in")
+
+    def do_TYPE(self, arg: str):
+        self.reply("200 type set")
+
+    def do_NOOP(self, arg: str):
+        self.reply("200 ok")
+
+    def do_FEAT(self, arg: str):
+        self.wfile.write(b"211-features\r\n SIZE\r\n MDTM\r\n REST STREAM\r\n")
+        self.wfile.write(b" MLSD\r\n")
+        self.reply("211 end")
+
+    def do_OPTS(self, arg: str):
+        self.reply("200 ok")
+
+    def do_PWD(self, arg: str):
+        self.reply(f'257 "{self.cwd}"')
+
+    def do_CWD(self, arg: str):
+        path = os.path.normpath(os.path.join(self.cwd, arg))
+        if not os.path.isdir(self.local(path)):
+            self.reply("550 no such directory")
+            return
+        self.cwd = path
+        self.reply("250 ok")
+
+    def do_SIZE(self, arg: str):
+        path = self.local(arg)
+        if not os.path.isfile(path):
+            self.reply("550 no such file")
+            return
+        self.reply(f"213 {os.path.getsize(path)}")
+
+    def do_MDTM(self, arg: str):
+        path = self.local(arg)
+        if not os.path.exists(path):
+            self.reply("550 no such file")
+            return
+        mtime = datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        self.reply(f"213 {mtime.strftime('%Y%m%d%H%M%S')}")
+
+    def do_MKD(self, arg: str):
+        path = self.local(arg)
+        if os.path.exists(path):
+            self.reply("550 exists")
+            return
+        os.mkdir(path)
+        self.reply(f'257 "{arg}" created')
+
+    def do_DELE(self, arg: str):
+        path = self.local(arg)
+        if not os.path.isfile(path):
+            self.reply("550 no such file")
+            return
+        os.remove(path)
+        self.reply("250 deleted")
+
+    def do_RNFR(self, arg: str):
+        if not os.path.exists(self.local(arg)):
+            self.reply("550 no such file")
+            return
+        self.rename_from = self.local(arg)
+        self.reply("350 ready for RNTO")
+
+    def do_RNTO(self, arg: str):
+        if not self.rename_from:
+            self.reply("503 RNFR first")
+            return
+        os.replace(self.rename_from, self.local(arg))
+        self.rename_from = None
+        self.reply("250 renamed")
+
+    def do_REST(self, arg: str):
+        self.rest = int(arg)
+        self.reply(f"350 restarting at {self.rest}")
+
+    def do_PASV(self, arg: str):
+        if self.passive:
+            self.passive.close()
+        self.passive = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.passive.bind(("127.0.0.1", 0))
+        self.passive.listen(1)
+        port = self.passive.getsockname()[1]
+        self.reply(
+            f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 0xFF})"
+        )
+
+    def do_EPSV(self, arg: str):
+        self.do_PASV(arg)
+
+    def accept(self) -> Optional[socket.socket]:
+        if not self.passive:
+            self.reply("425 use PASV first")
+            return None
+        self.reply("150 opening data connection")
+        conn, _ = self.passive.accept()
+        self.passive.close()
+        self.passive = None
+        return conn
+
+    def do_RETR(self, arg: str):
+        path = self.local(arg)
+        if not os.path.isfile(path):
+            self.reply("550 no such file")
+            return
+        data = self.accept()
+        if not data:
+            return
+        cut = self.server_fake.cut()
+        sent = 0
+        try:
+            with data, open(path, "rb") as f:
+                f.seek(self.rest)
+                while block := f.read(BLOCK_SIZE):
+                    if cut is not None and sent + len(block) > cut:
+                        data.sendall(block[: cut - sent])
+                        sent = cut
+                        raise ConnectionAbortedError("transfer cut")
+                    data.sendall(block)
+                    sent += len(block)
+        except OSError:
+            self.reply("426 transfer aborted")
+            return
+        finally:
+            with self.server_fake.lock:
+                self.server_fake.sent += sent
+        self.reply("226 transfer complete")
+
+    def do_STOR(self, arg: str):
+        self.store(self.local(arg), "r+b" if self.rest else "wb")
+
+    def do_APPE(self, arg: str):
+        self.rest = os.path.getsize(self.local(arg))
+        self.store(self.local(arg), "r+b")
+
+    def store(self, path: str, mode: str):
+        if not os.path.isdir(os.path.dirname(path)):
+            self.reply("553 no such directory")
+            return
+        if mode == "r+b" and not os.path.exists(path):
+            mode = "wb"
+        data = self.accept()
+        if not data:
+            return
+        cut = self.server_fake.cut()
+        stored = 0
+        with data, open(path, mode) as f:
+            f.seek(self.rest)
+            f.truncate()
+            while block := data.recv(BLOCK_SIZE):
+                if cut is not None and stored + len(block) > cut:
+                    f.write(block[: cut - stored])
+                    stored = cut
+                    break
+                f.write(block)
+                stored += len(block)
+        with self.server_fake.lock:
+            self.server_fake.stored += stored
+        if cut is not None and stored == cut:
+            self.reply("426 transfer aborted")
+            return
+        self.reply("226 transfer complete")
+
+    def listing(self, arg: str) -> Optional[list[str]]:
+        path = self.local(arg)
+        if not os.path.isdir(path):
+            self.reply("550 no such directory")
+            return None
+        return sorted(os.listdir(path))
+
+    def send_lines(self, lines: list[str]):
+        data = self.accept()
+        if not data:
+            return
+        with data:
+            data.sendall("".join(f"{line}\r\n" for line in lines).encode())
+        self.reply("226 transfer complete")
+
+    def do_NLST(self, arg: str):
+        names = self.listing(arg)
+        if names is not None:
+            self.send_lines(names)
+
+    def do_LIST(self, arg: str):
+        self.do_NLST(arg)
+
+    def do_MLSD(self, arg: str):
+        names = self.listing(arg)
+        if names is None:
+            return
+        lines: list[str] = []
+        for name in names:
+            st = os.stat(os.path.join(self.local(arg), name))
+            kind = (
+                "dir"
+                if os.path.isdir(os.path.join(self.local(arg), name))
+                else "file"
+            )
+            modify = datetime.fromtimestamp(st.st_mtime, timezone.utc)
+            lines.append(
+                f"type={kind};size={st.st_size};"
+                f"modify={modify.strftime('%Y%m%d%H%M%S.%f')}; {name}"
+            )
+        self.send_lines(lines)
+
+
+def benchmark(size_mb: int, images: int, connections: int, part_mb: int):
+    """Measure the registry client throughput against the stand-in."""
+    sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+    from registry import FtpRegistry
+
+    work = tempfile.mkdtemp()
+    try:
+        root = os.path.join(work, "root")
+        local = os.path.join(work, "local")
+        os.makedirs(os.path.join(root, "imgs"))
+        os.makedirs(local)
+        block = os.urandom(1 << 20)
+        for i in range(images):
+            with open(os.path.join(local, f"img-{i}"), "wb") as f:
+                for _ in range(size_mb):
+                    f.write(block)
+        server = FakeFtpServer(root).start()
+        registry = FtpRegistry(
+            "127.0.0.1",
+            "imgs",
+            port=server.port,
+            connections=connections,
+            part_size=part_mb << 20,
+        )
+        names = [f"img-{i}" for i in range(images)]
+        total = size_mb * images
+        start = time.monotonic()
+        registry.upload_many(
+            [(os.path.join(local, n), n) for n in names], connections
+        )
+        up = time.monotonic() - start
+        start = time.monotonic()
+        registry.download_many(
+            [(n, os.path.join(local, f"{n}.down")) for n in names], connections
+        )
+        down = time.monotonic() - start
+        registry.close()
+        server.stop()
+        print(f"upload:   {total} MB in {up:.2f}s, {total / up:.1f} MB/s")
+        print(f"download: {total} MB in {down:.2f}s, {total / down:.1f} MB/s")
+        print(f"connections opened: {server.logins}")
+    finally:
+        shutil.rmtree(work)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=benchmark.__doc__)
+    parser.add_argument("--size", type=int, default=64, help="MB per image")
+    parser.add_argument("--images", type=int, default=4)
+    parser.add_argument("--connections", type=int, default=4)
+    parser.add_argument("--part", type=int, default=16, help="MB per range")
+    args = parser.parse_args()
+    benchmark(args.size, args.images, args.connections, args.part)
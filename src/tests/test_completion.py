@@ -773,6 +773,40 @@ def test_completion_db_sql_shell(
     assert completions == ["red", "white"], "Expected sql-shell completion"
 
 
+@pytest.mark.compl
+@pytest.mark.parametrize("expanduser_side_effects", [1])
+def test_completion_db_rollback(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    shpd_json = shpd_dir / ".shpd.json"
+    shpd_json.write_text(shpd_config)
+    checkpoints = shpd_dir / ".checkpoints" / "test-1" / "red"
+    for created, name in [(2, "seeded"), (1, "empty")]:
+        (checkpoints / name).mkdir(parents=True)
+        (checkpoints / name / "checkpoint.json").write_text(
+            f'{{"name": "{name}", "created": {created}, "size": 0, '
+            f'"reflinked": 0, "source": "/data"}}'
+        )
+    (checkpoints / ".partial.tmp").mkdir()
+
+    sm = ShepherdMng()
+    completions = sm.completionMng.get_completions(["db", "rollback"])
+    assert completions == ["red", "white"], "Expected service tags"
+    completions = sm.completionMng.get_completions(["db", "rollback", "red"])
+    assert completions == ["empty", "seeded"], "Expected checkpoints"
+    completions = sm.completionMng.get_completions(["db", "prune", "white"])
+    assert completions == [], "Expected no checkpoints"
+
+
 @pytest.mark.compl
 @pytest.mark.parametrize("expanduser_side_effects", [1])
 def test_completion_svc_commands(
@@ -0,0 +1,816 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import gzip
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+from typing import Iterable
+
+import pytest
+from click.testing import CliRunner
+from pytest_mock import MockerFixture
+
+from database.dump import QUEUE_BATCHES, DumpImporter
+from database.engines import OracleEngine, PostgresEngine
+from database.provision import ProvisionManifest
+from docker import DockerEngineClient
+from shepctl import cli
+from tests.docker_fake_engine import FakeContainer, FakeEngine
+
+values = """
+  # PostgreSQL (pg) Configuration
+  pg_image=ghcr.io/lunaticfringers/shepherd/postgres:17-3.5
+  pg_empty_env=fresh-pg-1735
+  pg_listener_port=5432
+
+  # SHPD Registry Configuration
+  shpd_registry=ftp.example.com
+  shpd_registry_ftp_usr=
+  shpd_registry_ftp_psw=
+  shpd_registry_ftp_shpd_path=shpd
+  shpd_registry_ftp_imgs_path=imgs
+
+  # Host and Domain Configuration
+  host_inet_ip=127.0.0.1
+  domain=sslip.io
+  dns_type=autoresolving
+
+  # Certificate Authority (CA) Configuration
+  ca_country=IT
+  ca_state=MS
+  ca_locality=Carrara
+  ca_org=LunaticFringe
+  ca_org_unit=Development
+  ca_cn=sslip.io
+  ca_email=lf@sslip.io
+  ca_passphrase=test
+
+  # Certificate Configuration
+  cert_country=IT
+  cert_state=MS
+  cert_locality=Carrara
+  cert_org=LunaticFringe
+  cert_org_unit=Development
+  cert_cn=sslip.io
+  cert_email=lf@sslip.io
+  cert_subject_alternative_names=
+
+  shpd_dir=~/shpd
+
+  # Database Default Configuration
+  db_sys_usr=sys
+  db_sys_psw=sys
+  db_usr=docker
+  db_psw=docker
+
+  # Logging Configuration
+  log_file=~/shpd/shepctl.log
+  log_level=WARNING
+  log_stdout=false
+  log_format=%(asctime)s - %(levelname)s - %(message)s
+  """
+
+shpd_config_db = """
+{
+  "logging": {
+    "file": "${log_file}",
+    "level": "${log_level}",
+    "stdout": "${log_stdout}",
+    "format": "${log_format}"
+  },
+  "shpd_registry": {
+    "ftp_server": "${shpd_registry}",
+    "ftp_user": "${shpd_registry_ftp_usr}",
+    "ftp_psw": "${shpd_registry_ftp_psw}",
+    "ftp_shpd_path": "${shpd_registry_ftp_shpd_path}",
+    "ftp_env_imgs_path": "${shpd_registry_ftp_imgs_path}"
+  },
+  "host_inet_ip": "${host_inet_ip}",
+  "domain": "${domain}",
+  "dns_type": "${dns_type}",
+  "ca": {
+    "country": "${ca_country}",
+    "state": "${ca_state}",
+    "locality": "${ca_locality}",
+    "organization": "${ca_org}",
+    "organizational_unit": "${ca_org_unit}",
+    "common_name": "${ca_cn}",
+    "email": "${ca_email}",
+    "passphrase": "${ca_passphrase}"
+  },
+  "cert": {
+    "country": "${cert_country}",
+    "state": "${cert_state}",
+    "locality": "${cert_locality}",
+    "organization": "${cert_org}",
+    "organizational_unit": "${cert_org_unit}",
+    "common_name": "${cert_cn}",
+    "email": "${cert_email}",
+    "subject_alternative_names": []
+  },
+  "env_templates": [
+    {
+      "tag": "default",
+      "factory": "docker-compose",
+      "service_templates": [
+        {
+          "template": "default",
+          "tag": "service-default"
+        }
+      ],
+      "networks": [
+        {
+          "key": "shpdnet",
+          "name": "envnet",
+          "external": true
+        }
+      ]
+    }
+  ],
+  "service_templates": [
+    {
+      "tag": "default",
+      "factory": "docker",
+      "image": "test-image:latest",
+      "labels": [
+        "com.example.label1=value1",
+        "com.example.label2=value2"
+      ],
+      "workdir": "/test",
+      "volumes": [
+          "/home/test/.ssh:/home/test/.ssh",
+          "/etc/ssh:/etc/ssh"
+      ],
+      "ingress": false,
+      "empty_env": null,
+      "environment": [],
+      "ports": [
+        "80:80",
+        "443:443",
+        "8080:8080"
+      ],
+      "properties": {},
+      "networks": [
+        "default"
+      ],
+      "extra_hosts": [
+        "host.docker.internal:host-gateway"
+      ],
+      "subject_alternative_name": null
+    }
+  ],
+  "envs": [
+    {
+      "template": "default",
+      "factory": "docker-compose",
+      "tag": "test-1",
+      "services": [
+        {
+          "template": "default",
+          "factory": "docker",
+          "tag": "db",
+          "image": "ghcr.io/lunaticfringers/shepherd/postgres:17-3.5",
+          "labels": [
+            "com.example.label1=value1",
+            "com.example.label2=value2"
+          ],
+          "workdir": "/test",
+          "volumes": [
+              "/home/test/.ssh:/home/test/.ssh",
+              "/etc/ssh:/etc/ssh"
+          ],
+          "ingress": false,
+          "empty_env": null,
+          "environment": [],
+          "ports": [
+            "80:80",
+            "443:443",
+            "8080:8080"
+          ],
+          "properties": {
+            "db.user": "docker",
+            "db.name": "shop"
+          },
+          "networks": [
+            "default"
+          ],
+          "extra_hosts": [
+            "host.docker.internal:host-gateway"
+          ],
+          "subject_alternative_name": null
+        }
+      ],
+      "archived": false,
+      "active": true
+    }
+  ]
+}
+"""
+
+
+dump = b"""--
+-- PostgreSQL database dump
+--
+
+SET client_encoding = 'UTF8';
+SELECT pg_catalog.set_config('search_path', '', false);
+
+--
+-- Name: items; Type: TABLE; Schema: public; Owner: docker
+--
+
+CREATE TABLE public.items (id integer, name text);
+
+--
+-- Name: orders; Type: TABLE; Schema: public; Owner: docker
+--
+
+CREATE TABLE public.orders (id integer, item integer);
+
+--
+-- Data for Name: items; Type: TABLE DATA; Schema: public; Owner: docker
+--
+
+COPY public.items (id, name) FROM stdin;
+1\tbolt
+2\t-- Name: nut; Type: TABLE; Schema: public; Owner: docker
+\\.
+
+--
+-- Data for Name: orders; Type: TABLE DATA; Schema: public; Owner: docker
+--
+
+COPY public.orders (id, item) FROM stdin;
+1\t1
+\\.
+
+--
+-- Name: items items_pkey; Type: CONSTRAINT; Schema: public; Owner: docker
+--
+
+ALTER TABLE ONLY public.items ADD CONSTRAINT items_pkey PRIMARY KEY (id);
+
+--
+-- Name: items_name; Type: INDEX; Schema: public; Owner: docker
+--
+
+CREATE INDEX items_name ON public.items USING btree (name);
+
+--
+-- Name: orders_item; Type: INDEX; Schema: public; Owner: docker
+--
+
+CREATE INDEX orders_item ON public.orders USING btree (item);
+"""
+
+
+@pytest.fixture
+def temp_home(tmp_path: Path) -> Path:
+    temp_home = tmp_path / "home"
+    temp_home.mkdir()
+    (temp_home / ".shpd.conf").write_text(values)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir()
+    (shpd_dir / ".shpd.json").write_text(shpd_config_db)
+    return temp_home
+
+
+@pytest.fixture
+def runner() -> CliRunner:
+    return CliRunner()
+
+
+def make_expanduser_side_effect(path: Path, calls: int):
+    """Generate a list of `os.path.expanduser` return
+    values repeating [shpd, .shpd.conf, shpd/shepctl.log]."""
+    return [
+        (
+            path / ".shpd.conf"
+            if i % 3 == 0
+            else (
+                path / "shpd" if i % 3 == 1 else path / "shpd" / "shepctl.log"
+            )
+        )
+        for i in range(calls * 3)
+    ]
+
+
+class Sessions:
+    """Exec handler recording the sessions a dump is restored by."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.runs: list[tuple[list[str], bytes, float, float]] = []
+
+    def __call__(
+        self, c: FakeContainer, cmd: list[str], stdin: bytes
+    ) -> tuple[int, bytes, bytes]:
+        start = time.monotonic()
+        if b"FROM stdin" in stdin or b"CREATE INDEX" in stdin:
+            time.sleep(self.delay)
+        with self.lock:
+            self.runs.append((cmd, stdin, start, time.monotonic()))
+        if b"fail" in stdin:
+            return 3, b"", b"psql:<stdin>:9: ERROR:  relation exists\n"
+        return 0, b"", b""
+
+    def matching(self, data: bytes) -> list[tuple[float, float]]:
+        return [(s, e) for _, stdin, s, e in self.runs if data in stdin]
+
+
+@pytest.mark.db
+@pytest.mark.parametrize("expanduser_side_effects", [2])
+def test_db_import_parallel(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    sessions = Sessions(delay=0.3)
+    fake_engine.exec_handler = sessions
+    dump_file = temp_home / "shop.sql.gz"
+    dump_file.write_bytes(gzip.compress(dump))
+    fake_engine.add_container("db-test-1", state="running")
+    result = runner.invoke(cli, ["db", "import", "db", str(dump_file)])
+    assert result.exit_code == 0
+    assert result.output.split()[:6] == [
+        "Imported:",
+        "shop.sql.gz",
+        "into",
+        "db",
+        "(gzip,",
+        f"{len(dump_file.read_bytes()) / 1e6:.1f}",
+    ]
+    assert "7 objects, up to 2 parallel sessions" in " ".join(
+        result.output.split()
+    )
+
+    # schema, data in parallel, constraint, indexes in parallel
+    assert len(sessions.runs) == 6
+    for cmd, stdin, _, _ in sessions.runs:
+        assert cmd == [
+            "psql",
+            "-X",
+            "-q",
+            "-v",
+            "ON_ERROR_STOP=1",
+            "-U",
+            "docker",
+            "-d",
+            "shop",
+        ]
+        assert stdin.startswith(dump[: dump.index(b"\n--\n-- Name")])
+    schema = sessions.matching(b"CREATE TABLE public.orders")
+    data = sessions.matching(b"FROM stdin")
+    constraint = sessions.matching(b"ADD CONSTRAINT")
+    indexes = sessions.matching(b"CREATE INDEX")
+    assert len(schema) == 1 and len(data) == 2 and len(indexes) == 2
+    assert max(s for s, _ in data) < min(e for _, e in data)
+    assert schema[0][1] <= min(s for s, _ in data)
+    assert max(e for _, e in data) <= constraint[0][0]
+    assert constraint[0][1] <= min(s for s, _ in indexes)
+    # a data line looking like an entry header stays in its table data
+    assert len(sessions.matching(b"Name: nut")) == 1
+    assert sessions.matching(b"Name: nut") == sessions.matching(b"bolt")
+
+    # a failing session fails the import
+    dump_file.write_bytes(dump.replace(b"btree (item)", b"fail (item)"))
+    result = runner.invoke(
+        cli, ["db", "import", "db", str(dump_file), "-j", "1"]
+    )
+    assert result.exit_code == 1
+    assert "relation exists" in result.output
+
+
+@pytest.mark.db
+@pytest.mark.parametrize("expanduser_side_effects", [3])
+def test_db_import_formats(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    sessions = Sessions()
+    fake_engine.exec_handler = sessions
+    fake_engine.add_container("db-test-1", state="running")
+
+    # archives go to pg_restore as they are
+    archive = b"PGDMP\x01\x0f\x00" + bytes(range(256)) * 64
+    dump_file = temp_home / "shop.dump"
+    dump_file.write_bytes(archive)
+    result = runner.invoke(cli, ["db", "import", "db", str(dump_file)])
+    assert result.exit_code == 0
+    assert "(plain," in result.output
+    cmd, stdin, _, _ = sessions.runs[-1]
+    assert cmd[0] == "pg_restore" and stdin == archive
+
+    # scripts without entries run as a whole
+    script = b"CREATE TABLE t (id integer);\nINSERT INTO t VALUES (1);\n"
+    if shutil.which("zstd"):
+        zstd = subprocess.run(
+            ["zstd", "-q", "-c"], input=script, capture_output=True
+        )
+        dump_file = temp_home / "script.sql.zst"
+        dump_file.write_bytes(zstd.stdout)
+        compression = "zstd"
+    else:
+        dump_file = temp_home / "script.sql"
+        dump_file.write_bytes(script)
+        compression = "plain"
+    result = runner.invoke(cli, ["db", "import", "db", str(dump_file)])
+    assert result.exit_code == 0
+    assert f"({compression}," in result.output
+    assert "1 objects, up to 1 parallel sessions" in " ".join(
+        result.output.split()
+    )
+    assert sessions.runs[-1][1] == script
+
+    result = runner.invoke(cli, ["db", "import", "db", "missing.sql"])
+    assert result.exit_code == 1
+
+
+@pytest.mark.db
+def test_db_import_abort():
+    received: list[bytes] = []
+
+    def run(cmd: list[str], data: Iterable[bytes]) -> tuple[int, bytes]:
+        for chunk in data:
+            received.append(chunk)
+            time.sleep(0.2)
+        return 0, b""
+
+    importer = DumpImporter(PostgresEngine({}), run)
+    session = importer.begin(["psql"], b"head", True)
+    for _ in range(QUEUE_BATCHES):
+        session.queue.put(b"batch")
+    # a session with a full queue still ends, without its queued input
+    importer.abort()
+    assert not session.thread.is_alive()
+    assert received == [b"head"]
+
+
+def read_tree(path: Path) -> dict[str, str]:
+    return {
+        str(p.relative_to(path)): (
+            f"-> {os.readlink(p)}" if p.is_symlink() else p.read_text()
+        )
+        for p in path.rglob("*")
+        if p.is_symlink() or p.is_file()
+    }
+
+
+@pytest.mark.db
+@pytest.mark.parametrize("expanduser_side_effects", [16])
+def test_db_checkpoint_rollback(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    data = temp_home / "shpd" / "envs" / "test-1" / "pgdata"
+    (data / "base" / "1").mkdir(parents=True)
+    (data / "pg_tblspc").mkdir()
+    (data / "PG_VERSION").write_text("17\n")
+    (data / "base" / "1" / "1259").write_text("pages")
+    (data / "pg_tblspc" / "16384").symlink_to("../base")
+    data.chmod(0o700)
+    before = read_tree(data)
+    container = fake_engine.add_container("db-test-1", state="running")
+    container.mounts = [
+        {
+            "Type": "bind",
+            "Source": str(data),
+            "Destination": "/var/lib/postgresql/data",
+        }
+    ]
+
+    result = runner.invoke(cli, ["db", "checkpoint", "db", "before"])
+    assert result.exit_code == 0
+    assert result.output.startswith("Checkpointed: db to before (0.0 MB")
+    actions = [p for _, p in fake_engine.requests if p.endswith("pause")]
+    assert actions == [
+        "/containers/db-test-1/pause",
+        "/containers/db-test-1/unpause",
+    ]
+    assert container.state == "running"
+
+    (data / "base" / "1" / "1259").write_text("changed pages")
+    (data / "base" / "1" / "1260").write_text("new pages")
+    (data / "PG_VERSION").unlink()
+    after = read_tree(data)
+    result = runner.invoke(cli, ["db", "checkpoint", "db", "after"])
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ["db", "checkpoint", "db", "before"])
+    assert result.exit_code == 1
+    assert "already exists" in result.output
+    result = runner.invoke(cli, ["db", "checkpoint", "db", "../up"])
+    assert result.exit_code == 1
+
+    fake_engine.requests.clear()
+    result = runner.invoke(cli, ["db", "rollback", "db", "before"])
+    assert result.exit_code == 0
+    assert result.output.startswith("Rolled back: db to before")
+    assert read_tree(data) == before
+    assert data.stat().st_mode & 0o777 == 0o700
+    assert sorted(p.name for p in data.parent.iterdir()) == ["pgdata"]
+    actions = [
+        p
+        for _, p in fake_engine.requests
+        if p.endswith(("/stop", "/start", "pause"))
+    ]
+    assert actions == [
+        "/containers/db-test-1/stop",
+        "/containers/db-test-1/start",
+    ]
+    assert container.state == "running"
+
+    # the rolled back volume does not share its files with the
+    # checkpoint, which can be rolled back to again
+    (data / "base" / "1" / "1259").write_text("lost pages")
+    result = runner.invoke(cli, ["db", "rollback", "db", "after"])
+    assert result.exit_code == 0
+    assert read_tree(data) == after
+    result = runner.invoke(cli, ["db", "rollback", "db", "before"])
+    assert result.exit_code == 0
+    assert read_tree(data) == before
+    result = runner.invoke(cli, ["db", "rollback", "db", "missing"])
+    assert result.exit_code == 1
+    result = runner.invoke(cli, ["db", "rollback", "db", "../../x"])
+    assert result.exit_code == 1
+    assert "Invalid checkpoint name" in result.output
+
+    result = runner.invoke(cli, ["-p", "db", "checkpoints", "db"])
+    assert result.exit_code == 0
+    lines = [line.split() for line in result.output.splitlines()]
+    assert [line[0] for line in lines] == ["before", "after"]
+    assert [int(line[2]) for line in lines] == [8, 22]
+
+    result = runner.invoke(cli, ["db", "prune", "db"])
+    assert result.exit_code == 1
+    result = runner.invoke(cli, ["db", "prune", "db", "../before"])
+    assert result.exit_code == 1
+    assert "Invalid checkpoint name" in result.output
+    result = runner.invoke(cli, ["db", "prune", "db", "--keep", "1"])
+    assert result.exit_code == 0
+    assert result.output.split()[:2] == ["Pruned:", "before"]
+    result = runner.invoke(cli, ["db", "prune", "db", "--older-than", "1h"])
+    assert result.output == "No checkpoints to prune.\n"
+    # a bare number is an age in seconds
+    result = runner.invoke(cli, ["db", "prune", "db", "--older-than", "0"])
+    assert result.output.split()[:2] == ["Pruned:", "after"]
+
+    container.mounts = []
+    result = runner.invoke(cli, ["db", "checkpoint", "db", "later"])
+    assert result.exit_code == 1
+    assert "no volume mounted" in result.output
+
+
+manifest = """
+users:
+  - name: app
+    password: "it's secret"
+  - reporting
+grants:
+  - privileges: [SELECT, INSERT]
+    on: table public.orders
+    to: app
+  - privileges: readers
+    to: reporting
+remove_users:
+  - legacy
+"""
+
+
+class FakePostgres:
+    """
+    Exec handler running provisioning scripts, a step being done when
+    its condition, told apart by its text, was not met yet.
+    """
+
+    STEP = re.compile(
+        r"DO \$shpd\$ BEGIN IF (.*?) THEN .*?RAISE NOTICE '%', '(.*?)'; "
+        r"END IF; END \$shpd\$;"
+    )
+
+    def __init__(self, roles: set[str]):
+        self.roles = roles
+        self.done: set[str] = set()
+        self.scripts: list[bytes] = []
+
+    def __call__(
+        self, c: FakeContainer, cmd: list[str], stdin: bytes
+    ) -> tuple[int, bytes, bytes]:
+        self.scripts.append(stdin)
+        if b"public.missing" in stdin:
+            return 3, b"", b'psql:<stdin>:4: ERROR:  relation "missing"\n'
+        notices = b""
+        for condition, change in self.STEP.findall(stdin.decode()):
+            role = re.search(r"rolname = '(.*?)'", condition)
+            if condition.startswith("EXISTS"):
+                met = role is not None and role.group(1) in self.roles
+                if role:
+                    self.roles.discard(role.group(1))
+            elif role:
+                met = role.group(1) not in self.roles
+                self.roles.add(role.group(1))
+            else:
+                met = condition not in self.done
+                self.done.add(condition)
+            if met:
+                notices += b"psql:<stdin>:1: NOTICE:  " + change.encode()
+                notices += b"\n"
+        return 0, b"", notices
+
+
+@pytest.mark.db
+@pytest.mark.parametrize("expanduser_side_effects", [5])
+def test_db_provision(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    postgres = FakePostgres({"postgres", "reporting", "legacy"})
+    fake_engine.exec_handler = postgres
+    manifest_file = temp_home / "users.yaml"
+    manifest_file.write_text(manifest)
+    fake_engine.add_container("db-test-1", state="running")
+
+    result = runner.invoke(cli, ["db", "provision", "db", str(manifest_file)])
+    assert result.exit_code == 0
+    assert result.output.splitlines() == [
+        "Provisioned: db (5 changes)",
+        " - created user app",
+        " - granted SELECT on table public.orders to app",
+        " - granted INSERT on table public.orders to app",
+        " - granted readers to reporting",
+        " - removed user legacy",
+    ]
+    # a single session, in a transaction
+    assert len(postgres.scripts) == 1
+    script = postgres.scripts[0].decode()
+    assert script.startswith("BEGIN;\n") and script.endswith("COMMIT;\n")
+    assert "PASSWORD 'it''s secret'" in script
+    assert postgres.roles == {"postgres", "reporting", "app"}
+
+    result = runner.invoke(cli, ["db", "provision", "db", str(manifest_file)])
+    assert result.exit_code == 0
+    assert result.output == "Provisioned: db (no changes)\n"
+    assert len(postgres.scripts) == 2
+
+    manifest_file.write_text(
+        manifest.replace("public.orders", "public.missing")
+    )
+    result = runner.invoke(cli, ["db", "provision", "db", str(manifest_file)])
+    assert result.exit_code == 1
+    assert 'relation "missing"' in result.output
+
+    # names are checked before any session
+    manifest_file.write_text('users: ["app; DROP TABLE orders"]')
+    result = runner.invoke(cli, ["db", "provision", "db", str(manifest_file)])
+    assert result.exit_code == 1
+    assert "Invalid user" in result.output
+    manifest_file.write_text("directories: [{name: exports, path: /exports}]")
+    result = runner.invoke(cli, ["db", "provision", "db", str(manifest_file)])
+    assert result.exit_code == 1
+    assert "no directory objects" in result.output
+    assert len(postgres.scripts) == 3
+
+
+@pytest.mark.db
+def test_db_provision_postgres_grants():
+    script = (
+        PostgresEngine({})
+        .provision_script(
+            ProvisionManifest.from_dict(
+                {
+                    "grants": [
+                        {
+                            "privileges": "USAGE",
+                            "on": "schema App",
+                            "to": "app",
+                        },
+                        {
+                            "privileges": "CONNECT",
+                            "on": "database shop",
+                            "to": "app",
+                        },
+                        {
+                            "privileges": "SELECT",
+                            "on": "Sales.orders",
+                            "to": "app",
+                        },
+                    ]
+                }
+            )
+        )
+        .decode()
+    )
+    steps = re.findall(r"IF (.*?) THEN (.*?); RAISE", script)
+    assert steps == [
+        (
+            "NOT has_schema_privilege('app', 'App', 'USAGE')",
+            'GRANT USAGE ON SCHEMA "App" TO "app"',
+        ),
+        (
+            "NOT has_database_privilege('app', 'shop', 'CONNECT')",
+            'GRANT CONNECT ON DATABASE "shop" TO "app"',
+        ),
+        (
+            "NOT has_table_privilege('app', '\"Sales\".\"orders\"', 'SELECT')",
+            'GRANT SELECT ON TABLE "Sales"."orders" TO "app"',
+        ),
+    ]
+
+
+@pytest.mark.db
+def test_db_provision_oracle_script():
+    oracle = OracleEngine({"db.name": "FREEPDB1"})
+    script = oracle.provision_script(
+        ProvisionManifest.from_dict(
+            {
+                "users": [{"name": "app", "password": "secret"}],
+                "directories": [
+                    {"name": "exports", "path": "/exports", "owner": "app"}
+                ],
+                "grants": [{"privileges": "CREATE SESSION", "to": "app"}],
+                "remove_users": ["legacy"],
+            }
+        )
+    ).decode()
+    assert script.startswith(
+        "WHENEVER SQLERROR EXIT FAILURE\n"
+        "ALTER SESSION SET CONTAINER = FREEPDB1;\n"
+        "SET SERVEROUTPUT ON FEEDBACK OFF\nDECLARE\n"
+    )
+    assert script.endswith("END;\n/\nEXIT\n")
+    statements = re.findall(r"EXECUTE IMMEDIATE '(.*)';", script)
+    assert statements == [
+        'CREATE USER app IDENTIFIED BY "secret"',
+        "CREATE OR REPLACE DIRECTORY exports AS ''/exports''",
+        "GRANT READ ON DIRECTORY exports TO app",
+        "GRANT WRITE ON DIRECTORY exports TO app",
+        "GRANT CREATE SESSION TO app",
+        "DROP USER legacy CASCADE",
+    ]
+    assert "WHERE username = 'APP'" in script
+    assert script.count("shpd-change: ") == 6
+
+    with pytest.raises(ValueError):
+        oracle.provision_script(
+            ProvisionManifest.from_dict(
+                {
+                    "grants": [
+                        {"privileges": "USAGE", "on": "schema s", "to": "a"}
+                    ]
+                }
+            )
+        )
+    with pytest.raises(ValueError):
+        ProvisionManifest.from_dict({"users": [{"name": "a", "role": "x"}]})
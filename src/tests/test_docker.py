@@ -0,0 +1,621 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import io
+import json
+import queue
+import socket
+import tarfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional, cast
+
+import pytest
+from pytest_mock import MockerFixture
+
+from docker import (
+    DockerEngineClient,
+    DockerEngineError,
+    DockerImageBuilder,
+    DockerNotFoundError,
+    DockerReconciler,
+    DockerStatusCache,
+    PullProgress,
+)
+from docker.docker_engine import DockerEngineResponse
+from docker.docker_logs import LogIndex
+from docker.docker_readiness import ExecProbe, LogProbe, PortProbe
+from docker.docker_reconcile import ContainerSpec, DesiredState
+from docker.docker_svc import parse_port
+from service import ReadinessGate, ServiceStatus
+from tests.docker_fake_engine import FakeEngine
+
+
+def container(cid: str, env: str, svc: str, state: str) -> dict[str, Any]:
+    return {
+        "Id": cid,
+        "Names": [f"/{svc}-{env}"],
+        "State": state,
+        "Status": "",
+        "Labels": {"shpd.env.tag": env, "shpd.svc.tag": svc},
+    }
+
+
+def event(cid: str, env: str, svc: str, action: str, t: int) -> dict[str, Any]:
+    return {
+        "Type": "container",
+        "Action": action,
+        "Actor": {
+            "ID": cid,
+            "Attributes": {
+                "name": f"{svc}-{env}",
+                "shpd.env.tag": env,
+                "shpd.svc.tag": svc,
+            },
+        },
+        "time": t,
+        "timeNano": t * 1_000_000_000,
+    }
+
+
+class FakeStream:
+
+    def __init__(self, events: "queue.Queue[Optional[dict[str, Any]]]"):
+        self.events = events
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        while (item := self.events.get()) is not None:
+            yield item
+
+    def close(self):
+        self.events.put(None)
+
+
+class FakeSource:
+
+    def __init__(self, containers: list[dict[str, Any]]):
+        self.containers = containers
+        self.lists = 0
+        self.streams: "queue.Queue[FakeStream]" = queue.Queue()
+
+    def list_containers(
+        self, all: bool = True, filters: Optional[dict[str, list[str]]] = None
+    ) -> list[dict[str, Any]]:
+        self.lists += 1
+        return list(self.containers)
+
+    def events(
+        self,
+        filters: Optional[dict[str, list[str]]] = None,
+        since: Optional[str] = None,
+    ) -> FakeStream:
+        stream = FakeStream(queue.Queue())
+        self.streams.put(stream)
+        return stream
+
+
+@pytest.mark.docker
+def test_status_cache_sync():
+    source = FakeSource(
+        [
+            container("a", "env-1", "db", "running"),
+            container("b", "env-1", "web", "exited"),
+            container("c", "env-2", "db", "paused"),
+        ]
+    )
+    cache = DockerStatusCache(source)
+    cache.ensure_synced()
+    cache.ensure_synced()
+
+    assert source.lists == 1
+    assert [s.state for s in cache.get_env_status("env-1")] == [
+        "running",
+        "exited",
+    ]
+    status = cache.get_svc_status("env-2", "db")
+    assert status and status.state == "paused"
+    assert cache.get_svc_status("env-2", "web") is None
+
+
+@pytest.mark.docker
+def test_status_cache_apply_events():
+    cache = DockerStatusCache(FakeSource([]))
+    cache.sync()
+    changes: list[ServiceStatus] = []
+    unsubscribe = cache.subscribe(changes.append)
+
+    cache.apply_event(event("a", "env-1", "db", "create", 1))
+    cache.apply_event(event("a", "env-1", "db", "start", 2))
+    cache.apply_event(event("a", "env-1", "db", "exec_start: ls", 3))
+    cache.apply_event(event("a", "env-1", "db", "health_status: healthy", 4))
+    cache.apply_event(event("a", "env-1", "db", "pause", 5))
+
+    status = cache.get_svc_status("env-1", "db")
+    assert status and status.state == "paused"
+    assert status.health == "healthy"
+    assert [c.state for c in changes] == [
+        "created",
+        "running",
+        "running",
+        "paused",
+    ]
+
+    cache.apply_event(event("a", "env-1", "db", "destroy", 6))
+    assert cache.get_svc_status("env-1", "db") is None
+    assert changes[-1].state == "absent"
+
+    unsubscribe()
+    cache.apply_event(event("b", "env-1", "web", "create", 7))
+    assert len(changes) == 5
+
+
+@pytest.mark.docker
+def test_status_cache_resync_after_gap():
+    source = FakeSource([container("a", "env-1", "db", "running")])
+    cache = DockerStatusCache(source, resync_delay=0)
+    cache.start()
+    try:
+        version = cache.version
+        stream = source.streams.get(timeout=5)
+        stream.events.put(event("a", "env-1", "db", "die", 10))
+        version = cache.wait_for_change(version, 5)
+        status = cache.get_svc_status("env-1", "db")
+        assert status and status.state == "exited"
+
+        # the container was restarted while the stream was down
+        source.containers = [container("a", "env-1", "db", "running")]
+        stream.close()
+        cache.wait_for_change(version, 5)
+        source.streams.get(timeout=5)
+
+        assert source.lists == 2
+        status = cache.get_svc_status("env-1", "db")
+        assert status and status.state == "running"
+    finally:
+        cache.stop()
+
+
+@pytest.mark.docker
+def test_engine_host_from_env(monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setenv("DOCKER_HOST", "unix:///tmp/other.sock")
+    assert DockerEngineClient().host == "unix:///tmp/other.sock"
+    monkeypatch.delenv("DOCKER_HOST")
+    assert DockerEngineClient().host == "unix:///var/run/docker.sock"
+
+
+@pytest.mark.docker
+def test_engine_reuses_connections(
+    fake_engine: FakeEngine, client: DockerEngineClient
+):
+    fake_engine.add_container("db-env-1")
+    assert client.ping()
+    for _ in range(20):
+        client.inspect_container("db-env-1")
+    assert fake_engine.connections == 1
+
+    def worker():
+        for _ in range(10):
+            client.list_containers()
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert fake_engine.connections <= 4
+
+
+@pytest.mark.docker
+def test_engine_container_lifecycle(
+    fake_engine: FakeEngine, client: DockerEngineClient
+):
+    created = client.create_container(
+        "web-env-1", {"Image": "nginx", "Labels": {"shpd.env.tag": "env-1"}}
+    )
+    container = fake_engine.find("web-env-1")
+    assert container and container.id == created["Id"]
+
+    client.start_container("web-env-1")
+    assert container.state == "running"
+    client.pause_container("web-env-1")
+    assert container.state == "paused"
+    client.unpause_container("web-env-1")
+    client.restart_container("web-env-1")
+    assert container.state == "running"
+    client.stop_container("web-env-1")
+    assert client.inspect_container("web-env-1")["State"]["Status"] == "exited"
+    assert [c["Names"] for c in client.list_containers()] == [["/web-env-1"]]
+    assert client.list_containers(all=False) == []
+
+    client.remove_container("web-env-1")
+    with pytest.raises(DockerNotFoundError):
+        client.inspect_container("web-env-1")
+
+
+@pytest.mark.docker
+def test_engine_logs_demux(fake_engine: FakeEngine, client: DockerEngineClient):
+    fake_engine.add_container("db-env-1", state="running")
+    fake_engine.add_log("db-env-1", b"ready\n", ts=1)
+    fake_engine.add_log("db-env-1", b"warning\n", stream=2, ts=2)
+    fake_engine.add_log("db-env-1", b"serving\n", ts=3)
+
+    frames = list(client.logs("db-env-1").iter_frames())
+    assert frames == [(1, b"ready\n"), (2, b"warning\n"), (1, b"serving\n")]
+    frames = list(client.logs("db-env-1", tail=1).iter_frames())
+    assert frames == [(1, b"serving\n")]
+
+
+@pytest.mark.docker
+def test_engine_exec(fake_engine: FakeEngine, client: DockerEngineClient):
+    fake_engine.add_container("db-env-1", state="running")
+    fake_engine.exec_handler = lambda c, cmd, stdin: (
+        3,
+        " ".join(cmd).encode() + stdin,
+        b"oops",
+    )
+    assert client.exec_run("db-env-1", ["echo", "hi"]) == (
+        3,
+        b"echo hi",
+        b"oops",
+    )
+
+    exec_id = client.exec_create("db-env-1", ["cat"], stdin=True)
+    conn = client.exec_attach(exec_id)
+    conn.sendall(b" input")
+    conn.close_write()
+    data = b""
+    while chunk := conn.recv():
+        data += chunk
+    conn.close()
+    assert data.startswith(b"\x01\x00\x00\x00")
+    assert b"cat input" in data
+    assert client.exec_inspect(exec_id)["ExitCode"] == 3
+
+    # the session may still be reported running once its output ended
+    fake_engine.exec_exit_delay = 0.2
+    assert client.exec_run("db-env-1", ["false"])[0] == 3
+    exec_id = client.exec_create("db-env-1", ["false"])
+    fake_engine.execs[exec_id].running = True
+    with pytest.raises(DockerEngineError):
+        client.exec_exit_code(exec_id, timeout=0.1)
+
+
+@pytest.mark.docker
+def test_engine_events(fake_engine: FakeEngine, client: DockerEngineClient):
+    container = fake_engine.add_container(
+        "db-env-1", labels={"shpd.env.tag": "env-1", "shpd.svc.tag": "db"}
+    )
+    stream = client.events()
+    received: list[str] = []
+
+    def consume():
+        for event in stream:
+            received.append(event["Action"])
+
+    thread = threading.Thread(target=consume)
+    thread.start()
+    while not fake_engine.subscribers:
+        threading.Event().wait(0.01)
+    fake_engine.emit("start", container)
+    fake_engine.emit("die", container)
+    while len(received) < 2:
+        threading.Event().wait(0.01)
+    stream.close()
+    thread.join(timeout=5)
+    assert not thread.is_alive()
+    assert received == ["start", "die"]
+
+
+@pytest.mark.docker
+def test_status_cache_with_engine(
+    fake_engine: FakeEngine, client: DockerEngineClient
+):
+    fake_engine.add_container(
+        "db-env-1",
+        state="running",
+        labels={"shpd.env.tag": "env-1", "shpd.svc.tag": "db"},
+    )
+    fake_engine.add_container("other", state="running")
+    cache = DockerStatusCache(client, resync_delay=0)
+    cache.start()
+    try:
+        assert [s.svc_tag for s in cache.get_env_status("env-1")] == ["db"]
+        while not fake_engine.subscribers:
+            threading.Event().wait(0.01)
+        version = cache.version
+        client.stop_container("db-env-1")
+        cache.wait_for_change(version, 5)
+        status = cache.get_svc_status("env-1", "db")
+        assert status and status.state == "exited"
+    finally:
+        cache.stop()
+
+
+@pytest.mark.docker
+@pytest.mark.parametrize(
+    "port, expected",
+    [
+        ("80", ("", "", "80/tcp")),
+        ("8080:80", ("", "8080", "80/tcp")),
+        ("127.0.0.1:5432:5432", ("127.0.0.1", "5432", "5432/tcp")),
+        ("53:53/udp", ("", "53", "53/udp")),
+    ],
+)
+def test_parse_port(port: str, expected: tuple[str, str, str]):
+    assert parse_port(port) == expected
+
+
+@pytest.mark.docker
+def test_readiness_docker_probes(
+    fake_engine: FakeEngine, client: DockerEngineClient
+):
+    fake_engine.add_container("db-env-1")
+    fake_engine.add_log("db-env-1", b"database system is ready\n", ts=1)
+    client.start_container("db-env-1")
+    checks: list[list[str]] = []
+
+    def pg_isready(c: Any, cmd: list[str], stdin: bytes):
+        checks.append(cmd)
+        return (0, b"", b"") if len(checks) > 1 else (2, b"", b"no response")
+
+    fake_engine.exec_handler = pg_isready
+    log = LogProbe("db", client, "db-env-1", "system is ready", timeout=5)
+    exec_probe = ExecProbe("db", client, "db-env-1", "pg_isready", timeout=5)
+
+    def later():
+        threading.Event().wait(0.3)
+        fake_engine.add_log("db-env-1", b"database system is ")
+        fake_engine.add_log("db-env-1", b"database system is ready\n")
+
+    threading.Thread(target=later).start()
+    results = ReadinessGate([log, exec_probe], initial_delay=0.05).run()
+
+    assert [r.ready for r in results] == [True, True]
+    # the output of the previous run is ignored
+    assert results[0].attempts > 1
+    assert checks[0] == ["/bin/sh", "-c", "pg_isready"]
+    assert results[1].attempts == 2
+
+
+@pytest.mark.docker
+def test_readiness_port_probe(
+    fake_engine: FakeEngine, client: DockerEngineClient
+):
+    db = fake_engine.add_container("db-env-1")
+    client.start_container("db-env-1")
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        host_port = server.getsockname()[1]
+
+        # a published port is reached on the host port
+        db.config["HostConfig"] = {
+            "PortBindings": {
+                "5432/tcp": [{"HostIp": "", "HostPort": str(host_port)}]
+            }
+        }
+        probe = PortProbe("db", client, "db-env-1", 5432, timeout=1)
+        assert probe.describe() == "tcp db-env-1:5432"
+        assert ReadinessGate([probe]).run()[0].ready
+
+        # an unpublished one on the container address
+        db.config["HostConfig"] = {}
+        db.ip_address = "127.0.0.1"
+        probe = PortProbe("db", client, "db-env-1", host_port, timeout=1)
+        assert ReadinessGate([probe]).run()[0].ready
+
+    db.ip_address = ""
+    result = ReadinessGate([probe], initial_delay=0.05).run()[0]
+    assert not result.ready
+    assert result.error == (
+        f"port {host_port} is not published and the container has no address"
+    )
+
+
+@pytest.mark.docker
+def test_log_index_window(tmp_path: Path):
+    base = 1_700_000_000
+    index = LogIndex(str(tmp_path / "svc.log"), stride=64)
+    index.append(
+        [
+            (
+                2 if i % 10 == 0 else 1,
+                time.strftime(
+                    "%Y-%m-%dT%H:%M:%S", time.gmtime(base + i)
+                ).encode()
+                + f".000000000Z line {i}\n".encode(),
+            )
+            for i in range(500)
+        ]
+    )
+    assert len(index.entries) > 50
+    assert index.last == base + 499
+
+    def window(**kwargs: Any) -> list[bytes]:
+        return [data for _, data in index.read(**kwargs)]
+
+    assert window(since=base + 100, until=base + 103) == [
+        b"line 100\n",
+        b"line 101\n",
+        b"line 102\n",
+    ]
+    assert window(tail=2) == [b"line 498\n", b"line 499\n"]
+    assert window(tail=2, until=base + 50) == [b"line 48\n", b"line 49\n"]
+    assert window(tail=5, since=base + 498) == [b"line 498\n", b"line 499\n"]
+    assert list(index.read(since=base + 10, until=base + 11)) == [
+        (2, b"line 10\n")
+    ]
+    # the window is read within a couple of strides of the capture
+    offset = index.seek(base + 300)
+    with open(index.path, "rb") as f:
+        f.seek(offset)
+        assert len(f.read(index.bound(base + 300) - offset)) <= 4 * 64
+
+    # the index is rebuilt when the capture changed behind its back
+    with open(index.path, "ab") as f:
+        f.write(b"partial")
+    reloaded = LogIndex(index.path, stride=64)
+    assert reloaded.entries == index.entries
+    assert reloaded.size == index.size
+
+
+@pytest.mark.docker
+def test_pull_progress():
+    reports: list[str] = []
+    progress = PullProgress(reports.append)
+    for image in ("a:1", "b:1"):
+        progress.start(image)
+        progress.update(image, {"status": "Pulling from a", "id": "1"})
+        progress.update(image, {"status": "Pulling fs layer", "id": "l1"})
+        progress.update(
+            image,
+            {
+                "status": "Downloading",
+                "id": "l1",
+                "progressDetail": {"current": 1_000_000, "total": 4_000_000},
+            },
+        )
+    assert reports[-1] == "Pulled 0/2 images, 0/2 layers, 2.0/8.0 MB"
+    progress.update("a:1", {"status": "Pull complete", "id": "l1"})
+    progress.finish("a:1")
+    assert reports[-1] == "Pulled 1/2 images, 1/2 layers, 5.0/8.0 MB"
+
+
+@pytest.mark.docker
+def test_build_context_dockerignore(tmp_path: Path, client: DockerEngineClient):
+    for path in (
+        "Dockerfile",
+        "app.py",
+        "debug.log",
+        "src/main.py",
+        "src/trace.log",
+        "src/deep/more.log",
+        "docs/index.md",
+        "docs/keep.md",
+        "cache/a/b.bin",
+    ):
+        (tmp_path / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / path).write_text(path)
+    (tmp_path / ".dockerignore").write_text(
+        "# comment\n**/*.log\n/docs\n!docs/keep.md\ncache/**\n"
+    )
+    builder = DockerImageBuilder(client, str(tmp_path))
+    files = [rel for rel, _ in builder.context_files(str(tmp_path))]
+    assert files == [
+        ".dockerignore",
+        "Dockerfile",
+        "app.py",
+        "docs/keep.md",
+        "src/main.py",
+    ]
+
+    # the Dockerfile and .dockerignore are sent even when ignored
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "Dockerfile").write_text("FROM scratch\n")
+    (tmp_path / ".dockerignore").write_text("*\n")
+    files = [rel for rel, _ in builder.context_files(str(tmp_path))]
+    assert files == [".dockerignore", "Dockerfile"]
+    files = builder.context_files(str(tmp_path), "build/Dockerfile")
+    assert [rel for rel, _ in files] == [".dockerignore", "build/Dockerfile"]
+
+    data = b"".join(builder.tar_context(str(tmp_path), "build/Dockerfile"))
+    assert len(data) % tarfile.RECORDSIZE == 0
+    with tarfile.open(fileobj=io.BytesIO(data)) as tar:
+        assert tar.getnames() == [".dockerignore", "build/Dockerfile"]
+        dockerfile = tar.extractfile("build/Dockerfile")
+        assert dockerfile and dockerfile.read() == b"FROM scratch\n"
+
+    (tmp_path / ".dockerignore").write_text("file[0-9\n")
+    with pytest.raises(RuntimeError, match="invalid .dockerignore pattern"):
+        builder.context_files(str(tmp_path))
+
+
+class SplitBody:
+    """A response body read a few bytes at a time."""
+
+    status = 200
+    will_close = True
+
+    def __init__(self, data: bytes, size: int):
+        self.data = data
+        self.size = size
+
+    def read1(self, size: int) -> bytes:
+        piece, self.data = self.data[: self.size], self.data[self.size :]
+        return piece
+
+    def isclosed(self) -> bool:
+        return True
+
+    def close(self):
+        pass
+
+
+@pytest.mark.docker
+def test_engine_iter_json_split_characters():
+    messages = [{"stream": "Étape 1/2 : FROM café ☕\n"}, {"status": "終了"}]
+    data = "".join(json.dumps(m, ensure_ascii=False) for m in messages)
+    for size in (1, 2, 3, 5):
+        body = SplitBody(data.encode(), size)
+        response = DockerEngineResponse(
+            cast(Any, None), cast(Any, body), cast(Any, body)
+        )
+        assert list(response.iter_json()) == messages
+
+
+@pytest.mark.docker
+def test_reconciler_restart(
+    fake_engine: FakeEngine,
+    client: DockerEngineClient,
+    mocker: MockerFixture,
+):
+    labels = {"shpd.env.tag": "env", "shpd.config.hash": "h1"}
+    specs = [
+        ContainerSpec(
+            "env", svc, f"{svc}-env", "app:1", {"Labels": labels}, [], []
+        )
+        for svc in ("web", "db", "cache")
+    ]
+    fake_engine.images["app:1"] = {"Id": "sha256:app", "RepoTags": ["app:1"]}
+    fake_engine.add_container("web-env", "running", labels, "app:1")
+    fake_engine.add_container("db-env", "exited", labels, "app:1")
+    reconciler = DockerReconciler(client)
+    mocker.patch.object(
+        reconciler, "desired", return_value=DesiredState(["env"], specs)
+    )
+
+    # containers the reconcile brings up are not restarted on top
+    actions = reconciler.restart([])
+    assert sorted(str(a) for a in actions) == [
+        "create cache-env",
+        "restart web-env",
+        "start db-env",
+    ]
+    states = {c.name: c.state for c in fake_engine.containers.values()}
+    assert states == {
+        "web-env": "running",
+        "db-env": "running",
+        "cache-env": "running",
+    }
+
+    # pulls only look at the images
+    fake_engine.requests.clear()
+    assert reconciler.pull_images([]) == []
+    assert [p for _, p in fake_engine.requests] == ["/images/app%3A1/json"]
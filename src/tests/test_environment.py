@@ -17,14 +17,49 @@
 
 from __future__ import annotations
 
+import gzip
+import io
+import json
 import os
+import shutil
+import socket
+import subprocess
+import sys
+import tarfile
+import threading
+import time
+import zlib
 from pathlib import Path
+from types import SimpleNamespace
+from typing import Any, Callable
 
 import pytest
 from click.testing import CliRunner
 from pytest_mock import MockerFixture
 
+from docker import (
+    DockerEngineClient,
+    DockerLogMux,
+    DockerStatusCache,
+    LogSource,
+)
+from docker.docker_svc import DockerSvc
+from environment import EnvironmentMng, FleetScheduler
+from environment.cache import CACHE_FILE, ImageCache
+from environment.catalog import CATALOG_FILE, RegistryCatalog
+from environment.chunks import (
+    MAX_CHUNK,
+    MIN_CHUNK,
+    Chunker,
+    ChunkStore,
+    manifest_path,
+)
+from environment.seekable import TRAILER, TRAILER_MAGIC, Toc, TocEntry
+from environment.suspend import SuspendRegistry
+from registry import DirRegistry, FtpRegistry
 from shepctl import ShepherdMng, cli
+from tests.docker_fake_engine import FakeEngine
+from tests.ftp_fake_server import FakeFtpServer
 
 values = """
   # Oracle (ora) Configuration
@@ -617,6 +652,8 @@ def test_env_render_compose_env(
         "    labels:\n"
         "    - com.example.label1=value1\n"
         "    - com.example.label2=value2\n"
+        "    - shpd.env.tag=test-1\n"
+        "    - shpd.svc.tag=test-1\n"
         "    volumes:\n"
         "    - /home/test/.ssh:/home/test/.ssh\n"
         "    - /etc/ssh:/etc/ssh\n"
@@ -635,6 +672,8 @@ def test_env_render_compose_env(
         "    labels:\n"
         "    - com.example.label1=value1\n"
         "    - com.example.label2=value2\n"
+        "    - shpd.env.tag=test-1\n"
+        "    - shpd.svc.tag=test-2\n"
         "    volumes:\n"
         "    - /home/test/.ssh:/home/test/.ssh\n"
         "    - /etc/ssh:/etc/ssh\n"
@@ -647,3 +686,1327 @@ def test_env_render_compose_env(
         "    networks:\n"
         "    - default\n\n"
     )
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [1])
+def test_env_status(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    shpd_json = shpd_dir / ".shpd.json"
+    shpd_json.write_text(shpd_config)
+
+    source = mocker.Mock()
+    source.list_containers.return_value = [
+        {
+            "Id": "c1",
+            "Names": ["/test-1-test-1"],
+            "State": "running",
+            "Status": "Up 2 minutes (healthy)",
+            "Labels": {"shpd.env.tag": "test-1", "shpd.svc.tag": "test-1"},
+        }
+    ]
+    mocker.patch.object(
+        DockerStatusCache, "shared", return_value=DockerStatusCache(source)
+    )
+
+    result = runner.invoke(cli, ["env", "status"])
+    assert result.exit_code == 0
+    assert result.output == (
+        "Environment: test-1\n"
+        " - test-1 (test-1-test-1): running (healthy)\n"
+        " - test-2 (test-2-test-1): absent\n"
+    )
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [4])
+def test_env_up_native(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(values + "\ndocker_lifecycle=native\n")
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    shpd_json = shpd_dir / ".shpd.json"
+    shpd_json.write_text(shpd_config)
+
+    result = runner.invoke(cli, ["env", "up"])
+    assert result.exit_code == 0
+    assert result.output == "Started: test-1\n"
+    assert set(fake_engine.images) == {
+        "test-1-image:latest",
+        "test-2-image:latest",
+    }
+    assert set(fake_engine.networks) == {"test-1_default"}
+    web = fake_engine.find("test-1-test-1")
+    assert web and web.state == "running"
+    assert web.labels["shpd.svc.tag"] == "test-1"
+    assert web.config["HostConfig"]["PortBindings"]["8080/tcp"] == [
+        {"HostIp": "", "HostPort": "8080"}
+    ]
+
+    # nothing to do when the environment is already up
+    fake_engine.requests.clear()
+    result = runner.invoke(cli, ["env", "up"])
+    assert result.exit_code == 0
+    assert all(method == "GET" for method, _ in fake_engine.requests)
+
+    # configuration drift recreates the container
+    web.labels["shpd.config.hash"] = "stale"
+    runner.invoke(cli, ["env", "up"])
+    recreated = fake_engine.find("test-1-test-1")
+    assert recreated and recreated.id != web.id
+    assert recreated.state == "running"
+
+    result = runner.invoke(cli, ["env", "halt"])
+    assert result.exit_code == 0
+    assert {c.state for c in fake_engine.containers.values()} == {"exited"}
+
+
+@pytest.mark.env
+def test_fleet_scheduler_caps():
+    scheduler = FleetScheduler(max_parallel=3, max_parallel_env=2)
+    lock = threading.Lock()
+    running: dict[str, int] = {}
+    peaks = {"total": 0, "env": 0}
+
+    def operation(env: Any) -> str:
+        tag = env.envCfg.tag
+        if tag == "env-2":
+            raise RuntimeError("boom")
+
+        def task():
+            with env.scheduler.slot(tag):
+                with lock:
+                    running[tag] = running.get(tag, 0) + 1
+                    peaks["env"] = max(peaks["env"], running[tag])
+                    peaks["total"] = max(peaks["total"], sum(running.values()))
+                time.sleep(0.02)
+                with lock:
+                    running[tag] -= 1
+
+        threads = [threading.Thread(target=task) for _ in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return tag
+
+    envs: list[Any] = [
+        SimpleNamespace(envCfg=SimpleNamespace(tag=f"env-{i}"))
+        for i in range(5)
+    ]
+    results = scheduler.run(envs, operation)
+
+    assert [r.env_tag for r in results] == [e.envCfg.tag for e in envs]
+    assert [r.ok for r in results] == [True, True, False, True, True]
+    assert results[2].error == "boom"
+    assert results[0].output == "env-0"
+    assert peaks["env"] == 2
+    assert peaks["total"] == 3
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [3])
+def test_env_fleet(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    config = json.loads(shpd_config)
+    for tag in ("test-2", "other-1"):
+        env = json.loads(json.dumps(config["envs"][0]))
+        env["tag"], env["active"] = tag, False
+        config["envs"].append(env)
+    (shpd_dir / ".shpd.json").write_text(json.dumps(config))
+
+    mocker.patch.object(
+        DockerStatusCache,
+        "shared",
+        return_value=DockerStatusCache(shared_client),
+    )
+    for env_tag in ("test-1", "test-2", "other-1"):
+        for svc_tag in ("test-1", "test-2"):
+            fake_engine.add_container(
+                f"{svc_tag}-{env_tag}",
+                state="running",
+                labels={"shpd.env.tag": env_tag, "shpd.svc.tag": svc_tag},
+            )
+
+    result = runner.invoke(cli, ["env", "halt", "test-*"])
+    assert result.exit_code == 0
+    states = {c.name: c.state for c in fake_engine.containers.values()}
+    assert states["test-1-test-2"] == "exited"
+    assert states["test-2-test-1"] == "exited"
+    assert states["test-1-other-1"] == "running"
+    assert "test-1" in result.output and "test-2" in result.output
+    assert "other-1" not in result.output
+
+    result = runner.invoke(cli, ["--all", "env", "status"])
+    assert result.exit_code == 0
+    assert " - test-1 (test-1-other-1): running\n" in result.output
+    assert " - test-2 (test-2-test-2): exited\n" in result.output
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [4])
+def test_env_checkout_suspend(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(values + "\nenv_suspend=pause\nenv_idle_ttl=0\n")
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    config = json.loads(shpd_config)
+    env = json.loads(json.dumps(config["envs"][0]))
+    env["tag"], env["active"] = "test-2", False
+    config["envs"].append(env)
+    (shpd_dir / ".shpd.json").write_text(json.dumps(config))
+
+    for env_tag in ("test-1", "test-2"):
+        for svc_tag in ("test-1", "test-2"):
+            fake_engine.add_container(f"{svc_tag}-{env_tag}", state="running")
+
+    def states(env_tag: str) -> set[str]:
+        return {
+            c.state
+            for c in fake_engine.containers.values()
+            if c.name.endswith(env_tag)
+        }
+
+    result = runner.invoke(cli, ["env", "checkout", "test-2"])
+    assert result.exit_code == 0
+    assert result.output == (
+        "Switched to: test-2\nPaused: test-1 (128 MB held)\n"
+    )
+    assert states("test-1") == {"paused"}
+    assert states("test-2") == {"running"}
+
+    result = runner.invoke(cli, ["env", "checkout", "test-1"])
+    assert result.exit_code == 0
+    assert result.output == (
+        "Switched to: test-1\n"
+        "Paused: test-2 (128 MB held)\n"
+        "Resumed: test-1\n"
+    )
+    assert states("test-1") == {"running"}
+    assert states("test-2") == {"paused"}
+
+    config_file.write_text(values + "\nenv_suspend=pause\nenv_idle_ttl=0.01\n")
+    time.sleep(0.02)
+    result = runner.invoke(cli, ["env", "idle"])
+    assert result.exit_code == 0
+    assert result.output == (
+        "Stopped idle: test-2 (128 MB reclaimed)\n"
+        "No suspended environments.\n"
+        "Held: 0 MB, reclaimed: 128 MB\n"
+    )
+    assert states("test-2") == {"exited"}
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [2])
+def test_env_checkout_start(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    config = json.loads(shpd_config)
+    env = json.loads(json.dumps(config["envs"][0]))
+    env["tag"], env["active"] = "test-2", False
+    # only the first service publishes a port of the old environment
+    env["services"][0]["ports"] = ["8080:8080"]
+    env["services"][1]["ports"] = ["9000:9000"]
+    config["envs"].append(env)
+    (shpd_dir / ".shpd.json").write_text(json.dumps(config))
+
+    for svc_tag in ("test-1", "test-2"):
+        fake_engine.add_container(f"{svc_tag}-test-1", state="running")
+        fake_engine.add_container(f"{svc_tag}-test-2", state="exited")
+    fake_engine.delays.update({"stop": 0.3, "start": 0.1})
+
+    result = runner.invoke(cli, ["env", "checkout", "--start", "test-2"])
+    assert result.exit_code == 0
+    assert result.output.startswith("Halted: test-1\nStarted: test-2 (")
+    assert result.output.endswith("\nSwitched to: test-2\n")
+    states = {c.name: c.state for c in fake_engine.containers.values()}
+    assert states == {
+        "test-1-test-1": "exited",
+        "test-2-test-1": "exited",
+        "test-1-test-2": "running",
+        "test-2-test-2": "running",
+    }
+    conflicting = fake_engine.find("test-1-test-2")
+    free = fake_engine.find("test-2-test-2")
+    assert conflicting and free
+    # the free service started while the old environment was stopping
+    assert conflicting.started_at - free.started_at >= 0.25
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [4])
+def test_env_checkout_start_uncreated(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    config = json.loads(shpd_config)
+    env = json.loads(json.dumps(config["envs"][0]))
+    env["tag"], env["active"] = "test-2", False
+    config["envs"].append(env)
+    (shpd_dir / ".shpd.json").write_text(json.dumps(config))
+
+    # the active environment was never brought up
+    for svc_tag in ("test-1", "test-2"):
+        fake_engine.add_container(f"{svc_tag}-test-2", state="exited")
+
+    # a failed switch leaves the previous environment active
+    start = mocker.patch.object(
+        DockerSvc, "start", side_effect=RuntimeError("boom")
+    )
+    result = runner.invoke(cli, ["env", "checkout", "--start", "test-2"])
+    assert result.exit_code == 1
+    assert "boom" in result.output
+    active = ShepherdMng().configMng.get_active_environment()
+    assert active and active.tag == "test-1"
+
+    mocker.stop(start)
+    result = runner.invoke(cli, ["env", "checkout", "--start", "test-2"])
+    assert result.exit_code == 0, result.output
+    assert result.output.startswith("Halted: test-1\nStarted: test-2 (")
+    assert {c.state for c in fake_engine.containers.values()} == {"running"}
+    active = ShepherdMng().configMng.get_active_environment()
+    assert active and active.tag == "test-2"
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [6])
+def test_env_pool(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(values + "\nenv_pool_size=2\nenv_pool_warm=true\n")
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    popen = mocker.patch("environment.environment.subprocess.Popen")
+
+    result = runner.invoke(cli, ["env", "pool", "fill"])
+    assert result.exit_code == 0
+    lines = result.output.splitlines()
+    assert len(lines) == 2
+    pooled = [line.split()[1] for line in lines]
+    assert all(
+        line.startswith("Pooled: pool-default-") and line.endswith(" (default)")
+        for line in lines
+    )
+    assert "test-image:latest" in fake_engine.images
+
+    result = runner.invoke(cli, ["env", "list"])
+    assert result.exit_code == 0
+    assert "pool-default-" not in result.output
+
+    result = runner.invoke(cli, ["env", "init", "default", "test-pool"])
+    assert result.exit_code == 0
+    assert result.output == "test-pool\n"
+    assert popen.call_args.args[0][-3:] == ["env", "pool", "fill"]
+
+    result = runner.invoke(cli, ["env", "pool"])
+    assert result.exit_code == 0
+    assert result.output == " - default: 1 ready, 0 warming (size 2)\n"
+
+    result = runner.invoke(cli, ["env", "pool", "drain"])
+    assert result.exit_code == 0
+    assert result.output == f"Deleted: {pooled[1]}\n"
+
+    sm = ShepherdMng()
+    envs_dir = sm.configMng.constants.SHPD_ENVS_DIR
+    assert sm.configMng.exists_environment("test-pool")
+    assert os.path.isdir(os.path.join(envs_dir, "test-pool"))
+    for env_tag in pooled:
+        assert not sm.configMng.exists_environment(env_tag)
+        assert not os.path.exists(os.path.join(envs_dir, env_tag))
+
+
+@pytest.mark.env
+def test_log_mux_backpressure(
+    fake_engine: FakeEngine, client: DockerEngineClient
+):
+    fake_engine.add_container("web", state="running")
+    fake_engine.add_container("db", state="running")
+    for i in range(200):
+        fake_engine.add_log("web", f"web {i}\n".encode())
+        fake_engine.add_log("db", f"db {i}\n".encode(), stream=2)
+    fake_engine.add_log("web", b"partial")
+
+    out = io.BytesIO()
+    mux = DockerLogMux(
+        client,
+        [
+            LogSource("web", "web"),
+            LogSource("db", "db"),
+            LogSource("gone", "gone"),
+        ],
+        out,
+        buffer_lines=4,
+    )
+    mux.run()
+    lines = out.getvalue().decode().splitlines()
+    web = [line for line in lines if line.startswith("web  | ")]
+    db = [line for line in lines if line.startswith("db   | ")]
+    assert web == [f"web  | web {i}" for i in range(200)] + ["web  | partial"]
+    assert db == [f"db   | db {i}" for i in range(200)]
+    assert "gone | (no container)" in lines
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [1])
+def test_env_logs(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+
+    fake_engine.add_container("test-1-test-1", state="running")
+    fake_engine.add_container("test-2-test-1", state="exited")
+    fake_engine.add_log("test-1-test-1", b"listening on 8080\n")
+    fake_engine.add_log("test-2-test-1", b"exited\n", stream=2)
+    result = runner.invoke(cli, ["env", "logs"])
+    assert result.exit_code == 0
+    assert sorted(result.output.splitlines()) == [
+        "test-1 | listening on 8080",
+        "test-2 | exited",
+    ]
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [4])
+def test_env_prefetch(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(values + "\nenv_prefetch=true\n")
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    popen = mocker.patch("environment.environment.subprocess.Popen")
+
+    fake_engine.images["test-1-image:latest"] = {
+        "Id": "sha256:present",
+        "RepoTags": ["test-1-image:latest"],
+    }
+    result = runner.invoke(cli, ["env", "prefetch"])
+    assert result.exit_code == 0
+    assert result.output == "Pulled: test-2-image:latest\n"
+
+    # the images shared by every environment are already there
+    (shpd_dir / "envs" / "test-1").mkdir(parents=True)
+    result = runner.invoke(cli, ["env", "clone", "test-1", "test-3"])
+    assert result.exit_code == 0
+    fake_engine.requests.clear()
+    result = runner.invoke(cli, ["--all", "env", "prefetch"])
+    assert result.exit_code == 0
+    assert result.output == "Images up to date.\n"
+    assert ("POST", "/v1.43/images/create") not in fake_engine.requests
+
+    result = runner.invoke(cli, ["env", "init", "default", "test-4"])
+    assert result.exit_code == 0
+    assert popen.call_args.args[0][-3:] == ["env", "prefetch", "test-4"]
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [3])
+def test_env_pack(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    env_dir = shpd_dir / "envs" / "test-1"
+    (env_dir / "pgdata").mkdir(parents=True)
+    state = os.urandom(1 << 20) * 3
+    (env_dir / "pgdata" / "base.dat").write_bytes(state)
+
+    result = runner.invoke(cli, ["env", "pack", "test-1", "--format", "gzip"])
+    assert result.exit_code == 0
+    image = shpd_dir / ".env_imgs" / "test-1.tar.gz"
+    output = result.output.replace("\n", "")
+    assert output.startswith(f"Packed: {image} (3.2 MB in ")
+    assert "MB/s" in output
+    with tarfile.open(image, "r:gz") as tar:
+        config = tar.extractfile("env.json")
+        data = tar.extractfile("data/pgdata/base.dat")
+        assert config and json.load(config)["tag"] == "test-1"
+        assert data and data.read() == state
+    assert not list((shpd_dir / ".env_imgs").glob("*.part"))
+
+    result = runner.invoke(cli, ["env", "pack", "missing"])
+    assert result.exit_code == 1
+
+    if not shutil.which("zstd"):
+        return
+    result = runner.invoke(cli, ["env", "pack", "test-1"])
+    assert result.exit_code == 0
+    image = shpd_dir / ".env_imgs" / "test-1.tar.zst"
+    unpacked = subprocess.run(
+        ["zstd", "-dc", str(image)], capture_output=True, check=True
+    ).stdout
+    with tarfile.open(fileobj=io.BytesIO(unpacked), mode="r:") as tar:
+        data = tar.extractfile("data/pgdata/base.dat")
+        assert data and data.read() == state
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [9])
+def test_env_import(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    envs_dir = shpd_dir / "envs"
+    (envs_dir / "test-1" / "pgdata").mkdir(parents=True)
+    state = os.urandom(1 << 20) * 2
+    (envs_dir / "test-1" / "pgdata" / "base.dat").write_bytes(state)
+
+    result = runner.invoke(cli, ["env", "pack", "test-1", "--format", "gzip"])
+    assert result.exit_code == 0
+    image = shpd_dir / ".env_imgs" / "test-1.tar.gz"
+    checksum = (shpd_dir / ".env_imgs" / "test-1.tar.gz.sha256").read_text()
+
+    result = runner.invoke(cli, ["env", "import", str(image), "test-5"])
+    assert result.exit_code == 0
+    output = result.output.replace("\n", "")
+    assert output.startswith("Imported: test-5 (")
+    assert output.endswith("checksum verified)")
+    assert (envs_dir / "test-5" / "pgdata" / "base.dat").read_bytes() == state
+
+    # existing tags, wrong checksums and corrupted images leave nothing
+    result = runner.invoke(cli, ["env", "import", str(image), "test-5"])
+    assert result.exit_code == 1
+    result = runner.invoke(
+        cli, ["env", "import", str(image), "test-6", "--sha256", "0" * 64]
+    )
+    assert result.exit_code == 1
+    assert "checksum mismatch" in result.output.replace("\n", "")
+    corrupted = temp_home / "corrupted.tar.gz"
+    corrupted.write_bytes(image.read_bytes()[: 1 << 20])
+    result = runner.invoke(cli, ["env", "import", str(corrupted), "test-6"])
+    assert result.exit_code == 1
+    assert sorted(p.name for p in envs_dir.iterdir()) == ["test-1", "test-5"]
+
+    # images are also looked up by name in the images directory
+    result = runner.invoke(
+        cli,
+        [
+            "env",
+            "import",
+            "test-1.tar.gz",
+            "test-6",
+            "--sha256",
+            checksum.split()[0],
+        ],
+    )
+    assert result.exit_code == 0
+    assert (envs_dir / "test-6" / "pgdata" / "base.dat").exists()
+
+    zstd_tag = "test-6"
+    if shutil.which("zstd"):
+        zstd_tag = "test-7"
+        result = runner.invoke(cli, ["env", "pack", "test-1"])
+        assert result.exit_code == 0
+        result = runner.invoke(cli, ["env", "import", "test-1", zstd_tag])
+        assert result.exit_code == 0
+        data = envs_dir / zstd_tag / "pgdata" / "base.dat"
+        assert data.read_bytes() == state
+
+    sm = ShepherdMng()
+    for tag in ("test-5", zstd_tag):
+        envCfg = sm.configMng.get_environment(tag)
+        assert envCfg and not envCfg.active
+        assert [svc.tag for svc in envCfg.services or []] == [
+            "test-1",
+            "test-2",
+        ]
+
+
+@pytest.mark.env
+def test_chunker_content_defined():
+    data = os.urandom(16 << 20)
+    chunker = Chunker()
+    chunks = chunker.feed(data[: 5 << 20]) + chunker.feed(data[5 << 20 :])
+    chunks += chunker.flush()
+    assert b"".join(chunks) == data
+    assert all(len(c) <= MAX_CHUNK for c in chunks)
+    assert all(len(c) >= MIN_CHUNK for c in chunks[:-1])
+
+    # an insertion only changes the chunks around it
+    edited = data[: 7 << 20] + b"inserted" + data[7 << 20 :]
+    chunker = Chunker()
+    edited_chunks = chunker.feed(edited) + chunker.flush()
+    assert len(set(chunks) - set(edited_chunks)) <= 2
+
+
+@pytest.mark.env
+def test_chunker_structured_data():
+    rows = [
+        f"INSERT INTO orders VALUES ({i}, 'customer {i * 7919 % 10007}', "
+        f"{i * 104729 % 100000 / 100:.2f}, '2024-0{i % 9 + 1}-1{i % 9}');\n"
+        for i in range(200000)
+    ]
+    data = "".join(rows).encode()
+    chunks = Chunker().feed(data)
+    assert len(chunks) > 4
+    assert any(len(c) < MAX_CHUNK for c in chunks)
+
+    # a byte inserted up front leaves the chunks after the first in place
+    chunker = Chunker()
+    edited_chunks = chunker.feed(b"-" + data) + chunker.flush()
+    assert len(set(chunks) & set(edited_chunks)) >= len(chunks) - 2
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [6])
+def test_env_push_pull(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    registry_dir = temp_home / "registry"
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(
+        values.replace(
+            "shpd_registry=ftp.example.com", f"shpd_registry={registry_dir}"
+        )
+    )
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    envs_dir = shpd_dir / "envs"
+    (envs_dir / "test-1" / "pgdata").mkdir(parents=True)
+    state = bytearray(os.urandom(12 << 20))
+    data_file = envs_dir / "test-1" / "pgdata" / "base.dat"
+    data_file.write_bytes(state)
+
+    result = runner.invoke(cli, ["env", "push", "test-1", "base"])
+    assert result.exit_code == 0
+    assert result.output.split()[:2] == ["Pushed:", "base"]
+    chunks = len(list((registry_dir / "imgs" / "chunks").glob("*/*")))
+    assert chunks > 3
+
+    # a new version shares most of its chunks with the previous one
+    state[6 << 20 : (6 << 20) + 16] = b"x" * 16
+    data_file.write_bytes(state)
+    result = runner.invoke(cli, ["env", "push", "test-1", "base-2"])
+    assert result.exit_code == 0
+    uploaded = int(result.output.split()[6])
+    assert 1 <= uploaded <= 3
+    assert len(list((registry_dir / "imgs" / "chunks").glob("*/*"))) == (
+        chunks + uploaded
+    )
+
+    # pulls fetch the chunks missing locally only
+    shutil.rmtree(shpd_dir / ".env_imgs")
+    result = runner.invoke(cli, ["env", "pull", "base", "test-8"])
+    assert result.exit_code == 0
+    assert int(result.output.split()[4]) == chunks
+    result = runner.invoke(cli, ["env", "pull", "base-2", "test-9"])
+    assert result.exit_code == 0
+    assert int(result.output.split()[4]) == uploaded
+    pulled = envs_dir / "test-9" / "pgdata" / "base.dat"
+    assert pulled.read_bytes() == bytes(state)
+
+    result = runner.invoke(cli, ["env", "pull", "missing"])
+    assert result.exit_code == 1
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [3])
+def test_env_publish_fetch(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    ftp_root = temp_home / "ftp"
+    (ftp_root / "imgs").mkdir(parents=True)
+    server = FakeFtpServer(str(ftp_root)).start()
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(
+        values.replace(
+            "shpd_registry=ftp.example.com",
+            f"shpd_registry={server.address}",
+        )
+    )
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    imgs_dir = shpd_dir / ".env_imgs"
+    imgs_dir.mkdir()
+    images = {f"base-{i}": os.urandom((i + 1) << 20) for i in range(2)}
+    for name, data in images.items():
+        (imgs_dir / f"{name}.tar.zst").write_bytes(data)
+    (imgs_dir / "base-0.tar.zst.sha256").write_text("abc  base-0.tar.zst\n")
+
+    try:
+        result = runner.invoke(cli, ["env", "publish", "base-0", "base-1"])
+        assert result.exit_code == 0
+        assert result.output.split()[:2] == ["Published:", "base-0.tar.zst"]
+        published = ftp_root / "imgs"
+        assert (published / "base-1.tar.zst").read_bytes() == images["base-1"]
+        assert (published / "base-0.tar.zst.sha256").exists()
+
+        shutil.rmtree(imgs_dir)
+        result = runner.invoke(cli, ["env", "fetch", "base-0", "base-1"])
+        assert result.exit_code == 0
+        assert "Fetched: base-1.tar.zst" in result.output
+        for name, data in images.items():
+            assert (imgs_dir / f"{name}.tar.zst").read_bytes() == data
+        assert (imgs_dir / "base-0.tar.zst.sha256").exists()
+
+        result = runner.invoke(cli, ["env", "fetch", "missing"])
+        assert result.exit_code == 1
+        assert "Image 'missing.tar.zst' not found." in result.output
+    finally:
+        server.stop()
+
+
+@pytest.mark.env
+def test_registry_catalog_revalidation(tmp_path: Path):
+    imgs = tmp_path / "ftp" / "imgs"
+    (imgs / "manifests").mkdir(parents=True)
+    (imgs / "base.tar.zst").write_bytes(b"x" * 1000)
+    (imgs / "base.tar.zst.sha256").write_text("aa11  base.tar.zst\n")
+    (imgs / "old.tar.gz").write_bytes(b"x" * 10)
+    manifest: dict[str, Any] = {"name": "db", "size": 5000, "sha256": "bb22"}
+    (imgs / "manifests" / "db.json").write_text(json.dumps(manifest))
+    server = FakeFtpServer(str(tmp_path / "ftp")).start()
+    registry = FtpRegistry("127.0.0.1", "imgs", port=server.port)
+    catalog = RegistryCatalog(str(tmp_path / "cache" / CATALOG_FILE))
+    try:
+        stats = catalog.refresh(registry)
+        assert (stats.listed, stats.fetched, stats.changed) == (2, 2, 3)
+        assert [(i.name, i.kind, i.size, i.sha256) for i in catalog.list()] == [
+            ("base", "zstd", 1000, "aa11"),
+            ("db", "chunked", 5000, "bb22"),
+            ("old", "gzip", 10, ""),
+        ]
+
+        # nothing changed: the root listing only
+        catalog = RegistryCatalog(str(tmp_path / "cache" / CATALOG_FILE))
+        stats = catalog.refresh(registry)
+        assert (stats.listed, stats.fetched, stats.changed) == (1, 0, 0)
+
+        # a new manifest: the manifests are listed, the new one fetched
+        manifest.update(name="db-2", sha256="cc33")
+        (imgs / "manifests" / "db-2.json").write_text(json.dumps(manifest))
+        (imgs / "old.tar.gz").unlink()
+        stats = catalog.refresh(registry)
+        assert (stats.listed, stats.fetched, stats.changed) == (2, 1, 2)
+        assert [i.name for i in catalog.list()] == ["base", "db", "db-2"]
+    finally:
+        registry.close()
+        server.stop()
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [4])
+def test_env_images(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    registry_dir = temp_home / "registry"
+    (registry_dir / "imgs").mkdir(parents=True)
+    (registry_dir / "imgs" / "base.tar.zst").write_bytes(b"x" * 2000000)
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(
+        values.replace(
+            "shpd_registry=ftp.example.com", f"shpd_registry={registry_dir}"
+        )
+        + "\nenv_catalog_ttl=3600\n"
+    )
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    (shpd_dir / ".env_imgs").mkdir()
+    (shpd_dir / ".env_imgs" / "local.tar.gz").write_bytes(b"x" * 1000000)
+    spawn = mocker.patch.object(EnvironmentMng, "spawn")
+
+    result = runner.invoke(cli, ["env", "images"])
+    assert result.exit_code == 0
+    assert "local (gzip, 1.0 MB)" in result.output
+
+    # the first listing fetches the catalog
+    result = runner.invoke(cli, ["env", "images", "--remote"])
+    assert result.exit_code == 0
+    assert "base (zstd, 2.0 MB)" in result.output
+    spawn.assert_not_called()
+
+    # later ones answer from the cache, refreshed in background once stale
+    (registry_dir / "imgs" / "next.tar.zst").write_bytes(b"x")
+    catalog_file = shpd_dir / ".env_imgs" / CATALOG_FILE
+    cached = json.loads(catalog_file.read_text())
+    cached["refreshed"] -= 7200
+    catalog_file.write_text(json.dumps(cached))
+    result = runner.invoke(cli, ["env", "images", "--remote"])
+    assert result.exit_code == 0
+    assert "next" not in result.output
+    spawn.assert_called_once_with(["env", "images", "--remote", "--refresh"])
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [7])
+def test_env_verify(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    envs_dir = shpd_dir / "envs"
+    (envs_dir / "test-1" / "pgdata").mkdir(parents=True)
+    data_file = envs_dir / "test-1" / "pgdata" / "base.dat"
+    data_file.write_bytes(os.urandom(5 << 20))
+    (envs_dir / "test-1" / "pgdata" / "pg.conf").write_text("port=5432\n")
+
+    result = runner.invoke(cli, ["env", "pack", "test-1", "--format", "gzip"])
+    assert result.exit_code == 0
+    image = shpd_dir / ".env_imgs" / "test-1.tar.gz"
+    manifest = json.loads(Path(f"{image}.integrity.json").read_text())
+    assert manifest["algorithm"] == "blake2b"
+    assert len(manifest["chunks"]) == 2
+    assert sorted(manifest["files"]) == ["pgdata/base.dat", "pgdata/pg.conf"]
+
+    # files unchanged since the pack are not hashed again
+    result = runner.invoke(cli, ["env", "verify", "test-1"])
+    assert result.exit_code == 0
+    assert result.output.split()[2:] == [
+        "(2",
+        "files,",
+        "0",
+        "hashed,",
+        "2",
+        "unchanged)",
+    ]
+
+    with open(data_file, "r+b") as f:
+        f.seek(1 << 20)
+        f.write(b"corrupted")
+    result = runner.invoke(cli, ["env", "verify", "test-1"])
+    assert result.exit_code == 1
+    assert " - modified: pgdata/base.dat" in result.output
+
+    # imports check the stream and record the manifest
+    result = runner.invoke(cli, ["env", "import", str(image), "test-5"])
+    assert result.exit_code == 0
+    assert "2 chunks verified" in result.output.replace("\n", "")
+    assert not (envs_dir / "test-5" / ".integrity.json.tmp").exists()
+
+    # a corrupted tar stream is caught before it is imported, even when
+    # it is compressed again and has no checksum
+    tar = bytearray(gzip.decompress(image.read_bytes()))
+    tar[3 << 20] ^= 0xFF
+    corrupted = temp_home / "corrupted.tar.gz"
+    corrupted.write_bytes(gzip.compress(bytes(tar)))
+    Path(f"{corrupted}.integrity.json").write_bytes(
+        Path(f"{image}.integrity.json").read_bytes()
+    )
+    result = runner.invoke(cli, ["env", "import", str(corrupted), "test-6"])
+    assert result.exit_code == 1
+    assert "chunk 0 mismatch" in result.output.replace("\n", "")
+    assert not (envs_dir / "test-6").exists()
+
+    result = runner.invoke(cli, ["env", "verify", "test-5", "--full"])
+    assert result.exit_code == 0
+    assert result.output.split()[4] == "2"
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [9])
+def test_env_import_lazy(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    env_dir = shpd_dir / "envs" / "test-1"
+    (env_dir / "pgdata").mkdir(parents=True)
+    (env_dir / "dumps").mkdir()
+    state = os.urandom(9 << 20)
+    (env_dir / "pgdata" / "base.dat").write_bytes(state)
+    (env_dir / "pgdata" / "PG_VERSION").write_text("17\n")
+    (env_dir / "pgdata" / "empty").touch()
+    (env_dir / "dumps" / "old.sql").write_bytes(os.urandom(1 << 20))
+    (env_dir / "latest").symlink_to("dumps/old.sql")
+
+    result = runner.invoke(
+        cli, ["env", "pack", "test-1", "--format", "seekable"]
+    )
+    assert result.exit_code == 0
+    image = shpd_dir / ".env_imgs" / "test-1.simg"
+    assert image.exists()
+
+    # the environment exists at once, without the content of its files
+    result = runner.invoke(
+        cli, ["env", "import", "test-1.simg", "test-2", "--lazy"]
+    )
+    assert result.exit_code == 0
+    lazy_dir = shpd_dir / "envs" / "test-2"
+    assert result.output.split()[:2] == ["Imported:", "test-2"]
+    assert (lazy_dir / "pgdata").is_dir()
+    assert (lazy_dir / "pgdata" / "empty").exists()
+    assert os.readlink(lazy_dir / "latest") == "dumps/old.sql"
+    assert not (lazy_dir / "pgdata" / "base.dat").exists()
+    assert (lazy_dir / ".lazy.json").exists()
+
+    result = runner.invoke(cli, ["env", "materialize", "test-2", "pgdata"])
+    assert result.exit_code == 0
+    assert result.output.split()[:3] == ["Materialized:", "test-2", "(2"]
+    assert (lazy_dir / "pgdata" / "base.dat").read_bytes() == state
+    assert not (lazy_dir / "dumps" / "old.sql").exists()
+
+    # the rest comes with the first command needing every file
+    result = runner.invoke(cli, ["env", "verify", "test-2"])
+    assert result.exit_code == 0
+    assert (lazy_dir / "dumps" / "old.sql").exists()
+    assert not (lazy_dir / ".lazy.json").exists()
+
+    # a plain import of a seekable image extracts everything
+    result = runner.invoke(cli, ["env", "import", str(image), "test-6"])
+    assert result.exit_code == 0
+    assert (shpd_dir / "envs" / "test-6" / "dumps" / "old.sql").exists()
+
+    # corrupted frames are caught when materialized
+    data = bytearray(image.read_bytes())
+    data[len(data) // 3] ^= 0xFF
+    image.write_bytes(bytes(data))
+    result = runner.invoke(
+        cli, ["env", "import", str(image), "test-7", "--lazy"]
+    )
+    assert result.exit_code == 0
+    result = runner.invoke(cli, ["env", "materialize", "test-7"])
+    assert result.exit_code == 1
+    assert "corrupted frame" in result.output.replace("\n", "")
+
+    sm = ShepherdMng()
+    envCfg = sm.configMng.get_environment("test-2")
+    assert envCfg and envCfg.services
+    envCfg.services[0].volumes = [
+        "./pgdata:/var/lib/postgresql/data",
+        "/srv/shared:/shared",
+        "cache:/cache",
+        "../escape:/x",
+    ]
+    env = sm.environmentMng.envFactory.new_environment_cfg(envCfg)
+    assert env.bind_paths() == ["pgdata"]
+
+
+def craft_toc(image: Path, dest: Path, edit: Callable[[Toc], None]):
+    """Write a copy of a seekable image with an edited table of contents."""
+    data = image.read_bytes()
+    offset, length, _ = TRAILER.unpack(data[-TRAILER.size :])
+    item = json.loads(zlib.decompress(data[offset : offset + length]))
+    toc = Toc(item["config"], item["algorithm"])
+    toc.entries = [TocEntry(**e) for e in item["entries"]]
+    edit(toc)
+    packed = zlib.compress(toc.to_json())
+    dest.write_bytes(
+        data[:offset]
+        + packed
+        + TRAILER.pack(offset, len(packed), TRAILER_MAGIC)
+    )
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [6])
+def test_env_import_seekable_unsafe(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    env_dir = shpd_dir / "envs" / "test-1"
+    (env_dir / "dumps").mkdir(parents=True)
+    (env_dir / "dumps" / "old.sql").write_text("select 1;")
+    (env_dir / "latest").symlink_to("dumps/old.sql")
+    result = runner.invoke(
+        cli, ["env", "pack", "test-1", "--format", "seekable"]
+    )
+    assert result.exit_code == 0
+    image = shpd_dir / ".env_imgs" / "test-1.simg"
+    absolute = temp_home / "absolute.txt"
+
+    def entry(toc: Toc, path: str) -> TocEntry:
+        return next(e for e in toc.entries if e.path == path)
+
+    def escape(toc: Toc):
+        entry(toc, "dumps/old.sql").path = "../../escaped.txt"
+
+    def absolute_path(toc: Toc):
+        entry(toc, "dumps/old.sql").path = str(absolute)
+
+    def symlink_out(toc: Toc):
+        entry(toc, "latest").target = "../../outside"
+
+    def through_symlink(toc: Toc):
+        entry(toc, "latest").target = "dumps"
+        entry(toc, "dumps/old.sql").path = "latest/old.sql"
+
+    for i, edit in enumerate(
+        [escape, absolute_path, symlink_out, through_symlink]
+    ):
+        crafted = temp_home / f"crafted-{i}.simg"
+        craft_toc(image, crafted, edit)
+        result = runner.invoke(
+            cli, ["env", "import", str(crafted), f"test-{i + 2}"]
+        )
+        assert result.exit_code == 1, edit.__name__
+    assert not list(temp_home.rglob("escaped.txt"))
+    assert not absolute.exists()
+    assert not (shpd_dir / "envs" / "test-5" / "dumps" / "old.sql").exists()
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [5])
+def test_env_imgs_budget(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(values + "\nenv_imgs_budget=2\n")
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    (shpd_dir / "envs" / "test-1" / "pgdata").mkdir(parents=True)
+    data_file = shpd_dir / "envs" / "test-1" / "pgdata" / "base.dat"
+    data_file.write_bytes(os.urandom(800000))
+    imgs_dir = shpd_dir / ".env_imgs"
+    imgs_dir.mkdir()
+    stale = imgs_dir / "stale.tar.zst"
+    stale.write_bytes(b"x" * 1000000)
+    os.utime(stale, (time.time() - 3600, time.time() - 3600))
+
+    result = runner.invoke(cli, ["env", "pack", "test-1", "--format", "gzip"])
+    assert result.exit_code == 0
+    assert "Evicted" not in result.output
+    result = runner.invoke(cli, ["env", "import", "test-1.tar.gz", "test-2"])
+    assert result.exit_code == 0
+
+    # the image test-2 comes from is the least recently used, but pinned
+    cache_file = imgs_dir / CACHE_FILE
+    index = json.loads(cache_file.read_text())
+    for image in index["images"]:
+        if image["path"] == "test-1.tar.gz":
+            assert image["envs"] == ["test-2"]
+            image["atime"] -= 7200
+    cache_file.write_text(json.dumps(index))
+
+    result = runner.invoke(cli, ["env", "pack", "test-2", "--format", "gzip"])
+    assert result.exit_code == 0
+    assert "Evicted: stale.tar.zst (1.0 MB freed)" in result.output
+    assert not stale.exists()
+    assert (imgs_dir / "test-1.tar.gz").exists()
+
+    result = runner.invoke(cli, ["-p", "system", "df"])
+    assert result.exit_code == 0
+    rows = [line.split() for line in result.output.splitlines()]
+    assert [(r[0], r[1], r[4:]) for r in rows] == [
+        ("test-1.tar.gz", "gzip", ["pinned"]),
+        ("test-2.tar.gz", "gzip", []),
+    ]
+
+    result = runner.invoke(cli, ["system", "df"])
+    assert result.exit_code == 0
+    assert "Images: 2 (1 pinned)" in result.output.replace("\n", " ")
+
+
+@pytest.mark.env
+def test_suspend_registry_concurrent(tmp_path: Path):
+    path = str(tmp_path / ".suspended.json")
+
+    def suspend(i: int):
+        registry = SuspendRegistry(path)
+        with registry.lock():
+            time.sleep(0.01)
+            registry.add(f"env-{i}", time.time(), i)
+
+    threads = [threading.Thread(target=suspend, args=(i,)) for i in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    registry = SuspendRegistry(path)
+    assert sorted(registry.envs) == [f"env-{i}" for i in range(8)]
+    assert registry.held == sum(range(8))
+
+
+@pytest.mark.env
+def test_image_cache_chunks(tmp_path: Path):
+    store = ChunkStore(str(tmp_path / "imgs"), min_size=4096, max_size=65536)
+    env_dir = tmp_path / "env"
+    (env_dir / "data").mkdir(parents=True)
+    shared = os.urandom(1 << 20)
+    (env_dir / "data" / "base.dat").write_bytes(shared)
+    first, _ = store.add_image("first", str(env_dir), {"tag": "first"})
+    (env_dir / "data" / "more.dat").write_bytes(os.urandom(1 << 20))
+    second, _ = store.add_image("second", str(env_dir), {"tag": "second"})
+
+    cache = ImageCache(store.root)
+    cache.record(manifest_path("first"), now=1.0)
+    cache.record(manifest_path("second"), now=2.0)
+    own = set(second.digests()) - set(first.digests())
+    assert set(cache.chunks) == set(first.digests()) | own
+    usage = cache.usage()
+    assert usage.images == 2
+    assert usage.chunks == len(cache.chunks)
+
+    # shared chunks stay with the image still using them
+    eviction = cache.evict(usage.total - 1)
+    assert list(eviction.images) == [manifest_path("first")]
+    assert set(cache.chunks) == set(second.digests())
+    assert store.manifests() == ["second"]
+    assert all(store.has(d) for d in second.digests())
+
+    # pinned images are never evicted
+    eviction = cache.evict(0, {manifest_path("second")})
+    assert not eviction.images
+
+    # the chunks of a manifest removed behind the cache's back go with it
+    os.remove(cache.local(manifest_path("second")))
+    cache.sync()
+    assert not cache.images and not cache.chunks
+    assert not any(store.has(d) for d in second.digests())
+
+
+def start_peer(home: Path) -> tuple[subprocess.Popen[str], int]:
+    """Run `env serve` in a process of its own, as another peer."""
+    process = subprocess.Popen(
+        [sys.executable, "shepctl.py", "env", "serve", "--port", "0"],
+        cwd=Path(__file__).parent.parent,
+        env={**os.environ, "HOME": str(home), "PYTHONUNBUFFERED": "1"},
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    assert process.stdout
+    line = process.stdout.readline()
+    assert line.startswith("Serving chunks on port"), line
+    return process, int(line.split()[-1])
+
+
+@pytest.mark.env
+@pytest.mark.parametrize("expanduser_side_effects", [2])
+def test_env_pull_peers(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    registry_dir = temp_home / "registry"
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        dead = s.getsockname()[1]
+    peer_homes = [temp_home / "peer-a", temp_home / "peer-b"]
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config)
+    (shpd_dir / "envs" / "test-1" / "pgdata").mkdir(parents=True)
+    state = os.urandom(8 << 20)
+    (shpd_dir / "envs" / "test-1" / "pgdata" / "base.dat").write_bytes(state)
+    config_file = temp_home / ".shpd.conf"
+    config_file.write_text(
+        values.replace(
+            "shpd_registry=ftp.example.com", f"shpd_registry={registry_dir}"
+        )
+    )
+    result = runner.invoke(cli, ["env", "push", "test-1", "base"])
+    assert result.exit_code == 0
+
+    # the peers share the chunks, one of them corrupted
+    chunks = sorted((shpd_dir / ".env_imgs" / "chunks").glob("*/*"))
+    assert len(chunks) > 3
+    for i, chunk in enumerate(chunks):
+        home = peer_homes[i % 2]
+        dest = home / "shpd" / ".env_imgs" / "chunks" / chunk.parent.name
+        dest.mkdir(parents=True, exist_ok=True)
+        shutil.copy(chunk, dest / chunk.name)
+    corrupted = peer_homes[1] / "shpd" / ".env_imgs" / "chunks"
+    corrupted = next(corrupted.glob("*/*"))
+    corrupted.write_bytes(b"garbage")
+    for home in peer_homes:
+        (home / ".shpd.conf").write_text(values)
+        (home / "shpd" / ".shpd.json").write_text(shpd_config)
+    shutil.rmtree(shpd_dir / ".env_imgs")
+
+    peers = [start_peer(home) for home in peer_homes]
+    try:
+        addresses = [f"127.0.0.1:{port}" for _, port in peers]
+        config_file.write_text(
+            config_file.read_text()
+            + f"\nenv_peers=127.0.0.1:{dead},{','.join(addresses)}\n"
+        )
+        registry_get = mocker.spy(DirRegistry, "get")
+        result = runner.invoke(cli, ["env", "pull", "base", "test-8"])
+    finally:
+        for process, _ in peers:
+            process.terminate()
+            process.wait()
+    assert result.exit_code == 0
+    assert result.output.split()[2:7] == [
+        f"({len(chunks)}",
+        "chunks,",
+        str(len(chunks)),
+        "fetched,",
+        str(len(chunks) - 1),
+    ]
+    # the registry is asked for the manifest and the corrupted chunk only
+    paths = sorted(call.args[1] for call in registry_get.call_args_list)
+    assert paths == sorted(
+        [
+            "manifests/base.json",
+            f"chunks/{corrupted.parent.name}/{corrupted.name}",
+        ]
+    )
+    pulled = shpd_dir / "envs" / "test-8" / "pgdata" / "base.dat"
+    assert pulled.read_bytes() == state
@@ -0,0 +1,150 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from config import ShpdRegistryCfg
+from registry import DirRegistry, FtpRegistry, Registry, RegistryError
+from tests.ftp_fake_server import FakeFtpServer
+
+PART = 1 << 18
+
+
+@pytest.fixture
+def ftp_server(tmp_path: Path) -> Iterator[FakeFtpServer]:
+    root = tmp_path / "ftp"
+    (root / "imgs").mkdir(parents=True)
+    server = FakeFtpServer(str(root), "shpd", "secret").start()
+    yield server
+    server.stop()
+
+
+def ftp_registry(server: FakeFtpServer, **kwargs: int) -> FtpRegistry:
+    return FtpRegistry(
+        "127.0.0.1",
+        "imgs",
+        "shpd",
+        "secret",
+        server.port,
+        part_size=PART,
+        **kwargs,
+    )
+
+
+@pytest.mark.registry
+def test_registry_from_config(tmp_path: Path):
+    def cfg(server: str) -> ShpdRegistryCfg:
+        return ShpdRegistryCfg(server, "shpd", "secret", "shpd", "/imgs")
+
+    local = Registry.from_config(cfg(str(tmp_path)))
+    assert isinstance(local, DirRegistry)
+    assert local.root == str(tmp_path / "imgs")
+
+    ftp = Registry.from_config(cfg("ftp.example.com:2121"), 2)
+    assert isinstance(ftp, FtpRegistry)
+    assert (ftp.host, ftp.port, ftp.root) == ("ftp.example.com", 2121, "/imgs")
+    assert ftp.pool.size == 2
+    ftp = Registry.from_config(cfg("ftp://ftp.example.com"))
+    assert isinstance(ftp, FtpRegistry) and ftp.port == 21
+
+    with pytest.raises(RegistryError):
+        Registry.from_config(cfg("https://example.com"))
+
+
+@pytest.mark.registry
+def test_ftp_registry_files(ftp_server: FakeFtpServer):
+    registry = ftp_registry(ftp_server, connections=2)
+    registry.put("chunks/ab/abc", b"chunk")
+    registry.put("chunks/ab/abd", b"other")
+    assert registry.get("chunks/ab/abc") == b"chunk"
+    assert registry.exists("chunks/ab/abd")
+    assert not registry.exists("chunks/ab/abe")
+    assert registry.list("chunks/ab") == ["abc", "abd"]
+    assert registry.list("chunks/cd") == []
+    assert registry.missing(["chunks/ab/abc", "chunks/ab/abe"]) == [
+        "chunks/ab/abe"
+    ]
+    with pytest.raises(FileNotFoundError):
+        registry.get("chunks/ab/abe")
+
+    # the connections are reused across operations
+    registry.close()
+    assert ftp_server.logins <= 2
+
+
+@pytest.mark.registry
+def test_ftp_registry_ranged_resumed_download(
+    tmp_path: Path, ftp_server: FakeFtpServer
+):
+    image = os.urandom(6 * PART + 1000)
+    (Path(ftp_server.root) / "imgs" / "big.tar.zst").write_bytes(image)
+    dest = tmp_path / "big.tar.zst"
+
+    # an interrupted download keeps what it received
+    registry = ftp_registry(ftp_server, connections=3, retries=0)
+    ftp_server.cuts = [PART // 2]
+    with pytest.raises(RegistryError):
+        registry.download("big.tar.zst", str(dest))
+    registry.close()
+    assert not dest.exists()
+    assert (tmp_path / "big.tar.zst.part.json").exists()
+
+    registry = ftp_registry(ftp_server, connections=3)
+    received = registry.download("big.tar.zst", str(dest))
+    registry.close()
+    assert dest.read_bytes() == image
+    assert received < len(image)
+    assert not (tmp_path / "big.tar.zst.part").exists()
+    # one ranged RETR per part
+    assert ftp_server.count("REST") >= 6
+
+
+@pytest.mark.registry
+def test_ftp_registry_resumed_upload(tmp_path: Path, ftp_server: FakeFtpServer):
+    image = os.urandom(3 * PART)
+    src = tmp_path / "up.tar.zst"
+    src.write_bytes(image)
+
+    registry = ftp_registry(ftp_server, retries=0)
+    ftp_server.cuts = [PART]
+    with pytest.raises(RegistryError):
+        registry.upload(str(src), "up.tar.zst")
+    assert not registry.exists("up.tar.zst")
+
+    sent = registry.upload(str(src), "up.tar.zst")
+    assert sent == 2 * PART
+    assert (Path(ftp_server.root) / "imgs" / "up.tar.zst").read_bytes() == image
+
+    # several images at once
+    for i in range(3):
+        (tmp_path / f"img-{i}").write_bytes(image[i * PART :])
+    registry.upload_many(
+        [(str(tmp_path / f"img-{i}"), f"img-{i}") for i in range(3)]
+    )
+    sizes = registry.download_many(
+        [(f"img-{i}", str(tmp_path / f"down-{i}")) for i in range(3)]
+    )
+    registry.close()
+    assert sizes == [3 * PART, 2 * PART, PART]
+    for i in range(3):
+        assert (tmp_path / f"down-{i}").read_bytes() == image[i * PART :]
@@ -17,13 +17,21 @@
 
 from __future__ import annotations
 
+import asyncio
+import json
+import socket
 from pathlib import Path
+from typing import Any
 
 import pytest
 from click.testing import CliRunner
 from pytest_mock import MockerFixture
 
+from docker import DockerEngineClient
+from service import ReadinessGate
+from service.readiness import HttpProbe, TcpProbe, parse_probes
 from shepctl import ShepherdMng, cli
+from tests.docker_fake_engine import FakeEngine
 
 values = """
   # PostgreSQL (pg) Configuration
@@ -613,6 +621,8 @@ def test_svc_render_compose_service(
         "    labels:\n"
         "    - com.example.label1=value1\n"
         "    - com.example.label2=value2\n"
+        "    - shpd.env.tag=test-1\n"
+        "    - shpd.svc.tag=test\n"
         "    volumes:\n"
         "    - /home/test/.ssh:/home/test/.ssh\n"
         "    - /etc/ssh:/etc/ssh\n"
@@ -625,3 +635,321 @@ def test_svc_render_compose_service(
         "    networks:\n"
         "    - default\n\n"
     )
+
+
+@pytest.mark.svc
+@pytest.mark.parametrize("expanduser_side_effects", [4])
+def test_svc_lifecycle(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    shpd_json = shpd_dir / ".shpd.json"
+    shpd_json.write_text(shpd_config_svc_default)
+
+    container = fake_engine.add_container("test-test-1")
+    fake_engine.add_log("test-test-1", b"hello\n")
+
+    result = runner.invoke(cli, ["svc", "up", "test"])
+    assert result.exit_code == 0
+    assert result.output == "Started: test\n"
+    assert container.state == "running"
+
+    result = runner.invoke(cli, ["svc", "halt", "test"])
+    assert result.exit_code == 0
+    assert container.state == "exited"
+
+    result = runner.invoke(cli, ["svc", "stdout", "test"])
+    assert result.exit_code == 0
+    assert result.output == "hello\n"
+
+    result = runner.invoke(cli, ["svc", "up", "missing"])
+    assert result.exit_code == 1
+
+
+def add_build_template(
+    config: dict[str, Any], tag: str, image: str, context: Path
+):
+    template = json.loads(json.dumps(config["service_templates"][0]))
+    template["tag"], template["image"] = tag, image
+    template["properties"] = {"build.context": str(context)}
+    config["service_templates"].append(template)
+
+
+@pytest.mark.svc
+@pytest.mark.parametrize("expanduser_side_effects", [3])
+def test_svc_build(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    dockerfiles = {
+        "base": "FROM alpine:3\nRUN apk add curl\n",
+        "app": "FROM shpd/base:1\nCOPY app.py /app.py\nRUN echo app\n",
+        "tool": "FROM alpine:3\nRUN apk add curl\nRUN echo tool\n",
+        "other": "FROM busybox:1\nRUN echo other\n",
+        "broken": "FROM missing/base:1\nRUN echo broken\n",
+    }
+    for name, dockerfile in dockerfiles.items():
+        context = temp_home / "ctx" / name
+        context.mkdir(parents=True)
+        (context / "Dockerfile").write_text(dockerfile)
+    (temp_home / "ctx" / "app" / "app.py").write_text("print('app')\n")
+    config = json.loads(shpd_config_svc_default)
+    for tag, image, context in (
+        ("base", "shpd/base:1", "base"),
+        ("app", "shpd/app:1", "app"),
+        ("app-debug", "shpd/app-debug:1", "app"),
+        ("tool", "shpd/tool:1", "tool"),
+        ("other", "shpd/other:1", "other"),
+    ):
+        add_build_template(config, tag, image, temp_home / "ctx" / context)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(json.dumps(config))
+
+    fake_engine.delays["build-step"] = 0.2
+    result = runner.invoke(cli, ["--all", "--porcelain", "svc", "build"])
+    assert result.exit_code == 0
+    rows = [line.split() for line in result.output.splitlines()]
+    assert [(r[0], r[1], r[2], r[4]) for r in rows] == [
+        ("shpd/base:1", "base", "ok", "0/1"),
+        ("shpd/app:1", "app,app-debug", "ok", "0/2"),
+        ("shpd/tool:1", "tool", "ok", "1/2"),
+        ("shpd/other:1", "other", "ok", "0/1"),
+    ]
+    # the app is built once and tagged for both templates
+    assert (
+        fake_engine.images["shpd/app-debug:1"]
+        == fake_engine.images["shpd/app:1"]
+    )
+    assert [b[0] for b in fake_engine.builds].count("shpd/app:1") == 1
+    assert fake_engine.requests.count(("POST", "/images/create")) == 2
+
+    builds = {tag: (start, end) for tag, start, end in fake_engine.builds}
+    # dependent and layer sharing builds wait for the base one
+    assert builds["shpd/app:1"][0] >= builds["shpd/base:1"][1]
+    assert builds["shpd/tool:1"][0] >= builds["shpd/base:1"][1]
+    # independent builds run in parallel
+    assert builds["shpd/other:1"][0] < builds["shpd/base:1"][1]
+
+    config = json.loads((shpd_dir / ".shpd.json").read_text())
+    add_build_template(
+        config, "broken", "shpd/broken:1", temp_home / "ctx" / "broken"
+    )
+    (shpd_dir / ".shpd.json").write_text(json.dumps(config))
+    result = runner.invoke(cli, ["svc", "build", "broken", "other"])
+    assert result.exit_code == 1
+    assert "Cache hits: 0/0 steps (0%), 1 unchanged images" in (result.output)
+    assert "ERROR: shpd/broken:1: Failed to pull missing/base:1" in (
+        result.output
+    )
+
+
+@pytest.mark.svc
+@pytest.mark.parametrize("expanduser_side_effects", [5])
+def test_svc_build_unchanged(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    context = temp_home / "ctx" / "app"
+    context.mkdir(parents=True)
+    (context / "Dockerfile").write_text(
+        "FROM alpine:3\nCOPY app.py /app.py\nRUN echo app\n"
+    )
+    (context / "app.py").write_text("print('app')\n")
+    config = json.loads(shpd_config_svc_default)
+    add_build_template(config, "app", "shpd/app:1", context)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    shpd_json = shpd_dir / ".shpd.json"
+    shpd_json.write_text(json.dumps(config))
+
+    def build() -> str:
+        result = runner.invoke(cli, ["--porcelain", "svc", "build", "app"])
+        assert result.exit_code == 0
+        return result.output.split()[2]
+
+    assert build() == "ok"
+    built = fake_engine.images["shpd/app:1"]["Id"]
+    index = json.loads((shpd_dir / ".build_index.json").read_text())
+    assert list(index["images"].values()) == [built]
+    assert str(context / "app.py") in index["files"]
+
+    # same content with a new modification time, retagged only
+    del fake_engine.images["shpd/app:1"]
+    fake_engine.images["shpd/app-old:1"] = {"Id": built, "RepoTags": []}
+    (context / "app.py").write_text("print('app')\n")
+    assert build() == "unchanged"
+    assert fake_engine.images["shpd/app:1"]["Id"] == built
+    assert len(fake_engine.builds) == 1
+
+    (context / "app.py").write_text("print('app v2')\n")
+    assert build() == "ok"
+    assert len(fake_engine.builds) == 2
+
+    config = json.loads(shpd_json.read_text())
+    config["service_templates"][-1]["labels"].append("version=2")
+    shpd_json.write_text(json.dumps(config))
+    assert build() == "ok"
+    assert len(fake_engine.builds) == 3
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.svc
+def test_readiness_parse_probes():
+    probes = parse_probes(
+        "db",
+        {
+            "readiness.tcp": "5432",
+            "readiness.http": "http://localhost:8080/health",
+            "readiness.timeout": "30",
+        },
+        "127.0.0.1",
+    )
+    assert [p.describe() for p in probes] == [
+        "tcp 127.0.0.1:5432",
+        "http http://localhost:8080/health",
+    ]
+    assert all(p.timeout == 30 for p in probes)
+
+
+@pytest.mark.svc
+def test_readiness_gate_concurrent_probes():
+    tcp_port, http_port = free_port(), free_port()
+    hits: list[int] = []
+
+    async def serve_http(
+        reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ):
+        await reader.readuntil(b"\r\n\r\n")
+        hits.append(1)
+        status = "200 OK" if len(hits) > 2 else "503 Unavailable"
+        writer.write(f"HTTP/1.0 {status}\r\n\r\n".encode())
+        await writer.drain()
+        writer.close()
+
+    async def scenario():
+        gate = ReadinessGate(
+            [
+                TcpProbe("db", "127.0.0.1", tcp_port, timeout=5),
+                HttpProbe("web", f"http://127.0.0.1:{http_port}/", timeout=5),
+                TcpProbe("down", "127.0.0.1", free_port(), timeout=0.3),
+            ],
+            initial_delay=0.05,
+        )
+        waiting = asyncio.ensure_future(gate.wait_all())
+        await asyncio.sleep(0.2)
+        tcp = await asyncio.start_server(
+            lambda r, w: w.close(), "127.0.0.1", tcp_port
+        )
+        http = await asyncio.start_server(serve_http, "127.0.0.1", http_port)
+        async with tcp, http:
+            return await waiting
+
+    db, web, down = asyncio.run(scenario())
+    assert db.ready and db.attempts > 1
+    assert web.ready and len(hits) == 3
+    assert not down.ready and down.error
+    assert down.elapsed < 1
+
+
+@pytest.mark.svc
+@pytest.mark.parametrize("expanduser_side_effects", [5])
+def test_svc_stdout_window(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+    fake_engine: FakeEngine,
+    shared_client: DockerEngineClient,
+):
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+    shpd_dir = temp_home / "shpd"
+    shpd_dir.mkdir(parents=True, exist_ok=True)
+    (shpd_dir / ".shpd.json").write_text(shpd_config_svc_default)
+
+    base = 1_700_000_000
+    fake_engine.add_container("test-test-1", state="running")
+    for i in range(100):
+        fake_engine.add_log("test-test-1", f"line {i}\n".encode(), ts=base + i)
+
+    result = runner.invoke(cli, ["svc", "stdout", "test", "--tail", "2"])
+    assert result.exit_code == 0
+    assert result.output == "line 98\nline 99\n"
+
+    result = runner.invoke(
+        cli,
+        [
+            "svc",
+            "stdout",
+            "test",
+            "--since",
+            str(base + 10),
+            "--until",
+            str(base + 12),
+        ],
+    )
+    assert result.exit_code == 0
+    assert result.output == "line 10\nline 11\n"
+
+    result = runner.invoke(
+        cli, ["svc", "stdout", "test", "--captured", "-n", "1"]
+    )
+    assert result.exit_code == 0
+    assert result.output == "line 99\n"
+
+    # only the output not captured yet is asked again
+    fake_engine.add_log("test-test-1", b"line 100\n", ts=base + 100)
+    result = runner.invoke(
+        cli,
+        [
+            "svc",
+            "stdout",
+            "test",
+            "-c",
+            "--since",
+            str(base + 99),
+        ],
+    )
+    assert result.exit_code == 0
+    assert result.output == "line 99\nline 100\n"
+    capture = shpd_dir / ".logs" / "test-1" / "test.log"
+    assert len(capture.read_bytes().splitlines()) == 101
+
+    result = runner.invoke(
+        cli, ["svc", "stdout", "test", "--since", "yesterday"]
+    )
+    assert result.exit_code == 1
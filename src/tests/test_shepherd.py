@@ -316,6 +316,7 @@ def test_cli_flags_no_flags(
             "keep": False,
             "replace": False,
             "checkout": False,
+            "wait": False,
         }
     )
 
@@ -345,6 +346,7 @@ def test_cli_flags_verbose(
         "keep": False,
         "replace": False,
         "checkout": False,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -381,6 +383,7 @@ def test_cli_flags_yes(
         "keep": False,
         "replace": False,
         "checkout": False,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -417,6 +420,7 @@ def test_cli_flags_all(
         "keep": False,
         "replace": False,
         "checkout": False,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -453,6 +457,7 @@ def test_cli_flags_follow(
         "keep": False,
         "replace": False,
         "checkout": False,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -489,6 +494,7 @@ def test_cli_flags_porcelain(
         "keep": False,
         "replace": False,
         "checkout": False,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -525,6 +531,7 @@ def test_cli_flags_keep(
         "keep": True,
         "replace": False,
         "checkout": False,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -561,6 +568,7 @@ def test_cli_flags_replace(
         "keep": False,
         "replace": True,
         "checkout": False,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -597,6 +605,7 @@ def test_cli_flags_checkout(
         "keep": False,
         "replace": False,
         "checkout": True,
+        "wait": False,
     }
 
     assert result.exit_code == 0
@@ -646,7 +655,7 @@ def test_cli_srv_build(
 
     result = runner.invoke(cli, ["svc", "build", "service_template"])
     assert result.exit_code == 0
-    mock_build.assert_called_once_with("service_template")
+    mock_build.assert_called_once_with(["service_template"])
 
 
 @pytest.mark.shpd
@@ -832,7 +841,7 @@ def test_cli_env_clone(
 
 
 @pytest.mark.shpd
-@pytest.mark.parametrize("expanduser_side_effects", [1])
+@pytest.mark.parametrize("expanduser_side_effects", [2])
 def test_cli_env_checkout(
     temp_home: Path,
     runner: CliRunner,
@@ -847,7 +856,11 @@ def test_cli_env_checkout(
 
     result = runner.invoke(cli, ["env", "checkout", "env_tag"])
     assert result.exit_code == 0
-    mock_checkout.assert_called_once_with("env_tag")
+    mock_checkout.assert_called_once_with("env_tag", False)
+
+    result = runner.invoke(cli, ["env", "checkout", "--start", "env_tag"])
+    assert result.exit_code == 0
+    mock_checkout.assert_called_with("env_tag", True)
 
 
 @pytest.mark.shpd
@@ -959,3 +972,40 @@ def test_cli_env_status(
     result = runner.invoke(cli, ["env", "status"])
     assert result.exit_code == 0
     mock_status.assert_called_once()
+
+
+@pytest.mark.shpd
+@pytest.mark.parametrize("expanduser_side_effects", [1])
+def test_cli_flags_wait(
+    temp_home: Path,
+    runner: CliRunner,
+    mocker: MockerFixture,
+    expanduser_side_effects: int,
+):
+    mock_init = mocker.patch.object(ShepherdMng, "__init__", return_value=None)
+    side_effect = make_expanduser_side_effect(
+        temp_home, expanduser_side_effects
+    )
+    mocker.patch("os.path.expanduser", side_effect=side_effect)
+
+    result = runner.invoke(cli, ["--wait", "test"])
+
+    flags = {
+        "verbose": False,
+        "yes": False,
+        "all": False,
+        "follow": False,
+        "porcelain": False,
+        "keep": False,
+        "replace": False,
+        "checkout": False,
+        "wait": True,
+    }
+
+    assert result.exit_code == 0
+    mock_init.assert_called_once_with(flags)
+
+    result = runner.invoke(cli, ["-w", "test"])
+
+    assert result.exit_code == 0
+    mock_init.assert_called_with(flags)
@@ -42,6 +42,26 @@ class Constants:
     def SHPD_ENV_IMGS_DIR(self) -> str:
         return os.path.join(self.SHPD_DIR, ".env_imgs")
 
+    @property
+    def SHPD_SUSPEND_FILE(self) -> str:
+        return os.path.join(self.SHPD_DIR, ".suspended.json")
+
+    @property
+    def SHPD_POOL_FILE(self) -> str:
+        return os.path.join(self.SHPD_DIR, ".pool.json")
+
+    @property
+    def SHPD_BUILD_INDEX_FILE(self) -> str:
+        return os.path.join(self.SHPD_DIR, ".build_index.json")
+
+    @property
+    def SHPD_LOGS_DIR(self) -> str:
+        return os.path.join(self.SHPD_DIR, ".logs")
+
+    @property
+    def SHPD_CHECKPOINTS_DIR(self) -> str:
+        return os.path.join(self.SHPD_DIR, ".checkpoints")
+
     @property
     def SHPD_CERTS_DIR(self) -> str:
         return os.path.join(self.SHPD_DIR, ".certs")
@@ -85,6 +105,30 @@ class Constants:
 
     SVC_FACTORY_DEFAULT: str = "docker"
 
+    # Policies applied to the environment left by a checkout
+
+    ENV_SUSPEND_NONE: str = "none"
+    ENV_SUSPEND_PAUSE: str = "pause"
+
+    # Prefix of the environments realized in advance for the warm pool
+
+    ENV_POOL_PREFIX: str = "pool-"
+
+    # Docker environments lifecycle drivers
+
+    DOCKER_LIFECYCLE_COMPOSE: str = "compose"
+    DOCKER_LIFECYCLE_NATIVE: str = "native"
+
+    # Container labels
+
+    LABEL_ENV_TAG: str = "shpd.env.tag"
+    LABEL_SVC_TAG: str = "shpd.svc.tag"
+    LABEL_CONFIG_HASH: str = "shpd.config.hash"
+
+    # Service runtime states
+
+    SVC_STATE_ABSENT: str = "absent"
+
     # Resource types
 
     RESOURCE_TYPE_SVC: str = "svc"
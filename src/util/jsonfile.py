@@ -0,0 +1,75 @@
+# Copyright (c) 2025 Lunatic Fringers
+#
+# This file is part of Shepherd Core Stack
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import fcntl
+import json
+import os
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Generator
+
+
+class LockedJsonFile(ABC):
+    """
+    State kept in a JSON file shared between processes: they hold the
+    file lock while they change the state, which is stored by replacing
+    the file.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.load()
+
+    @abstractmethod
+    def decode(self, data: dict[str, Any]):
+        """Set the state from the file data, empty without a file."""
+        pass
+
+    @abstractmethod
+    def encode(self) -> dict[str, Any]:
+        """Return the file data of the state."""
+        pass
+
+    @contextmanager
+    def lock(self) -> Generator[None]:
+        """Hold the file lock, reloading the state."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(f"{self.path}.lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                self.load()
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def load(self):
+        data: dict[str, Any] = {}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            pass
+        self.decode(data)
+
+    def store(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.encode(), f, indent=2)
+        os.replace(tmp, self.path)
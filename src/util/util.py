@@ -19,11 +19,14 @@
 import json
 import os
 import platform
+import re
 import shutil
 import subprocess
 import sys
+import time
 from dataclasses import dataclass
-from typing import Any, List, Union
+from datetime import datetime
+from typing import Any, List, Optional, Union
 
 from rich.console import Console
 
@@ -108,6 +111,46 @@ class Util:
     def print(message: str):
         Util.console.print(f"{message}", highlight=False)
 
+    @staticmethod
+    def parse_time(value: str, now: Optional[float] = None) -> float:
+        """
+        Parse a point in time given as a unix timestamp, an ISO 8601 date
+        (local time when no offset is given) or a duration ago like `90s`,
+        `10m` or `1h30m`.
+
+        :return: The unix timestamp.
+        :raises ValueError: If the value is not a point in time.
+        """
+        value = value.strip()
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        parts = re.findall(r"(\d+(?:\.\d+)?)([smhd])", value)
+        if parts and "".join(n + u for n, u in parts) == value:
+            units = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+            ago = sum(float(n) * units[u] for n, u in parts)
+            return (time.time() if now is None else now) - ago
+        try:
+            return datetime.fromisoformat(value).astimezone().timestamp()
+        except ValueError:
+            raise ValueError(f"Invalid time '{value}'")
+
+    @staticmethod
+    def parse_age(value: str, now: Optional[float] = None) -> float:
+        """
+        Parse an age given as seconds, a duration like `90s`, `10m` or
+        `7d`, or the ISO 8601 date it started at.
+
+        :return: The unix timestamp the age started at.
+        :raises ValueError: If the value is not an age.
+        """
+        try:
+            seconds = float(value.strip())
+        except ValueError:
+            return Util.parse_time(value, now)
+        return (time.time() if now is None else now) - seconds
+
     @staticmethod
     def ensure_dirs(constants: Constants):
         dirs = {